@@ -1,74 +1,86 @@
-import mysql.connector
-from mysql.connector import Error
 import getpass
-from datetime import datetime, timedelta
-import hashlib
+import os
+import sys
+
+from almacenamiento import ErrorBD, crear_backend
+from diario import RUTA_DIARIO, DiarioMostrador, sincronizar
+from informes import INFORMES, escribir_tabla
+from seguridad import hash_password, verificar_password
+from servicio import CredencialesInvalidas, DemasiadosIntentos, ErrorBiblioteca, NoDisponible, ServicioBiblioteca, TABLAS_REQUERIDAS
+import validaciones
+
+TAMAÑO_PAGINA = 20
 
 
 class SistemaLibreria:
-    def __init__(self):
-        self.connection = None
+    def __init__(self, backend=None):
+        self.backend = backend or crear_backend()
+        self.servicio = None
+        self.sesion = None
         self.usuario_actual = None
         self.tipo_usuario = None
         self.nombre_usuario = None
+        self.diario = None
         
     def conectar_bd(self):
-        """Conectar a la base de datos MySQL de forma segura"""
+        """Conectar a la base de datos configurada (MySQL o SQLite)"""
         try:
-            self.connection = mysql.connector.connect(
-                host='localhost',
-                database='biblioteca',
-                user='root',  # Cambiar por tu usuario de MySQL
-                password='toor'   # Cambiar por tu contraseña de MySQL
-            )
-            if self.connection.is_connected():
-                print("✓ Conexión exitosa a la base de datos")
-                return True
-        except Error as e:
-            print(f"✗ Error al conectar a MySQL: {e}")
+            # Una terminal interactiva solo necesita una conexión en el pool
+            self.servicio = ServicioBiblioteca(self.backend, tamaño_pool=1)
+            with self.servicio.pool.conexion():
+                pass
+            print(f"✓ Conexión exitosa a la base de datos ({self.backend.descripcion()})")
+            return True
+        except ErrorBD as e:
+            print(f"✗ Error al conectar a la base de datos: {e}")
             print("Por favor verifica:")
-            print("1. Que MySQL esté ejecutándose")
-            print("2. Que la base de datos 'sistema_libreria' exista")
-            print("3. Que el usuario y contraseña sean correctos")
+            if self.backend.nombre == "mysql":
+                print("1. Que MySQL esté ejecutándose")
+                print("2. Que la base de datos 'biblioteca' exista")
+                print("3. Que el usuario y contraseña sean correctos")
+            else:
+                print("1. Que la ruta del archivo SQLite sea accesible y escribible")
             return False
 
     def verificar_tablas(self):
-        """Verificar que las tablas necesarias existan"""
-        tablas_requeridas = ['administradores', 'usuarios', 'libros', 'prestamos']
+        """Crear o actualizar el esquema y verificar que las tablas necesarias existan"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SHOW TABLES")
-            tablas_existentes = [tabla[0] for tabla in cursor.fetchall()]
+            for version, descripcion in self.servicio.migrar_esquema():
+                print(f"✓ Migración {version} aplicada: {descripcion}")
+            faltantes = self.servicio.tablas_faltantes()
             
-            for tabla in tablas_requeridas:
-                if tabla not in tablas_existentes:
+            for tabla in TABLAS_REQUERIDAS:
+                if tabla in faltantes:
                     print(f"✗ Tabla '{tabla}' no encontrada en la base de datos")
                     return False
             
             print("✓ Todas las tablas necesarias existen")
             return True
-        except Error as e:
+        except ErrorBD as e:
             print(f"✗ Error al verificar tablas: {e}")
             return False
 
     def hash_password(self, password):
-        """Hashear la contraseña para mayor seguridad usando SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hashear la contraseña con sal y coste configurable (scrypt o PBKDF2)"""
+        return hash_password(password)
 
     def verificar_password(self, password, password_hash):
         """Verificar si la contraseña coincide con el hash"""
-        return self.hash_password(password) == password_hash
+        return verificar_password(password, password_hash)
 
     def validar_input(self, texto):
         """Validar y limpiar input básico"""
-        return texto.strip()
+        return validaciones.validar_input(texto)
 
     def validar_numero(self, texto):
         """Validar que el input sea un número"""
-        try:
-            return int(texto.strip())
-        except ValueError:
-            return None
+        return validaciones.validar_numero(texto)
+
+    def _iniciar_sesion(self, sesion):
+        self.sesion = sesion
+        self.usuario_actual = sesion.usuario_id
+        self.tipo_usuario = sesion.tipo
+        self.nombre_usuario = sesion.nombre
 
     def login(self):
         """Sistema de login unificado"""
@@ -83,63 +95,45 @@ class SistemaLibreria:
             print("✗ Username/Email y password son requeridos")
             return False
         
-        # Primero intentamos buscar como administrador
-        if self.verificar_credenciales_administrador(username, password):
-            self.tipo_usuario = "administrador"
-            return True
-        
-        # Si no es administrador, buscamos como usuario regular
-        if self.verificar_credenciales_usuario(username, password):
-            self.tipo_usuario = "usuario"
-            return True
-        
-        print("✗ Credenciales incorrectas o usuario no encontrado")
-        return False
-    
-    def verificar_credenciales_administrador(self, username, password):
-        """Verificar credenciales de administrador con contraseña encriptada"""
-        try:
-            cursor = self.connection.cursor()
-            query = "SELECT id, nombre, password FROM administradores WHERE username = %s"
-            cursor.execute(query, (username,))
-            resultado = cursor.fetchone()
-            
-            if resultado:
-                # Verificar contraseña hasheada
-                if self.verificar_password(password, resultado[2]):
-                    self.usuario_actual = resultado[0]
-                    self.nombre_usuario = resultado[1]
-                    print(f"\n✓ Bienvenido administrador: {resultado[1]}")
-                    return True
-                else:
-                    print("✗ Contraseña incorrecta")
-            return False
-        except Error as e:
-            print(f"Error en login administrador: {e}")
-            return False
-    
-    def verificar_credenciales_usuario(self, username, password):
-        """Verificar credenciales de usuario regular con contraseña encriptada"""
         try:
-            cursor = self.connection.cursor()
-            query = "SELECT id, nombre, password FROM usuarios WHERE email = %s"
-            cursor.execute(query, (username,))
-            resultado = cursor.fetchone()
-            
-            if resultado:
-                # Verificar contraseña hasheada
-                if self.verificar_password(password, resultado[2]):
-                    self.usuario_actual = resultado[0]
-                    self.nombre_usuario = resultado[1]
-                    print(f"\n✓ Bienvenido usuario: {resultado[1]}")
-                    return True
-                else:
-                    print("✗ Contraseña incorrecta")
+            sesion = self.servicio.login(username, password)
+        except (CredencialesInvalidas, DemasiadosIntentos) as e:
+            print(f"✗ {e}")
             return False
-        except Error as e:
-            print(f"Error en login usuario: {e}")
+        except ErrorBD as e:
+            print(f"✗ Error en login: {e}")
             return False
 
+        self._iniciar_sesion(sesion)
+        print(f"\n✓ Bienvenido {sesion.tipo}: {sesion.nombre}")
+        return True
+
+    def _mostrar_paginado(self, listado, encabezado, ancho, formatear, mensaje_vacio):
+        """Imprimir un listado página a página sin cargarlo entero en memoria"""
+        self._mostrar_paginas(lambda cursor: self.servicio.pagina(self.sesion, listado, TAMAÑO_PAGINA, cursor),
+                              encabezado, ancho, formatear, mensaje_vacio)
+
+    def _mostrar_paginas(self, obtener_pagina, encabezado, ancho, formatear, mensaje_vacio):
+        """Imprimir las páginas que devuelve obtener_pagina(cursor) hasta agotarlas o salir"""
+        cursor = None
+        mostradas = 0
+        while True:
+            pagina = obtener_pagina(cursor)
+            if mostradas == 0:
+                if not pagina["filas"]:
+                    print(mensaje_vacio)
+                    return
+                print(encabezado)
+                print("-" * ancho)
+            for fila in pagina["filas"]:
+                print(formatear(fila))
+            mostradas += len(pagina["filas"])
+            cursor = pagina["siguiente"]
+            if cursor is None:
+                return
+            if input(f"-- {mostradas} mostrados. Enter para ver más, 'q' para terminar: ").strip().lower() == "q":
+                return
+
     # === FUNCIONES PARA ADMINISTRADORES ===
     
     def registrar_libro(self):
@@ -174,14 +168,11 @@ class SistemaLibreria:
             return
         
         try:
-            cursor = self.connection.cursor()
-            # Uso de parámetros para prevenir inyecciones SQL
-            query = """INSERT INTO libros (titulo, autor, isbn, editorial, año_publicacion, categoria, cantidad_disponible) 
-                      VALUES (%s, %s, %s, %s, %s, %s, %s)"""
-            cursor.execute(query, (titulo, autor, isbn, editorial, año, categoria, cantidad))
-            self.connection.commit()
+            self.servicio.registrar_libro(self.sesion, titulo, autor, isbn, editorial, año, categoria, cantidad)
             print("✓ Libro registrado exitosamente!")
-        except Error as e:
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al registrar libro: {e}")
     
     def registrar_usuario(self):
@@ -211,24 +202,13 @@ class SistemaLibreria:
             return
         
         try:
-            cursor = self.connection.cursor()
-            # Verificar si el email ya existe
-            check_query = "SELECT id FROM usuarios WHERE email = %s"
-            cursor.execute(check_query, (email,))
-            if cursor.fetchone():
-                print("✗ El email ya está registrado")
-                return
-            
-            # Hashear la contraseña antes de guardarla
-            password_hash = self.hash_password(password)
-            
-            # Insertar nuevo usuario con parámetros
-            query = "INSERT INTO usuarios (nombre, email, password, telefono, direccion) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(query, (nombre, email, password_hash, telefono, direccion))
-            self.connection.commit()
+            # El servicio comprueba duplicados y hashea la contraseña antes de guardarla
+            self.servicio.registrar_usuario(self.sesion, nombre, email, password, telefono, direccion)
             print("✓ Usuario registrado exitosamente!")
             print(" Contraseña encriptada y guardada de forma segura")
-        except Error as e:
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al registrar usuario: {e}")
     
     def registrar_administrador(self):
@@ -257,24 +237,13 @@ class SistemaLibreria:
             return
         
         try:
-            cursor = self.connection.cursor()
-            # Verificar si el username ya existe
-            check_query = "SELECT id FROM administradores WHERE username = %s"
-            cursor.execute(check_query, (username,))
-            if cursor.fetchone():
-                print("✗ El username ya está registrado")
-                return
-            
-            # Hashear la contraseña antes de guardarla
-            password_hash = self.hash_password(password)
-            
-            # Insertar nuevo administrador con parámetros
-            query = "INSERT INTO administradores (username, password, nombre, email) VALUES (%s, %s, %s, %s)"
-            cursor.execute(query, (username, password_hash, nombre, email))
-            self.connection.commit()
+            # El servicio comprueba duplicados y hashea la contraseña antes de guardarla
+            self.servicio.registrar_administrador(self.sesion, username, password, nombre, email)
             print("✓ Administrador registrado exitosamente!")
             print(" Contraseña encriptada y guardada de forma segura")
-        except Error as e:
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al registrar administrador: {e}")
     
     def listar_libros(self):
@@ -283,20 +252,14 @@ class SistemaLibreria:
         print("           LISTA DE LIBROS")
         print("="*50)
         try:
-            cursor = self.connection.cursor()
-            # Consulta segura sin parámetros de usuario
-            query = "SELECT id, titulo, autor, editorial, año_publicacion, categoria, cantidad_disponible FROM libros ORDER BY titulo"
-            cursor.execute(query)
-            libros = cursor.fetchall()
-            
-            if libros:
-                print(f"{'ID':<5} {'Título':<25} {'Autor':<20} {'Editorial':<15} {'Año':<6} {'Categoría':<15} {'Disp.'}")
-                print("-" * 95)
-                for libro in libros:
-                    print(f"{libro[0]:<5} {libro[1]:<25} {libro[2]:<20} {libro[3]:<15} {libro[4]:<6} {libro[5]:<15} {libro[6]:<5}")
-            else:
-                print("No hay libros registrados")
-        except Error as e:
+            self._mostrar_paginado(
+                "libros",
+                f"{'ID':<5} {'Título':<25} {'Autor':<20} {'Editorial':<15} {'Año':<6} {'Categoría':<15} {'Disp.'}", 95,
+                lambda libro: f"{libro['id']:<5} {libro['titulo']:<25} {libro['autor']:<20} {libro['editorial']:<15} {libro['año_publicacion']:<6} {libro['categoria']:<15} {libro['cantidad_disponible']:<5}",
+                "No hay libros registrados")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al listar libros: {e}")
     
     def listar_usuarios(self):
@@ -305,20 +268,14 @@ class SistemaLibreria:
         print("          LISTA DE USUARIOS")
         print("="*50)
         try:
-            cursor = self.connection.cursor()
-            # Consulta segura
-            query = "SELECT id, nombre, email, telefono FROM usuarios ORDER BY nombre"
-            cursor.execute(query)
-            usuarios = cursor.fetchall()
-            
-            if usuarios:
-                print(f"{'ID':<5} {'Nombre':<20} {'Email':<25} {'Teléfono':<15}")
-                print("-" * 70)
-                for usuario in usuarios:
-                    print(f"{usuario[0]:<5} {usuario[1]:<20} {usuario[2]:<25} {usuario[3]:<15}")
-            else:
-                print("No hay usuarios registrados")
-        except Error as e:
+            self._mostrar_paginado(
+                "usuarios",
+                f"{'ID':<5} {'Nombre':<20} {'Email':<25} {'Teléfono':<15}", 70,
+                lambda usuario: f"{usuario['id']:<5} {usuario['nombre']:<20} {usuario['email']:<25} {usuario['telefono']:<15}",
+                "No hay usuarios registrados")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al listar usuarios: {e}")
     
     def listar_prestamos(self):
@@ -327,30 +284,274 @@ class SistemaLibreria:
         print("          LISTA DE PRÉSTAMOS")
         print("="*50)
         try:
-            cursor = self.connection.cursor()
-            # Consulta segura con INNER JOIN
-            query = """
-            SELECT p.id, l.titulo, u.nombre, p.fecha_prestamo, p.fecha_devolucion, p.estado
-            FROM prestamos p
-            INNER JOIN libros l ON p.libro_id = l.id
-            INNER JOIN usuarios u ON p.usuario_id = u.id
-            ORDER BY p.fecha_prestamo DESC
-            """
-            cursor.execute(query)
-            prestamos = cursor.fetchall()
+            def formatear(prestamo):
+                devolucion = prestamo['fecha_devolucion'] if prestamo['fecha_devolucion'] else "Pendiente"
+                estado = " Activo" if prestamo['estado'] == 'activo' else " Devuelto"
+                return f"{prestamo['id']:<5} {prestamo['titulo']:<20} {prestamo['usuario']:<15} {str(prestamo['fecha_prestamo']):<12} {str(devolucion):<12} {estado:<10}"
             
-            if prestamos:
-                print(f"{'ID':<5} {'Libro':<20} {'Usuario':<15} {'Préstamo':<12} {'Devolución':<12} {'Estado':<10}")
-                print("-" * 80)
-                for prestamo in prestamos:
-                    devolucion = prestamo[4] if prestamo[4] else "Pendiente"
-                    estado = " Activo" if prestamo[5] == 'activo' else " Devuelto"
-                    print(f"{prestamo[0]:<5} {prestamo[1]:<20} {prestamo[2]:<15} {str(prestamo[3]):<12} {str(devolucion):<12} {estado:<10}")
-            else:
-                print("No hay préstamos registrados")
-        except Error as e:
+            self._mostrar_paginado(
+                "prestamos",
+                f"{'ID':<5} {'Libro':<20} {'Usuario':<15} {'Préstamo':<12} {'Devolución':<12} {'Estado':<10}", 80,
+                formatear, "No hay préstamos registrados")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al listar préstamos: {e}")
 
+    def listar_vencidos(self):
+        """Listar los préstamos activos con la fecha de vencimiento superada"""
+        print("\n" + "="*50)
+        print("          PRÉSTAMOS VENCIDOS")
+        print("="*50)
+        try:
+            self._mostrar_paginado(
+                "vencidos",
+                f"{'ID':<5} {'Libro':<20} {'Usuario':<15} {'Vencimiento':<12} {'Días':<5} {'Multa':>8}", 70,
+                lambda prestamo: f"{prestamo['id']:<5} {prestamo['titulo']:<20} {prestamo['usuario']:<15} {str(prestamo['fecha_vencimiento']):<12} {prestamo['dias_retraso']:<5} {prestamo['multa_centimos'] / 100:>8.2f}",
+                "No hay préstamos vencidos")
+            print(" Días y multa según el último cálculo nocturno (python multas.py)")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error al listar préstamos vencidos: {e}")
+
+    def ver_informes(self):
+        """Mostrar los informes de circulación"""
+        print("\n" + "="*50)
+        print("        INFORMES DE CIRCULACIÓN")
+        print("="*50)
+        nombres = list(INFORMES)
+        for i, nombre in enumerate(nombres, 1):
+            print(f"{i}. {INFORMES[nombre][0]}")
+        opcion = self.validar_numero(input(f"Seleccione un informe (1-{len(nombres)}): "))
+        if opcion is None or not 1 <= opcion <= len(nombres):
+            print("✗ Opción inválida")
+            return
+        try:
+            informe = self.servicio.informe(self.sesion, nombres[opcion - 1], TAMAÑO_PAGINA)
+            print(f"\n{informe['descripcion']}\n")
+            if informe["filas"]:
+                escribir_tabla(sys.stdout, informe["columnas"],
+                               [tuple(fila.values()) for fila in informe["filas"]])
+            else:
+                print("Todavía no hay préstamos registrados")
+            print("\n Para exportar: python informes.py <informe> --formato csv|columnas|parquet --salida archivo")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error al generar el informe: {e}")
+
+    def ver_metricas(self):
+        """Mostrar la latencia de las consultas de esta sesión (BIBLIOTECA_METRICAS=1)"""
+        print("\n" + "="*50)
+        print("        MÉTRICAS DE RENDIMIENTO")
+        print("="*50)
+        try:
+            metricas = self.servicio.resumen_metricas(self.sesion)
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+            return
+        columnas = ("consulta", "llamadas", "filas", "errores", "media_ms", "p95_ms", "max_ms")
+        filas = [tuple(consulta[columna] for columna in columnas) for consulta in metricas["consultas"]]
+        if filas:
+            escribir_tabla(sys.stdout, columnas, filas)
+        else:
+            print("Todavía no se ha ejecutado ninguna consulta")
+        pool = metricas["pool"]
+        print(f"\n Pool: {pool['adquisiciones']} conexiones prestadas, espera máxima {pool['espera_max_ms']} ms, "
+              f"{pool['timeouts']} tiempos agotados")
+        print(f" Caché: {metricas['cache']['aciertos']} aciertos, {metricas['cache']['fallos']} fallos")
+        for lenta in metricas["lentas"][:5]:
+            print(f" ⚠ {lenta['momento']} {lenta['consulta']}: {lenta['ms']} ms, {lenta['filas']} filas")
+
+    def consultar_ejemplar(self):
+        """Mostrar el ejemplar de un código de barras y su préstamo activo"""
+        print("\n" + "="*50)
+        print("        CONSULTAR EJEMPLAR")
+        print("="*50)
+        codigo = self.validar_input(input("Código de barras: "))
+        try:
+            ejemplar = self.servicio.buscar_ejemplar(self.sesion, codigo)
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+            return
+        except ErrorBD as e:
+            print(f"✗ Error al consultar el ejemplar: {e}")
+            return
+        print(f" Libro: {ejemplar['titulo']} (ID {ejemplar['libro_id']})")
+        print(f" Sucursal: {ejemplar['sucursal']}")
+        print(f" Estado: {ejemplar['estado']}")
+        if ejemplar["prestamo_id"] is not None:
+            print(f" Préstamo {ejemplar['prestamo_id']} a {ejemplar['usuario']} (ID {ejemplar['usuario_id']}), "
+                  f"vence el {ejemplar['fecha_vencimiento']}")
+
+    def importar_catalogo(self):
+        """Importar libros en bloque desde un archivo"""
+        print("\n" + "="*50)
+        print("         IMPORTAR CATÁLOGO")
+        print("="*50)
+        
+        ruta = self.validar_input(input("Ruta del archivo (.csv, .jsonl, .mrc): "))
+        if not ruta:
+            print("✗ La ruta es requerida")
+            return
+        
+        lote_input = self.validar_input(input("Tamaño de lote [1000]: "))
+        tamaño_lote = self.validar_numero(lote_input) if lote_input else 1000
+        if tamaño_lote is None or tamaño_lote < 1:
+            print("✗ El tamaño de lote debe ser un número positivo")
+            return
+        
+        ruta_rechazos = self.validar_input(input("Archivo de rechazos (opcional): ")) or None
+        
+        def progreso(resumen):
+            print(f"  Lote {resumen['lotes']}: {resumen['insertadas']} insertados")
+        
+        try:
+            resumen = self.servicio.importar_catalogo(self.sesion, ruta, tamaño_lote=tamaño_lote,
+                                                      ruta_rechazos=ruta_rechazos, progreso=progreso)
+            print(f"✓ Importación terminada en {resumen['segundos']} s ({resumen['filas_por_segundo']} filas/s)")
+            print(f" Leídas: {resumen['leidas']}  Insertadas: {resumen['insertadas']}  "
+                  f"Duplicadas: {resumen['duplicadas']}  Rechazadas: {resumen['rechazadas']}")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error al importar catálogo: {e}")
+
+    def _leer_codigos(self):
+        """Leer ids escaneados o tecleados hasta una línea vacía"""
+        print("Escanee o escriba los IDs (uno por línea, o separados por comas). Línea vacía para terminar.")
+        codigos = []
+        while True:
+            linea = input("> ").strip()
+            if not linea:
+                return codigos
+            codigos.extend(codigo for codigo in linea.replace(";", ",").replace(" ", ",").split(",") if codigo)
+
+    def _mostrar_lote(self, resumen):
+        for item in resumen["items"]:
+            if item["ok"]:
+                print(f"✓ {item['id']}: {item['titulo']} (préstamo {item['prestamo_id']})")
+            else:
+                print(f"✗ {item['id']}: {item['error']}")
+        print(f"\n {resumen['correctos']} correctos, {resumen['fallidos']} fallidos "
+              f"en {resumen['segundos']} s ({resumen['items_por_segundo']} por segundo)")
+
+    def devolver_lote(self):
+        """Devolver de una vez los libros del buzón"""
+        print("\n" + "="*50)
+        print("        DEVOLUCIÓN EN LOTE")
+        print("="*50)
+        modo = self.validar_input(input("Los IDs son de (1) préstamo, (2) libro o (3) código de barras [1]: "))
+        por = {"2": "libro", "3": "codigo"}.get(modo, "prestamo")
+        codigos = self._leer_codigos()
+        if not codigos:
+            print("✗ No se indicó ningún ID")
+            return
+        try:
+            self._mostrar_lote(self.servicio.devolver_lote(self.sesion, codigos, por))
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error en la devolución en lote: {e}")
+
+    def prestar_lote(self):
+        """Prestar varios libros a un usuario en una sola operación"""
+        print("\n" + "="*50)
+        print("        PRÉSTAMO EN LOTE")
+        print("="*50)
+        usuario_id = self.validar_numero(input("ID del usuario: "))
+        if usuario_id is None:
+            print("✗ ID debe ser un número válido")
+            return
+        codigos = self._leer_codigos()
+        if not codigos:
+            print("✗ No se indicó ningún ID")
+            return
+        try:
+            resumen = self.servicio.prestar_lote(self.sesion, codigos, usuario_id)
+            self._mostrar_lote(resumen)
+            if resumen["correctos"]:
+                print(f" Devolver antes de: {resumen['fecha_devolucion_estimada']}")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error en el préstamo en lote: {e}")
+
+    # === DIARIO SIN CONEXIÓN ===
+
+    def _diario(self):
+        if self.diario is None:
+            self.diario = DiarioMostrador()
+        return self.diario
+
+    def trabajar_sin_conexion(self):
+        """Anotar préstamos y devoluciones en el diario local mientras no hay base central.
+
+        Devuelve True si la conexión se recupera y el sistema puede continuar.
+        """
+        print("\n Modo sin conexión: los préstamos y devoluciones se anotan en el diario local")
+        print(" y se aplican en la base central al sincronizar (opción 16 del administrador).")
+        while True:
+            print("\n" + "="*50)
+            print("        MOSTRADOR SIN CONEXIÓN")
+            print("="*50)
+            print("1. Préstamo (códigos de barras)")
+            print("2. Devolución (códigos de barras)")
+            print("3. Estado del diario")
+            print("4. Reintentar la conexión")
+            print("5. Salir")
+            print("-"*50)
+            opcion = input("Seleccione una opción (1-5): ")
+            try:
+                if opcion == "1":
+                    usuario_id = self.validar_numero(input("ID del usuario: "))
+                    if usuario_id is None:
+                        print("✗ ID debe ser un número válido")
+                        continue
+                    codigos = self._leer_codigos()
+                    if codigos:
+                        print(f"✓ {self._diario().prestar(usuario_id, codigos)} préstamos anotados")
+                elif opcion == "2":
+                    codigos = self._leer_codigos()
+                    if codigos:
+                        print(f"✓ {self._diario().devolver(codigos)} devoluciones anotadas")
+                elif opcion == "3":
+                    estado = self._diario().estado()
+                    print(f" Pendientes: {estado['pendiente']}  Aplicadas: {estado['aplicada']}  "
+                          f"Duplicadas: {estado['duplicada']}  Conflictos: {estado['conflicto']}")
+                elif opcion == "4":
+                    if self.conectar_bd():
+                        return True
+                elif opcion == "5":
+                    return False
+                else:
+                    print("✗ Opción inválida")
+            except ErrorBD as e:
+                print(f"✗ No se pudo escribir en el diario local: {e}")
+
+    def sincronizar_diario(self):
+        """Aplicar en la base central lo anotado sin conexión"""
+        print("\n" + "="*50)
+        print("        SINCRONIZAR DIARIO")
+        print("="*50)
+
+        def progreso(resumen):
+            print(f"  lote {resumen['lotes']}: {resumen['aplicada']} aplicadas, {resumen['conflicto']} conflictos")
+
+        try:
+            resumen = sincronizar(self._diario(), self.servicio, self.sesion, progreso=progreso)
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+            return
+        except ErrorBD as e:
+            print(f"✗ Error al sincronizar; lo pendiente sigue en el diario: {e}")
+            return
+        print(f"✓ {resumen['aplicada']} aplicadas, {resumen['duplicada']} duplicadas, "
+              f"{resumen['conflicto']} conflictos")
+        for conflicto in self._diario().conflictos():
+            print(f"✗ {conflicto['fecha']} {conflicto['tipo']} {conflicto['codigo_barras']}: {conflicto['detalle']}")
+
     # === FUNCIONES PARA USUARIOS ===
     
     def registrar_prestamo(self):
@@ -368,34 +569,68 @@ class SistemaLibreria:
             return
         
         try:
-            cursor = self.connection.cursor()
-            # Verificar disponibilidad con parámetros
-            query = "SELECT id, titulo, cantidad_disponible FROM libros WHERE id = %s AND cantidad_disponible > 0"
-            cursor.execute(query, (libro_id,))
-            resultado = cursor.fetchone()
-            
-            if resultado:
-                fecha_prestamo = datetime.now().date()
-                fecha_devolucion_estimada = fecha_prestamo + timedelta(days=15)
-                
-                # Registrar préstamo con parámetros
-                query = "INSERT INTO prestamos (libro_id, usuario_id, fecha_prestamo, estado) VALUES (%s, %s, %s, 'activo')"
-                cursor.execute(query, (libro_id, self.usuario_actual, fecha_prestamo))
-                
-                # Actualizar cantidad disponible con parámetros
-                query = "UPDATE libros SET cantidad_disponible = cantidad_disponible - 1 WHERE id = %s"
-                cursor.execute(query, (libro_id,))
-                
-                self.connection.commit()
-                print(f"\n✓ Préstamo registrado exitosamente!")
-                print(f" Libro: {resultado[1]}")
-                print(f" Fecha de préstamo: {fecha_prestamo}")
-                print(f" Devolver antes de: {fecha_devolucion_estimada}")
-            else:
-                print("✗ Libro no disponible o no encontrado")
-                
-        except Error as e:
+            # Verificar disponibilidad, registrar el préstamo y descontar el ejemplar
+            prestamo = self.servicio.registrar_prestamo(self.sesion, libro_id)
+            print(f"\n✓ Préstamo registrado exitosamente!")
+            print(f" Libro: {prestamo['titulo']}")
+            print(f" Ejemplar: {prestamo['codigo_barras']}")
+            print(f" Fecha de préstamo: {prestamo['fecha_prestamo']}")
+            print(f" Devolver antes de: {prestamo['fecha_devolucion_estimada']}")
+        except NoDisponible as e:
+            print(f"✗ {e}")
+            # En lugar de reintentar, la reserva aparta el próximo ejemplar devuelto
+            if self.validar_input(input("¿Desea reservarlo? (s/n): ")).lower() == "s":
+                self.reservar_libro(libro_id)
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al registrar préstamo: {e}")
+
+    def reservar_libro(self, libro_id):
+        """Poner al usuario en la cola de reservas del libro"""
+        try:
+            reserva = self.servicio.reservar(self.sesion, libro_id)
+            print(f"✓ Reserva registrada: es el número {reserva['posicion']} de la cola")
+            print(" Cuando se devuelva un ejemplar quedará apartado a su nombre (ver 'Mis reservas')")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error al reservar: {e}")
+
+    def mis_reservas(self):
+        """Mostrar las reservas activas y permitir cancelar una"""
+        print("\n" + "="*50)
+        print("            MIS RESERVAS")
+        print("="*50)
+        try:
+            reservas = self.servicio.mis_reservas(self.sesion)
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+            return
+        except ErrorBD as e:
+            print(f"✗ Error al listar reservas: {e}")
+            return
+        if not reservas:
+            print("No tienes reservas activas")
+            return
+        print(f"{'ID':<5} {'Libro':<30} {'Situación'}")
+        print("-" * 65)
+        for reserva in reservas:
+            if reserva["estado"] == "asignada":
+                situacion = f"Apartado ({reserva['codigo_barras']}) hasta el {reserva['fecha_limite']}"
+            else:
+                situacion = f"En cola, posición {reserva['posicion']}"
+            print(f"{reserva['id']:<5} {reserva['titulo'][:29]:<30} {situacion}")
+        reserva_id = self.validar_numero(input("\nID de la reserva a cancelar (Enter para volver): ") or "")
+        if reserva_id is None:
+            return
+        try:
+            self.servicio.cancelar_reserva(self.sesion, reserva_id)
+            print("✓ Reserva cancelada")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error al cancelar la reserva: {e}")
     
     def listar_libros_disponibles(self):
         """Listar solo libros disponibles de forma segura"""
@@ -403,22 +638,36 @@ class SistemaLibreria:
         print("        LIBROS DISPONIBLES")
         print("="*50)
         try:
-            cursor = self.connection.cursor()
-            # Consulta segura
-            query = "SELECT id, titulo, autor, editorial, categoria, cantidad_disponible FROM libros WHERE cantidad_disponible > 0 ORDER BY titulo"
-            cursor.execute(query)
-            libros = cursor.fetchall()
-            
-            if libros:
-                print(f"{'ID':<5} {'Título':<25} {'Autor':<20} {'Editorial':<15} {'Categoría':<15} {'Disp.'}")
-                print("-" * 85)
-                for libro in libros:
-                    print(f"{libro[0]:<5} {libro[1]:<25} {libro[2]:<20} {libro[3]:<15} {libro[4]:<15} {libro[5]:<5}")
-            else:
-                print("No hay libros disponibles")
-        except Error as e:
+            self._mostrar_paginado(
+                "libros_disponibles",
+                f"{'ID':<5} {'Título':<25} {'Autor':<20} {'Editorial':<15} {'Categoría':<15} {'Disp.'}", 85,
+                lambda libro: f"{libro['id']:<5} {libro['titulo']:<25} {libro['autor']:<20} {libro['editorial']:<15} {libro['categoria']:<15} {libro['cantidad_disponible']:<5}",
+                "No hay libros disponibles")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al listar libros: {e}")
     
+    def buscar_libros(self):
+        """Buscar libros por título, autor, editorial, categoría o ISBN"""
+        print("\n" + "="*50)
+        print("        BUSCAR LIBROS")
+        print("="*50)
+        texto = self.validar_input(input("Buscar (título, autor, editorial, categoría o ISBN): "))
+        if not texto:
+            print("✗ Escriba al menos una palabra para buscar")
+            return
+        try:
+            self._mostrar_paginas(
+                lambda cursor: self.servicio.buscar_libros(self.sesion, texto, TAMAÑO_PAGINA, cursor),
+                f"{'ID':<5} {'Título':<25} {'Autor':<20} {'Editorial':<15} {'Categoría':<15} {'Disp.'}", 85,
+                lambda libro: f"{libro['id']:<5} {libro['titulo']:<25} {libro['autor']:<20} {libro['editorial'] or '':<15} {libro['categoria'] or '':<15} {libro['cantidad_disponible']:<5}",
+                f"No se encontraron libros para '{texto}'")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
+            print(f"✗ Error al buscar libros: {e}")
+
     def devolver_libro(self):
         """Devolver libro prestado de forma segura"""
         print("\n" + "="*50)
@@ -434,36 +683,13 @@ class SistemaLibreria:
             return
         
         try:
-            cursor = self.connection.cursor()
-            
-            # Verificar que el préstamo pertenece al usuario actual con parámetros
-            query = """SELECT p.libro_id, l.titulo 
-                      FROM prestamos p 
-                      INNER JOIN libros l ON p.libro_id = l.id 
-                      WHERE p.id = %s AND p.usuario_id = %s AND p.estado = 'activo'"""
-            cursor.execute(query, (prestamo_id, self.usuario_actual))
-            resultado = cursor.fetchone()
-            
-            if resultado:
-                libro_id = resultado[0]
-                libro_titulo = resultado[1]
-                fecha_devolucion = datetime.now().date()
-                
-                # Actualizar préstamo con parámetros
-                query = "UPDATE prestamos SET estado = 'devuelto', fecha_devolucion = %s WHERE id = %s"
-                cursor.execute(query, (fecha_devolucion, prestamo_id))
-                
-                # Actualizar cantidad disponible del libro con parámetros
-                query = "UPDATE libros SET cantidad_disponible = cantidad_disponible + 1 WHERE id = %s"
-                cursor.execute(query, (libro_id,))
-                
-                self.connection.commit()
-                print(f"✓ Libro '{libro_titulo}' devuelto exitosamente!")
-                print(f" Fecha de devolución: {fecha_devolucion}")
-            else:
-                print("✗ Préstamo no encontrado, ya devuelto o no te pertenece")
-                
-        except Error as e:
+            # Verificar que el préstamo pertenece al usuario actual y devolverlo
+            devolucion = self.servicio.devolver_libro(self.sesion, prestamo_id)
+            print(f"✓ Libro '{devolucion['titulo']}' devuelto exitosamente!")
+            print(f" Fecha de devolución: {devolucion['fecha_devolucion']}")
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+        except ErrorBD as e:
             print(f"✗ Error al devolver libro: {e}")
     
     def mis_prestamos_activos(self):
@@ -472,32 +698,74 @@ class SistemaLibreria:
         print("        MIS PRÉSTAMOS ACTIVOS")
         print("="*50)
         try:
-            cursor = self.connection.cursor()
-            # Consulta segura con parámetros
-            query = """
-            SELECT p.id, l.titulo, p.fecha_prestamo, l.autor
-            FROM prestamos p
-            INNER JOIN libros l ON p.libro_id = l.id
-            WHERE p.usuario_id = %s AND p.estado = 'activo'
-            ORDER BY p.fecha_prestamo DESC
-            """
-            cursor.execute(query, (self.usuario_actual,))
-            prestamos = cursor.fetchall()
+            prestamos = self.servicio.mis_prestamos_activos(self.sesion)
             
             if prestamos:
                 print(f"{'ID':<5} {'Libro':<25} {'Autor':<20} {'Préstamo':<12}")
                 print("-" * 65)
                 for prestamo in prestamos:
-                    fecha_devolucion_estimada = prestamo[2] + timedelta(days=15)
-                    print(f"{prestamo[0]:<5} {prestamo[1]:<25} {prestamo[3]:<20} {str(prestamo[2]):<12}")
-                    print(f"   Devolver antes: {fecha_devolucion_estimada}")
+                    print(f"{prestamo['id']:<5} {prestamo['titulo']:<25} {prestamo['autor']:<20} {str(prestamo['fecha_prestamo']):<12}")
+                    print(f"   Devolver antes: {prestamo['fecha_devolucion_estimada']}")
+                    if prestamo['multa_centimos']:
+                        print(f"   Retraso: {prestamo['dias_retraso']} días  Multa: {prestamo['multa_centimos'] / 100:.2f}")
                     print()
             else:
                 print("No tienes préstamos activos")
-        except Error as e:
+        except ErrorBD as e:
             print(f"✗ Error al listar préstamos: {e}")
 
-    # === MENÚ PRINCIPAL ===
+    def ver_recomendaciones(self):
+        """Sugerir libros a partir de los préstamos activos del usuario"""
+        print("\n" + "="*50)
+        print("        TE PUEDE INTERESAR")
+        print("="*50)
+        try:
+            libros = self.servicio.recomendaciones(self.sesion)
+        except ErrorBiblioteca as e:
+            print(f"✗ {e}")
+            return
+        except ErrorBD as e:
+            print(f"✗ Error al buscar recomendaciones: {e}")
+            return
+        if not libros:
+            print("Todavía no hay recomendaciones para tus préstamos")
+            return
+        print("Otros lectores de tus libros también se llevaron:\n")
+        print(f"{'ID':<5} {'Título':<30} {'Autor':<25} {'Disp.':<5}")
+        print("-" * 68)
+        for libro in libros:
+            print(f"{libro['id']:<5} {libro['titulo'][:29]:<30} {libro['autor'][:24]:<25} {libro['cantidad_disponible']:<5}")
+        print("\n Para pedir uno: opción 2 (Registrar préstamo) con su ID")
+
+    def historial_prestamos(self):
+        """Mostrar todos los préstamos del usuario, página a página, del más reciente al más antiguo"""
+        print("\n" + "="*50)
+        print("        HISTORIAL DE PRÉSTAMOS")
+        print("="*50)
+        cursor = None
+        while True:
+            try:
+                pagina = self.servicio.historial_prestamos(self.sesion, limite=20, cursor=cursor)
+            except ErrorBiblioteca as e:
+                print(f"✗ {e}")
+                return
+            except ErrorBD as e:
+                print(f"✗ Error al leer el historial: {e}")
+                return
+            if not pagina["filas"] and cursor is None:
+                print("Todavía no has tomado ningún libro prestado")
+                return
+            print(f"{'ID':<7} {'Título':<30} {'Préstamo':<12} {'Devuelto':<12} {'Multa':<6}")
+            print("-" * 70)
+            for prestamo in pagina["filas"]:
+                devuelto = str(prestamo['fecha_devolucion'] or "-")[:10]
+                multa = f"{prestamo['multa_centimos'] / 100:.2f}" if prestamo['multa_centimos'] else ""
+                print(f"{prestamo['id']:<7} {prestamo['titulo'][:29]:<30} {str(prestamo['fecha_prestamo'])[:10]:<12} "
+                      f"{devuelto:<12} {multa:<6}")
+            cursor = pagina["siguiente"]
+            if not cursor or input("\n¿Ver más? (s/n): ").strip().lower() != "s":
+                return
+
     
     def menu_administrador(self):
         """Menú para administradores"""
@@ -512,9 +780,18 @@ class SistemaLibreria:
             print("5.  Listar usuarios")
             print("6.  Listar préstamos")
             print("7.  Cerrar sesión")
+            print("8.  Importar catálogo (CSV/JSONL/MARC)")
+            print("9.  Buscar libros")
+            print("10. Devolución en lote (buzón)")
+            print("11. Préstamo en lote (mostrador)")
+            print("12. Préstamos vencidos")
+            print("13. Informes de circulación")
+            print("14. Métricas de rendimiento")
+            print("15. Consultar ejemplar (código de barras)")
+            print("16. Sincronizar diario sin conexión")
             print("-"*50)
             
-            opcion = input("Seleccione una opción (1-7): ")
+            opcion = input("Seleccione una opción (1-16): ")
             
             if opcion == "1":
                 self.registrar_libro()
@@ -531,6 +808,24 @@ class SistemaLibreria:
             elif opcion == "7":
                 print("¡Sesión cerrada! ")
                 break
+            elif opcion == "8":
+                self.importar_catalogo()
+            elif opcion == "9":
+                self.buscar_libros()
+            elif opcion == "10":
+                self.devolver_lote()
+            elif opcion == "11":
+                self.prestar_lote()
+            elif opcion == "12":
+                self.listar_vencidos()
+            elif opcion == "13":
+                self.ver_informes()
+            elif opcion == "14":
+                self.ver_metricas()
+            elif opcion == "15":
+                self.consultar_ejemplar()
+            elif opcion == "16":
+                self.sincronizar_diario()
             else:
                 print("✗ Opción inválida")
     
@@ -545,9 +840,13 @@ class SistemaLibreria:
             print("3.  Mis préstamos activos")
             print("4. ↩  Devolver libro")
             print("5.  Cerrar sesión")
+            print("6.  Buscar libros")
+            print("7.  Mis reservas")
+            print("8.  Recomendaciones")
+            print("9.  Historial de préstamos")
             print("-"*50)
             
-            opcion = input("Seleccione una opción (1-5): ")
+            opcion = input("Seleccione una opción (1-9): ")
             
             if opcion == "1":
                 self.listar_libros_disponibles()
@@ -560,6 +859,14 @@ class SistemaLibreria:
             elif opcion == "5":
                 print("¡Sesión cerrada! ")
                 break
+            elif opcion == "6":
+                self.buscar_libros()
+            elif opcion == "7":
+                self.mis_reservas()
+            elif opcion == "8":
+                self.ver_recomendaciones()
+            elif opcion == "9":
+                self.historial_prestamos()
             else:
                 print("✗ Opción inválida")
     
@@ -568,24 +875,41 @@ class SistemaLibreria:
         print(" Iniciando Sistema de Biblioteca...")
         
         if not self.conectar_bd():
-            print("No se pudo conectar a la base de datos. Saliendo...")
-            input("Presiona Enter para continuar...")
-            return
+            respuesta = input("¿Trabajar sin conexión con el diario local? (s/n): ").strip().lower()
+            if respuesta != "s" or not self.trabajar_sin_conexion():
+                if self.diario:
+                    self.diario.cerrar()
+                print("No se pudo conectar a la base de datos. Saliendo...")
+                input("Presiona Enter para continuar...")
+                return
         
         if not self.verificar_tablas():
             print("Faltan tablas en la base de datos. Saliendo...")
             input("Presiona Enter para continuar...")
             return
         
+        # Una base nueva (por ejemplo SQLite embebido) necesita un primer administrador
+        try:
+            if not self.servicio.hay_administradores():
+                print("No hay administradores registrados. Cree el primero para continuar.")
+                self.registrar_administrador()
+        except ErrorBD as e:
+            print(f"✗ Error al verificar administradores: {e}")
+        
         # Inicia directamente con el login
         if self.login():
             if self.tipo_usuario == "administrador":
+                pendientes = os.path.exists(RUTA_DIARIO) and self._diario().estado()["pendiente"]
+                if pendientes:
+                    print(f" Hay {pendientes} operaciones del diario sin sincronizar (opción 16)")
                 self.menu_administrador()
             else:
                 self.menu_usuario()
         
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
+        if self.diario:
+            self.diario.cerrar()
+        if self.servicio:
+            self.servicio.cerrar()
             print("Conexión a la base de datos cerrada.")
 
 if __name__ == "__main__":
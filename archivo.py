@@ -0,0 +1,95 @@
+"""Archivo de préstamos devueltos: mantiene pequeña la tabla prestamos.
+
+Uso:
+    python archivo.py                             # devueltos hace más de 365 días
+    python archivo.py --dias 180 --lote 2000 --pausa 0.2
+
+Mueve a prestamos_archivo (migración 14) los préstamos devueltos antes del
+corte cuya multa ya está calculada. Recorre prestamos por clave primaria y
+mueve cada lote en una transacción (copiar y borrar), con una pausa entre
+lotes para no competir con los préstamos del mostrador ni retrasar las
+réplicas. Puede interrumpirse en cualquier momento: lo movido ya no está en
+prestamos y la siguiente ejecución sigue con el resto.
+
+Las consultas diarias (préstamos activos, devoluciones, listados y
+vencidos) solo leen prestamos; el historial de cada usuario
+(servicio.historial_prestamos, GET /prestamos/historial) y el índice de
+recomendaciones leen las dos tablas.
+"""
+import argparse
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+
+DIAS_ARCHIVO = int(os.environ.get("BIBLIOTECA_ARCHIVO_DIAS", "365"))
+TAMAÑO_LOTE = 1000
+# Segundos de espera entre lotes
+PAUSA = 0.1
+
+
+def archivar_prestamos(repo, dias=DIAS_ARCHIVO, tamaño_lote=TAMAÑO_LOTE, pausa=PAUSA, hoy=None, progreso=None):
+    """Mover por lotes los préstamos devueltos hace más de dias días y devolver un resumen"""
+    if dias < 0 or tamaño_lote < 1 or pausa < 0:
+        raise ValueError("Días, lote y pausa deben ser positivos")
+    corte = (hoy or date.today()) - timedelta(days=dias)
+    inicio = time.perf_counter()
+    resumen = {"corte": corte, "lotes": 0, "archivados": 0}
+    desde_id = 0
+    while True:
+        ids = repo.prestamos_para_archivar(desde_id, corte, tamaño_lote)
+        if not ids:
+            break
+        desde_id = ids[-1]
+        resumen["archivados"] += repo.archivar_prestamos(ids, datetime.now().replace(microsecond=0))
+        resumen["lotes"] += 1
+        if progreso:
+            progreso(resumen)
+        if len(ids) < tamaño_lote:
+            break
+        time.sleep(pausa)
+    duracion = time.perf_counter() - inicio
+    resumen["segundos"] = round(duracion, 3)
+    resumen["prestamos_por_segundo"] = round(resumen["archivados"] / duracion, 1) if duracion else None
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dias", type=int, default=DIAS_ARCHIVO, help="Antigüedad mínima de la devolución")
+    parser.add_argument("--lote", type=int, default=TAMAÑO_LOTE, help="Préstamos por lote y por commit")
+    parser.add_argument("--pausa", type=float, default=PAUSA, help="Segundos de espera entre lotes")
+    parser.add_argument("--hoy", type=date.fromisoformat, help="Fecha de referencia AAAA-MM-DD (por defecto, hoy)")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+    if args.dias < 0 or args.lote < 1 or args.pausa < 0:
+        parser.error("--dias, --lote y --pausa deben ser positivos")
+
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+
+    def progreso(resumen):
+        print(f"  lote {resumen['lotes']}: {resumen['archivados']} préstamos archivados")
+
+    try:
+        resumen = archivar_prestamos(RepositorioBiblioteca(backend, connection), args.dias, args.lote, args.pausa,
+                                     args.hoy, progreso)
+    except ErrorBD as e:
+        print(f"✗ Error al archivar préstamos: {e}")
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+    print(f"✓ {resumen['archivados']} préstamos devueltos antes del {resumen['corte']} archivados "
+          f"en {resumen['segundos']} s")
+    print(json.dumps(resumen, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Pruebas de rendimiento del Sistema de Biblioteca"""
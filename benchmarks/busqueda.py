@@ -0,0 +1,115 @@
+"""Medir la latencia de la búsqueda de texto completo sobre un catálogo sintético.
+
+Uso:
+    python -m benchmarks.busqueda --libros 1000000 --consultas 500
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from almacenamiento import ErrorBD
+from benchmarks.comun import crear_backend_bench, percentil
+from repositorio import RepositorioBiblioteca
+from validaciones import terminos_busqueda
+
+PALABRAS = ("árbol ciencia memoria sombra río ciudad noche jardín camino mar guerra paz historia corazón "
+            "viento silencio tiempo fuego luna montaña invierno verano niño mujer hombre casa puerta "
+            "cielo tierra sueño libro palabra voz isla ángel lobo reino canción sangre hielo").split()
+NOMBRES = "Pío Benito Isabel Carmen Ramón Emilia Gabriel Rosalía Miguel Ana Julio Teresa".split()
+APELLIDOS = "Baroja Pérez Allende Laforet Valle-Inclán Pardo García Castro Unamuno Matute Cortázar Martín".split()
+CATEGORIAS = "Novela Poesía Ensayo Historia Ciencia Infantil Teatro Biografía".split()
+SILABAS = "ba be bi bo ca ce ci co da de di do fa la le li lo ma me mi mo na ne ni no ra re ri ro sa se si so ta te to".split()
+
+
+def _vocabulario(azar, tamaño=20000):
+    """Palabras inventadas que, junto con PALABRAS, dan un vocabulario de catálogo real"""
+    return sorted({"".join(azar.choices(SILABAS, k=azar.randint(2, 4))) for _ in range(tamaño)})
+
+
+def generar_libros(cantidad, azar, prefijo):
+    """Generar filas de libro con títulos y autores en español.
+
+    Las palabras frecuentes salen de PALABRAS y el resto de un vocabulario
+    amplio, para que cada término no aparezca en una fracción irreal del catálogo.
+    """
+    vocabulario = _vocabulario(azar)
+    for i in range(cantidad):
+        palabras = [azar.choice(PALABRAS) if azar.random() < 0.25 else azar.choice(vocabulario)
+                    for _ in range(azar.randint(2, 5))]
+        titulo = " ".join(palabras).capitalize()
+        autor = f"{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)}"
+        yield (titulo, autor, f"{prefijo}{i:09d}", f"Editorial {azar.randint(1, 300)}",
+               azar.randint(1850, 2024), azar.choice(CATEGORIAS), azar.randint(0, 5))
+
+
+def consultas_aleatorias(cantidad, azar):
+    """Mezcla de palabras completas, prefijos, varias palabras y búsquedas sin tildes"""
+    consultas = []
+    for _ in range(cantidad):
+        tipo = azar.random()
+        if tipo < 0.3:
+            consultas.append(azar.choice(PALABRAS))
+        elif tipo < 0.5:
+            consultas.append(azar.choice(PALABRAS)[:3])
+        elif tipo < 0.8:
+            consultas.append(f"{azar.choice(PALABRAS)} {azar.choice(APELLIDOS).lower()}")
+        else:
+            consultas.append(" ".join(azar.sample(PALABRAS, 2)).replace("á", "a").replace("í", "i"))
+    return consultas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--libros", type=int, default=200000)
+    parser.add_argument("--consultas", type=int, default=500)
+    parser.add_argument("--pagina", type=int, default=20)
+    parser.add_argument("--lote", type=int, default=10000)
+    args = parser.parse_args()
+
+    azar = random.Random(7)
+    with tempfile.TemporaryDirectory() as directorio:
+        backend = crear_backend_bench(args.backend, directorio)
+        try:
+            connection = backend.conectar()
+        except ErrorBD as e:
+            raise SystemExit(f"✗ No se pudo conectar: {e}")
+        repo = RepositorioBiblioteca(backend, connection)
+
+        inicio = time.perf_counter()
+        lote = []
+        for fila in generar_libros(args.libros, azar, f"B{time.time_ns() % 10**6}-"):
+            lote.append(fila)
+            if len(lote) >= args.lote:
+                repo.insertar_libros(lote)
+                lote = []
+        if lote:
+            repo.insertar_libros(lote)
+        carga = time.perf_counter() - inicio
+
+        latencias = []
+        resultados = 0
+        for consulta in consultas_aleatorias(args.consultas, azar):
+            terminos = terminos_busqueda(consulta)
+            t0 = time.perf_counter()
+            filas, _ = repo.buscar_libros(terminos, args.pagina)
+            latencias.append((time.perf_counter() - t0) * 1000)
+            resultados += len(filas)
+        backend.cerrar(connection)
+
+    print(json.dumps({
+        "backend": backend.descripcion(),
+        "libros": args.libros,
+        "carga_segundos": round(carga, 2),
+        "consultas": args.consultas,
+        "resultados_medios": round(resultados / args.consultas, 1),
+        "ms_p50": round(percentil(latencias, 50), 2),
+        "ms_p95": round(percentil(latencias, 95), 2),
+        "ms_p99": round(percentil(latencias, 99), 2),
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Ejecutar la misma carga de catálogo y préstamos sobre varios backends.
+
+Uso:
+    python -m benchmarks.comparar_backends --backends sqlite mysql --libros 2000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from almacenamiento import BackendSQLite, crear_backend
+from repositorio import RepositorioBiblioteca
+
+
+def medir(nombre, funcion, repeticiones, resultados):
+    """Ejecutar funcion(i) varias veces y guardar operaciones por segundo"""
+    inicio = time.perf_counter()
+    for i in range(repeticiones):
+        funcion(i)
+    duracion = time.perf_counter() - inicio
+    resultados[nombre] = {
+        "operaciones": repeticiones,
+        "segundos": round(duracion, 4),
+        "ops_por_segundo": round(repeticiones / duracion, 1) if duracion else None,
+    }
+
+
+def ejecutar_carga(backend, libros, usuarios, prestamos, semilla=42):
+    """Cargar datos, prestar, devolver y listar sobre un backend"""
+    azar = random.Random(semilla)
+    connection = backend.conectar()
+    repo = RepositorioBiblioteca(backend, connection)
+    resultados = {}
+    prefijo = f"bench-{int(time.time())}"
+    libro_ids = []
+    usuario_ids = []
+
+    medir("registrar_libro", lambda i: libro_ids.append(repo.insertar_libro(
+        f"Libro {i}", f"Autor {i % 97}", f"{prefijo}-{i}", "Editorial", 2000 + i % 25, "General", 3
+    )), libros, resultados)
+    medir("registrar_usuario", lambda i: usuario_ids.append(repo.insertar_usuario(
+        f"Usuario {i}", f"{prefijo}-{i}@example.com", "x" * 64, "", ""
+    )), usuarios, resultados)
+    medir("login_usuario", lambda i: repo.buscar_usuario(f"{prefijo}-{i % usuarios}@example.com"), usuarios, resultados)
+
+    activos = []
+
+    def prestar(i):
+        usuario_id = usuario_ids[i % usuarios]
+        resultado = repo.registrar_prestamo(azar.choice(libro_ids), usuario_id, date.today(),
+                                            date.today() + timedelta(days=15))
+        if resultado:
+            activos.append((usuario_id, resultado[0]))
+
+    medir("registrar_prestamo", prestar, prestamos, resultados)
+    medir("mis_prestamos_activos", lambda i: repo.prestamos_activos(usuario_ids[i % usuarios]), usuarios, resultados)
+    medir("listar_libros_disponibles", lambda i: repo.listar_libros_disponibles(), 20, resultados)
+    medir("listar_prestamos", lambda i: repo.listar_prestamos(), 5, resultados)
+    medir("devolver_libro", lambda i: repo.devolver_prestamo(activos[i][1], activos[i][0], date.today(),
+                                                              date.today() + timedelta(days=3)),
+          len(activos), resultados)
+
+    backend.cerrar(connection)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["sqlite"], choices=["sqlite", "mysql"])
+    parser.add_argument("--libros", type=int, default=1000)
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--prestamos", type=int, default=1000)
+    args = parser.parse_args()
+
+    informe = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        for nombre in args.backends:
+            if nombre == "sqlite":
+                backend = BackendSQLite(os.path.join(directorio, "bench.db"))
+            else:
+                backend = crear_backend(nombre)
+            informe[nombre] = ejecutar_carga(backend, args.libros, args.usuarios, args.prestamos)
+    print(json.dumps(informe, indent=2))
+
+
+if __name__ == "__main__":
+    main()
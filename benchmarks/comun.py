@@ -0,0 +1,49 @@
+"""Utilidades compartidas por los scripts de rendimiento"""
+import os
+import time
+
+from almacenamiento import BackendSQLite, crear_backend
+
+PASSWORD = "bench-1234"
+
+
+def crear_backend_bench(nombre, directorio):
+    """SQLite en un directorio desechable o el backend configurado por entorno"""
+    if nombre == "sqlite":
+        return BackendSQLite(os.path.join(directorio, "bench.db"))
+    return crear_backend(nombre)
+
+
+def poblar(servicio, libros, usuarios, copias=3):
+    """Crear un administrador, libros y usuarios; devolver (sesion_admin, libro_ids, emails)"""
+    prefijo = f"bench-{time.time_ns()}"
+    username = f"{prefijo}-admin"
+    sesion = _sesion_admin(servicio) if servicio.hay_administradores() else None
+    servicio.registrar_administrador(sesion, username, PASSWORD, "Bench", f"{username}@example.com")
+    admin = servicio.login(username, PASSWORD)
+    libro_ids = [
+        servicio.registrar_libro(admin, f"Libro {i}", f"Autor {i % 97}", f"{prefijo}-{i}", "Editorial",
+                                 2000 + i % 25, "General", copias)
+        for i in range(libros)
+    ]
+    emails = [f"{prefijo}-{i}@example.com" for i in range(usuarios)]
+    for i, email in enumerate(emails):
+        servicio.registrar_usuario(admin, f"Usuario {i}", email, PASSWORD)
+    return admin, libro_ids, emails
+
+
+def _sesion_admin(servicio):
+    username = os.environ.get("BIBLIOTECA_BENCH_ADMIN")
+    password = os.environ.get("BIBLIOTECA_BENCH_PASSWORD")
+    if not username or not password:
+        raise SystemExit("La base ya tiene administradores: defina BIBLIOTECA_BENCH_ADMIN y BIBLIOTECA_BENCH_PASSWORD")
+    return servicio.login(username, password)
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) por rango más cercano de una lista de valores"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
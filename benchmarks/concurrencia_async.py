@@ -0,0 +1,117 @@
+"""Comparar el rendimiento del camino síncrono con la API asyncio.
+
+Cada "petición" simula una terminal: login, consulta de disponibles, préstamo,
+mis préstamos y devolución. El camino síncrono las atiende una tras otra; el
+asíncrono mantiene --concurrencia corrutinas en vuelo sobre un pool de --pool
+conexiones.
+
+Uso:
+    python -m benchmarks.concurrencia_async --peticiones 500 --concurrencia 200 --pool 8
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+
+from benchmarks.comun import PASSWORD, crear_backend_bench, percentil, poblar
+from servicio import NoDisponible, ServicioBiblioteca
+from servicio_async import ServicioBibliotecaAsync
+
+
+def peticion_sincrona(servicio, email, libro_id):
+    sesion = servicio.login(email, PASSWORD)
+    servicio.listar_libros_disponibles(sesion)
+    try:
+        prestamo = servicio.registrar_prestamo(sesion, libro_id)
+    except NoDisponible:
+        prestamo = None
+    servicio.mis_prestamos_activos(sesion)
+    if prestamo:
+        servicio.devolver_libro(sesion, prestamo["prestamo_id"])
+    servicio.cerrar_sesion(sesion)
+
+
+async def peticion_asincrona(servicio, email, libro_id):
+    sesion = await servicio.login(email, PASSWORD)
+    await servicio.listar_libros_disponibles(sesion)
+    try:
+        prestamo = await servicio.registrar_prestamo(sesion, libro_id)
+    except NoDisponible:
+        prestamo = None
+    await servicio.mis_prestamos_activos(sesion)
+    if prestamo:
+        await servicio.devolver_libro(sesion, prestamo["prestamo_id"])
+    servicio.cerrar_sesion(sesion)
+
+
+def resumen(latencias, duracion):
+    return {
+        "peticiones": len(latencias),
+        "segundos": round(duracion, 3),
+        "peticiones_por_segundo": round(len(latencias) / duracion, 1),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+    }
+
+
+def medir_sincrono(servicio, trabajo):
+    latencias = []
+    inicio = time.perf_counter()
+    for email, libro_id in trabajo:
+        t0 = time.perf_counter()
+        peticion_sincrona(servicio, email, libro_id)
+        latencias.append(time.perf_counter() - t0)
+    return resumen(latencias, time.perf_counter() - inicio)
+
+
+async def medir_asincrono(servicio, trabajo, concurrencia):
+    latencias = []
+    limite = asyncio.Semaphore(concurrencia)
+
+    async def una(email, libro_id):
+        async with limite:
+            t0 = time.perf_counter()
+            await peticion_asincrona(servicio, email, libro_id)
+            latencias.append(time.perf_counter() - t0)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una(email, libro_id) for email, libro_id in trabajo))
+    return resumen(latencias, time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql"])
+    parser.add_argument("--peticiones", type=int, default=500)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--pool", type=int, default=8)
+    parser.add_argument("--libros", type=int, default=200)
+    parser.add_argument("--usuarios", type=int, default=100)
+    args = parser.parse_args()
+
+    azar = random.Random(7)
+    with tempfile.TemporaryDirectory() as directorio:
+        backend = crear_backend_bench(args.backend, directorio)
+        servicio = ServicioBiblioteca(backend, tamaño_pool=args.pool)
+        _, libro_ids, emails = poblar(servicio, args.libros, args.usuarios)
+        trabajo = [(azar.choice(emails), azar.choice(libro_ids)) for _ in range(args.peticiones)]
+
+        informe = {"backend": args.backend, "pool": args.pool, "concurrencia": args.concurrencia}
+        informe["sincrono"] = medir_sincrono(servicio, trabajo)
+
+        async def asincrono():
+            servicio_async = ServicioBibliotecaAsync(servicio)
+            try:
+                return await medir_asincrono(servicio_async, trabajo, args.concurrencia)
+            finally:
+                await servicio_async.cerrar()
+
+        informe["asincrono"] = asyncio.run(asincrono())
+    print(json.dumps(informe, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Generar una biblioteca sintética: catálogo, usuarios y años de préstamos.
+
+Uso:
+    python -m benchmarks.datos --ruta /tmp/biblioteca-bench.db --libros 50000 --usuarios 5000 --años 3
+
+La popularidad de los libros sigue una ley de Zipf: unos pocos títulos reúnen
+la mayoría de los préstamos, como en una biblioteca real. La actividad de los
+usuarios está sesgada del mismo modo, con menos pendiente. Los préstamos de
+los últimos 30 días pueden seguir activos (sin superar los ejemplares de cada
+libro) y el resto están devueltos, algunos con retraso. Con la misma semilla se
+generan los mismos datos. Todas las cuentas, incluido el administrador que se
+crea, tienen la contraseña de benchmarks.comun.PASSWORD.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from collections import Counter
+from datetime import date, timedelta
+from itertools import accumulate
+
+from almacenamiento import BackendSQLite
+from benchmarks.busqueda import APELLIDOS, NOMBRES, generar_libros
+from benchmarks.comun import PASSWORD, _sesion_admin
+from servicio import DIAS_PRESTAMO, ServicioBiblioteca
+
+PENDIENTE_LIBROS = 1.1
+PENDIENTE_USUARIOS = 0.7
+DIAS_ACTIVOS = 30
+BLOQUE = 10000
+
+
+def pesos_zipf(cantidad, pendiente):
+    """Pesos acumulados de una ley de Zipf para random.choices"""
+    return list(accumulate(1 / rango ** pendiente for rango in range(1, cantidad + 1)))
+
+
+def generar_prestamos(azar, libros, usuarios, copias, años, por_usuario_y_año, hoy):
+    """Devolver los préstamos como (libro, usuario, fecha, vencimiento, devolución, estado) por posición.
+
+    libro y usuario son posiciones en orden de popularidad; devuelve también los
+    activos por libro, que nunca superan sus ejemplares.
+    """
+    total = int(usuarios * por_usuario_y_año * años)
+    dias = max(1, int(años * 365))
+    libros_elegidos = azar.choices(range(libros), cum_weights=pesos_zipf(libros, PENDIENTE_LIBROS), k=total)
+    usuarios_elegidos = azar.choices(range(usuarios), cum_weights=pesos_zipf(usuarios, PENDIENTE_USUARIOS), k=total)
+    activos = Counter()
+    prestamos = []
+    for libro, usuario in zip(libros_elegidos, usuarios_elegidos):
+        fecha = hoy - timedelta(days=azar.randint(0, dias))
+        vencimiento = fecha + timedelta(days=DIAS_PRESTAMO)
+        if (hoy - fecha).days <= DIAS_ACTIVOS and activos[libro] < copias[libro] and azar.random() < 0.6:
+            activos[libro] += 1
+            prestamos.append((libro, usuario, fecha, vencimiento, None, "activo"))
+            continue
+        # La mayoría devuelve antes del vencimiento; la cola de la normal son los retrasos
+        devolucion = min(hoy, fecha + timedelta(days=max(1, int(azar.gauss(11, 6)))))
+        prestamos.append((libro, usuario, fecha, vencimiento, devolucion, "devuelto"))
+    prestamos.sort(key=lambda prestamo: prestamo[2])
+    return prestamos, activos
+
+
+def generar_biblioteca(servicio, libros, usuarios, años=3, por_usuario_y_año=12, semilla=42, hoy=None,
+                       progreso=None):
+    """Poblar el servicio y devolver un dict con la sesión de administrador, ids y emails.
+
+    libro_ids está en orden de popularidad (el primero es el más prestado) para
+    que las cargas de trabajo elijan libros con la misma distribución.
+    """
+    azar = random.Random(semilla)
+    hoy = hoy or date.today()
+    inicio = time.perf_counter()
+    prefijo = f"sint-{time.time_ns() % 10 ** 9}"
+    sesion = _sesion_admin(servicio) if servicio.hay_administradores() else None
+    username = f"{prefijo}-admin"
+    servicio.registrar_administrador(sesion, username, PASSWORD, "Bench", f"{username}@example.com")
+    admin = servicio.login(username, PASSWORD)
+
+    copias = [azar.randint(1, 5) for _ in range(libros)]
+    prestamos, activos = generar_prestamos(azar, libros, usuarios, copias, años, por_usuario_y_año, hoy)
+    # Los préstamos activos ocupan sus ejemplares al cargar el historial
+    filas_libros = [fila[:6] + (copias[i],)
+                    for i, fila in enumerate(generar_libros(libros, azar, f"{prefijo}-"))]
+    # Todas las cuentas comparten hash: verificar cuesta lo mismo que con sales distintas
+    password_hash = servicio._hash(PASSWORD)
+    emails = [f"{prefijo}-{i}@example.com" for i in range(usuarios)]
+    filas_usuarios = [(f"{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)}", email, password_hash,
+                       f"6{azar.randint(0, 99999999):08d}", f"Calle {azar.randint(1, 200)}") for email in emails]
+
+    # Se insertan en orden aleatorio para que el libro más popular no sea el de id más bajo
+    orden = list(range(libros))
+    azar.shuffle(orden)
+    popularidad = [None] * libros
+    with servicio._repo() as repo:
+        with repo.transaccion():
+            for posicion in orden:
+                popularidad[posicion] = repo.insertar_libro(*filas_libros[posicion])
+            usuario_ids = [repo.insertar_usuario(*fila) for fila in filas_usuarios]
+        if progreso:
+            progreso(f"{libros} libros y {usuarios} usuarios")
+        for desde in range(0, len(prestamos), BLOQUE):
+            repo.insertar_historial([(popularidad[libro], usuario_ids[usuario], fecha, vencimiento, devolucion, estado)
+                                     for libro, usuario, fecha, vencimiento, devolucion, estado
+                                     in prestamos[desde:desde + BLOQUE]])
+            if progreso:
+                progreso(f"{min(desde + BLOQUE, len(prestamos))} de {len(prestamos)} préstamos")
+    # Las escrituras directas no pasan por el servicio: se descarta lo que hubiera en caché
+    servicio.cache.invalidar("catalogo", "disponibilidad", "usuarios", "prestamos")
+    return {
+        "admin": admin,
+        "administrador": username,
+        "libro_ids": popularidad,
+        "emails": emails,
+        "libros": libros,
+        "usuarios": usuarios,
+        "prestamos": len(prestamos),
+        "prestamos_activos": sum(activos.values()),
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ruta", required=True, help="Archivo SQLite nuevo donde generar los datos")
+    parser.add_argument("--libros", type=int, default=20000)
+    parser.add_argument("--usuarios", type=int, default=2000)
+    parser.add_argument("--años", type=float, default=3)
+    parser.add_argument("--prestamos", type=float, default=12, help="Préstamos por usuario y año (media)")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+    if os.path.exists(args.ruta):
+        parser.error(f"{args.ruta} ya existe: los datos sintéticos se generan en una base nueva")
+    if min(args.libros, args.usuarios) < 1:
+        parser.error("--libros y --usuarios deben ser positivos")
+
+    servicio = ServicioBiblioteca(BackendSQLite(args.ruta), tamaño_pool=1)
+    try:
+        datos = generar_biblioteca(servicio, args.libros, args.usuarios, args.años, args.prestamos, args.semilla,
+                                   progreso=lambda mensaje: print(f"  {mensaje}"))
+    finally:
+        servicio.cerrar()
+    print(f"✓ Biblioteca sintética en {args.ruta}: {datos['libros']} libros, {datos['usuarios']} usuarios, "
+          f"{datos['prestamos']} préstamos en {datos['segundos']} s")
+    print(json.dumps({clave: valor for clave, valor in datos.items() if clave not in ("admin", "libro_ids", "emails")},
+                     ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Prueba de estrés de préstamos y devoluciones concurrentes sobre un mismo título.
+
+Varios hilos piden y devuelven ejemplares de un libro popular con pocas
+copias. Al terminar se comprueba que cantidad_disponible nunca fue negativa,
+que préstamos activos + disponibles = copias iniciales y que el resumen
+coincide con los ejemplares disponibles y cada préstamo activo ocupa un
+ejemplar distinto. Sale con código 1 si se viola alguna invariante.
+
+Uso:
+    python -m benchmarks.estres_prestamos --hilos 32 --operaciones 200 --copias 5
+"""
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.comun import PASSWORD, crear_backend_bench, poblar
+from servicio import NoDisponible, ServicioBiblioteca
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "mysql"])
+    parser.add_argument("--hilos", type=int, default=32)
+    parser.add_argument("--operaciones", type=int, default=200, help="Préstamos o devoluciones por hilo")
+    parser.add_argument("--copias", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        servicio = ServicioBiblioteca(crear_backend_bench(args.backend, directorio), tamaño_pool=args.hilos)
+        admin, libro_ids, emails = poblar(servicio, 1, args.hilos, copias=args.copias)
+        libro_id = libro_ids[0]
+
+        contadores = {"prestamos": 0, "rechazados": 0, "devoluciones": 0}
+        minimo_observado = [args.copias]
+        lock = threading.Lock()
+        terminado = threading.Event()
+
+        def cantidad_actual():
+            with servicio._repo() as repo:
+                return repo.cantidad_disponible(libro_id)
+
+        def observador():
+            while not terminado.is_set():
+                valor = cantidad_actual()
+                with lock:
+                    minimo_observado[0] = min(minimo_observado[0], valor)
+
+        def cliente(email):
+            # Cada cliente alterna entre pedir un ejemplar y devolver el que tiene
+            sesion = servicio.login(email, PASSWORD)
+            prestamo = None
+            for _ in range(args.operaciones):
+                if prestamo is not None:
+                    servicio.devolver_libro(sesion, prestamo["prestamo_id"])
+                    prestamo = None
+                    with lock:
+                        contadores["devoluciones"] += 1
+                    continue
+                try:
+                    prestamo = servicio.registrar_prestamo(sesion, libro_id)
+                except NoDisponible:
+                    with lock:
+                        contadores["rechazados"] += 1
+                    continue
+                with lock:
+                    contadores["prestamos"] += 1
+
+        hilo_observador = threading.Thread(target=observador)
+        hilo_observador.start()
+        hilos = [threading.Thread(target=cliente, args=(email,)) for email in emails]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        terminado.set()
+        hilo_observador.join()
+
+        disponibles = cantidad_actual()
+        with servicio._repo() as repo:
+            ejemplares = repo.ejemplares(libro_id)
+        activos = sum(len(servicio.mis_prestamos_activos(servicio.login(email, PASSWORD))) for email in emails)
+        servicio.cerrar()
+
+    informe = dict(contadores)
+    informe.update({
+        "backend": args.backend,
+        "hilos": args.hilos,
+        "copias": args.copias,
+        "segundos": round(duracion, 3),
+        "prestamos_por_segundo": round(contadores["prestamos"] / duracion, 1),
+        "disponibles_final": disponibles,
+        "prestamos_activos_final": activos,
+        "minimo_observado": minimo_observado[0],
+        "ejemplares_disponibles": sum(1 for ejemplar in ejemplares if ejemplar[3] == "disponible"),
+        "ejemplares_con_prestamo": sum(1 for ejemplar in ejemplares if ejemplar[4] is not None),
+    })
+    informe["invariantes_ok"] = (minimo_observado[0] >= 0 and disponibles >= 0
+                                 and disponibles + activos == args.copias
+                                 and informe["ejemplares_disponibles"] == disponibles
+                                 and informe["ejemplares_con_prestamo"] == activos)
+    print(json.dumps(informe, indent=2))
+    sys.exit(0 if informe["invariantes_ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
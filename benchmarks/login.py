@@ -0,0 +1,100 @@
+"""Medir logins por segundo con distintos algoritmos y costes de hash.
+
+Uso:
+    python -m benchmarks.login --logins 400 --hilos 16
+    python -m benchmarks.login --costes scrypt:16384 scrypt:32768 pbkdf2_sha256:600000
+
+Cada coste se expresa como algoritmo:parámetro (n de scrypt o iteraciones de
+PBKDF2). Sirve para elegir el coste más alto que todavía cubre el pico de
+logins esperado con los núcleos disponibles.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.comun import PASSWORD, crear_backend_bench, percentil
+from seguridad import PoliticaHash
+from servicio import ServicioBiblioteca
+
+COSTES_POR_DEFECTO = ("pbkdf2_sha256:100000", "pbkdf2_sha256:300000", "pbkdf2_sha256:600000",
+                      "scrypt:8192", "scrypt:16384", "scrypt:32768")
+
+
+def politica(coste):
+    algoritmo, _, valor = coste.partition(":")
+    if algoritmo == "scrypt":
+        return PoliticaHash("scrypt", n=int(valor or 2 ** 14))
+    return PoliticaHash(algoritmo, iteraciones=int(valor or 600_000))
+
+
+def medir_coste(backend, coste, usuarios, logins, hilos):
+    """Crear cuentas con el coste dado y lanzar logins concurrentes contra el servicio"""
+    servicio = ServicioBiblioteca(backend, tamaño_pool=hilos, politica_hash=politica(coste))
+    try:
+        inicio = time.perf_counter()
+        # Todas las cuentas comparten hash: verificarlo cuesta lo mismo que con sales distintas
+        password_hash = servicio._hash(PASSWORD)
+        un_hash_ms = (time.perf_counter() - inicio) * 1000
+        prefijo = f"login-{time.time_ns()}"
+        emails = [f"{prefijo}-{i}@example.com" for i in range(usuarios)]
+        with servicio._repo() as repo:
+            for i, email in enumerate(emails):
+                repo.insertar_usuario(f"Usuario {i}", email, password_hash, "", "")
+
+        latencias = []
+        lock = threading.Lock()
+        siguiente = iter(range(logins))
+
+        def trabajador():
+            propias = []
+            while True:
+                with lock:
+                    i = next(siguiente, None)
+                if i is None:
+                    break
+                t0 = time.perf_counter()
+                servicio.cerrar_sesion(servicio.login(emails[i % usuarios], PASSWORD))
+                propias.append(time.perf_counter() - t0)
+            with lock:
+                latencias.extend(propias)
+
+        inicio = time.perf_counter()
+        trabajadores = [threading.Thread(target=trabajador) for _ in range(hilos)]
+        for hilo in trabajadores:
+            hilo.start()
+        for hilo in trabajadores:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        return {
+            "coste": politica(coste).descripcion(),
+            "hash_ms": round(un_hash_ms, 1),
+            "logins": len(latencias),
+            "logins_por_segundo": round(len(latencias) / duracion, 1),
+            "p50_ms": round(percentil(latencias, 50) * 1000, 1),
+            "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        }
+    finally:
+        servicio.cerrar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--costes", nargs="+", default=COSTES_POR_DEFECTO)
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--hilos", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        backend = crear_backend_bench(args.backend, directorio)
+        informe = [medir_coste(backend, coste, args.usuarios, args.logins, args.hilos) for coste in args.costes]
+    print(json.dumps({"backend": args.backend, "hilos": args.hilos, "nucleos": os.cpu_count(), "resultados": informe},
+                     indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
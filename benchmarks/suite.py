@@ -0,0 +1,329 @@
+"""Suite de rendimiento reproducible sobre una biblioteca sintética desechable.
+
+Uso:
+    python -m benchmarks.suite --salida base.json
+    python -m benchmarks.suite --libros 100000 --usuarios 20000 --años 5 --hilos 16 --salida rama.json
+    python -m benchmarks.suite --cargas circulacion busqueda --operaciones 5000
+    python -m benchmarks.suite --comparar base.json rama.json
+
+Genera los datos con benchmarks.datos en una base SQLite temporal (o en la
+configurada con --backend mysql) y lanza cada carga con --hilos terminales
+concurrentes contra ServicioBiblioteca, las mismas operaciones que usan el
+menú interactivo y el servidor HTTP:
+
+    login        avalancha de inicios de sesión
+    circulacion  préstamos de libros populares y devoluciones mezclados
+    listados     página de disponibles, mis préstamos y ficha de un libro
+    busqueda     búsqueda en el catálogo por relevancia
+    mixta        mezcla de todo lo anterior en proporciones de mostrador
+
+El resultado es un JSON con p50/p95/p99 y operaciones por segundo de cada
+operación, junto con el commit y la máquina, para comparar dos ejecuciones.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from almacenamiento import ErrorBD
+from benchmarks.busqueda import consultas_aleatorias
+from benchmarks.comun import PASSWORD, crear_backend_bench, percentil
+from benchmarks.datos import PENDIENTE_LIBROS, generar_biblioteca, pesos_zipf
+from benchmarks.login import politica
+from informes import escribir_tabla
+from metricas import Metricas
+from servicio import ErrorBiblioteca, ServicioBiblioteca
+
+VERSION_INFORME = 1
+CARGAS = ("login", "circulacion", "listados", "busqueda", "mixta")
+PRESTAMOS_POR_TERMINAL = 5
+
+
+class Terminal:
+    """Estado de un hilo cliente: su sesión, su generador aleatorio y sus préstamos"""
+
+    def __init__(self, servicio, datos, email, azar):
+        self.servicio = servicio
+        self.datos = datos
+        self.azar = azar
+        self.sesion = servicio.login(email, PASSWORD)
+        self.prestamos = []
+        self.cursor = None
+        self.latencias = defaultdict(list)
+        self.rechazadas = Counter()
+        self.errores = Counter()
+
+    def medir(self, operacion, funcion, *args):
+        """Ejecutar una operación del servicio y guardar su latencia"""
+        inicio = time.perf_counter()
+        try:
+            resultado = funcion(*args)
+        except ErrorBiblioteca:
+            # Rechazos de negocio (sin ejemplares, préstamo ya devuelto): cuentan, pero no como error
+            self.rechazadas[operacion] += 1
+            resultado = None
+        except ErrorBD:
+            self.errores[operacion] += 1
+            return None
+        self.latencias[operacion].append(time.perf_counter() - inicio)
+        return resultado
+
+    def libro_popular(self):
+        posicion = self.azar.choices(range(len(self.datos["libro_ids"])), cum_weights=self.datos["pesos"])[0]
+        return self.datos["libro_ids"][posicion]
+
+
+# === CARGAS ===
+
+def paso_login(terminal):
+    email = terminal.azar.choice(terminal.datos["emails"])
+    sesion = terminal.medir("login", terminal.servicio.login, email, PASSWORD)
+    if sesion is not None:
+        terminal.servicio.cerrar_sesion(sesion)
+
+
+def paso_circulacion(terminal):
+    servicio = terminal.servicio
+    if terminal.prestamos and (len(terminal.prestamos) >= PRESTAMOS_POR_TERMINAL or terminal.azar.random() < 0.4):
+        prestamo_id = terminal.prestamos.pop(terminal.azar.randrange(len(terminal.prestamos)))
+        terminal.medir("devolver_libro", servicio.devolver_libro, terminal.sesion, prestamo_id)
+        return
+    prestamo = terminal.medir("registrar_prestamo", servicio.registrar_prestamo, terminal.sesion,
+                              terminal.libro_popular())
+    if prestamo is not None:
+        terminal.prestamos.append(prestamo["prestamo_id"])
+
+
+def paso_listados(terminal):
+    servicio = terminal.servicio
+    azar = terminal.azar.random()
+    if azar < 0.4:
+        # A veces se sigue a la página siguiente, como quien recorre el listado
+        cursor = terminal.cursor if terminal.cursor and terminal.azar.random() < 0.5 else None
+        pagina = terminal.medir("pagina_disponibles", servicio.pagina, terminal.sesion, "libros_disponibles", 50,
+                                cursor)
+        terminal.cursor = pagina and pagina["siguiente"]
+    elif azar < 0.7:
+        terminal.medir("mis_prestamos_activos", servicio.mis_prestamos_activos, terminal.sesion)
+    else:
+        terminal.medir("obtener_libro", servicio.obtener_libro, terminal.sesion, terminal.libro_popular())
+
+
+def paso_busqueda(terminal):
+    consulta = terminal.azar.choice(terminal.datos["consultas"])
+    terminal.medir("buscar_libros", terminal.servicio.buscar_libros, terminal.sesion, consulta)
+
+
+def paso_mixta(terminal):
+    azar = terminal.azar.random()
+    if azar < 0.45:
+        paso_listados(terminal)
+    elif azar < 0.7:
+        paso_busqueda(terminal)
+    elif azar < 0.97:
+        paso_circulacion(terminal)
+    else:
+        paso_login(terminal)
+
+
+PASOS = {"login": paso_login, "circulacion": paso_circulacion, "listados": paso_listados,
+         "busqueda": paso_busqueda, "mixta": paso_mixta}
+
+
+def ejecutar_carga(servicio, datos, nombre, hilos, operaciones, semilla):
+    """Repartir las operaciones entre hilos y devolver las medidas agregadas"""
+    paso = PASOS[nombre]
+    terminales = [Terminal(servicio, datos, datos["emails"][i % len(datos["emails"])],
+                           random.Random(f"{semilla}-{nombre}-{i}")) for i in range(hilos)]
+    restantes = [operaciones]
+    lock = threading.Lock()
+
+    def trabajador(terminal):
+        while True:
+            with lock:
+                if not restantes[0]:
+                    return
+                restantes[0] -= 1
+            paso(terminal)
+
+    cache_antes = servicio.cache.estadisticas()
+    inicio = time.perf_counter()
+    hilos_carga = [threading.Thread(target=trabajador, args=(terminal,)) for terminal in terminales]
+    for hilo in hilos_carga:
+        hilo.start()
+    for hilo in hilos_carga:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    cache_despues = servicio.cache.estadisticas()
+
+    # Se devuelve lo prestado para que la siguiente carga parta del mismo inventario
+    for terminal in terminales:
+        for prestamo_id in terminal.prestamos:
+            servicio.devolver_libro(terminal.sesion, prestamo_id)
+        servicio.cerrar_sesion(terminal.sesion)
+    return _resumir(terminales, duracion, {
+        "aciertos": cache_despues["aciertos"] - cache_antes["aciertos"],
+        "fallos": cache_despues["fallos"] - cache_antes["fallos"],
+    })
+
+
+def _resumir(terminales, duracion, cache):
+    latencias = defaultdict(list)
+    rechazadas, errores = Counter(), Counter()
+    for terminal in terminales:
+        for operacion, valores in terminal.latencias.items():
+            latencias[operacion].extend(valores)
+        rechazadas.update(terminal.rechazadas)
+        errores.update(terminal.errores)
+    por_operacion = {}
+    for operacion in sorted(set(latencias) | set(errores)):
+        valores = latencias[operacion]
+        por_operacion[operacion] = {
+            "operaciones": len(valores),
+            "ops_por_segundo": round(len(valores) / duracion, 1) if duracion else None,
+            "p50_ms": _ms(percentil(valores, 50)),
+            "p95_ms": _ms(percentil(valores, 95)),
+            "p99_ms": _ms(percentil(valores, 99)),
+            "max_ms": _ms(max(valores, default=None)),
+            "rechazadas": rechazadas[operacion],
+            "errores": errores[operacion],
+        }
+    total = sum(len(valores) for valores in latencias.values())
+    return {
+        "operaciones": total,
+        "segundos": round(duracion, 3),
+        "ops_por_segundo": round(total / duracion, 1) if duracion else None,
+        "errores": sum(errores.values()),
+        "cache": cache,
+        "por_operacion": por_operacion,
+    }
+
+
+def _ms(segundos):
+    return None if segundos is None else round(segundos * 1000, 3)
+
+
+def _git(*args):
+    try:
+        salida = subprocess.run(["git", *args], capture_output=True, text=True, timeout=10,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return salida.stdout.strip() if salida.returncode == 0 else None
+
+
+def entorno():
+    """Commit y máquina de la ejecución, para saber qué se está comparando"""
+    cambios = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "cambios_sin_confirmar": None if cambios is None else bool(cambios),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "nucleos": os.cpu_count(),
+    }
+
+
+# === COMPARACIÓN ===
+
+def comparar(base, nuevo):
+    """Filas (carga, operación, medida, antes, después, cambio %) de dos informes"""
+    filas = []
+    for carga, resultado in nuevo["cargas"].items():
+        anterior = base["cargas"].get(carga)
+        if anterior is None:
+            continue
+        for operacion, medidas in resultado["por_operacion"].items():
+            medidas_base = anterior["por_operacion"].get(operacion)
+            if medidas_base is None:
+                continue
+            for medida in ("ops_por_segundo", "p50_ms", "p95_ms", "p99_ms"):
+                antes, despues = medidas_base[medida], medidas[medida]
+                cambio = round((despues - antes) / antes * 100, 1) if antes and despues is not None else None
+                filas.append((carga, operacion, medida, antes, despues, cambio))
+    return filas
+
+
+def mostrar_comparacion(ruta_base, ruta_nueva):
+    with open(ruta_base, encoding="utf-8") as archivo:
+        base = json.load(archivo)
+    with open(ruta_nueva, encoding="utf-8") as archivo:
+        nuevo = json.load(archivo)
+    print(f"Base: {base['entorno']['commit']} ({base['entorno']['fecha']})   "
+          f"Nuevo: {nuevo['entorno']['commit']} ({nuevo['entorno']['fecha']})")
+    if base["parametros"] != nuevo["parametros"]:
+        print("⚠ Los parámetros de las dos ejecuciones no coinciden")
+    filas = [(carga, operacion, medida, antes, despues, "" if cambio is None else f"{cambio:+.1f}%")
+             for carga, operacion, medida, antes, despues, cambio in comparar(base, nuevo)]
+    escribir_tabla(sys.stdout, ("carga", "operacion", "medida", "base", "nuevo", "cambio"), filas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--cargas", nargs="+", choices=CARGAS, default=list(CARGAS))
+    parser.add_argument("--libros", type=int, default=20000)
+    parser.add_argument("--usuarios", type=int, default=2000)
+    parser.add_argument("--años", type=float, default=3)
+    parser.add_argument("--prestamos", type=float, default=12, help="Préstamos históricos por usuario y año")
+    parser.add_argument("--hilos", type=int, default=8, help="Terminales concurrentes")
+    parser.add_argument("--pool", type=int, help="Conexiones del pool (por defecto, una por hilo)")
+    parser.add_argument("--operaciones", type=int, default=2000, help="Operaciones por carga")
+    parser.add_argument("--logins", type=int, default=200, help="Operaciones de la carga login (el hash es caro)")
+    parser.add_argument("--coste-hash", help="Coste del hash como algoritmo:valor (por defecto, el configurado)")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--metricas", action="store_true", help="Incluir las consultas más costosas en el informe")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar el informe")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVO"), help="Comparar dos informes y salir")
+    args = parser.parse_args()
+    if args.comparar:
+        mostrar_comparacion(*args.comparar)
+        return
+    if min(args.libros, args.usuarios, args.hilos, args.operaciones, args.logins) < 1:
+        parser.error("Los tamaños, los hilos y las operaciones deben ser positivos")
+
+    parametros = {clave: valor for clave, valor in vars(args).items() if clave not in ("salida", "comparar")}
+    informe = {"version": VERSION_INFORME, "entorno": entorno(), "parametros": parametros, "cargas": {}}
+    with tempfile.TemporaryDirectory() as directorio:
+        servicio = ServicioBiblioteca(
+            crear_backend_bench(args.backend, directorio), tamaño_pool=args.pool or args.hilos,
+            politica_hash=politica(args.coste_hash) if args.coste_hash else None,
+            metricas=Metricas() if args.metricas else None)
+        try:
+            datos = generar_biblioteca(servicio, args.libros, args.usuarios, args.años, args.prestamos, args.semilla)
+            informe["backend"] = servicio.backend.descripcion()
+            informe["datos"] = {clave: datos[clave] for clave in ("libros", "usuarios", "prestamos",
+                                                                   "prestamos_activos", "segundos")}
+            datos["pesos"] = pesos_zipf(len(datos["libro_ids"]), PENDIENTE_LIBROS)
+            datos["consultas"] = consultas_aleatorias(500, random.Random(args.semilla))
+            for carga in args.cargas:
+                operaciones = args.logins if carga == "login" else args.operaciones
+                resultado = ejecutar_carga(servicio, datos, carga, args.hilos, operaciones, args.semilla)
+                informe["cargas"][carga] = resultado
+                print(f"✓ {carga}: {resultado['operaciones']} operaciones, {resultado['ops_por_segundo']} ops/s",
+                      flush=True)
+            if servicio.metricas is not None:
+                informe["consultas"] = servicio.metricas.resumen()["consultas"][:15]
+        finally:
+            servicio.cerrar()
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False, default=str)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(texto + "\n")
+        print(f"✓ Informe guardado en {args.salida}")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
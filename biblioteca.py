@@ -0,0 +1,383 @@
+"""Interfaz de línea de comandos no interactiva para scripts, cron e integraciones.
+
+Uso:
+    python biblioteca.py libros listar --formato json
+    python biblioteca.py books list --format json            (alias en inglés)
+    python biblioteca.py prestamos crear 42 --sucursal norte
+    python biblioteca.py loan create 42
+    python biblioteca.py prestamos listar --todo --formato ndjson
+    python biblioteca.py lote < operaciones.txt
+
+Autenticación, sin preguntar nada: --token o BIBLIOTECA_TOKEN con un token de
+"tokens crear", o BIBLIOTECA_USUARIO y BIBLIOTECA_PASSWORD. El token evita el
+hash lento de la contraseña en cada ejecución.
+
+Con "lote" se lee un comando por línea de la entrada estándar (la misma
+sintaxis, sin las opciones globales) y se ejecutan todos con una sola sesión y
+una sola conexión por nodo. Cada línea produce una línea JSON en la salida:
+{"linea": 3, "ok": true, "resultado": ...} o {"linea": 3, "ok": false, "error": "..."}.
+
+Códigos de salida: 0 correcto, 1 error de la operación (o alguna línea del
+lote falló), 2 uso incorrecto, 3 error de base de datos.
+"""
+import argparse
+import json
+import os
+import shlex
+import sys
+import types
+
+from almacenamiento import ErrorBD, crear_backend
+from informes import INFORMES, escribir_tabla
+from servicio import ErrorBiblioteca, ServicioBiblioteca
+
+FORMATOS = ("json", "ndjson", "tabla")
+LIMITE_PAGINA = 50
+SALIDA_ERROR = 1
+SALIDA_USO = 2
+SALIDA_BD = 3
+
+
+class ErrorUso(Exception):
+    """Comando mal formado; en el lote se informa en su línea y se sigue"""
+
+
+class _ParserLote(argparse.ArgumentParser):
+    """Parser que no termina el proceso: una línea errónea del lote no corta las demás"""
+
+    def error(self, mensaje):
+        raise ErrorUso(mensaje)
+
+    def exit(self, estado=0, mensaje=None):
+        raise ErrorUso(mensaje or "ayuda no disponible en el lote")
+
+
+# === OPERACIONES ===
+
+def _listado(servicio, sesion, args, listado):
+    if args.todo:
+        return servicio.iterar(sesion, listado)
+    return servicio.pagina(sesion, listado, args.limite, args.cursor)
+
+
+def _listar_libros(servicio, sesion, args):
+    return _listado(servicio, sesion, args, "libros_disponibles" if args.disponibles else "libros")
+
+
+def _buscar_libros(servicio, sesion, args):
+    return servicio.buscar_libros(sesion, args.texto, args.limite, args.cursor)
+
+
+def _ver_libro(servicio, sesion, args):
+    return servicio.obtener_libro(sesion, args.libro_id)
+
+
+def _alta_libro(servicio, sesion, args):
+    return {"id": servicio.registrar_libro(sesion, args.titulo, args.autor, args.isbn, args.editorial, args.año,
+                                           args.categoria, args.cantidad, args.sucursal)}
+
+
+def _ejemplares(servicio, sesion, args):
+    return servicio.ejemplares(sesion, args.libro_id)
+
+
+def _listar_usuarios(servicio, sesion, args):
+    return _listado(servicio, sesion, args, "usuarios")
+
+
+def _alta_usuario(servicio, sesion, args):
+    return {"id": servicio.registrar_usuario(sesion, args.nombre, args.email, args.password, args.telefono,
+                                             args.direccion)}
+
+
+def _listar_prestamos(servicio, sesion, args):
+    return _listado(servicio, sesion, args, "vencidos" if args.vencidos else "prestamos")
+
+
+def _crear_prestamo(servicio, sesion, args):
+    return servicio.registrar_prestamo(sesion, args.libro_id, args.sucursal)
+
+
+def _devolver(servicio, sesion, args):
+    return servicio.devolver_libro(sesion, args.prestamo_id, args.sucursal)
+
+
+def _prestamos_activos(servicio, sesion, args):
+    return servicio.mis_prestamos_activos(sesion)
+
+
+def _prestar_lote(servicio, sesion, args):
+    return servicio.prestar_lote(sesion, args.libro_ids, args.usuario, args.sucursal)
+
+
+def _devolver_lote(servicio, sesion, args):
+    return servicio.devolver_lote(sesion, args.ids, args.por, args.sucursal)
+
+
+def _reservar(servicio, sesion, args):
+    return servicio.reservar(sesion, args.libro_id, args.sucursal)
+
+
+def _mis_reservas(servicio, sesion, args):
+    return servicio.mis_reservas(sesion)
+
+
+def _cancelar_reserva(servicio, sesion, args):
+    return servicio.cancelar_reserva(sesion, args.reserva_id, args.sucursal)
+
+
+def _informe(servicio, sesion, args):
+    return servicio.informe(sesion, args.nombre, args.limite, args.sucursal)
+
+
+def _crear_token(servicio, sesion, args):
+    return servicio.crear_token_api(sesion, args.descripcion)
+
+
+def _revocar_token(servicio, sesion, args):
+    return servicio.revocar_token_api(sesion, args.token_api)
+
+
+# === PARSER ===
+
+def _paginacion(parser):
+    parser.add_argument("--limite", "--limit", type=int, default=LIMITE_PAGINA, help="Filas por página")
+    parser.add_argument("--cursor", help="Cursor \"siguiente\" de la página anterior")
+    parser.add_argument("--todo", "--all", action="store_true",
+                        help="Recorrer el listado completo, una fila por línea")
+
+
+def _sucursal(parser):
+    parser.add_argument("--sucursal", "--branch", help="Sucursal (con BIBLIOTECA_TOPOLOGIA)")
+
+
+# Opciones que se aceptan también detrás de la acción (libros listar --formato json).
+# Sin valor por defecto: si no se indican, vale el de la opción global
+_COMUNES = argparse.ArgumentParser(add_help=False)
+_COMUNES.add_argument("--formato", "--format", dest="formato", choices=FORMATOS, default=argparse.SUPPRESS)
+
+
+def _acciones(subparsers, recurso, alias, ayuda):
+    parser = subparsers.add_parser(recurso, aliases=alias, help=ayuda)
+    return parser.add_subparsers(dest="accion", metavar="accion", required=True)
+
+
+def _accion(acciones, nombre, alias, ayuda, operacion):
+    parser = acciones.add_parser(nombre, aliases=alias, help=ayuda, parents=[_COMUNES])
+    parser.set_defaults(operacion=operacion)
+    return parser
+
+
+def _comandos(parser):
+    """Recursos y acciones comunes al modo normal y al lote"""
+    recursos = parser.add_subparsers(dest="recurso", metavar="recurso", required=True)
+
+    libros = _acciones(recursos, "libros", ["books"], "Catálogo")
+    p = _accion(libros, "listar", ["list"], "Listar libros por páginas", _listar_libros)
+    p.add_argument("--disponibles", "--available", action="store_true", help="Solo los que tienen ejemplares")
+    _paginacion(p)
+    p = _accion(libros, "buscar", ["search"], "Buscar por relevancia", _buscar_libros)
+    p.add_argument("texto")
+    p.add_argument("--limite", "--limit", type=int, default=20)
+    p.add_argument("--cursor")
+    p = _accion(libros, "ver", ["show"], "Ficha de un libro", _ver_libro)
+    p.add_argument("libro_id", type=int)
+    p = _accion(libros, "alta", ["create"], "Registrar un libro", _alta_libro)
+    for campo in ("titulo", "autor", "isbn", "editorial", "categoria"):
+        p.add_argument(f"--{campo}", required=True)
+    p.add_argument("--año", "--year", dest="año", type=int, required=True)
+    p.add_argument("--cantidad", "--quantity", type=int, default=1)
+    _sucursal(p)
+    p = _accion(libros, "ejemplares", ["copies"], "Ejemplares de un libro", _ejemplares)
+    p.add_argument("libro_id", type=int)
+
+    usuarios = _acciones(recursos, "usuarios", ["users"], "Usuarios")
+    _paginacion(_accion(usuarios, "listar", ["list"], "Listar usuarios por páginas", _listar_usuarios))
+    p = _accion(usuarios, "alta", ["create"], "Registrar un usuario", _alta_usuario)
+    p.add_argument("--nombre", "--name", dest="nombre", required=True)
+    p.add_argument("--email", required=True)
+    p.add_argument("--password", required=True)
+    p.add_argument("--telefono", "--phone", dest="telefono", default="")
+    p.add_argument("--direccion", "--address", dest="direccion", default="")
+
+    prestamos = _acciones(recursos, "prestamos", ["loans", "loan"], "Préstamos y devoluciones")
+    p = _accion(prestamos, "listar", ["list"], "Listar préstamos por páginas", _listar_prestamos)
+    p.add_argument("--vencidos", "--overdue", action="store_true", help="Solo los activos ya vencidos")
+    _paginacion(p)
+    p = _accion(prestamos, "crear", ["create"], "Prestar un libro a la cuenta de la sesión", _crear_prestamo)
+    p.add_argument("libro_id", type=int)
+    _sucursal(p)
+    p = _accion(prestamos, "devolver", ["return"], "Devolver un préstamo propio", _devolver)
+    p.add_argument("prestamo_id", type=int)
+    _sucursal(p)
+    _accion(prestamos, "activos", ["active"], "Préstamos activos de la cuenta", _prestamos_activos)
+    p = _accion(prestamos, "prestar-lote", ["lend-batch"], "Prestar varios libros en una transacción",
+                _prestar_lote)
+    p.add_argument("libro_ids", nargs="+")
+    p.add_argument("--usuario", "--user", dest="usuario", type=int, help="Usuario (obligatorio en el mostrador)")
+    _sucursal(p)
+    p = _accion(prestamos, "devolver-lote", ["return-batch"], "Devolver varios préstamos en una transacción",
+                _devolver_lote)
+    p.add_argument("ids", nargs="+")
+    p.add_argument("--por", "--by", dest="por", choices=["prestamo", "libro", "codigo"], default="prestamo")
+    _sucursal(p)
+
+    reservas = _acciones(recursos, "reservas", ["holds"], "Reservas")
+    p = _accion(reservas, "crear", ["create"], "Reservar un libro sin ejemplares", _reservar)
+    p.add_argument("libro_id", type=int)
+    _sucursal(p)
+    _accion(reservas, "listar", ["list"], "Reservas de la cuenta", _mis_reservas)
+    p = _accion(reservas, "cancelar", ["cancel"], "Cancelar una reserva", _cancelar_reserva)
+    p.add_argument("reserva_id", type=int)
+    _sucursal(p)
+
+    informes = _acciones(recursos, "informes", ["reports"], "Informes de circulación")
+    p = _accion(informes, "ver", ["show"], "Generar un informe", _informe)
+    p.add_argument("nombre", choices=list(INFORMES))
+    p.add_argument("--limite", "--limit", type=int, default=20)
+    _sucursal(p)
+
+    tokens = _acciones(recursos, "tokens", [], "Tokens de acceso para scripts")
+    p = _accion(tokens, "crear", ["create"], "Crear un token para la cuenta (solo se muestra una vez)", _crear_token)
+    p.add_argument("--descripcion", "--description", dest="descripcion", default="")
+    p = _accion(tokens, "revocar", ["revoke"], "Revocar un token", _revocar_token)
+    p.add_argument("token_api")
+
+    recursos.add_parser("lote", aliases=["batch"], help="Ejecutar los comandos de la entrada estándar").set_defaults(
+        operacion=None)
+    return parser
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formato", "--format", dest="formato", choices=FORMATOS, default="json")
+    parser.add_argument("--token", help="Token de acceso (mejor en BIBLIOTECA_TOKEN: no aparece en ps)")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"], default=None)
+    parser.add_argument("--detener", "--stop-on-error", dest="detener", action="store_true",
+                        help="En el lote, parar en la primera línea con error")
+    return _comandos(parser)
+
+
+def crear_parser_lote():
+    return _comandos(_ParserLote(prog="lote", add_help=False))
+
+
+# === SALIDA ===
+
+def _json(valor):
+    return json.dumps(valor, default=str, ensure_ascii=False)
+
+
+def _escribir_filas(salida, filas):
+    filas = list(filas)
+    if not filas:
+        salida.write("(sin resultados)\n")
+        return
+    columnas = list(filas[0])
+    escribir_tabla(salida, columnas, [["" if fila.get(columna) is None else fila.get(columna)
+                                       for columna in columnas] for fila in filas])
+
+
+def escribir_resultado(resultado, formato, salida=sys.stdout):
+    """Escribir el resultado de una operación; los generadores se escriben fila a fila"""
+    if isinstance(resultado, types.GeneratorType):
+        if formato == "tabla":
+            _escribir_filas(salida, resultado)
+            return
+        try:
+            for fila in resultado:
+                salida.write(_json(fila) + "\n")
+        finally:
+            resultado.close()
+        return
+    if formato == "json":
+        salida.write(_json(resultado) + "\n")
+    elif formato == "ndjson":
+        filas = resultado.get("filas") if isinstance(resultado, dict) else resultado
+        for fila in filas if isinstance(filas, list) else [resultado]:
+            salida.write(_json(fila) + "\n")
+    elif isinstance(resultado, list):
+        _escribir_filas(salida, resultado)
+    elif isinstance(resultado, dict) and isinstance(resultado.get("filas"), list):
+        _escribir_filas(salida, resultado["filas"])
+        for clave, valor in resultado.items():
+            if clave != "filas" and valor is not None:
+                salida.write(f"{clave}: {valor}\n")
+    elif isinstance(resultado, dict):
+        for clave, valor in resultado.items():
+            salida.write(f"{clave}: {valor}\n")
+    else:
+        salida.write(f"{resultado}\n")
+
+
+# === EJECUCIÓN ===
+
+def abrir_sesion(servicio, token=None):
+    """Sesión del token, de BIBLIOTECA_TOKEN o de BIBLIOTECA_USUARIO y BIBLIOTECA_PASSWORD"""
+    token = token or os.environ.get("BIBLIOTECA_TOKEN")
+    if token:
+        return servicio.login_token(token)
+    usuario, password = os.environ.get("BIBLIOTECA_USUARIO"), os.environ.get("BIBLIOTECA_PASSWORD")
+    if not usuario or not password:
+        raise ErrorUso("Indique --token o BIBLIOTECA_TOKEN, o BIBLIOTECA_USUARIO y BIBLIOTECA_PASSWORD")
+    return servicio.login(usuario, password)
+
+
+def ejecutar_lote(servicio, sesion, entrada, salida, detener=False):
+    """Ejecutar un comando por línea y escribir una línea JSON por comando; devolver cuántos fallaron"""
+    parser = crear_parser_lote()
+    fallidos = 0
+    for numero, linea in enumerate(entrada, 1):
+        linea = linea.strip()
+        if not linea or linea.startswith("#"):
+            continue
+        try:
+            args = parser.parse_args(shlex.split(linea))
+            if args.operacion is None:
+                raise ErrorUso("El lote no puede contener otro lote")
+            resultado = args.operacion(servicio, sesion, args)
+            if isinstance(resultado, types.GeneratorType):
+                resultado = list(resultado)
+            respuesta = {"linea": numero, "ok": True, "resultado": resultado}
+        except (ErrorUso, ErrorBiblioteca, ErrorBD, ValueError) as e:
+            fallidos += 1
+            respuesta = {"linea": numero, "ok": False, "error": str(e)}
+        salida.write(_json(respuesta) + "\n")
+        # Cada respuesta sale en cuanto está lista: quien escribe en la tubería puede ir leyendo
+        salida.flush()
+        if detener and not respuesta["ok"]:
+            break
+    return fallidos
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    # Un solo proceso y una sola conexión por nodo: no se comprueban las tablas al
+    # arrancar (un esquema incompleto aparece como error de base de datos)
+    servicio = ServicioBiblioteca(crear_backend(args.backend) if args.backend else None, tamaño_pool=1)
+    try:
+        sesion = abrir_sesion(servicio, args.token)
+        if args.operacion is None:
+            fallidos = ejecutar_lote(servicio, sesion, sys.stdin, sys.stdout, args.detener)
+            return SALIDA_ERROR if fallidos else 0
+        escribir_resultado(args.operacion(servicio, sesion, args), args.formato)
+        return 0
+    except ErrorUso as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return SALIDA_USO
+    except ErrorBiblioteca as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return SALIDA_ERROR
+    except ErrorBD as e:
+        print(f"✗ Error de base de datos: {e}", file=sys.stderr)
+        return SALIDA_BD
+    except BrokenPipeError:
+        # La salida se cortó (por ejemplo con | head): no es un error de la operación
+        sys.stderr.close()
+        return 0
+    finally:
+        servicio.cerrar()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""Caché de lectura para listados y búsquedas con invalidación por generaciones.
+
+Cada resultado se guarda junto con la generación de los datos de los que
+depende ("catalogo", "disponibilidad", ...). Una escritura incrementa esa
+generación y las entradas antiguas dejan de encontrarse sin tener que
+buscarlas. Si las generaciones viven en un almacén compartido, varios
+procesos del servicio ven las invalidaciones de los demás.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_FALTA = object()
+
+
+class CacheLRU:
+    """Diccionario acotado con caducidad por entrada y desalojo del menos usado"""
+
+    def __init__(self, capacidad=1024, ttl=30.0, reloj=time.monotonic):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._reloj = reloj
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.caducadas = 0
+        self.desalojos = 0
+
+    def obtener(self, clave, defecto=None):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return defecto
+            expira, valor = entrada
+            if expira <= self._reloj():
+                del self._entradas[clave]
+                self.caducadas += 1
+                self.fallos += 1
+                return defecto
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        if self.capacidad <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = (self._reloj() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+                self.desalojos += 1
+
+    def borrar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "tamaño": len(self._entradas),
+            "capacidad": self.capacidad,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "caducadas": self.caducadas,
+            "desalojos": self.desalojos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else None,
+        }
+
+
+# === ALMACENES DE GENERACIONES ===
+
+class AlmacenLocal:
+    """Generaciones en memoria: suficiente para un único proceso"""
+
+    def __init__(self):
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def leer(self, claves):
+        with self._lock:
+            return [self._valores.get(clave, 0) for clave in claves]
+
+    def incrementar(self, clave):
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + 1
+            return self._valores[clave]
+
+
+class AlmacenArchivo:
+    """Generaciones en un archivo SQLite compartido por los procesos de una máquina.
+
+    Hace el papel de un almacén tipo Redis sin necesitar un servidor aparte.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+
+    def _conexion(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.ruta, timeout=10.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS generaciones (clave TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+            self._local.connection = connection
+        return connection
+
+    def leer(self, claves):
+        marcadores = ", ".join("?" * len(claves))
+        filas = dict(self._conexion().execute(
+            f"SELECT clave, valor FROM generaciones WHERE clave IN ({marcadores})", claves).fetchall())
+        return [filas.get(clave, 0) for clave in claves]
+
+    def incrementar(self, clave):
+        fila = self._conexion().execute(
+            """INSERT INTO generaciones (clave, valor) VALUES (?, 1)
+               ON CONFLICT (clave) DO UPDATE SET valor = valor + 1 RETURNING valor""", (clave,)).fetchone()
+        return fila[0]
+
+
+class AlmacenRedis:
+    """Generaciones en Redis para procesos repartidos en varias máquinas"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise ValueError("El paquete redis no está instalado") from e
+        self._cliente = redis.Redis.from_url(url)
+
+    def leer(self, claves):
+        return [int(valor or 0) for valor in self._cliente.mget(claves)]
+
+    def incrementar(self, clave):
+        return self._cliente.incr(clave)
+
+
+def crear_almacen(destino):
+    """Almacén compartido a partir de una URL redis:// o la ruta de un archivo"""
+    if not destino:
+        return AlmacenLocal()
+    if destino.startswith(("redis://", "rediss://", "unix://")):
+        return AlmacenRedis(destino)
+    return AlmacenArchivo(destino)
+
+
+# === CACHÉ DE CONSULTAS ===
+
+class CacheConsultas:
+    """Caché de lectura con invalidación por dependencias nombradas"""
+
+    def __init__(self, capacidad=1024, ttl=30.0, almacen=None, espacio=""):
+        self.entradas = CacheLRU(capacidad, ttl)
+        self.almacen = almacen or AlmacenLocal()
+        # Prefijo de las generaciones: separa bases distintas en un mismo almacén
+        self.espacio = espacio
+        self.invalidaciones = 0
+
+    def _generaciones(self, dependencias):
+        return tuple(self.almacen.leer([f"{self.espacio}:{dependencia}" for dependencia in dependencias]))
+
+    def obtener(self, clave, dependencias, cargar):
+        """Devolver el valor en caché o calcularlo con cargar() y guardarlo.
+
+        La generación se lee antes de cargar: si una escritura ocurre mientras
+        tanto, el valor queda guardado bajo una generación que ya no se consulta.
+        """
+        if self.entradas.capacidad <= 0:
+            return cargar()
+        clave = (clave, self._generaciones(dependencias))
+        valor = self.entradas.obtener(clave, _FALTA)
+        if valor is _FALTA:
+            valor = cargar()
+            self.entradas.guardar(clave, valor)
+        return valor
+
+    def invalidar(self, *dependencias):
+        """Dejar obsoletos todos los resultados que dependen de estos datos"""
+        for dependencia in dependencias:
+            self.almacen.incrementar(f"{self.espacio}:{dependencia}")
+        self.invalidaciones += len(dependencias)
+
+    def estadisticas(self):
+        return dict(self.entradas.estadisticas(), invalidaciones=self.invalidaciones)
+
+
+def crear_cache(espacio=""):
+    """Caché configurada con BIBLIOTECA_CACHE_CAPACIDAD, _TTL y _COMPARTIDA"""
+    return CacheConsultas(
+        capacidad=int(os.environ.get("BIBLIOTECA_CACHE_CAPACIDAD", "1024")),
+        ttl=float(os.environ.get("BIBLIOTECA_CACHE_TTL", "30")),
+        almacen=crear_almacen(os.environ.get("BIBLIOTECA_CACHE_COMPARTIDA")),
+        espacio=espacio,
+    )
@@ -0,0 +1,219 @@
+"""Circulación en lote: devoluciones del buzón y préstamos en el mostrador.
+
+Uso:
+    python circulacion.py devolver codigos.txt --por libro
+    lector_codigos | python circulacion.py devolver --por libro
+    lector_codigos | python circulacion.py devolver --por codigo
+    python circulacion.py prestar --usuario 42 libros.txt
+
+Los ids se leen de un archivo o de la entrada estándar (un lector de códigos
+escribe uno por línea; también se aceptan separados por espacios o comas).
+Cada lote se valida con una sola consulta y se aplica en una transacción; una
+línea vacía en la entrada procesa lo leído hasta ese momento sin esperar a
+completar el lote.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+from servicio import DIAS_PRESTAMO, DIAS_RECOGIDA
+from validaciones import validar_numero
+
+TAMAÑO_LOTE = 500
+# Una transacción no debe retener demasiadas filas bloqueadas
+LOTE_MAXIMO = 5000
+MODOS_DEVOLUCION = ("prestamo", "libro", "codigo")
+# Los códigos de barras de los ejemplares (EJ<libro>-<n>) caben en la columna
+LONGITUD_CODIGO = 32
+
+
+def leer_ids(lineas):
+    """Generar los códigos leídos; None marca una línea vacía (fin de tanda)"""
+    for linea in lineas:
+        codigos = [codigo for codigo in re.split(r"[\s,;]+", linea.strip()) if codigo]
+        if not codigos:
+            yield None
+        yield from codigos
+
+
+def _separar(codigos):
+    """Devolver (ids válidos sin signo, {posición: error}) conservando el orden"""
+    ids, errores = [], {}
+    for posicion, codigo in enumerate(codigos):
+        numero = validar_numero(codigo)
+        if numero is None or numero < 1:
+            errores[posicion] = "ID inválido"
+        else:
+            ids.append(numero)
+    return ids, errores
+
+
+def _separar_codigos(codigos):
+    """Como _separar, para códigos de barras de ejemplares en lugar de ids"""
+    validos, errores = [], {}
+    for posicion, codigo in enumerate(codigos):
+        codigo = codigo.strip()
+        if not codigo or len(codigo) > LONGITUD_CODIGO:
+            errores[posicion] = "Código de barras inválido"
+        else:
+            validos.append(codigo)
+    return validos, errores
+
+
+def _resumen(items, inicio):
+    duracion = time.perf_counter() - inicio
+    correctos = sum(1 for item in items if item["ok"])
+    return {
+        "procesados": len(items),
+        "correctos": correctos,
+        "fallidos": len(items) - correctos,
+        "segundos": round(duracion, 4),
+        "items_por_segundo": round(len(items) / duracion, 1) if duracion else None,
+        "items": items,
+    }
+
+
+def _combinar(codigos, errores, resultados, formatear):
+    """Alinear los resultados del repositorio con los códigos originales"""
+    pendientes = iter(resultados)
+    return [{"id": codigo, "ok": False, "error": errores[posicion]} if posicion in errores
+            else formatear(codigo, next(pendientes))
+            for posicion, codigo in enumerate(codigos)]
+
+
+def _validar_lote(codigos):
+    if not codigos:
+        raise ValueError("Indique al menos un ID")
+    if len(codigos) > LOTE_MAXIMO:
+        raise ValueError(f"Un lote admite como máximo {LOTE_MAXIMO} IDs")
+
+
+def devolver_lote(repo, codigos, por="prestamo", usuario_id=None, fecha=None):
+    """Devolver un lote de préstamos (o libros, o ejemplares) e informar del resultado de cada uno"""
+    if por not in MODOS_DEVOLUCION:
+        raise ValueError(f"Modo de devolución desconocido: {por}")
+    _validar_lote(codigos)
+    inicio = time.perf_counter()
+    fecha = fecha or datetime.now().date()
+    ids, errores = _separar_codigos(codigos) if por == "codigo" else _separar(codigos)
+    limite_recogida = fecha + timedelta(days=DIAS_RECOGIDA)
+    resultados = repo.devolver_lote(ids, por, fecha, limite_recogida, usuario_id) if ids else []
+
+    def formatear(codigo, resultado):
+        if resultado is None:
+            error = {"libro": "El libro no tiene préstamos activos",
+                     "codigo": "El ejemplar no está prestado o no te pertenece"}.get(
+                por, "Préstamo no encontrado, ya devuelto o no te pertenece")
+            return {"id": codigo, "ok": False, "error": error}
+        prestamo_id, libro_id, titulo = resultado
+        return {"id": codigo, "ok": True, "prestamo_id": prestamo_id, "libro_id": libro_id, "titulo": titulo}
+
+    resumen = _resumen(_combinar(codigos, errores, resultados, formatear), inicio)
+    resumen["fecha_devolucion"] = fecha
+    return resumen
+
+
+def prestar_lote(repo, usuario_id, codigos, dias_prestamo=DIAS_PRESTAMO, fecha=None):
+    """Prestar un lote de libros a un usuario e informar del resultado de cada uno"""
+    _validar_lote(codigos)
+    if not repo.existe_usuario_id(usuario_id):
+        raise ValueError("Usuario no encontrado")
+    inicio = time.perf_counter()
+    fecha = fecha or datetime.now().date()
+    ids, errores = _separar(codigos)
+    vencimiento = fecha + timedelta(days=dias_prestamo)
+    resultados = repo.prestar_lote(usuario_id, ids, fecha, vencimiento) if ids else []
+
+    def formatear(codigo, resultado):
+        titulo, prestamo_id = resultado
+        if titulo is None:
+            return {"id": codigo, "ok": False, "error": "Libro no encontrado"}
+        if prestamo_id is None:
+            return {"id": codigo, "ok": False, "titulo": titulo, "error": "Sin ejemplares disponibles"}
+        return {"id": codigo, "ok": True, "prestamo_id": prestamo_id, "libro_id": validar_numero(codigo),
+                "titulo": titulo}
+
+    resumen = _resumen(_combinar(codigos, errores, resultados, formatear), inicio)
+    resumen["fecha_prestamo"] = fecha
+    resumen["fecha_devolucion_estimada"] = vencimiento
+    return resumen
+
+
+def tandas(codigos, tamaño_lote=TAMAÑO_LOTE):
+    """Agrupar un flujo de códigos en lotes; una línea vacía cierra el lote en curso"""
+    lote = []
+    for codigo in codigos:
+        if codigo is not None:
+            lote.append(codigo)
+        if lote and (codigo is None or len(lote) >= tamaño_lote):
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("operacion", choices=["devolver", "prestar"])
+    parser.add_argument("archivo", nargs="?", help="Archivo con los ids (por defecto, la entrada estándar)")
+    parser.add_argument("--por", choices=MODOS_DEVOLUCION, default="prestamo",
+                        help="Los ids de la devolución son de préstamo, de libro o códigos de barras")
+    parser.add_argument("--usuario", type=int, help="Usuario al que se prestan los libros")
+    parser.add_argument("--lote", type=int, default=TAMAÑO_LOTE, help="Ids por transacción")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    parser.add_argument("--json", action="store_true", help="Escribir el resultado de cada id como JSON Lines")
+    args = parser.parse_args()
+    if args.operacion == "prestar" and args.usuario is None:
+        parser.error("prestar requiere --usuario")
+    if not 1 <= args.lote <= LOTE_MAXIMO:
+        parser.error(f"--lote debe estar entre 1 y {LOTE_MAXIMO}")
+
+    try:
+        entrada = open(args.archivo, encoding="utf-8") if args.archivo else sys.stdin
+    except OSError as e:
+        print(f"✗ No se pudo abrir el archivo: {e}")
+        raise SystemExit(1)
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+    repo = RepositorioBiblioteca(backend, connection)
+    total = {"procesados": 0, "correctos": 0, "fallidos": 0, "segundos": 0.0}
+    try:
+        for lote in tandas(leer_ids(entrada), args.lote):
+            if args.operacion == "devolver":
+                resumen = devolver_lote(repo, lote, args.por)
+            else:
+                resumen = prestar_lote(repo, args.usuario, lote)
+            for item in resumen["items"]:
+                if args.json:
+                    print(json.dumps(item, ensure_ascii=False))
+                elif item["ok"]:
+                    print(f"✓ {item['id']}: {item['titulo']} (préstamo {item['prestamo_id']})")
+                else:
+                    print(f"✗ {item['id']}: {item['error']}")
+            for clave in total:
+                total[clave] += resumen[clave]
+    except (ErrorBD, ValueError, OSError) as e:
+        print(f"✗ Error en la circulación en lote: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        backend.cerrar(connection)
+    velocidad = round(total["procesados"] / total["segundos"], 1) if total["segundos"] else None
+    print(f"✓ {total['correctos']} de {total['procesados']} correctos, {total['fallidos']} fallidos "
+          f"en {round(total['segundos'], 3)} s ({velocidad} ids/s)", file=sys.stderr if args.json else sys.stdout)
+    if total["fallidos"]:
+        raise SystemExit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Diario local del mostrador: préstamos y devoluciones sin conexión a la base central.
+
+Uso:
+    python diario.py prestar --usuario 42 EJ7-1 EJ9-2
+    python diario.py devolver EJ7-1
+    python diario.py sincronizar          (con BIBLIOTECA_TOKEN o usuario y contraseña, como biblioteca.py)
+    python diario.py estado
+    python diario.py conflictos
+
+Cuando el enlace con la base central cae, el mostrador sigue anotando cada
+préstamo y devolución por código de barras en un archivo SQLite local (solo
+se añaden filas; cada una lleva un uuid). Al volver la conexión, sincronizar
+envía las pendientes en orden y en lotes: cada lote es una transacción en la
+base central, que recuerda los uuid aplicados para que repetir una
+sincronización interrumpida no duplique nada. El resultado de cada operación
+(aplicada, duplicada o conflicto) se guarda en el diario; los conflictos
+quedan para que los revise el personal.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import uuid
+from datetime import datetime
+
+from almacenamiento import ErrorBD, crear_backend
+from biblioteca import ErrorUso, abrir_sesion
+from servicio import DIARIO_LOTE, ErrorBiblioteca, ServicioBiblioteca
+
+RUTA_DIARIO = os.environ.get("BIBLIOTECA_DIARIO", "diario_mostrador.db")
+
+ESQUEMA = (
+    """CREATE TABLE IF NOT EXISTS operaciones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        uuid TEXT NOT NULL UNIQUE,
+        tipo TEXT NOT NULL,
+        codigo_barras TEXT NOT NULL,
+        usuario_id INTEGER,
+        sucursal TEXT,
+        fecha TEXT NOT NULL
+    )""",
+    # El resultado va aparte: las operaciones no se modifican nunca
+    """CREATE TABLE IF NOT EXISTS sincronizadas (
+        operacion_id INTEGER PRIMARY KEY REFERENCES operaciones (id),
+        estado TEXT NOT NULL,
+        detalle TEXT,
+        prestamo_id INTEGER,
+        sincronizada TEXT NOT NULL
+    )""",
+)
+
+
+class DiarioMostrador:
+    """Diario de solo añadir en un archivo SQLite local"""
+
+    def __init__(self, ruta=RUTA_DIARIO, sucursal=None):
+        self.ruta = ruta
+        self.sucursal = sucursal
+        try:
+            self._conexion = sqlite3.connect(ruta)
+            # Cada anotación llega al disco antes de confirmar al mostrador
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=FULL")
+            with self._conexion:
+                for sentencia in ESQUEMA:
+                    self._conexion.execute(sentencia)
+        except sqlite3.Error as e:
+            raise ErrorBD(f"Diario local {ruta}: {e}") from e
+
+    def _anotar(self, filas):
+        try:
+            with self._conexion:
+                self._conexion.executemany(
+                    "INSERT INTO operaciones (uuid, tipo, codigo_barras, usuario_id, sucursal, fecha) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", filas)
+        except sqlite3.Error as e:
+            raise ErrorBD(f"Diario local {self.ruta}: {e}") from e
+        return len(filas)
+
+    def prestar(self, usuario_id, codigos, fecha=None):
+        """Anotar el préstamo de los ejemplares al usuario y devolver cuántos se anotaron"""
+        fecha = (fecha or datetime.now()).replace(microsecond=0).isoformat()
+        return self._anotar([(uuid.uuid4().hex, "prestamo", codigo, usuario_id, self.sucursal, fecha)
+                             for codigo in codigos])
+
+    def devolver(self, codigos, fecha=None):
+        """Anotar la devolución de los ejemplares y devolver cuántas se anotaron"""
+        fecha = (fecha or datetime.now()).replace(microsecond=0).isoformat()
+        return self._anotar([(uuid.uuid4().hex, "devolucion", codigo, None, self.sucursal, fecha)
+                             for codigo in codigos])
+
+    def pendientes(self, limite=DIARIO_LOTE):
+        """Primeras operaciones sin sincronizar, en el orden en que se anotaron"""
+        filas = self._conexion.execute(
+            # Se sincroniza por orden y cada lote se marca entero: lo pendiente va tras lo último marcado
+            "SELECT id, uuid, tipo, codigo_barras, usuario_id, sucursal, fecha FROM operaciones "
+            "WHERE id > (SELECT COALESCE(MAX(operacion_id), 0) FROM sincronizadas) "
+            "ORDER BY id LIMIT ?", (limite,)).fetchall()
+        return [{"id": fila[0], "uuid": fila[1], "tipo": fila[2], "codigo_barras": fila[3], "usuario_id": fila[4],
+                 "sucursal": fila[5], "fecha": fila[6]} for fila in filas]
+
+    def marcar(self, operaciones, items):
+        """Guardar el resultado de la sincronización de cada operación"""
+        ahora = datetime.now().replace(microsecond=0).isoformat()
+        with self._conexion:
+            self._conexion.executemany(
+                "INSERT INTO sincronizadas (operacion_id, estado, detalle, prestamo_id, sincronizada) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(operacion["id"], item["estado"], item.get("detalle"), item.get("prestamo_id"), ahora)
+                 for operacion, item in zip(operaciones, items)])
+
+    def conflictos(self):
+        filas = self._conexion.execute(
+            "SELECT o.id, o.tipo, o.codigo_barras, o.usuario_id, o.fecha, s.detalle FROM operaciones o "
+            "INNER JOIN sincronizadas s ON s.operacion_id = o.id WHERE s.estado = 'conflicto' ORDER BY o.id"
+        ).fetchall()
+        return [dict(zip(("id", "tipo", "codigo_barras", "usuario_id", "fecha", "detalle"), fila)) for fila in filas]
+
+    def estado(self):
+        """Número de operaciones por estado ("pendiente" si aún no se sincronizaron)"""
+        filas = self._conexion.execute(
+            "SELECT COALESCE(s.estado, 'pendiente'), COUNT(*) FROM operaciones o "
+            "LEFT JOIN sincronizadas s ON s.operacion_id = o.id GROUP BY 1").fetchall()
+        return {"pendiente": 0, "aplicada": 0, "duplicada": 0, "conflicto": 0, **dict(filas)}
+
+    def cerrar(self):
+        self._conexion.close()
+
+
+def sincronizar(diario, servicio, sesion, tamaño_lote=DIARIO_LOTE, progreso=None):
+    """Enviar las operaciones pendientes por lotes y guardar sus resultados; devolver el resumen"""
+    resumen = {"lotes": 0, "aplicada": 0, "duplicada": 0, "conflicto": 0, "segundos": 0.0}
+    while True:
+        operaciones = diario.pendientes(tamaño_lote)
+        if not operaciones:
+            return resumen
+        # Si la conexión cae aquí, el lote sigue pendiente y la base central
+        # reconoce después los uuid que sí llegó a confirmar
+        resultado = servicio.sincronizar_diario(sesion, operaciones, tamaño_lote)
+        diario.marcar(operaciones, resultado["items"])
+        resumen["lotes"] += 1
+        for clave in ("aplicada", "duplicada", "conflicto", "segundos"):
+            resumen[clave] += resultado[clave]
+        if progreso:
+            progreso(resumen)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("operacion", choices=["prestar", "devolver", "sincronizar", "estado", "conflictos"])
+    parser.add_argument("codigos", nargs="*", help="Códigos de barras de los ejemplares")
+    parser.add_argument("--usuario", type=int, help="Usuario al que se prestan los ejemplares")
+    parser.add_argument("--diario", default=RUTA_DIARIO, help="Archivo del diario local")
+    parser.add_argument("--sucursal", help="Sucursal del mostrador (con BIBLIOTECA_TOPOLOGIA)")
+    parser.add_argument("--lote", type=int, default=DIARIO_LOTE, help="Operaciones por transacción al sincronizar")
+    parser.add_argument("--token", help="Token de acceso para sincronizar (mejor en BIBLIOTECA_TOKEN)")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+    if args.operacion in ("prestar", "devolver") and not args.codigos:
+        parser.error(f"{args.operacion} necesita al menos un código de barras")
+    if args.operacion == "prestar" and args.usuario is None:
+        parser.error("prestar requiere --usuario")
+    if args.lote < 1:
+        parser.error("--lote debe ser positivo")
+
+    diario = DiarioMostrador(args.diario, args.sucursal)
+    try:
+        if args.operacion == "prestar":
+            print(f"✓ {diario.prestar(args.usuario, args.codigos)} préstamos anotados en el diario")
+        elif args.operacion == "devolver":
+            print(f"✓ {diario.devolver(args.codigos)} devoluciones anotadas en el diario")
+        elif args.operacion == "estado":
+            print(json.dumps(diario.estado(), ensure_ascii=False))
+        elif args.operacion == "conflictos":
+            for conflicto in diario.conflictos():
+                print(json.dumps(conflicto, ensure_ascii=False))
+        else:
+            servicio = ServicioBiblioteca(crear_backend(args.backend) if args.backend else None, tamaño_pool=1)
+            try:
+                resumen = sincronizar(diario, servicio, abrir_sesion(servicio, args.token), args.lote)
+            finally:
+                servicio.cerrar()
+            print(f"✓ {resumen['aplicada']} aplicadas, {resumen['duplicada']} duplicadas y "
+                  f"{resumen['conflicto']} conflictos en {resumen['lotes']} lotes ({round(resumen['segundos'], 3)} s)")
+            if resumen["conflicto"]:
+                print("  Revise los conflictos con: python diario.py conflictos")
+    except (ErrorUso, ErrorBiblioteca) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        raise SystemExit(1)
+    except ErrorBD as e:
+        print(f"✗ Sin conexión con la base central; las operaciones siguen en el diario: {e}", file=sys.stderr)
+        raise SystemExit(3)
+    finally:
+        diario.cerrar()
+
+
+if __name__ == "__main__":
+    main()
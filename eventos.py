@@ -0,0 +1,235 @@
+"""Relé de la bandeja de salida: entrega los eventos de la biblioteca a otros sistemas.
+
+Uso:
+    python eventos.py --destino eventos.jsonl --consumidor archivo
+    python eventos.py --destino socket:/run/biblioteca.sock --consumidor portal --seguir
+    python eventos.py --destino tcp:localhost:9000 --consumidor notificaciones --seguir
+    python eventos.py --destino redis://localhost:6379/0 --consumidor cola --seguir
+    python eventos.py --purgar-dias 30
+
+Cada alta de libro o de usuario, préstamo, devolución y asignación de reserva
+escribe un evento en la tabla eventos en la misma transacción que el cambio:
+no hay eventos de cambios deshechos ni cambios sin evento. El relé los lee por
+orden de id en lotes, los entrega como JSON (una línea por evento) y después
+guarda el último id entregado del consumidor. Si se interrumpe entre la entrega
+y el guardado, el lote se vuelve a entregar: la entrega es al menos una vez y
+los destinatarios descartan los duplicados por el id del evento.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from datetime import datetime, timedelta
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+
+TAMAÑO_LOTE = 500
+INTERVALO = 1.0
+# Un hueco en los ids puede ser una transacción que aún no ha confirmado (en
+# MySQL los ids se asignan antes del commit); pasado este margen se da por
+# deshecha y se sigue adelante
+ESPERA_HUECOS = timedelta(seconds=10)
+STREAM_REDIS = "biblioteca:eventos"
+
+
+def serializar(fila):
+    """Línea JSON de un evento leído de la tabla"""
+    evento_id, tipo, entidad_id, datos, creado = fila
+    return json.dumps({"id": evento_id, "tipo": tipo, "entidad_id": entidad_id, "datos": json.loads(datos),
+                       "creado": creado}, ensure_ascii=False, default=str)
+
+
+# === DESTINOS ===
+
+class DestinoArchivo:
+    """Añade los eventos como JSON Lines a un archivo (o a la salida estándar con "-")"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._archivo = sys.stdout if ruta == "-" else open(ruta, "a", encoding="utf-8")
+
+    def enviar(self, lineas):
+        self._archivo.write("".join(f"{linea}\n" for linea in lineas))
+        self._archivo.flush()
+        if self._archivo is not sys.stdout:
+            # La posición solo se guarda después: el lote debe estar en disco
+            os.fsync(self._archivo.fileno())
+
+    def cerrar(self):
+        if self._archivo is not sys.stdout:
+            self._archivo.close()
+
+
+class DestinoSocket:
+    """Escribe los eventos como JSON Lines en un socket Unix o TCP; reconecta tras un error"""
+
+    def __init__(self, direccion):
+        self.direccion = direccion
+        self._socket = None
+
+    def _conectar(self):
+        if isinstance(self.direccion, tuple):
+            return socket.create_connection(self.direccion, timeout=10)
+        conexion = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conexion.settimeout(10)
+        conexion.connect(self.direccion)
+        return conexion
+
+    def enviar(self, lineas):
+        try:
+            if self._socket is None:
+                self._socket = self._conectar()
+            self._socket.sendall("".join(f"{linea}\n" for linea in lineas).encode("utf-8"))
+        except OSError:
+            self.cerrar()
+            raise
+
+    def cerrar(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class DestinoCola:
+    """Adaptador para colas de mensajes: publicar(lineas) recibe el lote y falla con una excepción"""
+
+    def __init__(self, publicar):
+        self._publicar = publicar
+
+    def enviar(self, lineas):
+        self._publicar(lineas)
+
+    def cerrar(self):
+        pass
+
+
+class DestinoRedis(DestinoCola):
+    """Publica cada evento en un stream de Redis (XADD) con un pipeline por lote"""
+
+    def __init__(self, url, stream=STREAM_REDIS):
+        try:
+            import redis
+        except ImportError as e:
+            raise ValueError("El paquete redis no está instalado") from e
+        self._cliente = redis.Redis.from_url(url)
+        self.stream = stream
+        super().__init__(self._publicar_stream)
+
+    def _publicar_stream(self, lineas):
+        pipeline = self._cliente.pipeline(transaction=False)
+        for linea in lineas:
+            pipeline.xadd(self.stream, {"evento": linea})
+        pipeline.execute()
+
+
+def crear_destino(destino):
+    """Destino a partir de una ruta, "-", socket:<ruta>, tcp:<host>:<puerto> o una URL redis://"""
+    if destino.startswith(("redis://", "rediss://", "unix://")):
+        return DestinoRedis(destino)
+    if destino.startswith("socket:"):
+        return DestinoSocket(destino[len("socket:"):])
+    if destino.startswith("tcp:"):
+        host, _, puerto = destino[len("tcp:"):].rpartition(":")
+        if not host or not puerto.isdigit():
+            raise ValueError("El destino tcp debe ser tcp:<host>:<puerto>")
+        return DestinoSocket((host, int(puerto)))
+    return DestinoArchivo(destino)
+
+
+# === RELÉ ===
+
+def _hasta_hueco(filas, ultimo_id, ahora, espera):
+    """Recortar el lote en el primer hueco de ids todavía reciente"""
+    anterior = ultimo_id
+    for posicion, fila in enumerate(filas):
+        if fila[0] != anterior + 1 and ahora - fila[4] < espera:
+            return filas[:posicion]
+        anterior = fila[0]
+    return filas
+
+
+def entregar_lote(repo, destino, consumidor, ultimo_id, tamaño_lote=TAMAÑO_LOTE, espera_huecos=ESPERA_HUECOS):
+    """Entregar los siguientes eventos y guardar la posición; devolver el nuevo último id y cuántos se entregaron"""
+    filas = _hasta_hueco(repo.eventos_desde(ultimo_id, tamaño_lote), ultimo_id, datetime.now(), espera_huecos)
+    if not filas:
+        return ultimo_id, 0
+    destino.enviar([serializar(fila) for fila in filas])
+    ultimo_id = filas[-1][0]
+    repo.guardar_posicion_consumidor(consumidor, ultimo_id, datetime.now())
+    return ultimo_id, len(filas)
+
+
+def retransmitir(repo, destino, consumidor, tamaño_lote=TAMAÑO_LOTE, seguir=False, intervalo=INTERVALO,
+                 espera_huecos=ESPERA_HUECOS, progreso=None):
+    """Entregar los eventos pendientes del consumidor; con seguir, esperar a los nuevos indefinidamente"""
+    inicio = time.perf_counter()
+    ultimo_id = repo.posicion_consumidor(consumidor)
+    resumen = {"consumidor": consumidor, "desde_id": ultimo_id, "lotes": 0, "eventos": 0}
+    while True:
+        ultimo_id, entregados = entregar_lote(repo, destino, consumidor, ultimo_id, tamaño_lote, espera_huecos)
+        if entregados:
+            resumen["lotes"] += 1
+            resumen["eventos"] += entregados
+            if progreso:
+                progreso(resumen)
+            # Un lote recortado por un hueco no debe repetirse sin pausa
+            if entregados == tamaño_lote:
+                continue
+        if not seguir:
+            break
+        time.sleep(intervalo)
+    resumen["hasta_id"] = ultimo_id
+    resumen["segundos"] = round(time.perf_counter() - inicio, 3)
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--destino", help="Archivo, -, socket:<ruta>, tcp:<host>:<puerto> o redis://...")
+    parser.add_argument("--consumidor", help="Nombre con el que se guarda la posición (por defecto, el destino)")
+    parser.add_argument("--lote", type=int, default=TAMAÑO_LOTE, help="Eventos por lote")
+    parser.add_argument("--seguir", action="store_true", help="Seguir esperando eventos nuevos")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO, help="Segundos entre consultas con --seguir")
+    parser.add_argument("--purgar-dias", type=int,
+                        help="Borrar los eventos de más de N días ya entregados a todos los consumidores")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+    if args.destino is None and args.purgar_dias is None:
+        parser.error("indique --destino o --purgar-dias")
+    if args.lote < 1:
+        parser.error("--lote debe ser positivo")
+
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    repo = RepositorioBiblioteca(backend, connection)
+    try:
+        if args.purgar_dias is not None:
+            borrados = repo.purgar_eventos(datetime.now() - timedelta(days=args.purgar_dias))
+            print(f"✓ {borrados} eventos purgados", file=sys.stderr)
+        if args.destino is not None:
+            destino = crear_destino(args.destino)
+            try:
+                resumen = retransmitir(repo, destino, args.consumidor or args.destino, args.lote, args.seguir,
+                                       args.intervalo)
+            finally:
+                destino.cerrar()
+            print(f"✓ {resumen['eventos']} eventos entregados a {resumen['consumidor']} "
+                  f"(hasta el id {resumen['hasta_id']}) en {resumen['segundos']} s", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("✓ Relé detenido; la posición del último lote entregado quedó guardada", file=sys.stderr)
+    except (ErrorBD, ValueError, OSError) as e:
+        print(f"✗ Error en el relé de eventos: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Importación masiva del catálogo desde CSV, JSON Lines o MARC 21 (ISO 2709).
+
+Uso:
+    python importacion.py catalogo.csv --lote 5000 --rechazos rechazos.csv
+    python importacion.py registros.mrc --cantidad 2
+
+Las filas se validan con las mismas reglas que el registro manual, se
+descartan los ISBN repetidos (en el archivo o ya presentes en la base) y se
+insertan por lotes con executemany y un commit por lote.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import time
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+from validaciones import validar_libro
+
+CAMPOS = ("titulo", "autor", "isbn", "editorial", "año_publicacion", "categoria", "cantidad_disponible")
+
+# Nombres de columna alternativos aceptados en CSV y JSON
+ALIAS = {
+    "título": "titulo",
+    "title": "titulo",
+    "author": "autor",
+    "publisher": "editorial",
+    "año": "año_publicacion",
+    "anio": "año_publicacion",
+    "anio_publicacion": "año_publicacion",
+    "year": "año_publicacion",
+    "categoría": "categoria",
+    "category": "categoria",
+    "cantidad": "cantidad_disponible",
+    "copias": "cantidad_disponible",
+}
+
+
+def normalizar_isbn(isbn):
+    """Quitar guiones y espacios para comparar ISBN escritos de distinta forma"""
+    return re.sub(r"[\s-]", "", isbn or "").upper()
+
+
+def _normalizar_claves(fila):
+    return {ALIAS.get(clave.strip().lower(), clave.strip().lower()): valor for clave, valor in fila.items() if clave}
+
+
+# === LECTORES ===
+
+def leer_csv(ruta):
+    """Generar (número de línea, fila) desde un CSV con cabecera"""
+    with open(ruta, newline="", encoding="utf-8-sig") as archivo:
+        for numero, fila in enumerate(csv.DictReader(archivo), start=2):
+            yield numero, _normalizar_claves(fila)
+
+
+def leer_jsonl(ruta):
+    """Generar (número de línea, fila) desde un archivo JSON Lines"""
+    with open(ruta, encoding="utf-8") as archivo:
+        for numero, linea in enumerate(archivo, start=1):
+            if not linea.strip():
+                continue
+            try:
+                datos = json.loads(linea)
+            except ValueError as e:
+                yield numero, {"_error": f"JSON inválido: {e}"}
+                continue
+            if not isinstance(datos, dict):
+                yield numero, {"_error": "Cada línea debe ser un objeto JSON"}
+                continue
+            yield numero, _normalizar_claves(datos)
+
+
+FIN_CAMPO = b"\x1e"
+DELIMITADOR_SUBCAMPO = b"\x1f"
+
+
+def _subcampos(campo, codificacion):
+    """Devolver {código: [valores]} de un campo de datos MARC"""
+    resultado = {}
+    for parte in campo[2:].split(DELIMITADOR_SUBCAMPO)[1:]:
+        if parte:
+            valor = parte[1:].decode(codificacion, errors="replace").strip()
+            resultado.setdefault(chr(parte[0]), []).append(valor)
+    return resultado
+
+
+def _limpiar_marc(texto):
+    # La puntuación ISBD final (" /", " :", ",", ".") no forma parte del dato
+    return re.sub(r"[\s/:;,.=]+$", "", texto or "").strip()
+
+
+def _registro_marc(registro, cantidad):
+    codificacion = "utf-8" if registro[9:10] == b"a" else "latin-1"
+    base = int(registro[12:17])
+    directorio = registro[24:base - 1]
+    campos = {}
+    for i in range(0, len(directorio) - 11, 12):
+        etiqueta = directorio[i:i + 3].decode("ascii", errors="replace")
+        largo = int(directorio[i + 3:i + 7])
+        inicio = int(directorio[i + 7:i + 12])
+        dato = registro[base + inicio:base + inicio + largo].rstrip(FIN_CAMPO)
+        if etiqueta >= "010":
+            campos.setdefault(etiqueta, []).append(_subcampos(dato, codificacion))
+
+    def primero(etiquetas, codigo):
+        for etiqueta in etiquetas:
+            for subcampos in campos.get(etiqueta, []):
+                if subcampos.get(codigo):
+                    return subcampos[codigo][0]
+        return ""
+
+    titulo = _limpiar_marc(primero(["245"], "a"))
+    subtitulo = _limpiar_marc(primero(["245"], "b"))
+    año = re.search(r"\d{4}", primero(["264", "260"], "c"))
+    return {
+        "titulo": f"{titulo}: {subtitulo}" if subtitulo else titulo,
+        "autor": _limpiar_marc(primero(["100", "110", "700"], "a")),
+        "isbn": primero(["020"], "a").split(" ")[0],
+        "editorial": _limpiar_marc(primero(["264", "260"], "b")),
+        "año_publicacion": año.group() if año else None,
+        "categoria": _limpiar_marc(primero(["650", "655"], "a")),
+        "cantidad_disponible": cantidad,
+    }
+
+
+def leer_marc(ruta, cantidad=1):
+    """Generar (número de registro, fila) desde un archivo MARC 21 binario"""
+    with open(ruta, "rb") as archivo:
+        numero = 0
+        while True:
+            cabecera = archivo.read(5)
+            if not cabecera.strip():
+                return
+            numero += 1
+            try:
+                registro = cabecera + archivo.read(int(cabecera) - 5)
+                yield numero, _registro_marc(registro, cantidad)
+            except ValueError as e:
+                # Sin longitud fiable no es posible resincronizar con el registro siguiente
+                yield numero, {"_error": f"Registro MARC inválido: {e}"}
+                return
+
+
+LECTORES = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".mrc": "marc", ".marc": "marc"}
+
+
+def leer_archivo(ruta, formato=None, cantidad_marc=1):
+    formato = formato or LECTORES.get(os.path.splitext(ruta)[1].lower())
+    if formato == "csv":
+        return leer_csv(ruta)
+    if formato == "jsonl":
+        return leer_jsonl(ruta)
+    if formato == "marc":
+        return leer_marc(ruta, cantidad_marc)
+    raise ValueError(f"Formato no reconocido para {ruta}; use --formato csv|jsonl|marc")
+
+
+# === IMPORTACIÓN ===
+
+class ImportadorCatalogo:
+    """Valida, deduplica por ISBN e inserta libros por lotes"""
+
+    def __init__(self, repo, tamaño_lote=1000, ruta_rechazos=None, progreso=None):
+        self.repo = repo
+        self.tamaño_lote = tamaño_lote
+        self.ruta_rechazos = ruta_rechazos
+        self.progreso = progreso
+        self._rechazos = None
+        self._isbns_vistos = set()
+
+    def _rechazar(self, numero, motivo, fila, resumen, contador="rechazadas"):
+        resumen[contador] += 1
+        if self._rechazos is not None:
+            datos = {clave: valor for clave, valor in fila.items() if not clave.startswith("_")}
+            self._rechazos.writerow([numero, motivo, json.dumps(datos, ensure_ascii=False, default=str)])
+
+    def _volcar(self, lote, resumen):
+        """Descartar ISBN ya existentes en la base e insertar el resto del lote"""
+        existentes = self.repo.isbns_existentes({fila[2] for _, fila in lote if fila[2]})
+        nuevos = []
+        for numero, fila in lote:
+            if fila[2] in existentes:
+                self._rechazar(numero, "ISBN ya registrado en el catálogo", dict(zip(CAMPOS, fila)), resumen,
+                               "duplicadas")
+            else:
+                nuevos.append(fila)
+        if nuevos:
+            resumen["insertadas"] += self.repo.insertar_libros(nuevos)
+        resumen["lotes"] += 1
+        if self.progreso:
+            self.progreso(resumen)
+
+    def importar(self, filas):
+        """Importar un iterable de (número, fila) y devolver un resumen"""
+        resumen = {"leidas": 0, "insertadas": 0, "duplicadas": 0, "rechazadas": 0, "lotes": 0}
+        inicio = time.perf_counter()
+        archivo_rechazos = None
+        if self.ruta_rechazos:
+            archivo_rechazos = open(self.ruta_rechazos, "w", newline="", encoding="utf-8")
+            self._rechazos = csv.writer(archivo_rechazos)
+            self._rechazos.writerow(["linea", "motivo", "datos"])
+        try:
+            lote = []
+            for numero, fila in filas:
+                resumen["leidas"] += 1
+                if "_error" in fila:
+                    self._rechazar(numero, fila["_error"], fila, resumen)
+                    continue
+                try:
+                    datos = validar_libro(*(fila.get(campo) for campo in CAMPOS))
+                except ValueError as e:
+                    self._rechazar(numero, str(e), fila, resumen)
+                    continue
+                isbn = normalizar_isbn(datos[2])
+                if isbn:
+                    if isbn in self._isbns_vistos:
+                        self._rechazar(numero, "ISBN repetido en el archivo", fila, resumen, "duplicadas")
+                        continue
+                    self._isbns_vistos.add(isbn)
+                    datos = (datos[0], datos[1], isbn) + datos[3:]
+                lote.append((numero, datos))
+                if len(lote) >= self.tamaño_lote:
+                    self._volcar(lote, resumen)
+                    lote = []
+            if lote:
+                self._volcar(lote, resumen)
+        finally:
+            if archivo_rechazos:
+                archivo_rechazos.close()
+                self._rechazos = None
+        duracion = time.perf_counter() - inicio
+        resumen["segundos"] = round(duracion, 3)
+        resumen["filas_por_segundo"] = round(resumen["leidas"] / duracion, 1) if duracion else None
+        return resumen
+
+
+def importar_archivo(repo, ruta, formato=None, tamaño_lote=1000, ruta_rechazos=None, cantidad_marc=1, progreso=None):
+    """Importar un archivo de catálogo usando el repositorio dado"""
+    importador = ImportadorCatalogo(repo, tamaño_lote, ruta_rechazos, progreso)
+    return importador.importar(leer_archivo(ruta, formato, cantidad_marc))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archivo")
+    parser.add_argument("--formato", choices=["csv", "jsonl", "marc"])
+    parser.add_argument("--lote", type=int, default=1000, help="Filas por lote y por commit")
+    parser.add_argument("--rechazos", help="CSV donde guardar las filas rechazadas")
+    parser.add_argument("--cantidad", type=int, default=1, help="Ejemplares por registro MARC")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+
+    backend = crear_backend(args.backend)
+
+    def progreso(resumen):
+        print(f"  lote {resumen['lotes']}: {resumen['insertadas']} insertadas, "
+              f"{resumen['duplicadas']} duplicadas, {resumen['rechazadas']} rechazadas")
+
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+    try:
+        resumen = importar_archivo(RepositorioBiblioteca(backend, connection), args.archivo, args.formato,
+                                   args.lote, args.rechazos, args.cantidad, progreso)
+    except (ErrorBD, ValueError, OSError) as e:
+        print(f"✗ Error al importar catálogo: {e}")
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+    print(f"✓ Importación terminada: {resumen['insertadas']} libros en {resumen['segundos']} s "
+          f"({resumen['filas_por_segundo']} filas/s)")
+    print(json.dumps(resumen, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Informes de circulación sobre contadores materializados.
+
+Uso:
+    python informes.py mas_prestados --limite 50
+    python informes.py categorias --formato csv --salida categorias.csv
+    python informes.py usuarios --formato parquet --salida usuarios.parquet
+    python informes.py reconstruir          # recalcular los contadores desde prestamos
+
+Los contadores por libro y por usuario los mantienen los triggers de la tabla
+prestamos en la misma transacción que cada préstamo o devolución, así que un
+informe lee filas ya agregadas en vez de recorrer el histórico.
+
+Formatos de salida: tabla (por defecto), csv, columnas (JSON por columnas,
+fácil de cargar en pandas o en un panel) y parquet (requiere pyarrow).
+"""
+import argparse
+import csv
+import json
+import sys
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+
+LIMITE_POR_DEFECTO = 20
+LIMITE_MAXIMO = 1000
+
+# nombre -> (descripción, columnas, admite límite)
+INFORMES = {
+    "mas_prestados": ("Títulos más prestados", ("id", "titulo", "autor", "categoria", "prestamos", "activos"), True),
+    "usuarios": ("Usuarios con más préstamos",
+                 ("id", "nombre", "email", "prestamos", "activos", "ultimo_prestamo"), True),
+    "categorias": ("Utilización por categoría",
+                   ("categoria", "libros", "disponibles", "prestamos", "activos", "utilizacion"), False),
+    "resumen": ("Resumen de circulación", ("libros_prestados", "prestamos", "activos"), False),
+}
+FORMATOS = ("tabla", "csv", "columnas", "parquet")
+
+
+def _utilizacion(filas):
+    """Añadir la fracción de ejemplares prestados y ordenar por préstamos"""
+    resultado = []
+    for categoria, libros, disponibles, prestamos, activos in filas:
+        disponibles = int(disponibles or 0)
+        activos = int(activos)
+        total = activos + disponibles
+        resultado.append((categoria, libros, disponibles, int(prestamos), activos,
+                          round(activos / total, 4) if total else 0.0))
+    return sorted(resultado, key=lambda fila: (-fila[3], fila[0]))
+
+
+def generar_informe(repo, nombre, limite=LIMITE_POR_DEFECTO):
+    """Devolver (columnas, filas) del informe"""
+    if nombre not in INFORMES:
+        raise ValueError(f"Informe desconocido: {nombre}")
+    _, columnas, con_limite = INFORMES[nombre]
+    if con_limite:
+        if not isinstance(limite, int) or not 1 <= limite <= LIMITE_MAXIMO:
+            raise ValueError(f"El límite debe estar entre 1 y {LIMITE_MAXIMO}")
+        filas = repo.informe(nombre, (limite,))
+    else:
+        filas = repo.informe(nombre)
+    if nombre == "categorias":
+        filas = _utilizacion(filas)
+    return columnas, [tuple(fila) for fila in filas]
+
+
+# === EXPORTACIÓN ===
+
+def escribir_tabla(archivo, columnas, filas):
+    anchos = [max([len(columna)] + [len(str(fila[i])) for fila in filas]) for i, columna in enumerate(columnas)]
+    archivo.write("  ".join(columna.ljust(ancho) for columna, ancho in zip(columnas, anchos)) + "\n")
+    archivo.write("  ".join("-" * ancho for ancho in anchos) + "\n")
+    for fila in filas:
+        archivo.write("  ".join(str(valor).ljust(ancho) for valor, ancho in zip(fila, anchos)) + "\n")
+
+
+def escribir_csv(archivo, columnas, filas):
+    escritor = csv.writer(archivo)
+    escritor.writerow(columnas)
+    escritor.writerows(filas)
+
+
+def escribir_columnas(archivo, columnas, filas):
+    """JSON orientado a columnas: {"columnas": [...], "datos": {columna: [valores]}}"""
+    datos = {columna: [fila[i] for fila in filas] for i, columna in enumerate(columnas)}
+    json.dump({"columnas": list(columnas), "filas": len(filas), "datos": datos}, archivo, ensure_ascii=False,
+              default=str)
+    archivo.write("\n")
+
+
+def escribir_parquet(ruta, columnas, filas):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ValueError("El formato parquet necesita el paquete pyarrow") from e
+    tabla = pyarrow.table({columna: [fila[i] for fila in filas] for i, columna in enumerate(columnas)})
+    pyarrow.parquet.write_table(tabla, ruta)
+
+
+def exportar(columnas, filas, formato="tabla", salida=None):
+    """Escribir el informe en el formato pedido, en un archivo o en la salida estándar"""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato desconocido: {formato}")
+    if formato == "parquet":
+        if not salida:
+            raise ValueError("El formato parquet necesita un archivo de salida")
+        escribir_parquet(salida, columnas, filas)
+        return
+    escribir = {"tabla": escribir_tabla, "csv": escribir_csv, "columnas": escribir_columnas}[formato]
+    if not salida:
+        escribir(sys.stdout, columnas, filas)
+        return
+    with open(salida, "w", newline="", encoding="utf-8") as archivo:
+        escribir(archivo, columnas, filas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("informe", choices=[*INFORMES, "reconstruir"])
+    parser.add_argument("--limite", type=int, default=LIMITE_POR_DEFECTO)
+    parser.add_argument("--formato", choices=FORMATOS, default="tabla")
+    parser.add_argument("--salida", help="Archivo de salida (por defecto, la salida estándar)")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+    try:
+        repo = RepositorioBiblioteca(backend, connection)
+        if args.informe == "reconstruir":
+            repo.reconstruir_estadisticas()
+            print("✓ Estadísticas reconstruidas desde el histórico de préstamos")
+            return
+        columnas, filas = generar_informe(repo, args.informe, args.limite)
+        exportar(columnas, filas, args.formato, args.salida)
+    except (ErrorBD, ValueError, OSError) as e:
+        print(f"✗ Error al generar el informe: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+    if args.salida:
+        print(f"✓ Informe '{INFORMES[args.informe][0]}' exportado a {args.salida} ({len(filas)} filas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Límite de intentos de login con cubos de fichas por origen y por cuenta.
+
+Cada cubo guarda hasta "tamaño" fichas y recupera "por_segundo" fichas por
+segundo. Un intento con contraseña gasta una ficha del origen (la dirección
+del cliente) y un intento fallido gasta además una de la cuenta; sin fichas el
+intento se rechaza antes de consultar la base de datos o calcular ningún hash.
+Los nombres que no existen se recuerdan unos segundos para no repetir la
+consulta. Si varios procesos atienden la misma base, los cubos y esos nombres
+pueden vivir en un almacén compartido (un archivo o Redis) como las
+generaciones de la caché.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from cache import CacheLRU
+
+
+def _espera(fichas, por_segundo):
+    """Segundos hasta tener una ficha entera (0.0 si ya la hay)"""
+    return 0.0 if fichas >= 1 else (1 - fichas) / por_segundo
+
+
+# === ALMACENES DE CUBOS ===
+
+class CubosLocales:
+    """Cubos en memoria, acotados: un cubo olvidado por falta de sitio vuelve lleno"""
+
+    def __init__(self, capacidad=100_000, reloj=time.monotonic):
+        self.capacidad = capacidad
+        self._reloj = reloj
+        self._cubos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consumir(self, clave, tamaño, por_segundo, coste=1):
+        """Gastar coste fichas si queda al menos una; devolver 0.0 o los segundos que hay que esperar"""
+        ahora = self._reloj()
+        with self._lock:
+            cubo = self._cubos.get(clave)
+            fichas = tamaño if cubo is None else min(tamaño, cubo[0] + (ahora - cubo[1]) * por_segundo)
+            espera = _espera(fichas, por_segundo)
+            if not espera:
+                fichas -= coste
+            self._cubos[clave] = (fichas, ahora)
+            self._cubos.move_to_end(clave)
+            while len(self._cubos) > self.capacidad:
+                self._cubos.popitem(last=False)
+            return espera
+
+    def marcas(self, capacidad, ttl):
+        """Conjunto con caducidad para los nombres inexistentes, en el mismo almacén"""
+        return CacheLRU(capacidad, ttl)
+
+
+class CubosArchivo:
+    """Cubos en un archivo SQLite compartido por los procesos de una máquina"""
+
+    # Cada cuántos consumos se borran los cubos que ya estarían llenos
+    PURGA = 1000
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._consumos = 0
+        self._recarga_maxima = 0.0
+
+    def _conexion(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.ruta, timeout=10.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cubos (clave TEXT PRIMARY KEY, fichas REAL NOT NULL, actualizado REAL NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS marcas (clave TEXT PRIMARY KEY, expira REAL NOT NULL)")
+            self._local.connection = connection
+        return connection
+
+    def consumir(self, clave, tamaño, por_segundo, coste=1):
+        # Reloj de pared: los procesos no comparten el monotónico
+        ahora = time.time()
+        connection = self._conexion()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            fila = connection.execute("SELECT fichas, actualizado FROM cubos WHERE clave = ?", (clave,)).fetchone()
+            fichas = tamaño if fila is None else min(tamaño, fila[0] + max(0.0, ahora - fila[1]) * por_segundo)
+            espera = _espera(fichas, por_segundo)
+            if not espera:
+                fichas -= coste
+            connection.execute(
+                """INSERT INTO cubos (clave, fichas, actualizado) VALUES (?, ?, ?)
+                   ON CONFLICT (clave) DO UPDATE SET fichas = excluded.fichas, actualizado = excluded.actualizado""",
+                (clave, fichas, ahora))
+            self._consumos += 1
+            self._recarga_maxima = max(self._recarga_maxima, tamaño / por_segundo)
+            if self._consumos % self.PURGA == 0:
+                connection.execute("DELETE FROM cubos WHERE actualizado < ?", (ahora - self._recarga_maxima,))
+                connection.execute("DELETE FROM marcas WHERE expira < ?", (ahora,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return espera
+
+    def marcas(self, capacidad, ttl):
+        return MarcasArchivo(self, ttl)
+
+
+class MarcasArchivo:
+    """Nombres inexistentes en el archivo de los cubos: todos los procesos ven las altas"""
+
+    def __init__(self, cubos, ttl):
+        self._cubos = cubos
+        self.ttl = ttl
+
+    def obtener(self, clave, defecto=None):
+        fila = self._cubos._conexion().execute("SELECT 1 FROM marcas WHERE clave = ? AND expira > ?",
+                                               (clave, time.time())).fetchone()
+        return defecto if fila is None else True
+
+    def guardar(self, clave, valor):
+        self._cubos._conexion().execute(
+            "INSERT INTO marcas (clave, expira) VALUES (?, ?) ON CONFLICT (clave) DO UPDATE SET expira = excluded.expira",
+            (clave, time.time() + self.ttl))
+
+    def borrar(self, clave):
+        self._cubos._conexion().execute("DELETE FROM marcas WHERE clave = ?", (clave,))
+
+    def estadisticas(self):
+        return {"compartidas": self._cubos.ruta, "ttl": self.ttl}
+
+
+# Recarga y consumo atómicos en el servidor Redis; la clave caduca cuando el cubo ya estaría lleno
+_SCRIPT_REDIS = """
+local cubo = redis.call('HMGET', KEYS[1], 'fichas', 'actualizado')
+local capacidad, por_segundo, coste, ahora = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local fichas = capacidad
+if cubo[1] then
+    fichas = math.min(capacidad, tonumber(cubo[1]) + math.max(0, ahora - tonumber(cubo[2])) * por_segundo)
+end
+local espera = 0
+if fichas >= 1 then fichas = fichas - coste else espera = (1 - fichas) / por_segundo end
+redis.call('HSET', KEYS[1], 'fichas', fichas, 'actualizado', ahora)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidad / por_segundo) + 1)
+return tostring(espera)
+"""
+
+
+class CubosRedis:
+    """Cubos en Redis para procesos repartidos en varias máquinas"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise ValueError("El paquete redis no está instalado") from e
+        self._cliente = redis.Redis.from_url(url)
+        self._script = self._cliente.register_script(_SCRIPT_REDIS)
+
+    def consumir(self, clave, tamaño, por_segundo, coste=1):
+        return float(self._script(keys=[clave], args=[tamaño, por_segundo, coste, time.time()]))
+
+    def marcas(self, capacidad, ttl):
+        return MarcasRedis(self._cliente, ttl)
+
+
+class MarcasRedis:
+    """Nombres inexistentes como claves de Redis que caducan solas"""
+
+    def __init__(self, cliente, ttl):
+        self._cliente = cliente
+        self.ttl = ttl
+
+    def obtener(self, clave, defecto=None):
+        return True if self._cliente.exists(clave) else defecto
+
+    def guardar(self, clave, valor):
+        self._cliente.set(clave, 1, px=max(1, int(self.ttl * 1000)))
+
+    def borrar(self, clave):
+        self._cliente.delete(clave)
+
+    def estadisticas(self):
+        return {"compartidas": "redis", "ttl": self.ttl}
+
+
+def crear_cubos(destino):
+    """Almacén de cubos a partir de una URL redis:// o la ruta de un archivo"""
+    if not destino:
+        return CubosLocales()
+    if destino.startswith(("redis://", "rediss://", "unix://")):
+        return CubosRedis(destino)
+    return CubosArchivo(destino)
+
+
+# === LIMITADOR DE LOGIN ===
+
+def leer_limite(texto):
+    """Convertir "intentos/segundos" en (tamaño, fichas por segundo); "0" o vacío lo desactiva"""
+    intentos, _, segundos = (texto or "0").partition("/")
+    intentos, segundos = int(intentos), float(segundos or 60)
+    if intentos <= 0:
+        return None
+    if segundos <= 0:
+        raise ValueError(f"Límite de intentos inválido: {texto}")
+    return intentos, intentos / segundos
+
+
+class LimitadorLogin:
+    """Cubos por origen y por cuenta más una caché negativa de nombres inexistentes.
+
+    La caché negativa vive en el mismo almacén que los cubos: si se comparten,
+    el alta de una cuenta en un proceso la quita de la caché de todos.
+    """
+
+    def __init__(self, cubos=None, por_origen=(120, 2.0), por_cuenta=(10, 1 / 30), ttl_desconocidos=30.0,
+                 capacidad_desconocidos=10_000, espacio=""):
+        self.cubos = cubos or CubosLocales()
+        self.por_origen = por_origen
+        self.por_cuenta = por_cuenta
+        self.desconocidos = self.cubos.marcas(capacidad_desconocidos, ttl_desconocidos)
+        # Prefijo de las claves: separa bases distintas en un mismo almacén
+        self.espacio = espacio
+        self.rechazos = 0
+        self._lock = threading.Lock()
+
+    def _consumir(self, tipo, clave, limite, coste):
+        if limite is None or not clave:
+            return 0.0
+        return self.cubos.consumir(f"{self.espacio}:{tipo}:{clave}", *limite, coste)
+
+    def admitir(self, cuenta=None, origen=None, coste_origen=1):
+        """Gastar el intento del origen y comprobar que la cuenta aún admite fallos.
+
+        Devuelve 0.0 si el intento sigue adelante o los segundos que hay que
+        esperar. El origen se comprueba primero: un origen bloqueado no gasta
+        fichas de la cuenta.
+        """
+        espera = (self._consumir("origen", origen, self.por_origen, coste_origen)
+                  or self._consumir("cuenta", cuenta and cuenta.casefold(), self.por_cuenta, 0))
+        if espera:
+            with self._lock:
+                self.rechazos += 1
+        return espera
+
+    def fallo(self, cuenta=None, origen=None, coste_origen=0):
+        """Gastar las fichas de un intento fallido"""
+        if coste_origen:
+            self._consumir("origen", origen, self.por_origen, coste_origen)
+        self._consumir("cuenta", cuenta and cuenta.casefold(), self.por_cuenta, 1)
+
+    def _clave_desconocida(self, cuenta):
+        return f"{self.espacio}:desconocida:{cuenta.casefold()}"
+
+    def es_desconocida(self, cuenta):
+        return self.desconocidos.obtener(self._clave_desconocida(cuenta), False)
+
+    def anotar_desconocida(self, cuenta):
+        self.desconocidos.guardar(self._clave_desconocida(cuenta), True)
+
+    def olvidar_desconocida(self, cuenta):
+        """La cuenta acaba de crearse: que su primer login consulte la base"""
+        self.desconocidos.borrar(self._clave_desconocida(cuenta))
+
+    def estadisticas(self):
+        return {"rechazos": self.rechazos, "desconocidas": self.desconocidos.estadisticas()}
+
+
+def crear_limitador(espacio=""):
+    """Limitador configurado con BIBLIOTECA_LOGIN_ORIGEN, _CUENTA, _DESCONOCIDOS_TTL y _COMPARTIDO"""
+    return LimitadorLogin(
+        cubos=crear_cubos(os.environ.get("BIBLIOTECA_LOGIN_COMPARTIDO")),
+        por_origen=leer_limite(os.environ.get("BIBLIOTECA_LOGIN_ORIGEN", "120/60")),
+        por_cuenta=leer_limite(os.environ.get("BIBLIOTECA_LOGIN_CUENTA", "10/300")),
+        ttl_desconocidos=float(os.environ.get("BIBLIOTECA_LOGIN_DESCONOCIDOS_TTL", "30")),
+        espacio=espacio,
+    )
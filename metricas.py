@@ -0,0 +1,255 @@
+"""Métricas de acceso a datos: latencia por consulta, filas, errores y consultas lentas.
+
+Desactivadas por defecto. Se activan con variables de entorno:
+    BIBLIOTECA_METRICAS=1                   registrar métricas
+    BIBLIOTECA_CONSULTA_LENTA_MS=250        umbral del registro de consultas lentas
+    BIBLIOTECA_CONSULTAS_LENTAS=lentas.log  añadir cada consulta lenta como JSON Lines
+    BIBLIOTECA_METRICAS_VOLCADO=metricas.prom  escribir las métricas al cerrar el servicio
+
+Con las métricas desactivadas el repositorio no recibe registro y el único coste
+por consulta es comprobar que no lo tiene. Los parámetros de las consultas
+lentas nunca se guardan: solo sus tipos, para no dejar emails ni hashes en un log.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+
+# Límites superiores de los intervalos del histograma, en segundos
+LIMITES_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+UMBRAL_LENTA_MS = 250.0
+LENTAS_RECIENTES = 100
+
+
+class Histograma:
+    """Recuento de observaciones por intervalo de latencia (acumulado al exponerlo)"""
+
+    __slots__ = ("conteos", "suma", "total", "maximo")
+
+    def __init__(self):
+        self.conteos = [0] * (len(LIMITES_LATENCIA) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self.maximo = 0.0
+
+    def observar(self, segundos):
+        self.conteos[bisect_left(LIMITES_LATENCIA, segundos)] += 1
+        self.suma += segundos
+        self.total += 1
+        if segundos > self.maximo:
+            self.maximo = segundos
+
+    def acumulados(self):
+        """(límite, observaciones <= límite) para cada intervalo, terminando en +Inf"""
+        acumulado = 0
+        resultado = []
+        for limite, conteo in zip((*LIMITES_LATENCIA, float("inf")), self.conteos):
+            acumulado += conteo
+            resultado.append((limite, acumulado))
+        return resultado
+
+    def percentil(self, p):
+        """Cota superior del intervalo que contiene el percentil p (el máximo si es el último)"""
+        if not self.total:
+            return None
+        objetivo = self.total * p / 100
+        for limite, acumulado in self.acumulados():
+            if acumulado >= objetivo:
+                return min(limite, self.maximo)
+        return self.maximo
+
+
+class EstadisticaConsulta:
+    __slots__ = ("latencia", "filas", "errores", "lentas")
+
+    def __init__(self):
+        self.latencia = Histograma()
+        self.filas = 0
+        self.errores = 0
+        self.lentas = 0
+
+
+def redactar(params):
+    """Describir los parámetros sin sus valores: tipos, claves o número de filas"""
+    if isinstance(params, dict):
+        return {clave: type(valor).__name__ for clave, valor in params.items()}
+    if isinstance(params, list) and params and isinstance(params[0], (tuple, list, dict)):
+        # executemany: basta con saber cuántas filas se enviaron
+        return f"<{len(params)} filas>"
+    return [type(valor).__name__ for valor in params]
+
+
+def filas_resultado(resultado, cursor):
+    """Filas devueltas (lecturas) o afectadas (escrituras) por una consulta"""
+    if isinstance(resultado, list):
+        return len(resultado)
+    if resultado is None:
+        return 0
+    if resultado is not cursor:
+        return 1
+    return max(cursor.rowcount, 0)
+
+
+class Metricas:
+    """Registro de métricas compartido por todos los hilos del servicio"""
+
+    def __init__(self, umbral_lenta_ms=UMBRAL_LENTA_MS, ruta_lentas=None, ruta_volcado=None):
+        self.umbral_lenta = umbral_lenta_ms / 1000
+        self.ruta_lentas = ruta_lentas
+        self.ruta_volcado = ruta_volcado
+        self.inicio = time.time()
+        self._consultas = {}
+        self._espera_pool = Histograma()
+        self._timeouts_pool = 0
+        self._lentas = deque(maxlen=LENTAS_RECIENTES)
+        self._lock = threading.Lock()
+        self._lock_archivo = threading.Lock()
+
+    def registrar_consulta(self, nombre, segundos, filas, params=()):
+        with self._lock:
+            estadistica = self._consultas.get(nombre)
+            if estadistica is None:
+                estadistica = self._consultas[nombre] = EstadisticaConsulta()
+            estadistica.latencia.observar(segundos)
+            estadistica.filas += filas
+            lenta = segundos >= self.umbral_lenta
+            if lenta:
+                estadistica.lentas += 1
+        if lenta:
+            self._registrar_lenta(nombre, segundos, filas, params)
+
+    def registrar_error(self, nombre):
+        with self._lock:
+            estadistica = self._consultas.get(nombre)
+            if estadistica is None:
+                estadistica = self._consultas[nombre] = EstadisticaConsulta()
+            estadistica.errores += 1
+
+    def registrar_espera_pool(self, segundos, agotado=False):
+        with self._lock:
+            if agotado:
+                self._timeouts_pool += 1
+            else:
+                self._espera_pool.observar(segundos)
+
+    def _registrar_lenta(self, nombre, segundos, filas, params):
+        entrada = {
+            "momento": datetime.now().isoformat(timespec="milliseconds"),
+            "consulta": nombre,
+            "ms": round(segundos * 1000, 2),
+            "filas": filas,
+            "params": redactar(params),
+        }
+        self._lentas.append(entrada)
+        if self.ruta_lentas:
+            linea = json.dumps(entrada, ensure_ascii=False) + "\n"
+            with self._lock_archivo:
+                try:
+                    with open(self.ruta_lentas, "a", encoding="utf-8") as archivo:
+                        archivo.write(linea)
+                except OSError:
+                    # Un log inaccesible no debe tumbar la consulta que se está midiendo
+                    pass
+
+    def consultas_lentas(self):
+        """Últimas consultas lentas, de la más reciente a la más antigua"""
+        return list(reversed(self._lentas))
+
+    def resumen(self):
+        """Una fila por consulta con llamadas, filas, errores y latencias en ms"""
+        with self._lock:
+            consultas = sorted(self._consultas.items(), key=lambda item: -item[1].latencia.suma)
+            resultado = []
+            for nombre, estadistica in consultas:
+                latencia = estadistica.latencia
+                resultado.append({
+                    "consulta": nombre,
+                    "llamadas": latencia.total,
+                    "filas": estadistica.filas,
+                    "errores": estadistica.errores,
+                    "lentas": estadistica.lentas,
+                    "total_ms": round(latencia.suma * 1000, 1),
+                    "media_ms": round(latencia.suma * 1000 / latencia.total, 3) if latencia.total else None,
+                    "p50_ms": _ms(latencia.percentil(50)),
+                    "p95_ms": _ms(latencia.percentil(95)),
+                    "max_ms": round(latencia.maximo * 1000, 3),
+                })
+            espera = self._espera_pool
+            pool = {"adquisiciones": espera.total, "timeouts": self._timeouts_pool,
+                    "espera_p95_ms": _ms(espera.percentil(95)), "espera_max_ms": round(espera.maximo * 1000, 3)}
+        return {"desde": datetime.fromtimestamp(self.inicio).isoformat(timespec="seconds"),
+                "consultas": resultado, "pool": pool}
+
+    def exposicion(self, adicionales=()):
+        """Texto en el formato de exposición de Prometheus.
+
+        adicionales son (nombre, tipo, ayuda, valor) para medidas que no guarda
+        este registro, como el estado del pool o de la caché.
+        """
+        lineas = []
+        with self._lock:
+            consultas = sorted(self._consultas.items())
+            _cabecera(lineas, "biblioteca_consulta_segundos", "histogram", "Latencia de cada consulta con nombre")
+            for nombre, estadistica in consultas:
+                _histograma(lineas, "biblioteca_consulta_segundos", estadistica.latencia, f'consulta="{nombre}"')
+            for sufijo, ayuda, atributo in (("filas_total", "Filas devueltas o afectadas", "filas"),
+                                            ("errores_total", "Consultas que fallaron", "errores"),
+                                            ("lentas_total", "Consultas por encima del umbral de lentitud",
+                                             "lentas")):
+                _cabecera(lineas, f"biblioteca_consulta_{sufijo}", "counter", ayuda)
+                for nombre, estadistica in consultas:
+                    lineas.append(f'biblioteca_consulta_{sufijo}{{consulta="{nombre}"}} '
+                                  f'{getattr(estadistica, atributo)}')
+            _cabecera(lineas, "biblioteca_pool_espera_segundos", "histogram",
+                      "Tiempo de espera para obtener una conexión del pool")
+            _histograma(lineas, "biblioteca_pool_espera_segundos", self._espera_pool)
+            _cabecera(lineas, "biblioteca_pool_timeouts_total", "counter",
+                      "Esperas de conexión que agotaron el tiempo")
+            lineas.append(f"biblioteca_pool_timeouts_total {self._timeouts_pool}")
+        for nombre, tipo, ayuda, valor in adicionales:
+            _cabecera(lineas, nombre, tipo, ayuda)
+            lineas.append(f"{nombre} {_numero(valor)}")
+        return "\n".join(lineas) + "\n"
+
+    def volcar(self, adicionales=()):
+        """Escribir la exposición en ruta_volcado, si está configurada"""
+        if self.ruta_volcado:
+            with open(self.ruta_volcado, "w", encoding="utf-8") as archivo:
+                archivo.write(self.exposicion(adicionales))
+
+
+def _ms(segundos):
+    return None if segundos is None else round(segundos * 1000, 3)
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(int(valor or 0))
+
+
+def _cabecera(lineas, nombre, tipo, ayuda):
+    lineas.append(f"# HELP {nombre} {ayuda}")
+    lineas.append(f"# TYPE {nombre} {tipo}")
+
+
+def _histograma(lineas, nombre, histograma, etiquetas=""):
+    separador = "," if etiquetas else ""
+    for limite, acumulado in histograma.acumulados():
+        le = "+Inf" if limite == float("inf") else repr(limite)
+        lineas.append(f'{nombre}_bucket{{{etiquetas}{separador}le="{le}"}} {acumulado}')
+    sufijo = f"{{{etiquetas}}}" if etiquetas else ""
+    lineas.append(f"{nombre}_sum{sufijo} {histograma.suma!r}")
+    lineas.append(f"{nombre}_count{sufijo} {histograma.total}")
+
+
+def crear_metricas():
+    """Registro configurado con BIBLIOTECA_METRICAS y afines, o None si están desactivadas"""
+    if os.environ.get("BIBLIOTECA_METRICAS", "").lower() not in ("1", "si", "sí", "true", "on"):
+        return None
+    return Metricas(
+        umbral_lenta_ms=float(os.environ.get("BIBLIOTECA_CONSULTA_LENTA_MS", UMBRAL_LENTA_MS)),
+        ruta_lentas=os.environ.get("BIBLIOTECA_CONSULTAS_LENTAS") or None,
+        ruta_volcado=os.environ.get("BIBLIOTECA_METRICAS_VOLCADO") or None,
+    )
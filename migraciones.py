@@ -0,0 +1,852 @@
+"""Esquema versionado de la base de datos y comprobación de planes de ejecución.
+
+Uso:
+    python migraciones.py                 # aplica las migraciones pendientes
+    python migraciones.py --explicar      # y comprueba que las consultas usan índices
+
+Cada migración tiene un número de versión y se aplica una sola vez; las ya
+aplicadas quedan registradas en la tabla version_esquema.
+"""
+import argparse
+from datetime import date, datetime
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import LISTADOS, SUCURSAL_PRINCIPAL, codigo_barras, sql_adaptado
+
+TABLA_VERSION = {
+    "mysql": """CREATE TABLE IF NOT EXISTS version_esquema (
+                    version INT PRIMARY KEY,
+                    descripcion VARCHAR(200) NOT NULL,
+                    aplicada DATETIME NOT NULL
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    "sqlite": """CREATE TABLE IF NOT EXISTS version_esquema (
+                    version INTEGER PRIMARY KEY,
+                    descripcion TEXT NOT NULL,
+                    aplicada DATETIME NOT NULL
+                )""",
+}
+
+# Intercalación insensible a tildes y mayúsculas para comparar y buscar texto en español
+OPCIONES_TABLA_MYSQL = "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci"
+
+TABLAS_BASE = {
+    "mysql": [
+        f"""CREATE TABLE IF NOT EXISTS administradores (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            nombre VARCHAR(100) NOT NULL,
+            email VARCHAR(100) NOT NULL
+        ) {OPCIONES_TABLA_MYSQL}""",
+        f"""CREATE TABLE IF NOT EXISTS usuarios (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            nombre VARCHAR(100) NOT NULL,
+            email VARCHAR(100) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            telefono VARCHAR(20),
+            direccion VARCHAR(255)
+        ) {OPCIONES_TABLA_MYSQL}""",
+        f"""CREATE TABLE IF NOT EXISTS libros (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            titulo VARCHAR(255) NOT NULL,
+            autor VARCHAR(255) NOT NULL,
+            isbn VARCHAR(20),
+            editorial VARCHAR(100),
+            año_publicacion INT,
+            categoria VARCHAR(100),
+            cantidad_disponible INT NOT NULL DEFAULT 0
+        ) {OPCIONES_TABLA_MYSQL}""",
+        f"""CREATE TABLE IF NOT EXISTS prestamos (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            libro_id INT NOT NULL,
+            usuario_id INT NOT NULL,
+            fecha_prestamo DATE NOT NULL,
+            fecha_devolucion DATE,
+            estado VARCHAR(20) NOT NULL DEFAULT 'activo',
+            FOREIGN KEY (libro_id) REFERENCES libros(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+        ) {OPCIONES_TABLA_MYSQL}""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS administradores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            nombre TEXT NOT NULL,
+            email TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            telefono TEXT,
+            direccion TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS libros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            autor TEXT NOT NULL,
+            isbn TEXT,
+            editorial TEXT,
+            año_publicacion INTEGER,
+            categoria TEXT,
+            cantidad_disponible INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS prestamos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            libro_id INTEGER NOT NULL REFERENCES libros(id),
+            usuario_id INTEGER NOT NULL REFERENCES usuarios(id),
+            fecha_prestamo DATE NOT NULL,
+            fecha_devolucion DATE,
+            estado TEXT NOT NULL DEFAULT 'activo'
+        )""",
+    ],
+}
+
+# (nombre, tabla, columnas) de los índices que necesitan las consultas frecuentes
+INDICES = (
+    ("idx_administradores_username", "administradores", ("username",)),
+    ("idx_usuarios_email", "usuarios", ("email",)),
+    ("idx_usuarios_nombre", "usuarios", ("nombre",)),
+    ("idx_libros_isbn", "libros", ("isbn",)),
+    ("idx_libros_disponibles", "libros", ("cantidad_disponible", "titulo")),
+    ("idx_libros_titulo", "libros", ("titulo",)),
+    ("idx_prestamos_usuario", "prestamos", ("usuario_id", "estado", "fecha_prestamo")),
+    ("idx_prestamos_libro", "prestamos", ("libro_id",)),
+    ("idx_prestamos_fecha", "prestamos", ("fecha_prestamo",)),
+)
+
+
+def crear_indices(*indices):
+    """Paso de migración que crea los índices que no estén ya cubiertos por otro"""
+    def paso(backend, connection):
+        for nombre, tabla, columnas in indices:
+            existentes = backend.listar_indices(connection, tabla).values()
+            # Un índice (o UNIQUE) que empieza por las mismas columnas ya sirve
+            if any(actual[:len(columnas)] == columnas for actual in existentes):
+                continue
+            _ejecutar(backend, connection, f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})")
+    return paso
+
+
+# Índice de texto completo del catálogo. En SQLite se alimenta por triggers, de
+# modo que cualquier alta (formulario, importación masiva) queda buscable al confirmar
+TEXTO_COMPLETO_SQLITE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS libros_fts USING fts5(
+        titulo, autor, editorial, categoria, isbn,
+        content='libros', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS libros_fts_alta AFTER INSERT ON libros BEGIN
+        INSERT INTO libros_fts (rowid, titulo, autor, editorial, categoria, isbn)
+        VALUES (new.id, new.titulo, new.autor, new.editorial, new.categoria, new.isbn);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS libros_fts_baja AFTER DELETE ON libros BEGIN
+        INSERT INTO libros_fts (libros_fts, rowid, titulo, autor, editorial, categoria, isbn)
+        VALUES ('delete', old.id, old.titulo, old.autor, old.editorial, old.categoria, old.isbn);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS libros_fts_cambio AFTER UPDATE OF titulo, autor, editorial, categoria, isbn ON libros BEGIN
+        INSERT INTO libros_fts (libros_fts, rowid, titulo, autor, editorial, categoria, isbn)
+        VALUES ('delete', old.id, old.titulo, old.autor, old.editorial, old.categoria, old.isbn);
+        INSERT INTO libros_fts (rowid, titulo, autor, editorial, categoria, isbn)
+        VALUES (new.id, new.titulo, new.autor, new.editorial, new.categoria, new.isbn);
+    END""",
+    # Indexa el catálogo que ya existía antes de crear la tabla virtual
+    "INSERT INTO libros_fts (libros_fts) VALUES ('rebuild')",
+]
+
+
+def _texto_completo_mysql(backend, connection):
+    if "ft_libros" not in backend.listar_indices(connection, "libros"):
+        _ejecutar(backend, connection,
+                  "ALTER TABLE libros ADD FULLTEXT INDEX ft_libros (titulo, autor, editorial, categoria, isbn)")
+
+
+# Progreso de los trabajos por lotes (multas nocturnas...) para reanudarlos tras un corte
+PUNTOS_CONTROL = {
+    "mysql": """CREATE TABLE IF NOT EXISTS puntos_control (
+                    trabajo VARCHAR(50) PRIMARY KEY,
+                    corte DATE NOT NULL,
+                    ultimo_id INT NOT NULL DEFAULT 0,
+                    procesados BIGINT NOT NULL DEFAULT 0,
+                    completado BOOLEAN NOT NULL DEFAULT FALSE,
+                    actualizado DATETIME NOT NULL
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    "sqlite": """CREATE TABLE IF NOT EXISTS puntos_control (
+                    trabajo TEXT PRIMARY KEY,
+                    corte DATE NOT NULL,
+                    ultimo_id INTEGER NOT NULL DEFAULT 0,
+                    procesados INTEGER NOT NULL DEFAULT 0,
+                    completado INTEGER NOT NULL DEFAULT 0,
+                    actualizado DATETIME NOT NULL
+                )""",
+}
+
+INDICE_VENCIMIENTO = ("idx_prestamos_vencimiento", "prestamos", ("estado", "fecha_vencimiento"))
+
+
+# Contadores por libro y por usuario que mantienen los triggers de prestamos en la
+# misma transacción que el préstamo o la devolución. Solo se tocan las filas del
+# libro y del usuario afectados: no hay una fila global que serialice los préstamos.
+# Los totales son históricos: borrar préstamos antiguos no los descuenta, por eso no hay trigger de borrado
+_RELLENAR_ESTADISTICAS = [
+    """INSERT INTO estadisticas_libros (libro_id, prestamos, activos)
+       SELECT libro_id, COUNT(*), SUM(estado = 'activo') FROM prestamos GROUP BY libro_id""",
+    """INSERT INTO estadisticas_usuarios (usuario_id, prestamos, activos, ultimo_prestamo)
+       SELECT usuario_id, COUNT(*), SUM(estado = 'activo'), MAX(fecha_prestamo) FROM prestamos GROUP BY usuario_id""",
+]
+
+ESTADISTICAS = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS estadisticas_libros (
+            libro_id INT PRIMARY KEY,
+            prestamos INT NOT NULL DEFAULT 0,
+            activos INT NOT NULL DEFAULT 0,
+            INDEX idx_estadisticas_libros_prestamos (prestamos)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS estadisticas_usuarios (
+            usuario_id INT PRIMARY KEY,
+            prestamos INT NOT NULL DEFAULT 0,
+            activos INT NOT NULL DEFAULT 0,
+            ultimo_prestamo DATE,
+            INDEX idx_estadisticas_usuarios_prestamos (prestamos)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        *_RELLENAR_ESTADISTICAS,
+        """CREATE TRIGGER estadisticas_alta AFTER INSERT ON prestamos FOR EACH ROW BEGIN
+            INSERT INTO estadisticas_libros (libro_id, prestamos, activos)
+            VALUES (NEW.libro_id, 1, NEW.estado = 'activo')
+            ON DUPLICATE KEY UPDATE prestamos = prestamos + 1, activos = activos + (NEW.estado = 'activo');
+            INSERT INTO estadisticas_usuarios (usuario_id, prestamos, activos, ultimo_prestamo)
+            VALUES (NEW.usuario_id, 1, NEW.estado = 'activo', NEW.fecha_prestamo)
+            ON DUPLICATE KEY UPDATE prestamos = prestamos + 1, activos = activos + (NEW.estado = 'activo'),
+                ultimo_prestamo = GREATEST(COALESCE(ultimo_prestamo, NEW.fecha_prestamo), NEW.fecha_prestamo);
+        END""",
+        """CREATE TRIGGER estadisticas_estado AFTER UPDATE ON prestamos FOR EACH ROW BEGIN
+            IF NOT (OLD.estado <=> NEW.estado) THEN
+                UPDATE estadisticas_libros SET activos = activos + (NEW.estado = 'activo') - (OLD.estado = 'activo')
+                WHERE libro_id = NEW.libro_id;
+                UPDATE estadisticas_usuarios SET activos = activos + (NEW.estado = 'activo') - (OLD.estado = 'activo')
+                WHERE usuario_id = NEW.usuario_id;
+            END IF;
+        END""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS estadisticas_libros (
+            libro_id INTEGER PRIMARY KEY,
+            prestamos INTEGER NOT NULL DEFAULT 0,
+            activos INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS estadisticas_usuarios (
+            usuario_id INTEGER PRIMARY KEY,
+            prestamos INTEGER NOT NULL DEFAULT 0,
+            activos INTEGER NOT NULL DEFAULT 0,
+            ultimo_prestamo DATE
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_estadisticas_libros_prestamos ON estadisticas_libros (prestamos)",
+        "CREATE INDEX IF NOT EXISTS idx_estadisticas_usuarios_prestamos ON estadisticas_usuarios (prestamos)",
+        *_RELLENAR_ESTADISTICAS,
+        """CREATE TRIGGER IF NOT EXISTS estadisticas_alta AFTER INSERT ON prestamos BEGIN
+            INSERT INTO estadisticas_libros (libro_id, prestamos, activos)
+            VALUES (new.libro_id, 1, new.estado = 'activo')
+            ON CONFLICT (libro_id) DO UPDATE SET prestamos = prestamos + 1, activos = activos + (new.estado = 'activo');
+            INSERT INTO estadisticas_usuarios (usuario_id, prestamos, activos, ultimo_prestamo)
+            VALUES (new.usuario_id, 1, new.estado = 'activo', new.fecha_prestamo)
+            ON CONFLICT (usuario_id) DO UPDATE SET prestamos = prestamos + 1, activos = activos + (new.estado = 'activo'),
+                ultimo_prestamo = MAX(COALESCE(ultimo_prestamo, new.fecha_prestamo), new.fecha_prestamo);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS estadisticas_estado AFTER UPDATE OF estado ON prestamos
+        WHEN old.estado IS NOT new.estado BEGIN
+            UPDATE estadisticas_libros SET activos = activos + (new.estado = 'activo') - (old.estado = 'activo')
+            WHERE libro_id = new.libro_id;
+            UPDATE estadisticas_usuarios SET activos = activos + (new.estado = 'activo') - (old.estado = 'activo')
+            WHERE usuario_id = new.usuario_id;
+        END""",
+    ],
+}
+
+
+# Un ejemplar por unidad física: los préstamos apuntan al ejemplar concreto y
+# cantidad_disponible queda como resumen de los ejemplares disponibles
+EJEMPLARES = {
+    "mysql": """CREATE TABLE IF NOT EXISTS ejemplares (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    libro_id INT NOT NULL,
+                    codigo_barras VARCHAR(32) NOT NULL UNIQUE,
+                    sucursal VARCHAR(50) NOT NULL DEFAULT 'central',
+                    estado VARCHAR(20) NOT NULL DEFAULT 'disponible',
+                    FOREIGN KEY (libro_id) REFERENCES libros(id)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    "sqlite": """CREATE TABLE IF NOT EXISTS ejemplares (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    libro_id INTEGER NOT NULL REFERENCES libros(id),
+                    codigo_barras TEXT NOT NULL UNIQUE,
+                    sucursal TEXT NOT NULL DEFAULT 'central',
+                    estado TEXT NOT NULL DEFAULT 'disponible'
+                )""",
+}
+
+INDICES_EJEMPLARES = (
+    ("idx_ejemplares_libro", "ejemplares", ("libro_id", "estado")),
+    ("idx_prestamos_ejemplar", "prestamos", ("ejemplar_id", "estado")),
+)
+
+BLOQUE_EJEMPLARES = 10000
+
+
+def _crear_ejemplares(backend, connection):
+    """Dar de alta los ejemplares del stock actual y asignar uno a cada préstamo activo.
+
+    Cada libro recibe cantidad_disponible ejemplares disponibles más uno prestado
+    por préstamo activo, de modo que el resumen sigue cuadrando.
+    """
+    activos = {}
+    for prestamo_id, libro_id in _ejecutar(backend, connection,
+                                           "SELECT id, libro_id FROM prestamos WHERE estado = 'activo' ORDER BY id"):
+        activos.setdefault(libro_id, []).append(prestamo_id)
+    ejemplares = []
+    asignaciones = []
+    for libro_id, disponibles in _ejecutar(backend, connection, "SELECT id, cantidad_disponible FROM libros ORDER BY id"):
+        prestados = activos.get(libro_id, [])
+        for numero in range(1, max(disponibles, 0) + len(prestados) + 1):
+            codigo = codigo_barras(libro_id, numero)
+            prestado = numero <= len(prestados)
+            ejemplares.append((libro_id, codigo, SUCURSAL_PRINCIPAL, "prestado" if prestado else "disponible"))
+            if prestado:
+                asignaciones.append((codigo, prestados[numero - 1]))
+    _ejecutar_lote(backend, connection,
+                   "INSERT INTO ejemplares (libro_id, codigo_barras, sucursal, estado) VALUES (%s, %s, %s, %s)",
+                   ejemplares)
+    _ejecutar_lote(backend, connection,
+                   "UPDATE prestamos SET ejemplar_id = (SELECT id FROM ejemplares WHERE codigo_barras = %s) WHERE id = %s",
+                   asignaciones)
+
+
+# Cola de reservas por libro. estado: esperando -> asignada (ejemplar apartado
+# hasta fecha_limite) -> recogida, o cancelada / caducada
+RESERVAS = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS reservas (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            libro_id INT NOT NULL,
+            usuario_id INT NOT NULL,
+            fecha_reserva DATETIME NOT NULL,
+            estado VARCHAR(20) NOT NULL DEFAULT 'esperando',
+            ejemplar_id INT NULL,
+            fecha_asignacion DATE NULL,
+            fecha_limite DATE NULL,
+            FOREIGN KEY (libro_id) REFERENCES libros(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY (ejemplar_id) REFERENCES ejemplares(id),
+            INDEX idx_reservas_cola (libro_id, estado, id),
+            INDEX idx_reservas_usuario (usuario_id, estado, libro_id),
+            INDEX idx_reservas_limite (estado, fecha_limite)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS reservas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            libro_id INTEGER NOT NULL REFERENCES libros(id),
+            usuario_id INTEGER NOT NULL REFERENCES usuarios(id),
+            fecha_reserva DATETIME NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'esperando',
+            ejemplar_id INTEGER REFERENCES ejemplares(id),
+            fecha_asignacion DATE,
+            fecha_limite DATE
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_reservas_cola ON reservas (libro_id, estado, id)",
+        "CREATE INDEX IF NOT EXISTS idx_reservas_usuario ON reservas (usuario_id, estado, libro_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reservas_limite ON reservas (estado, fecha_limite)",
+    ],
+}
+
+
+# Bandeja de salida de eventos: se escribe en la misma transacción que el
+# cambio y un relé la entrega por orden de id. consumidores_eventos guarda el
+# último id entregado por cada consumidor. AUTOINCREMENT en SQLite evita que
+# se reutilicen ids tras una purga
+EVENTOS = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS eventos (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            tipo VARCHAR(50) NOT NULL,
+            entidad_id INT NOT NULL,
+            datos TEXT NOT NULL,
+            creado DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS consumidores_eventos (
+            consumidor VARCHAR(100) PRIMARY KEY,
+            ultimo_id BIGINT NOT NULL,
+            actualizado DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            entidad_id INTEGER NOT NULL,
+            datos TEXT NOT NULL,
+            creado DATETIME NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS consumidores_eventos (
+            consumidor TEXT PRIMARY KEY,
+            ultimo_id INTEGER NOT NULL,
+            actualizado DATETIME NOT NULL
+        )""",
+    ],
+}
+
+
+# Latido de replicación: el servicio lo actualiza en el primario y lo lee en
+# cada réplica para saber con cuánto retraso aplica los cambios
+LATIDO = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS latido (
+            id INT PRIMARY KEY,
+            marca DATETIME(6) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        "INSERT INTO latido (id, marca) VALUES (1, '2000-01-01 00:00:00')",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS latido (
+            id INTEGER PRIMARY KEY,
+            marca DATETIME NOT NULL
+        )""",
+        "INSERT INTO latido (id, marca) VALUES (1, '2000-01-01 00:00:00')",
+    ],
+}
+
+
+# Tokens de acceso para scripts: solo se guarda su SHA-256; revocar es borrar la fila
+TOKENS_API = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS tokens_api (
+            token_hash CHAR(64) PRIMARY KEY,
+            tipo VARCHAR(20) NOT NULL,
+            cuenta_id INT NOT NULL,
+            descripcion VARCHAR(100) NOT NULL,
+            creado DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS tokens_api (
+            token_hash TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            cuenta_id INTEGER NOT NULL,
+            descripcion TEXT NOT NULL,
+            creado DATETIME NOT NULL
+        )""",
+    ],
+}
+
+
+# Operaciones de diarios de mostrador ya aplicadas: repetir una sincronización
+# interrumpida no presta ni devuelve dos veces
+DIARIO_APLICADO = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS diario_aplicado (
+            uuid CHAR(32) PRIMARY KEY,
+            aplicada DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS diario_aplicado (
+            uuid TEXT PRIMARY KEY,
+            aplicada DATETIME NOT NULL
+        )""",
+    ],
+}
+
+
+# Vecinos más parecidos de cada libro según quién los tomó prestados, ya
+# ordenados (posicion 1 es el mejor). Los reescribe recomendaciones.py; no
+# hay claves foráneas porque la tabla es un índice derivado de prestamos
+RECOMENDACIONES = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS recomendaciones (
+            libro_id INT NOT NULL,
+            posicion SMALLINT NOT NULL,
+            vecino_id INT NOT NULL,
+            puntuacion FLOAT NOT NULL,
+            PRIMARY KEY (libro_id, posicion)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS recomendaciones (
+            libro_id INTEGER NOT NULL,
+            posicion INTEGER NOT NULL,
+            vecino_id INTEGER NOT NULL,
+            puntuacion REAL NOT NULL,
+            PRIMARY KEY (libro_id, posicion)
+        ) WITHOUT ROWID""",
+    ],
+}
+
+
+# Préstamos devueltos hace tiempo: archivo.py los mueve aquí por lotes para
+# que prestamos solo crezca con la circulación reciente. Conservan su id; sin
+# claves foráneas, porque solo se escriben copiando filas ya comprobadas
+ARCHIVO_PRESTAMOS = {
+    "mysql": [
+        """CREATE TABLE IF NOT EXISTS prestamos_archivo (
+            id INT PRIMARY KEY,
+            libro_id INT NOT NULL,
+            ejemplar_id INT NULL,
+            usuario_id INT NOT NULL,
+            fecha_prestamo DATE NOT NULL,
+            fecha_vencimiento DATE NULL,
+            fecha_devolucion DATE NULL,
+            estado VARCHAR(20) NOT NULL,
+            dias_retraso INT NOT NULL DEFAULT 0,
+            multa_centimos INT NOT NULL DEFAULT 0,
+            multa_calculada DATE NULL,
+            archivado DATETIME NOT NULL,
+            INDEX idx_archivo_usuario (usuario_id, fecha_prestamo),
+            INDEX idx_archivo_libro (libro_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 ROW_FORMAT=COMPRESSED""",
+    ],
+    "sqlite": [
+        """CREATE TABLE IF NOT EXISTS prestamos_archivo (
+            id INTEGER PRIMARY KEY,
+            libro_id INTEGER NOT NULL,
+            ejemplar_id INTEGER,
+            usuario_id INTEGER NOT NULL,
+            fecha_prestamo DATE NOT NULL,
+            fecha_vencimiento DATE,
+            fecha_devolucion DATE,
+            estado TEXT NOT NULL,
+            dias_retraso INTEGER NOT NULL DEFAULT 0,
+            multa_centimos INTEGER NOT NULL DEFAULT 0,
+            multa_calculada DATE,
+            archivado DATETIME NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_archivo_usuario ON prestamos_archivo (usuario_id, fecha_prestamo)",
+        "CREATE INDEX IF NOT EXISTS idx_archivo_libro ON prestamos_archivo (libro_id)",
+    ],
+}
+
+
+# (versión, descripción, {motor: pasos}); un paso es una sentencia SQL o una
+# función (backend, connection). Nunca se modifica una migración ya publicada:
+# los cambios se añaden como una versión nueva al final
+MIGRACIONES = (
+    (1, "Tablas base", TABLAS_BASE),
+    (2, "Índices de las consultas frecuentes", {
+        "mysql": [crear_indices(*INDICES)],
+        "sqlite": [crear_indices(*INDICES)],
+    }),
+    (3, "Índice de texto completo del catálogo", {
+        "mysql": [_texto_completo_mysql],
+        "sqlite": TEXTO_COMPLETO_SQLITE,
+    }),
+    # Los hashes con sal y parámetros no caben en un CHAR(64) de SHA-256
+    (4, "Columnas de contraseña para hashes con sal", {
+        "mysql": [
+            "ALTER TABLE administradores MODIFY password VARCHAR(255) NOT NULL",
+            "ALTER TABLE usuarios MODIFY password VARCHAR(255) NOT NULL",
+        ],
+        "sqlite": [],
+    }),
+    # Los préstamos anteriores vencían a los 15 días de la fecha de préstamo
+    (5, "Fecha de vencimiento, multas y puntos de control", {
+        "mysql": [
+            """ALTER TABLE prestamos
+                ADD COLUMN fecha_vencimiento DATE NULL,
+                ADD COLUMN dias_retraso INT NOT NULL DEFAULT 0,
+                ADD COLUMN multa_centimos INT NOT NULL DEFAULT 0,
+                ADD COLUMN multa_calculada DATE NULL""",
+            "UPDATE prestamos SET fecha_vencimiento = DATE_ADD(fecha_prestamo, INTERVAL 15 DAY)",
+            "ALTER TABLE prestamos MODIFY fecha_vencimiento DATE NOT NULL",
+            PUNTOS_CONTROL["mysql"],
+            crear_indices(INDICE_VENCIMIENTO),
+        ],
+        "sqlite": [
+            "ALTER TABLE prestamos ADD COLUMN fecha_vencimiento DATE",
+            "ALTER TABLE prestamos ADD COLUMN dias_retraso INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE prestamos ADD COLUMN multa_centimos INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE prestamos ADD COLUMN multa_calculada DATE",
+            "UPDATE prestamos SET fecha_vencimiento = date(fecha_prestamo, '+15 days')",
+            PUNTOS_CONTROL["sqlite"],
+            crear_indices(INDICE_VENCIMIENTO),
+        ],
+    }),
+    (6, "Estadísticas de circulación materializadas", ESTADISTICAS),
+    (7, "Ejemplares con código de barras", {
+        "mysql": [
+            EJEMPLARES["mysql"],
+            "ALTER TABLE prestamos ADD COLUMN ejemplar_id INT NULL",
+            crear_indices(*INDICES_EJEMPLARES),
+            "ALTER TABLE prestamos ADD FOREIGN KEY (ejemplar_id) REFERENCES ejemplares(id)",
+            _crear_ejemplares,
+        ],
+        "sqlite": [
+            EJEMPLARES["sqlite"],
+            "ALTER TABLE prestamos ADD COLUMN ejemplar_id INTEGER REFERENCES ejemplares(id)",
+            crear_indices(*INDICES_EJEMPLARES),
+            _crear_ejemplares,
+        ],
+    }),
+    (8, "Cola de reservas", RESERVAS),
+    (9, "Bandeja de salida de eventos", EVENTOS),
+    (10, "Latido de replicación", LATIDO),
+    (11, "Tokens de acceso para scripts", TOKENS_API),
+    (12, "Operaciones aplicadas de diarios sin conexión", DIARIO_APLICADO),
+    (13, "Vecinos precalculados para recomendaciones", RECOMENDACIONES),
+    (14, "Archivo de préstamos devueltos", ARCHIVO_PRESTAMOS),
+)
+
+
+def _ejecutar(backend, connection, query, params=()):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(backend.adaptar_sql(query), params)
+        return cursor.fetchall() if cursor.description else None
+    finally:
+        cursor.close()
+
+
+def _ejecutar_lote(backend, connection, query, filas, tamaño=BLOQUE_EJEMPLARES):
+    """executemany en bloques para no enviar paquetes enormes al servidor"""
+    cursor = connection.cursor()
+    try:
+        for inicio in range(0, len(filas), tamaño):
+            cursor.executemany(backend.adaptar_sql(query), filas[inicio:inicio + tamaño])
+    finally:
+        cursor.close()
+
+
+def version_actual(backend, connection):
+    """Última versión aplicada del esquema (0 en una base vacía)"""
+    try:
+        _ejecutar(backend, connection, TABLA_VERSION[backend.nombre])
+        return _ejecutar(backend, connection, "SELECT MAX(version) FROM version_esquema")[0][0] or 0
+    except backend.Error as e:
+        raise ErrorBD(str(e)) from e
+
+
+def migrar(backend, connection, hasta=None):
+    """Aplicar las migraciones pendientes y devolver [(versión, descripción)] aplicadas"""
+    aplicadas = []
+    actual = version_actual(backend, connection)
+    for version, descripcion, pasos in MIGRACIONES:
+        if version <= actual or (hasta is not None and version > hasta):
+            continue
+        try:
+            # En SQLite la transacción hace la migración atómica y la serializa
+            # entre procesos; en MySQL cada DDL confirma por su cuenta
+            backend.iniciar_transaccion(connection)
+            if version <= version_actual(backend, connection):
+                connection.rollback()
+                continue
+            for paso in pasos[backend.nombre]:
+                if callable(paso):
+                    paso(backend, connection)
+                else:
+                    _ejecutar(backend, connection, paso)
+            _ejecutar(backend, connection,
+                      "INSERT INTO version_esquema (version, descripcion, aplicada) VALUES (%s, %s, %s)",
+                      (version, descripcion, datetime.now().replace(microsecond=0)))
+            connection.commit()
+        except backend.Error as e:
+            try:
+                connection.rollback()
+            except backend.Error:
+                pass
+            raise ErrorBD(f"Migración {version} ({descripcion}): {e}") from e
+        aplicadas.append((version, descripcion))
+    return aplicadas
+
+
+# === PLANES DE EJECUCIÓN ===
+
+# Consultas que leen la tabla entera a propósito (listados completos y recuentos)
+RECORRIDOS_ESPERADOS = {f"listar_{nombre}" for nombre in LISTADOS} | {
+    "contar_administradores",
+    "informe_categorias",
+    "informe_resumen",
+    "posicion_minima_consumidores",
+    "vaciar_estadisticas_libros",
+    "vaciar_estadisticas_usuarios",
+}
+
+# Parámetros representativos para pedir el plan de cada consulta con nombre
+PARAMETROS_EJEMPLO = {
+    "admin_por_username": ("admin",),
+    "usuario_por_email": ("ana@correo.com",),
+    "existe_admin": ("admin",),
+    "existe_usuario": ("ana@correo.com",),
+    "contar_administradores": (),
+    "credenciales": ("ana@correo.com", "ana@correo.com"),
+    "actualizar_password_administrador": ("x", 1, "y"),
+    "actualizar_password_usuario": ("x", 1, "y"),
+    "titulo_libro": (1,),
+    "libro_por_id": (1,),
+    "cantidad_libro": (1,),
+    "isbns_existentes": ("9788437604947",),
+    "descontar_ejemplar": (1,),
+    "descontar_ejemplar_returning": (1,),
+    "prestamo_activo_usuario": (1, 1),
+    "marcar_devuelto": (date(2024, 1, 1), 1),
+    "devolver_prestamo_returning": (date(2024, 1, 1), 1, 1),
+    "prestamos_activos_usuario": (1,),
+    "buscar_libros": {"expresion": None, "limite": 20, "desplazamiento": 0},
+    "existe_usuario_id": (1,),
+    "bloquear_usuario": (1,),
+    "prestamos_activos_por_prestamo": (1,),
+    "prestamos_activos_por_libro": (1,),
+    "marcar_devueltos": (date(2024, 1, 1), 1),
+    "reponer_ejemplares": (2, 1),
+    "libros_para_prestar": (1,),
+    "ejemplares_por_codigos": ("EJ1-1",),
+    "usuarios_existentes": (1,),
+    "diario_aplicado": ("0" * 32,),
+    "descontar_ejemplares": (2, 1, 2),
+    "prestamos_activos_por_codigo": ("EJ1-1",),
+    "ejemplar_libre": (1,),
+    "ocupar_ejemplar": (1,),
+    "ocupar_ejemplar_returning": (1,),
+    "liberar_ejemplares": (1,),
+    "ejemplares_para_prestar": (1,),
+    "ocupar_ejemplares": (1,),
+    "ejemplar_por_codigo": ("EJ1-1",),
+    "ejemplares_libro": (1,),
+    "reserva_activa_usuario": (1, 1),
+    "posicion_reserva": (1, 10),
+    "reservas_usuario": (1,),
+    "reservas_en_espera": (1,),
+    "asignar_reserva": (1, date(2024, 1, 1), date(2024, 1, 4), 1),
+    "reservar_ejemplares": (1,),
+    "reserva_asignada_usuario": (1, 1),
+    "reservas_asignadas_lote": (1, 1),
+    "recoger_reservas": (1,),
+    "recoger_ejemplares": (1,),
+    "reserva_usuario": (1, 1),
+    "reservas_caducadas": (date(2024, 1, 1), 1000),
+    "terminar_reservas": ("caducada", 1),
+    "prestamos_para_multa": (0, date(2024, 1, 1), date(2024, 1, 1), 10000),
+    "actualizar_multas": (3, 75, date(2024, 1, 1), 1),
+    "punto_control": ("multas",),
+    "borrar_punto_control": ("multas",),
+    "avanzar_punto_control": (1, 10000, datetime(2024, 1, 1), "multas"),
+    "completar_punto_control": (datetime(2024, 1, 1), "multas"),
+    "prestamos_lectores": (0, 10000),
+    "libros_prestados_usuario": (1,),
+    "libros_de_lectores": (1, 1),
+    "lectores_de_libros": (1, 1),
+    "numero_lectores": (1, 1),
+    "borrar_recomendaciones_libros": (1,),
+    "borrar_recomendaciones_tramo": (0, 1000),
+    "recomendaciones_libros": (1, 1),
+    "recomendaciones_usuario": (1, 10),
+    "archivo_lectores": (0, 10000),
+    "prestamos_para_archivar": (0, date(2024, 1, 1), 1000),
+    "borrar_prestamos_archivados": (1,),
+    "historial_usuario": (1, 1, 50),
+    "historial_usuario_siguiente": (1, date(2024, 1, 1), date(2024, 1, 1), 1, 1, date(2024, 1, 1), date(2024, 1, 1), 1, 50),
+    "eventos_desde": (0, 500),
+    "posicion_consumidor": ("archivo",),
+    "borrar_posicion_consumidor": ("archivo",),
+    "posicion_minima_consumidores": (),
+    "purgar_eventos": (1000, datetime(2024, 1, 1)),
+    "latido": (),
+    "marcar_latido": (datetime(2024, 1, 1),),
+    "disponibilidad_libros": (1,),
+    "fijar_disponible": (3, 1),
+    "usuario_por_id": (1,),
+    "token_api": ("0" * 64, "0" * 64),
+    "borrar_token_api": ("0" * 64,),
+    "informe_mas_prestados": (20,),
+    "informe_usuarios": (20,),
+    "informe_categorias": (),
+    "informe_resumen": (),
+    "vaciar_estadisticas_libros": (),
+    "vaciar_estadisticas_usuarios": (),
+}
+
+# Valor de ejemplo de las columnas que ordenan los listados paginados
+VALORES_ORDEN = {"titulo": "M", "nombre": "M", "p.fecha_prestamo": date(2024, 1, 1),
+                 "p.fecha_vencimiento": date(2024, 1, 1)}
+
+for _nombre, _listado in LISTADOS.items():
+    _columna = _listado["orden"][0][0]
+    PARAMETROS_EJEMPLO[f"listar_{_nombre}"] = ()
+    PARAMETROS_EJEMPLO[f"pagina_{_nombre}"] = (20,)
+    PARAMETROS_EJEMPLO[f"pagina_{_nombre}_siguiente"] = (VALORES_ORDEN[_columna], VALORES_ORDEN[_columna], 1, 20)
+
+
+def verificar_planes(backend, connection):
+    """Pedir el plan de cada consulta de lectura o actualización del catálogo.
+
+    Devuelve una lista de dicts con la consulta, si recorre una tabla entera,
+    si ese recorrido es esperado y el detalle del plan. Recorrer un índice en
+    orden solo cuenta como recorrido completo si la consulta no tiene LIMIT.
+    """
+    informe = []
+    for nombre, query in sorted(sql_adaptado(backend).items()):
+        if query.lstrip().upper().startswith("INSERT"):
+            continue
+        if nombre not in PARAMETROS_EJEMPLO:
+            informe.append({"consulta": nombre, "recorrido": None, "esperado": False,
+                            "detalle": "sin parámetros de ejemplo en PARAMETROS_EJEMPLO"})
+            continue
+        params = PARAMETROS_EJEMPLO[nombre]
+        if isinstance(params, dict) and "expresion" in params:
+            params = dict(params, expresion=backend.expresion_busqueda(["biblioteca"]))
+        if "{marcadores}" in query:
+            query = query.format(marcadores=backend.adaptar_sql("%s"))
+        try:
+            plan = backend.explicar(connection, query, params)
+        except backend.Error as e:
+            raise ErrorBD(f"{nombre}: {e}") from e
+        con_limite = "LIMIT" in query.upper()
+        informe.append({
+            "consulta": nombre,
+            "recorrido": any(acceso == "completo" or (acceso == "indice" and not con_limite)
+                             for _, acceso, _ in plan),
+            "esperado": nombre in RECORRIDOS_ESPERADOS,
+            "detalle": " | ".join(detalle for _, _, detalle in plan),
+        })
+    return informe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    parser.add_argument("--hasta", type=int, help="Aplicar solo hasta esta versión")
+    parser.add_argument("--explicar", action="store_true", help="Comprobar con EXPLAIN que las consultas usan índices")
+    args = parser.parse_args()
+
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+    try:
+        for version, descripcion in migrar(backend, connection, args.hasta):
+            print(f"✓ Migración {version} aplicada: {descripcion}")
+        print(f"✓ Esquema en la versión {version_actual(backend, connection)} ({backend.descripcion()})")
+        if not args.explicar:
+            return
+        fallos = 0
+        for fila in verificar_planes(backend, connection):
+            if fila["recorrido"] is None or (fila["recorrido"] and not fila["esperado"]):
+                fallos += 1
+                marca = "✗"
+            else:
+                marca = "✓"
+            print(f"{marca} {fila['consulta']:<36} {fila['detalle']}")
+        if fallos:
+            print(f"✗ {fallos} consultas recorren tablas completas")
+            raise SystemExit(1)
+        print("✓ Todas las consultas usan índices")
+    except ErrorBD as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+
+
+if __name__ == "__main__":
+    main()
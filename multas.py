@@ -0,0 +1,193 @@
+"""Detección de préstamos vencidos y cálculo de multas por lotes.
+
+Uso:
+    python multas.py                                  # corte: hoy
+    python multas.py --corte 2024-06-30 --bloque 50000
+    python multas.py --reglas reglas.json
+
+Pensado para ejecutarse cada noche. Recorre prestamos por clave primaria en
+bloques, calcula la multa de cada préstamo vencido según su categoría y la
+guarda con una actualización por grupo de resultados iguales. Cada bloque se
+confirma junto con el punto de control: si el trabajo se interrumpe, la
+siguiente ejecución con el mismo corte continúa donde se quedó.
+
+Las reglas se leen de un JSON con importes en céntimos:
+    {"por_defecto": {"gracia": 0, "por_dia": 25, "maximo": 1500},
+     "categorias": {"Infantil": {"por_dia": 10}}}
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+
+TRABAJO = "multas"
+TAMAÑO_BLOQUE = 10000
+
+# gracia: días de retraso sin multa; por_dia y maximo en céntimos
+REGLAS_POR_DEFECTO = {
+    "por_defecto": {"gracia": 0, "por_dia": 25, "maximo": 1500},
+    "categorias": {},
+}
+
+
+class ReglasMultas:
+    """Tarifa de multa por categoría de libro, con una tarifa por defecto"""
+
+    def __init__(self, reglas=None):
+        reglas = reglas or REGLAS_POR_DEFECTO
+        base = dict(REGLAS_POR_DEFECTO["por_defecto"], **reglas.get("por_defecto", {}))
+        self.por_defecto = self._tarifa(base)
+        self.categorias = {(categoria or "").casefold(): self._tarifa(dict(base, **tarifa))
+                           for categoria, tarifa in reglas.get("categorias", {}).items()}
+
+    @staticmethod
+    def _tarifa(tarifa):
+        try:
+            valores = (int(tarifa["gracia"]), int(tarifa["por_dia"]), int(tarifa["maximo"]))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Regla de multa inválida: {tarifa}") from e
+        if min(valores) < 0:
+            raise ValueError(f"Regla de multa inválida: {tarifa}")
+        return valores
+
+    @classmethod
+    def desde_archivo(cls, ruta):
+        with open(ruta, encoding="utf-8") as archivo:
+            try:
+                return cls(json.load(archivo))
+            except ValueError as e:
+                raise ValueError(f"{ruta}: {e}") from e
+
+    def calcular(self, filas, corte):
+        """Agrupar un bloque de (id, vencimiento, devolucion, categoria) por resultado.
+
+        Devuelve {(dias_retraso, multa_centimos, calculada): [ids]}. calculada es
+        la fecha hasta la que se contó el retraso: la devolución o el corte.
+        """
+        grupos = defaultdict(list)
+        tarifas = {}
+        for prestamo_id, vencimiento, devolucion, categoria in filas:
+            tarifa = tarifas.get(categoria)
+            if tarifa is None:
+                tarifa = tarifas[categoria] = self.categorias.get((categoria or "").casefold(), self.por_defecto)
+            gracia, por_dia, maximo = tarifa
+            fin = devolucion or corte
+            dias = max(0, (fin - vencimiento).days)
+            multa = min(maximo, por_dia * (dias - gracia)) if dias > gracia else 0
+            grupos[(dias, multa, fin)].append(prestamo_id)
+        return grupos
+
+
+def reglas_desde_entorno():
+    """Reglas del archivo BIBLIOTECA_MULTAS_REGLAS o las reglas por defecto"""
+    ruta = os.environ.get("BIBLIOTECA_MULTAS_REGLAS")
+    return ReglasMultas.desde_archivo(ruta) if ruta else ReglasMultas()
+
+
+class MotorMultas:
+    """Recorre los préstamos vencidos por bloques y guarda sus multas"""
+
+    def __init__(self, repo, reglas=None, tamaño_bloque=TAMAÑO_BLOQUE, progreso=None):
+        self.repo = repo
+        self.reglas = reglas or ReglasMultas()
+        self.tamaño_bloque = tamaño_bloque
+        self.progreso = progreso
+
+    def ejecutar(self, corte=None, reiniciar=False):
+        """Calcular las multas hasta la fecha de corte y devolver un resumen"""
+        corte = corte or datetime.now().date()
+        inicio = time.perf_counter()
+        punto = None if reiniciar else self.repo.punto_control(TRABAJO)
+        resumen = {"corte": corte, "reanudado": False, "bloques": 0, "procesados": 0, "con_multa": 0,
+                   "multa_total_centimos": 0}
+        if punto is not None and _fecha(punto[0]) == corte and not punto[3]:
+            # Ejecución interrumpida con el mismo corte: se sigue tras el último bloque confirmado
+            ultimo_id = punto[1]
+            resumen["reanudado"] = True
+        else:
+            ultimo_id = 0
+            self.repo.iniciar_punto_control(TRABAJO, corte, _ahora())
+        while True:
+            filas = self.repo.prestamos_para_multa(ultimo_id, corte, self.tamaño_bloque)
+            if not filas:
+                break
+            grupos = self.reglas.calcular(filas, corte)
+            ultimo_id = filas[-1][0]
+            self.repo.aplicar_multas(grupos, TRABAJO, ultimo_id, len(filas), _ahora())
+            resumen["bloques"] += 1
+            resumen["procesados"] += len(filas)
+            for (_, multa, _), ids in grupos.items():
+                if multa:
+                    resumen["con_multa"] += len(ids)
+                    resumen["multa_total_centimos"] += multa * len(ids)
+            if self.progreso:
+                self.progreso(resumen)
+        self.repo.completar_punto_control(TRABAJO, _ahora())
+        duracion = time.perf_counter() - inicio
+        resumen["segundos"] = round(duracion, 3)
+        resumen["prestamos_por_segundo"] = round(resumen["procesados"] / duracion, 1) if duracion else None
+        return resumen
+
+
+def _ahora():
+    return datetime.now().replace(microsecond=0)
+
+
+def _fecha(valor):
+    return date.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
+def procesar_vencidos(repo, corte=None, reglas=None, tamaño_bloque=TAMAÑO_BLOQUE, reiniciar=False, progreso=None):
+    """Calcular las multas con el repositorio dado"""
+    motor = MotorMultas(repo, reglas or reglas_desde_entorno(), tamaño_bloque, progreso)
+    return motor.ejecutar(corte, reiniciar)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corte", type=date.fromisoformat, help="Fecha de corte AAAA-MM-DD (por defecto, hoy)")
+    parser.add_argument("--bloque", type=int, default=TAMAÑO_BLOQUE, help="Préstamos por bloque y por commit")
+    parser.add_argument("--reglas", help="Archivo JSON con las tarifas por categoría")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignorar el punto de control y empezar de cero")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+    if args.bloque < 1:
+        parser.error("--bloque debe ser positivo")
+
+    try:
+        reglas = ReglasMultas.desde_archivo(args.reglas) if args.reglas else reglas_desde_entorno()
+    except (ValueError, OSError) as e:
+        print(f"✗ Error en las reglas de multas: {e}")
+        raise SystemExit(1)
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+
+    def progreso(resumen):
+        print(f"  bloque {resumen['bloques']}: {resumen['procesados']} préstamos, {resumen['con_multa']} con multa")
+
+    try:
+        resumen = procesar_vencidos(RepositorioBiblioteca(backend, connection), args.corte, reglas, args.bloque,
+                                    args.reiniciar, progreso)
+    except ErrorBD as e:
+        print(f"✗ Error al calcular multas: {e}")
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+    if resumen["reanudado"]:
+        print("✓ Reanudado desde el último punto de control")
+    print(f"✓ Multas calculadas al {resumen['corte']}: {resumen['procesados']} préstamos en {resumen['segundos']} s "
+          f"({resumen['prestamos_por_segundo']} préstamos/s)")
+    print(json.dumps(resumen, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import date, datetime
+
+
+def _a_json(valor):
+    if isinstance(valor, datetime):
+        return {"fechahora": valor.isoformat()}
+    if isinstance(valor, date):
+        return {"fecha": valor.isoformat()}
+    raise TypeError(f"Tipo no serializable en cursor: {type(valor).__name__}")
+
+
+def _desde_json(objeto):
+    if "fechahora" in objeto:
+        return datetime.fromisoformat(objeto["fechahora"])
+    if "fecha" in objeto:
+        return date.fromisoformat(objeto["fecha"])
+    return objeto
+
+
+def codificar_cursor(clave):
+    """Convertir la clave de la última fila en un token opaco para la página siguiente"""
+    if clave is None:
+        return None
+    texto = json.dumps(list(clave), default=_a_json, separators=(",", ":"))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token, longitud=2):
+    """Recuperar la clave de un token; lanza ValueError si no es válido"""
+    if not token:
+        return None
+    try:
+        texto = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        clave = json.loads(texto, object_hook=_desde_json)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Cursor de paginación inválido") from e
+    if not isinstance(clave, list) or len(clave) != longitud:
+        raise ValueError("Cursor de paginación inválido")
+    return tuple(clave)
@@ -0,0 +1,354 @@
+"""Índice de recomendaciones: "quienes se llevaron este libro también se llevaron...".
+
+Uso:
+    python recomendaciones.py                     # incorpora los préstamos nuevos
+    python recomendaciones.py --completo          # recalcula todos los libros
+    python recomendaciones.py --vecinos 20 --minimo 2 --bloque 2000 --motor scipy
+
+Trabajo fuera de línea. Dos libros se parecen cuando los han tomado prestados
+los mismos lectores: la puntuación es la similitud del coseno entre sus
+conjuntos de lectores (lectores comunes / raíz del producto de sus lectores).
+Para cada libro se guardan sus mejores vecinos, ya ordenados, en la tabla
+recomendaciones (migración 13); consultarlos es una búsqueda por clave.
+
+La matriz de coocurrencia no se construye entera: se calcula por bloques de
+libros, y cada bloque se escribe en su propia transacción. Con numpy y scipy
+instalados el cálculo es vectorial sobre matrices dispersas; sin ellos se hace
+en Python puro, con el mismo resultado.
+
+Sin --completo solo se recalculan los libros afectados por los préstamos
+posteriores a la última ejecución (punto de control "recomendaciones"): los
+de los lectores con préstamos nuevos. La puntuación de otros libros con esos
+mismos vecinos se actualiza en la siguiente reconstrucción completa, que
+también recoge los préstamos confirmados tarde con un id ya procesado y los
+préstamos archivados (archivo.py).
+"""
+import argparse
+import heapq
+import json
+import math
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+
+TRABAJO = "recomendaciones"
+VECINOS = 20
+# Lectores en común que hacen falta para considerar vecinos dos libros
+MINIMO_LECTORES = 2
+# Libros por bloque de cálculo y por transacción de escritura
+TAMAÑO_BLOQUE = 2000
+# Préstamos por lectura al recorrer el histórico
+BLOQUE_LECTURA = 50000
+# Mayor id posible: cierra el último tramo al reconstruir
+ID_MAXIMO = 2 ** 31 - 1
+
+
+# === MOTORES DE CÁLCULO ===
+
+class MotorPython:
+    """Coocurrencias con diccionarios y conjuntos: sin dependencias"""
+
+    nombre = "python"
+
+    def __init__(self):
+        self._libros_por_lector = defaultdict(set)
+        self._lectores_por_libro = None
+
+    def añadir(self, pares):
+        for usuario_id, libro_id in pares:
+            self._libros_por_lector[usuario_id].add(libro_id)
+        self._lectores_por_libro = None
+
+    def _lectores(self):
+        if self._lectores_por_libro is None:
+            self._lectores_por_libro = defaultdict(list)
+            for usuario_id, libros in self._libros_por_lector.items():
+                for libro_id in libros:
+                    self._lectores_por_libro[libro_id].append(usuario_id)
+        return self._lectores_por_libro
+
+    def numero_lectores(self):
+        return {libro_id: len(lectores) for libro_id, lectores in self._lectores().items()}
+
+    def vecinos(self, objetivos, numero, vecinos, minimo, tamaño_bloque):
+        """Devolver (libro_id, [(vecino_id, puntuacion)]) de cada objetivo, mejores primero"""
+        lectores_por_libro = self._lectores()
+        for libro_id in objetivos:
+            conteo = Counter()
+            for usuario_id in lectores_por_libro.get(libro_id, ()):
+                conteo.update(self._libros_por_lector[usuario_id])
+            conteo.pop(libro_id, None)
+            propios = numero.get(libro_id) or 1
+            mejores = heapq.nsmallest(vecinos, ((-comunes / math.sqrt(propios * (numero.get(vecino_id) or comunes)),
+                                                 vecino_id)
+                                                for vecino_id, comunes in conteo.items() if comunes >= minimo))
+            yield libro_id, [(vecino_id, round(-puntuacion, 6)) for puntuacion, vecino_id in mejores]
+
+
+class MotorScipy:
+    """Coocurrencias como producto de matrices dispersas lector x libro"""
+
+    nombre = "scipy"
+
+    def __init__(self):
+        try:
+            import numpy
+            from scipy import sparse
+        except ImportError as e:
+            raise ValueError("El motor scipy necesita los paquetes numpy y scipy") from e
+        self._np = numpy
+        self._sparse = sparse
+        self._usuarios = []
+        self._libros = []
+        self._matriz = None
+
+    def añadir(self, pares):
+        if pares:
+            pares = self._np.asarray(pares, dtype=self._np.int64).reshape(-1, 2)
+            self._usuarios.append(pares[:, 0])
+            self._libros.append(pares[:, 1])
+            self._matriz = None
+
+    def _construir(self):
+        if self._matriz is None:
+            np = self._np
+            usuarios = np.concatenate(self._usuarios) if self._usuarios else np.empty(0, dtype=np.int64)
+            libros = np.concatenate(self._libros) if self._libros else np.empty(0, dtype=np.int64)
+            self._libro_ids, columnas = np.unique(libros, return_inverse=True)
+            usuario_ids, filas = np.unique(usuarios, return_inverse=True)
+            # Los préstamos repetidos del mismo libro se suman al convertir; luego cuentan como uno
+            lector_libro = self._sparse.csr_matrix(
+                (np.ones(len(filas), dtype=np.float32), (filas, columnas)),
+                shape=(len(usuario_ids), len(self._libro_ids)))
+            lector_libro.data[:] = 1
+            self._matriz = lector_libro
+            self._traspuesta = lector_libro.T.tocsr()
+        return self._matriz
+
+    def numero_lectores(self):
+        self._construir()
+        return dict(zip(self._libro_ids.tolist(), self._np.diff(self._traspuesta.indptr).tolist()))
+
+    def vecinos(self, objetivos, numero, vecinos, minimo, tamaño_bloque):
+        np = self._np
+        lector_libro = self._construir()
+        libro_ids = self._libro_ids
+        norma = 1 / np.sqrt(np.array([numero.get(libro_id) or 1 for libro_id in libro_ids.tolist()],
+                                     dtype=np.float64))
+        objetivos = list(objetivos)
+        posiciones = np.searchsorted(libro_ids, objetivos)
+        for inicio in range(0, len(objetivos), tamaño_bloque):
+            bloque = objetivos[inicio:inicio + tamaño_bloque]
+            indices = posiciones[inicio:inicio + tamaño_bloque]
+            conocidos = [i for i, (libro_id, indice) in enumerate(zip(bloque, indices))
+                         if indice < len(libro_ids) and libro_ids[indice] == libro_id]
+            # Filas del bloque de la matriz de coocurrencia libro x libro
+            conteos = (self._traspuesta[indices[conocidos]] @ lector_libro).tocsr() if conocidos else None
+            fila_de = {i: fila for fila, i in enumerate(conocidos)}
+            for i, libro_id in enumerate(bloque):
+                fila = fila_de.get(i)
+                if fila is None:
+                    yield libro_id, []
+                    continue
+                desde, hasta = conteos.indptr[fila], conteos.indptr[fila + 1]
+                columnas, comunes = conteos.indices[desde:hasta], conteos.data[desde:hasta]
+                validas = (columnas != indices[i]) & (comunes >= minimo)
+                columnas, comunes = columnas[validas], comunes[validas]
+                puntuaciones = comunes * norma[columnas] * norma[indices[i]]
+                if len(puntuaciones) > vecinos:
+                    mejores = np.argpartition(-puntuaciones, vecinos)[:vecinos]
+                    columnas, puntuaciones = columnas[mejores], puntuaciones[mejores]
+                orden = np.lexsort((libro_ids[columnas], -puntuaciones))
+                yield libro_id, [(int(libro_ids[c]), round(float(p), 6))
+                                 for c, p in zip(columnas[orden], puntuaciones[orden])]
+
+
+MOTORES = {"python": MotorPython, "scipy": MotorScipy}
+
+
+def crear_motor(nombre="auto"):
+    """Motor por nombre; "auto" usa scipy si está instalado y si no Python puro"""
+    if nombre == "auto":
+        try:
+            return MotorScipy()
+        except ValueError:
+            return MotorPython()
+    if nombre not in MOTORES:
+        raise ValueError(f"Motor desconocido: {nombre}")
+    return MOTORES[nombre]()
+
+
+# === TRABAJO ===
+
+class IndiceRecomendaciones:
+    """Calcula los vecinos de cada libro desde los préstamos y los guarda en destino.
+
+    fuentes son los repositorios con préstamos (uno por sucursal si la
+    circulación está repartida); destino es el del catálogo.
+    """
+
+    def __init__(self, destino, fuentes=None, vecinos=VECINOS, minimo=MINIMO_LECTORES,
+                 tamaño_bloque=TAMAÑO_BLOQUE, motor="auto", progreso=None):
+        if vecinos < 1 or minimo < 1 or tamaño_bloque < 1:
+            raise ValueError("Vecinos, mínimo de lectores y bloque deben ser positivos")
+        self.destino = destino
+        self.fuentes = fuentes or [destino]
+        self.vecinos = vecinos
+        self.minimo = minimo
+        self.tamaño_bloque = tamaño_bloque
+        self.motor = motor
+        self.progreso = progreso
+
+    def actualizar(self, completo=False):
+        """Incorporar los préstamos nuevos (o recalcular todo) y devolver un resumen"""
+        inicio = time.perf_counter()
+        puntos = [fuente.punto_control(TRABAJO) for fuente in self.fuentes]
+        completo = completo or any(punto is None or not punto[3] for punto in puntos)
+        motor = crear_motor(self.motor)
+        resumen = {"completo": completo, "motor": motor.nombre, "prestamos": 0, "libros": 0, "bloques": 0,
+                   "filas": 0}
+        if completo:
+            ultimos = self._reconstruir(motor, resumen)
+        else:
+            ultimos = self._incorporar(motor, [punto[1] for punto in puntos], resumen)
+        ahora = _ahora()
+        for fuente, ultimo_id in zip(self.fuentes, ultimos):
+            fuente.fijar_punto_control(TRABAJO, ahora.date(), ultimo_id, resumen["prestamos"], ahora)
+        resumen["segundos"] = round(time.perf_counter() - inicio, 3)
+        return resumen
+
+    def _recorrer(self, fuente, desde_id, resumen, archivo=False):
+        """Recorrer los préstamos posteriores a desde_id por bloques de (usuario_id, libro_id)"""
+        while True:
+            filas = fuente.prestamos_lectores(desde_id, BLOQUE_LECTURA, archivo)
+            if not filas:
+                return
+            desde_id = filas[-1][0]
+            resumen["prestamos"] += len(filas)
+            yield desde_id, [(usuario_id, libro_id) for _, usuario_id, libro_id in filas]
+
+    def _reconstruir(self, motor, resumen):
+        ultimos = []
+        for fuente in self.fuentes:
+            ultimo_id = 0
+            for ultimo_id, pares in self._recorrer(fuente, 0, resumen):
+                motor.añadir(pares)
+            ultimos.append(ultimo_id)
+            # Después de prestamos: un préstamo archivado entre los dos recorridos
+            # se lee dos veces (y cuenta una), nunca ninguna
+            for _, pares in self._recorrer(fuente, 0, resumen, archivo=True):
+                motor.añadir(pares)
+        numero = motor.numero_lectores()
+        # Por tramos de id: cada escritura borra también los libros del tramo que ya no tienen vecinos
+        anterior = 0
+        for bloque in self._bloques(motor.vecinos(sorted(numero), numero, self.vecinos, self.minimo,
+                                                  self.tamaño_bloque)):
+            ultimo = max(bloque)
+            self._escribir(bloque, resumen, (anterior, ultimo))
+            anterior = ultimo
+        self.destino.guardar_recomendaciones({}, (anterior, ID_MAXIMO))
+        return ultimos
+
+    def _incorporar(self, motor, desdes, resumen):
+        ultimos, lectores_nuevos = [], set()
+        for fuente, desde_id in zip(self.fuentes, desdes):
+            ultimo_id = desde_id
+            for ultimo_id, pares in self._recorrer(fuente, desde_id, resumen):
+                lectores_nuevos.update(usuario_id for usuario_id, _ in pares)
+            ultimos.append(ultimo_id)
+        if not lectores_nuevos:
+            return ultimos
+        # Libros afectados: los de los lectores con préstamos nuevos. Para
+        # recalcularlos hacen falta todos sus lectores y los libros de estos
+        afectados = {libro_id for fuente in self.fuentes
+                     for _, libro_id in fuente.libros_de_lectores(lectores_nuevos)}
+        lectores = {usuario_id for fuente in self.fuentes
+                    for usuario_id, _ in fuente.lectores_de_libros(afectados)}
+        candidatos = set()
+        for fuente in self.fuentes:
+            pares = fuente.libros_de_lectores(lectores)
+            candidatos.update(libro_id for _, libro_id in pares)
+            motor.añadir(pares)
+        # Un lector que tomó el mismo libro en dos sucursales cuenta en ambas
+        numero = Counter()
+        for fuente in self.fuentes:
+            numero.update(fuente.numero_lectores(candidatos))
+        for bloque in self._bloques(motor.vecinos(sorted(afectados), numero, self.vecinos, self.minimo,
+                                                  self.tamaño_bloque)):
+            self._escribir(bloque, resumen)
+        return ultimos
+
+    def _bloques(self, vecinos):
+        bloque = {}
+        for libro_id, lista in vecinos:
+            bloque[libro_id] = lista
+            if len(bloque) >= self.tamaño_bloque:
+                yield bloque
+                bloque = {}
+        if bloque:
+            yield bloque
+
+    def _escribir(self, bloque, resumen, tramo=None):
+        self.destino.guardar_recomendaciones(bloque, tramo)
+        resumen["bloques"] += 1
+        resumen["libros"] += len(bloque)
+        resumen["filas"] += sum(len(lista) for lista in bloque.values())
+        if self.progreso:
+            self.progreso(resumen)
+
+
+def _ahora():
+    return datetime.now().replace(microsecond=0)
+
+
+def actualizar_recomendaciones(destino, fuentes=None, completo=False, vecinos=VECINOS, minimo=MINIMO_LECTORES,
+                               tamaño_bloque=TAMAÑO_BLOQUE, motor="auto", progreso=None):
+    """Actualizar el índice de recomendaciones con los repositorios dados"""
+    indice = IndiceRecomendaciones(destino, fuentes, vecinos, minimo, tamaño_bloque, motor, progreso)
+    return indice.actualizar(completo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--completo", action="store_true", help="Recalcular todos los libros desde cero")
+    parser.add_argument("--vecinos", type=int, default=VECINOS, help="Vecinos guardados por libro")
+    parser.add_argument("--minimo", type=int, default=MINIMO_LECTORES, help="Lectores en común necesarios")
+    parser.add_argument("--bloque", type=int, default=TAMAÑO_BLOQUE, help="Libros por bloque y por commit")
+    parser.add_argument("--motor", choices=["auto", *MOTORES], default="auto")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+    if min(args.vecinos, args.minimo, args.bloque) < 1:
+        parser.error("--vecinos, --minimo y --bloque deben ser positivos")
+
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+
+    def progreso(resumen):
+        print(f"  bloque {resumen['bloques']}: {resumen['libros']} libros, {resumen['filas']} vecinos")
+
+    try:
+        resumen = actualizar_recomendaciones(RepositorioBiblioteca(backend, connection), None, args.completo,
+                                             args.vecinos, args.minimo, args.bloque, args.motor, progreso)
+    except ValueError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    except ErrorBD as e:
+        print(f"✗ Error al calcular recomendaciones: {e}")
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+    tipo = "reconstruido" if resumen["completo"] else "actualizado"
+    print(f"✓ Índice {tipo}: {resumen['libros']} libros a partir de {resumen['prestamos']} préstamos "
+          f"en {resumen['segundos']} s (motor {resumen['motor']})")
+    print(json.dumps(resumen, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
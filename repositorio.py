@@ -0,0 +1,1516 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from almacenamiento import ErrorBD
+from metricas import filas_resultado
+
+
+# Valores por lista IN (...) en las operaciones en lote; SQLite antiguo admite 999 parámetros
+TAMAÑO_BLOQUE_IN = 500
+# Mayor id posible: en un cursor entre nodos, "todas las filas con la misma clave"
+ID_SIN_LIMITE = 2 ** 63 - 1
+
+# Sucursal de los ejemplares dados de alta sin indicar otra
+SUCURSAL_PRINCIPAL = "central"
+
+
+def codigo_barras(libro_id, numero):
+    """Código del ejemplar número n de un libro (único; apto para Code 128)"""
+    return f"EJ{libro_id}-{numero}"
+
+# Consultas con nombre; se escriben con marcadores %s y cada backend las adapta
+CONSULTAS = {
+    "admin_por_username": "SELECT id, nombre, password FROM administradores WHERE username = %s",
+    "usuario_por_email": "SELECT id, nombre, password FROM usuarios WHERE email = %s",
+    # Login unificado: una sola ida y vuelta para administradores y usuarios
+    "credenciales": """SELECT 'administrador', id, nombre, password FROM administradores WHERE username = %s
+                      UNION ALL
+                      SELECT 'usuario', id, nombre, password FROM usuarios WHERE email = %s""",
+    # Solo sustituye el hash si nadie lo cambió desde que se leyó
+    "actualizar_password_administrador": "UPDATE administradores SET password = %s WHERE id = %s AND password = %s",
+    "actualizar_password_usuario": "UPDATE usuarios SET password = %s WHERE id = %s AND password = %s",
+    "token_api": """SELECT t.tipo, t.cuenta_id, a.nombre FROM tokens_api t
+                    JOIN administradores a ON a.id = t.cuenta_id
+                    WHERE t.token_hash = %s AND t.tipo = 'administrador'
+                    UNION ALL
+                    SELECT t.tipo, t.cuenta_id, u.nombre FROM tokens_api t
+                    JOIN usuarios u ON u.id = t.cuenta_id
+                    WHERE t.token_hash = %s AND t.tipo = 'usuario'""",
+    "insertar_token_api": """INSERT INTO tokens_api (token_hash, tipo, cuenta_id, descripcion, creado)
+                             VALUES (%s, %s, %s, %s, %s)""",
+    "borrar_token_api": "DELETE FROM tokens_api WHERE token_hash = %s",
+    "existe_admin": "SELECT id FROM administradores WHERE username = %s",
+    "existe_usuario": "SELECT id FROM usuarios WHERE email = %s",
+    "contar_administradores": "SELECT COUNT(*) FROM administradores",
+    "insertar_libro": """INSERT INTO libros (titulo, autor, isbn, editorial, año_publicacion, categoria, cantidad_disponible)
+                      VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+    "insertar_usuario": "INSERT INTO usuarios (nombre, email, password, telefono, direccion) VALUES (%s, %s, %s, %s, %s)",
+    "insertar_admin": "INSERT INTO administradores (username, password, nombre, email) VALUES (%s, %s, %s, %s)",
+    "titulo_libro": "SELECT titulo FROM libros WHERE id = %s",
+    "libro_por_id": """SELECT id, titulo, autor, isbn, editorial, año_publicacion, categoria, cantidad_disponible
+                      FROM libros WHERE id = %s""",
+    "cantidad_libro": "SELECT cantidad_disponible FROM libros WHERE id = %s",
+    "insertar_prestamo": """INSERT INTO prestamos (libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento,
+                      estado) VALUES (%s, %s, %s, %s, %s, 'activo')""",
+    "insertar_prestamo_historico": """INSERT INTO prestamos (libro_id, usuario_id, fecha_prestamo, fecha_vencimiento,
+                      fecha_devolucion, estado, ejemplar_id) VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+    "insertar_libros": """INSERT INTO libros (titulo, autor, isbn, editorial, año_publicacion, categoria, cantidad_disponible)
+                      VALUES {filas}""",
+    "insertar_ejemplar": "INSERT INTO ejemplares (libro_id, codigo_barras, sucursal) VALUES (%s, %s, %s)",
+    # Cada préstamo ocupa un ejemplar concreto. SKIP LOCKED hace que préstamos
+    # simultáneos del mismo título bloqueen ejemplares distintos en vez de esperarse
+    "ejemplar_libre": """SELECT id, codigo_barras FROM ejemplares
+                      WHERE libro_id = %s AND estado = 'disponible'
+                      ORDER BY id LIMIT 1
+                      FOR UPDATE SKIP LOCKED""",
+    "ocupar_ejemplar": "UPDATE ejemplares SET estado = 'prestado' WHERE id = %s AND estado = 'disponible'",
+    "liberar_ejemplares": """UPDATE ejemplares SET estado = 'disponible'
+                      WHERE id IN ({marcadores}) AND estado IN ('prestado', 'reservado')""",
+    # cantidad_disponible es el resumen que leen listados, búsqueda e informes; se
+    # descuenta al final de la transacción para retener la fila del libro lo mínimo
+    "descontar_ejemplar": "UPDATE libros SET cantidad_disponible = cantidad_disponible - 1 WHERE id = %s AND cantidad_disponible > 0",
+    "prestamo_activo_usuario": """SELECT p.libro_id, p.ejemplar_id
+                      FROM prestamos p
+                      WHERE p.id = %s AND p.usuario_id = %s AND p.estado = 'activo'
+                      FOR UPDATE""",
+    "marcar_devuelto": "UPDATE prestamos SET estado = 'devuelto', fecha_devolucion = %s WHERE id = %s AND estado = 'activo'",
+    "isbns_existentes": "SELECT isbn FROM libros WHERE isbn IN ({marcadores})",
+    "existe_usuario_id": "SELECT id FROM usuarios WHERE id = %s",
+    # Circulación en lote: se leen y bloquean todas las filas afectadas con una
+    # consulta. La primera columna es el código leído (préstamo, libro o ejemplar)
+    "prestamos_activos_por_prestamo": """SELECT p.id, p.id, p.libro_id, p.usuario_id, l.titulo, p.ejemplar_id
+                      FROM prestamos p
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE p.id IN ({marcadores}) AND p.estado = 'activo'
+                      FOR UPDATE""",
+    "prestamos_activos_por_libro": """SELECT p.libro_id, p.id, p.libro_id, p.usuario_id, l.titulo, p.ejemplar_id
+                      FROM prestamos p
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE p.libro_id IN ({marcadores}) AND p.estado = 'activo'
+                      ORDER BY p.fecha_prestamo, p.id
+                      FOR UPDATE""",
+    "prestamos_activos_por_codigo": """SELECT e.codigo_barras, p.id, p.libro_id, p.usuario_id, l.titulo, p.ejemplar_id
+                      FROM ejemplares e
+                      INNER JOIN prestamos p ON p.ejemplar_id = e.id AND p.estado = 'activo'
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE e.codigo_barras IN ({marcadores})
+                      FOR UPDATE""",
+    "marcar_devueltos": "UPDATE prestamos SET estado = 'devuelto', fecha_devolucion = %s WHERE id IN ({marcadores}) AND estado = 'activo'",
+    "reponer_ejemplares": "UPDATE libros SET cantidad_disponible = cantidad_disponible + %s WHERE id = %s",
+    "libros_para_prestar": "SELECT id, titulo FROM libros WHERE id IN ({marcadores})",
+    # Lectura sin bloqueo: solo se bloquean los ejemplares que se ocupan después
+    "ejemplares_para_prestar": """SELECT id, libro_id FROM ejemplares
+                      WHERE libro_id IN ({marcadores}) AND estado = 'disponible'
+                      ORDER BY libro_id, id""",
+    "ocupar_ejemplares": "UPDATE ejemplares SET estado = 'prestado' WHERE id IN ({marcadores}) AND estado = 'disponible'",
+    "descontar_ejemplares": """UPDATE libros SET cantidad_disponible = cantidad_disponible - %s
+                      WHERE id = %s AND cantidad_disponible >= %s""",
+    "insertar_prestamos": """INSERT INTO prestamos (libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento, estado)
+                      VALUES {filas}""",
+    # Diario de mostrador sin conexión: estado de los ejemplares leídos y operaciones ya aplicadas
+    "ejemplares_por_codigos": """SELECT codigo_barras, id, libro_id, estado FROM ejemplares
+                      WHERE codigo_barras IN ({marcadores})
+                      FOR UPDATE""",
+    "usuarios_existentes": "SELECT id FROM usuarios WHERE id IN ({marcadores})",
+    "diario_aplicado": "SELECT uuid FROM diario_aplicado WHERE uuid IN ({marcadores})",
+    "insertar_diario_aplicado": "INSERT INTO diario_aplicado (uuid, aplicada) VALUES (%s, %s)",
+    "insertar_prestamos_diario": """INSERT INTO prestamos (libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento,
+                      fecha_devolucion, estado) VALUES {filas}""",
+    # Reservas: una cola FIFO por libro. Los ejemplares devueltos pasan a la
+    # reserva más antigua en la misma transacción que la devolución
+    "insertar_reserva": "INSERT INTO reservas (libro_id, usuario_id, fecha_reserva) VALUES (%s, %s, %s)",
+    # Serializa las reservas simultáneas de un mismo usuario: la comprobación de
+    # duplicados y el alta van en la misma transacción
+    "bloquear_usuario": """SELECT id FROM usuarios WHERE id = %s
+                      FOR UPDATE""",
+    "reserva_activa_usuario": """SELECT id FROM reservas
+                      WHERE usuario_id = %s AND estado IN ('esperando', 'asignada') AND libro_id = %s""",
+    # La posición se cuenta en el índice (libro_id, estado, id) sin leer filas
+    "posicion_reserva": """SELECT COUNT(*) FROM reservas
+                      WHERE libro_id = %s AND estado = 'esperando' AND id <= %s""",
+    "reservas_usuario": """SELECT r.id, r.libro_id, l.titulo, r.estado, r.fecha_reserva, r.fecha_limite, e.codigo_barras,
+                             CASE WHEN r.estado = 'esperando' THEN
+                                 (SELECT COUNT(*) FROM reservas c
+                                  WHERE c.libro_id = r.libro_id AND c.estado = 'esperando' AND c.id <= r.id)
+                             END
+                      FROM reservas r
+                      INNER JOIN libros l ON l.id = r.libro_id
+                      LEFT JOIN ejemplares e ON e.id = r.ejemplar_id
+                      WHERE r.usuario_id = %s AND r.estado IN ('esperando', 'asignada')
+                      ORDER BY r.id""",
+    "reservas_en_espera": """SELECT id, libro_id, usuario_id FROM reservas
+                      WHERE libro_id IN ({marcadores}) AND estado = 'esperando'
+                      ORDER BY libro_id, id
+                      FOR UPDATE""",
+    "asignar_reserva": """UPDATE reservas SET estado = 'asignada', ejemplar_id = %s, fecha_asignacion = %s, fecha_limite = %s
+                      WHERE id = %s AND estado = 'esperando'""",
+    "reservar_ejemplares": """UPDATE ejemplares SET estado = 'reservado'
+                      WHERE id IN ({marcadores}) AND estado IN ('prestado', 'reservado')""",
+    "reserva_asignada_usuario": """SELECT r.id, r.ejemplar_id, e.codigo_barras
+                      FROM reservas r
+                      INNER JOIN ejemplares e ON e.id = r.ejemplar_id
+                      WHERE r.libro_id = %s AND r.estado = 'asignada' AND r.usuario_id = %s
+                      FOR UPDATE""",
+    "reservas_asignadas_lote": """SELECT id, libro_id, ejemplar_id FROM reservas
+                      WHERE usuario_id = %s AND estado = 'asignada' AND libro_id IN ({marcadores})
+                      ORDER BY id
+                      FOR UPDATE""",
+    "recoger_reservas": "UPDATE reservas SET estado = 'recogida' WHERE id IN ({marcadores}) AND estado = 'asignada'",
+    "recoger_ejemplares": "UPDATE ejemplares SET estado = 'prestado' WHERE id IN ({marcadores}) AND estado = 'reservado'",
+    "reserva_usuario": """SELECT libro_id, ejemplar_id FROM reservas
+                      WHERE id = %s AND usuario_id = %s AND estado IN ('esperando', 'asignada')
+                      FOR UPDATE""",
+    "reservas_caducadas": """SELECT id, libro_id, ejemplar_id FROM reservas
+                      WHERE estado = 'asignada' AND fecha_limite < %s
+                      ORDER BY fecha_limite, id LIMIT %s
+                      FOR UPDATE""",
+    "terminar_reservas": """UPDATE reservas SET estado = %s
+                      WHERE id IN ({marcadores}) AND estado IN ('esperando', 'asignada')""",
+    # Un código de barras leído resuelve el ejemplar y su préstamo activo por índice
+    "ejemplar_por_codigo": """SELECT e.id, e.codigo_barras, e.sucursal, e.estado, l.id, l.titulo,
+                             p.id, p.usuario_id, u.nombre, p.fecha_prestamo, p.fecha_vencimiento
+                      FROM ejemplares e
+                      INNER JOIN libros l ON l.id = e.libro_id
+                      LEFT JOIN prestamos p ON p.ejemplar_id = e.id AND p.estado = 'activo'
+                      LEFT JOIN usuarios u ON u.id = p.usuario_id
+                      WHERE e.codigo_barras = %s""",
+    "ejemplares_libro": """SELECT e.id, e.codigo_barras, e.sucursal, e.estado, p.id, p.usuario_id, p.fecha_vencimiento
+                      FROM ejemplares e
+                      LEFT JOIN prestamos p ON p.ejemplar_id = e.id AND p.estado = 'activo'
+                      WHERE e.libro_id = %s
+                      ORDER BY e.id""",
+    "prestamos_activos_usuario": """
+            SELECT p.id, l.titulo, p.fecha_prestamo, l.autor, p.fecha_vencimiento, p.dias_retraso, p.multa_centimos
+            FROM prestamos p
+            INNER JOIN libros l ON p.libro_id = l.id
+            WHERE p.usuario_id = %s AND p.estado = 'activo'
+            ORDER BY p.fecha_prestamo DESC
+            """,
+    # Multas: recorrido por clave primaria en bloques; solo vuelve a leer los
+    # préstamos cuyo cálculo quedó anterior a su fecha de fin (devolución o corte)
+    "prestamos_para_multa": """SELECT p.id, p.fecha_vencimiento, p.fecha_devolucion, l.categoria
+                      FROM prestamos p
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE p.id > %s AND p.fecha_vencimiento < %s
+                        AND (p.multa_calculada IS NULL OR p.multa_calculada < COALESCE(p.fecha_devolucion, %s))
+                      ORDER BY p.id
+                      LIMIT %s""",
+    "actualizar_multas": """UPDATE prestamos SET dias_retraso = %s, multa_centimos = %s, multa_calculada = %s
+                      WHERE id IN ({marcadores})""",
+    "punto_control": "SELECT corte, ultimo_id, procesados, completado FROM puntos_control WHERE trabajo = %s",
+    "borrar_punto_control": "DELETE FROM puntos_control WHERE trabajo = %s",
+    "insertar_punto_control": """INSERT INTO puntos_control (trabajo, corte, ultimo_id, procesados, completado, actualizado)
+                      VALUES (%s, %s, 0, 0, 0, %s)""",
+    "avanzar_punto_control": """UPDATE puntos_control SET ultimo_id = %s, procesados = procesados + %s, actualizado = %s
+                      WHERE trabajo = %s""",
+    "completar_punto_control": "UPDATE puntos_control SET completado = 1, actualizado = %s WHERE trabajo = %s",
+    # Bandeja de salida (migración 9): el id autoincremental es la posición de cada evento
+    "insertar_evento": "INSERT INTO eventos (tipo, entidad_id, datos, creado) VALUES (%s, %s, %s, %s)",
+    "eventos_desde": """SELECT id, tipo, entidad_id, datos, creado FROM eventos
+                      WHERE id > %s ORDER BY id LIMIT %s""",
+    "posicion_consumidor": "SELECT ultimo_id FROM consumidores_eventos WHERE consumidor = %s",
+    "borrar_posicion_consumidor": "DELETE FROM consumidores_eventos WHERE consumidor = %s",
+    "insertar_posicion_consumidor": """INSERT INTO consumidores_eventos (consumidor, ultimo_id, actualizado)
+                      VALUES (%s, %s, %s)""",
+    # Pocas filas (una por consumidor): el recorrido completo es lo esperado
+    "posicion_minima_consumidores": "SELECT MIN(ultimo_id) FROM consumidores_eventos",
+    "purgar_eventos": "DELETE FROM eventos WHERE id <= %s AND creado < %s",
+    # Réplicas y sucursales (topologia.py)
+    "latido": "SELECT marca FROM latido WHERE id = 1",
+    "marcar_latido": "UPDATE latido SET marca = %s WHERE id = 1",
+    "disponibilidad_libros": "SELECT id, cantidad_disponible FROM libros WHERE id IN ({marcadores})",
+    "fijar_disponible": "UPDATE libros SET cantidad_disponible = %s WHERE id = %s",
+    "usuario_por_id": "SELECT id, nombre, email, telefono, direccion FROM usuarios WHERE id = %s",
+    # Filas de referencia del catálogo en el nodo de una sucursal, con el mismo id
+    "copiar_libro": """INSERT INTO libros (id, titulo, autor, isbn, editorial, año_publicacion, categoria,
+                      cantidad_disponible) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+    "copiar_usuario": """INSERT IGNORE INTO usuarios (id, nombre, email, telefono, direccion, password)
+                      VALUES (%s, %s, %s, %s, %s, %s)""",
+    # Informes sobre los contadores materializados (migración 6), nunca sobre el histórico
+    "informe_mas_prestados": """SELECT l.id, l.titulo, l.autor, l.categoria, e.prestamos, e.activos
+                      FROM estadisticas_libros e
+                      INNER JOIN libros l ON l.id = e.libro_id
+                      ORDER BY e.prestamos DESC, e.libro_id DESC
+                      LIMIT %s""",
+    "informe_usuarios": """SELECT u.id, u.nombre, u.email, e.prestamos, e.activos, e.ultimo_prestamo
+                      FROM estadisticas_usuarios e
+                      INNER JOIN usuarios u ON u.id = e.usuario_id
+                      ORDER BY e.prestamos DESC, e.usuario_id DESC
+                      LIMIT %s""",
+    # Una fila por libro, no por préstamo: el coste no crece con el histórico
+    "informe_categorias": """SELECT COALESCE(l.categoria, ''), COUNT(*), SUM(l.cantidad_disponible),
+                             COALESCE(SUM(e.prestamos), 0), COALESCE(SUM(e.activos), 0)
+                      FROM libros l
+                      LEFT JOIN estadisticas_libros e ON e.libro_id = l.id
+                      GROUP BY COALESCE(l.categoria, '')""",
+    "informe_resumen": """SELECT COUNT(*), COALESCE(SUM(prestamos), 0), COALESCE(SUM(activos), 0)
+                      FROM estadisticas_libros""",
+    "vaciar_estadisticas_libros": "DELETE FROM estadisticas_libros",
+    "vaciar_estadisticas_usuarios": "DELETE FROM estadisticas_usuarios",
+    # El histórico incluye los préstamos archivados (migración 14)
+    "reconstruir_estadisticas_libros": """INSERT INTO estadisticas_libros (libro_id, prestamos, activos)
+                      SELECT libro_id, COUNT(*), SUM(estado = 'activo')
+                      FROM (SELECT libro_id, estado FROM prestamos
+                            UNION ALL SELECT libro_id, estado FROM prestamos_archivo) h
+                      GROUP BY libro_id""",
+    "reconstruir_estadisticas_usuarios": """INSERT INTO estadisticas_usuarios (usuario_id, prestamos, activos, ultimo_prestamo)
+                      SELECT usuario_id, COUNT(*), SUM(estado = 'activo'), MAX(fecha_prestamo)
+                      FROM (SELECT usuario_id, estado, fecha_prestamo FROM prestamos
+                            UNION ALL SELECT usuario_id, estado, fecha_prestamo FROM prestamos_archivo) h
+                      GROUP BY usuario_id""",
+    # Recomendaciones (migración 13): pares lector-libro para el cálculo fuera de línea
+    # y los vecinos ya ordenados de cada libro para servirlos con una búsqueda por clave
+    # Los préstamos archivados (migración 14) también cuentan como lecturas
+    "prestamos_lectores": """SELECT id, usuario_id, libro_id FROM prestamos
+                      WHERE id > %s ORDER BY id LIMIT %s""",
+    "archivo_lectores": """SELECT id, usuario_id, libro_id FROM prestamos_archivo
+                      WHERE id > %s ORDER BY id LIMIT %s""",
+    "libros_prestados_usuario": "SELECT libro_id FROM prestamos WHERE usuario_id = %s AND estado = 'activo'",
+    "libros_de_lectores": """SELECT usuario_id, libro_id FROM prestamos WHERE usuario_id IN ({marcadores})
+                      UNION SELECT usuario_id, libro_id FROM prestamos_archivo WHERE usuario_id IN ({marcadores})""",
+    "lectores_de_libros": """SELECT usuario_id, libro_id FROM prestamos WHERE libro_id IN ({marcadores})
+                      UNION SELECT usuario_id, libro_id FROM prestamos_archivo WHERE libro_id IN ({marcadores})""",
+    "numero_lectores": """SELECT libro_id, COUNT(DISTINCT usuario_id)
+                      FROM (SELECT libro_id, usuario_id FROM prestamos WHERE libro_id IN ({marcadores})
+                            UNION ALL
+                            SELECT libro_id, usuario_id FROM prestamos_archivo WHERE libro_id IN ({marcadores})) h
+                      GROUP BY libro_id""",
+    "borrar_recomendaciones_libros": "DELETE FROM recomendaciones WHERE libro_id IN ({marcadores})",
+    "borrar_recomendaciones_tramo": "DELETE FROM recomendaciones WHERE libro_id > %s AND libro_id <= %s",
+    "insertar_recomendacion": """INSERT INTO recomendaciones (libro_id, posicion, vecino_id, puntuacion)
+                      VALUES (%s, %s, %s, %s)""",
+    # Suma de puntuaciones de los vecinos de varios libros, sin los propios libros
+    "recomendaciones_libros": """SELECT r.vecino_id, l.titulo, l.autor, l.categoria, l.cantidad_disponible,
+                             SUM(r.puntuacion) AS puntuacion
+                      FROM recomendaciones r
+                      INNER JOIN libros l ON l.id = r.vecino_id
+                      WHERE r.libro_id IN ({marcadores}) AND r.vecino_id NOT IN ({marcadores})
+                      GROUP BY r.vecino_id, l.titulo, l.autor, l.categoria, l.cantidad_disponible
+                      ORDER BY puntuacion DESC, r.vecino_id""",
+    # Lo mismo a partir de los préstamos activos del usuario, cuando están en la misma base
+    "recomendaciones_usuario": """SELECT r.vecino_id, l.titulo, l.autor, l.categoria, l.cantidad_disponible,
+                             SUM(r.puntuacion) AS puntuacion
+                      FROM prestamos p
+                      INNER JOIN recomendaciones r ON r.libro_id = p.libro_id
+                      INNER JOIN libros l ON l.id = r.vecino_id
+                      WHERE p.usuario_id = %s AND p.estado = 'activo'
+                        AND NOT EXISTS (SELECT 1 FROM prestamos a
+                                        WHERE a.usuario_id = p.usuario_id AND a.estado = 'activo'
+                                          AND a.libro_id = r.vecino_id)
+                      GROUP BY r.vecino_id, l.titulo, l.autor, l.categoria, l.cantidad_disponible
+                      ORDER BY puntuacion DESC, r.vecino_id
+                      LIMIT %s""",
+    # Archivo (migración 14): los devueltos antes del corte con la multa ya
+    # calculada salen de prestamos; se copian y borran por lotes de ids. Se
+    # recorre por clave primaria: el índice por estado obligaría a reordenar
+    # todos los devueltos en cada lote
+    "prestamos_para_archivar": """SELECT id FROM prestamos FORCE INDEX (PRIMARY)
+                      WHERE id > %s AND estado = 'devuelto' AND fecha_devolucion < %s
+                        AND (fecha_devolucion <= fecha_vencimiento OR multa_calculada >= fecha_devolucion)
+                      ORDER BY id
+                      LIMIT %s""",
+    "archivar_prestamos": """INSERT INTO prestamos_archivo (id, libro_id, ejemplar_id, usuario_id, fecha_prestamo,
+                             fecha_vencimiento, fecha_devolucion, estado, dias_retraso, multa_centimos,
+                             multa_calculada, archivado)
+                      SELECT id, libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento,
+                             fecha_devolucion, estado, dias_retraso, multa_centimos, multa_calculada, %s
+                      FROM prestamos WHERE id IN ({marcadores}) AND estado = 'devuelto'""",
+    "borrar_prestamos_archivados": "DELETE FROM prestamos WHERE id IN ({marcadores}) AND estado = 'devuelto'",
+    # Historial de un usuario en las dos tablas, del más reciente al más antiguo
+    "historial_usuario": """SELECT h.id, h.libro_id, l.titulo, h.fecha_prestamo, h.fecha_devolucion, h.estado,
+                             h.multa_centimos
+                      FROM (SELECT id, libro_id, fecha_prestamo, fecha_devolucion, estado, multa_centimos
+                            FROM prestamos WHERE usuario_id = %s
+                            UNION ALL
+                            SELECT id, libro_id, fecha_prestamo, fecha_devolucion, estado, multa_centimos
+                            FROM prestamos_archivo WHERE usuario_id = %s) h
+                      INNER JOIN libros l ON l.id = h.libro_id
+                      ORDER BY h.fecha_prestamo DESC, h.id DESC
+                      LIMIT %s""",
+    "historial_usuario_siguiente": """SELECT h.id, h.libro_id, l.titulo, h.fecha_prestamo, h.fecha_devolucion, h.estado,
+                             h.multa_centimos
+                      FROM (SELECT id, libro_id, fecha_prestamo, fecha_devolucion, estado, multa_centimos
+                            FROM prestamos
+                            WHERE usuario_id = %s AND (fecha_prestamo < %s OR (fecha_prestamo = %s AND id < %s))
+                            UNION ALL
+                            SELECT id, libro_id, fecha_prestamo, fecha_devolucion, estado, multa_centimos
+                            FROM prestamos_archivo
+                            WHERE usuario_id = %s AND (fecha_prestamo < %s OR (fecha_prestamo = %s AND id < %s))) h
+                      INNER JOIN libros l ON l.id = h.libro_id
+                      ORDER BY h.fecha_prestamo DESC, h.id DESC
+                      LIMIT %s""",
+    # Usa el índice FULLTEXT ft_libros sobre las mismas columnas (migración 3)
+    "buscar_libros": """
+            SELECT id, titulo, autor, editorial, categoria, cantidad_disponible,
+                   MATCH (titulo, autor, editorial, categoria, isbn) AGAINST (%(expresion)s IN BOOLEAN MODE) AS relevancia
+            FROM libros
+            WHERE MATCH (titulo, autor, editorial, categoria, isbn) AGAINST (%(expresion)s IN BOOLEAN MODE)
+            ORDER BY relevancia DESC, id
+            LIMIT %(limite)s OFFSET %(desplazamiento)s
+            """,
+}
+
+
+# Listados paginables: columnas, origen, filtro fijo y orden (columna, sentido)
+# que sirve de clave de paginación; el último campo del orden debe ser único
+LISTADOS = {
+    "libros": {
+        "columnas": "id, titulo, autor, editorial, año_publicacion, categoria, cantidad_disponible",
+        "desde": "libros",
+        "filtro": None,
+        "orden": (("titulo", "ASC", 1), ("id", "ASC", 0)),
+    },
+    "libros_disponibles": {
+        "columnas": "id, titulo, autor, editorial, categoria, cantidad_disponible",
+        "desde": "libros",
+        "filtro": "cantidad_disponible > 0",
+        "orden": (("titulo", "ASC", 1), ("id", "ASC", 0)),
+    },
+    "usuarios": {
+        "columnas": "id, nombre, email, telefono",
+        "desde": "usuarios",
+        "filtro": None,
+        "orden": (("nombre", "ASC", 1), ("id", "ASC", 0)),
+    },
+    "prestamos": {
+        "columnas": "p.id, l.titulo, u.nombre, p.fecha_prestamo, p.fecha_devolucion, p.estado",
+        "desde": """prestamos p
+            INNER JOIN libros l ON p.libro_id = l.id
+            INNER JOIN usuarios u ON p.usuario_id = u.id""",
+        "filtro": None,
+        "orden": (("p.fecha_prestamo", "DESC", 3), ("p.id", "DESC", 0)),
+    },
+    "vencidos": {
+        "columnas": """p.id, l.titulo, u.nombre, u.email, p.fecha_prestamo, p.fecha_vencimiento,
+            p.dias_retraso, p.multa_centimos""",
+        "desde": """prestamos p
+            INNER JOIN libros l ON p.libro_id = l.id
+            INNER JOIN usuarios u ON p.usuario_id = u.id""",
+        "filtro": "p.estado = 'activo' AND p.fecha_vencimiento < CURRENT_DATE",
+        "orden": (("p.fecha_vencimiento", "ASC", 5), ("p.id", "ASC", 0)),
+    },
+}
+
+
+def _consultas_listados():
+    """Generar las consultas completa, primera página y página siguiente de cada listado"""
+    consultas = {}
+    for nombre, listado in LISTADOS.items():
+        (col_a, sentido, _), (col_b, _, _) = listado["orden"]
+        operador = ">" if sentido == "ASC" else "<"
+        base = f"SELECT {listado['columnas']} FROM {listado['desde']}"
+        orden = f" ORDER BY {col_a} {sentido}, {col_b} {sentido}"
+        filtros = [listado["filtro"]] if listado["filtro"] else []
+        # Búsqueda por clave: continúa después de la última fila sin OFFSET
+        siguiente = filtros + [f"({col_a} {operador} %s OR ({col_a} = %s AND {col_b} {operador} %s))"]
+        consultas[f"listar_{nombre}"] = base + (" WHERE " + filtros[0] if filtros else "") + orden
+        consultas[f"pagina_{nombre}"] = consultas[f"listar_{nombre}"] + " LIMIT %s"
+        consultas[f"pagina_{nombre}_siguiente"] = base + " WHERE " + " AND ".join(siguiente) + orden + " LIMIT %s"
+    return consultas
+
+
+CONSULTAS.update(_consultas_listados())
+
+
+# Variantes propias de cada motor que sustituyen o amplían CONSULTAS
+CONSULTAS_MOTOR = {
+    "sqlite": {
+        # NOT INDEXED sigue permitiendo el recorrido por rowid
+        "prestamos_para_archivar": """SELECT id FROM prestamos NOT INDEXED
+                      WHERE id > %s AND estado = 'devuelto' AND fecha_devolucion < %s
+                        AND (fecha_devolucion <= fecha_vencimiento OR multa_calculada >= fecha_devolucion)
+                      ORDER BY id
+                      LIMIT %s""",
+        # SQLite serializa las escrituras con BEGIN IMMEDIATE y no admite FOR UPDATE
+        "bloquear_usuario": "SELECT id FROM usuarios WHERE id = %s",
+        "prestamo_activo_usuario": """SELECT p.libro_id, p.ejemplar_id
+                      FROM prestamos p
+                      WHERE p.id = %s AND p.usuario_id = %s AND p.estado = 'activo'""",
+        "ejemplar_libre": """SELECT id, codigo_barras FROM ejemplares
+                      WHERE libro_id = %s AND estado = 'disponible'
+                      ORDER BY id LIMIT 1""",
+        "copiar_usuario": """INSERT OR IGNORE INTO usuarios (id, nombre, email, telefono, direccion, password)
+                      VALUES (%s, %s, %s, %s, %s, %s)""",
+        "reservas_en_espera": """SELECT id, libro_id, usuario_id FROM reservas
+                      WHERE libro_id IN ({marcadores}) AND estado = 'esperando'
+                      ORDER BY libro_id, id""",
+        "reserva_asignada_usuario": """SELECT r.id, r.ejemplar_id, e.codigo_barras
+                      FROM reservas r
+                      INNER JOIN ejemplares e ON e.id = r.ejemplar_id
+                      WHERE r.libro_id = %s AND r.estado = 'asignada' AND r.usuario_id = %s""",
+        "reservas_asignadas_lote": """SELECT id, libro_id, ejemplar_id FROM reservas
+                      WHERE usuario_id = %s AND estado = 'asignada' AND libro_id IN ({marcadores})
+                      ORDER BY id""",
+        "reserva_usuario": """SELECT libro_id, ejemplar_id FROM reservas
+                      WHERE id = %s AND usuario_id = %s AND estado IN ('esperando', 'asignada')""",
+        "reservas_caducadas": """SELECT id, libro_id, ejemplar_id FROM reservas
+                      WHERE estado = 'asignada' AND fecha_limite < %s
+                      ORDER BY fecha_limite, id LIMIT %s""",
+        "ocupar_ejemplar_returning": """UPDATE ejemplares SET estado = 'prestado'
+                      WHERE id = (SELECT id FROM ejemplares WHERE libro_id = %s AND estado = 'disponible'
+                                  ORDER BY id LIMIT 1)
+                      RETURNING id, codigo_barras""",
+        # Con RETURNING cada paso devuelve lo que necesita el siguiente
+        "descontar_ejemplar_returning": """UPDATE libros SET cantidad_disponible = cantidad_disponible - 1
+                      WHERE id = %s AND cantidad_disponible > 0 RETURNING titulo""",
+        "devolver_prestamo_returning": """UPDATE prestamos SET estado = 'devuelto', fecha_devolucion = %s
+                      WHERE id = %s AND usuario_id = %s AND estado = 'activo' RETURNING libro_id, ejemplar_id""",
+        "prestamos_activos_por_prestamo": """SELECT p.id, p.id, p.libro_id, p.usuario_id, l.titulo, p.ejemplar_id
+                      FROM prestamos p
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE p.id IN ({marcadores}) AND p.estado = 'activo'""",
+        "prestamos_activos_por_libro": """SELECT p.libro_id, p.id, p.libro_id, p.usuario_id, l.titulo, p.ejemplar_id
+                      FROM prestamos p
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE p.libro_id IN ({marcadores}) AND p.estado = 'activo'
+                      ORDER BY p.fecha_prestamo, p.id""",
+        "prestamos_activos_por_codigo": """SELECT e.codigo_barras, p.id, p.libro_id, p.usuario_id, l.titulo, p.ejemplar_id
+                      FROM ejemplares e
+                      INNER JOIN prestamos p ON p.ejemplar_id = e.id AND p.estado = 'activo'
+                      INNER JOIN libros l ON l.id = p.libro_id
+                      WHERE e.codigo_barras IN ({marcadores})""",
+        "ejemplares_por_codigos": """SELECT codigo_barras, id, libro_id, estado FROM ejemplares
+                      WHERE codigo_barras IN ({marcadores})""",
+        "insertar_prestamos_diario_returning": """INSERT INTO prestamos (libro_id, ejemplar_id, usuario_id, fecha_prestamo,
+                      fecha_vencimiento, fecha_devolucion, estado) VALUES {filas} RETURNING id""",
+        "insertar_prestamos_returning": """INSERT INTO prestamos (libro_id, ejemplar_id, usuario_id, fecha_prestamo,
+                      fecha_vencimiento, estado) VALUES {filas} RETURNING id""",
+        "insertar_libros_returning": """INSERT INTO libros (titulo, autor, isbn, editorial, año_publicacion, categoria,
+                      cantidad_disponible) VALUES {filas} RETURNING id""",
+        # bm25 con pesos por columna (titulo, autor, editorial, categoria, isbn); menor es mejor.
+        # Se ordena y recorta dentro del índice y solo la página se cruza con libros
+        "buscar_libros": """
+            SELECT l.id, l.titulo, l.autor, l.editorial, l.categoria, l.cantidad_disponible, -f.puntos AS relevancia
+            FROM (SELECT rowid, bm25(libros_fts, 10.0, 5.0, 1.0, 2.0, 3.0) AS puntos
+                  FROM libros_fts
+                  WHERE libros_fts MATCH %(expresion)s
+                  ORDER BY puntos, rowid
+                  LIMIT %(limite)s OFFSET %(desplazamiento)s) f
+            INNER JOIN libros l ON l.id = f.rowid
+            ORDER BY f.puntos, l.id
+            """,
+    },
+}
+
+_SQL_POR_MOTOR = {}
+
+
+def sql_adaptado(backend):
+    """Consultas con nombre ya adaptadas al motor (se calculan una vez por motor)"""
+    if backend.nombre not in _SQL_POR_MOTOR:
+        consultas = dict(CONSULTAS, **CONSULTAS_MOTOR.get(backend.nombre, {}))
+        _SQL_POR_MOTOR[backend.nombre] = {nombre: backend.adaptar_sql(query) for nombre, query in consultas.items()}
+    return _SQL_POR_MOTOR[backend.nombre]
+
+
+class RepositorioBiblioteca:
+    """Acceso a los datos de la biblioteca sobre una conexión de un backend"""
+
+    def __init__(self, backend, connection, metricas=None):
+        self.backend = backend
+        self.connection = connection
+        self.metricas = metricas
+        self._sql = sql_adaptado(backend)
+        self._en_transaccion = False
+
+    def _consulta(self, nombre, sql, params, leer=None, varios=False):
+        """Ejecutar SQL ya adaptado, devolver el cursor (o leer(cursor)) y medirlo si hay métricas"""
+        metricas = self.metricas
+        inicio = time.perf_counter() if metricas is not None else 0.0
+        cursor = self.connection.cursor()
+        try:
+            if varios:
+                cursor.executemany(sql, params)
+            else:
+                cursor.execute(sql, params)
+            resultado = leer(cursor) if leer else cursor
+        except self.backend.Error as e:
+            if metricas is not None:
+                metricas.registrar_error(nombre)
+            raise ErrorBD(str(e)) from e
+        if metricas is not None:
+            metricas.registrar_consulta(nombre, time.perf_counter() - inicio, filas_resultado(resultado, cursor),
+                                        params)
+        return resultado
+
+    def _ejecutar(self, nombre, params=()):
+        """Ejecutar una consulta con nombre y devolver el cursor"""
+        return self._consulta(nombre, self._sql[nombre], params)
+
+    def _ejecutar_lote(self, nombre, filas):
+        """Ejecutar una sentencia con nombre para muchas filas (executemany)"""
+        return self._consulta(nombre, self._sql[nombre], filas, varios=True)
+
+    def _ejecutar_en(self, nombre, valores, params_previos=(), leer=None):
+        """Ejecutar una consulta con una lista IN ({marcadores}) de tamaño variable"""
+        marcadores = ", ".join([self.backend.adaptar_sql("%s")] * len(valores))
+        return self._consulta(nombre, self._sql[nombre].format(marcadores=marcadores),
+                              (*params_previos, *valores), leer)
+
+    def _todos_en(self, nombre, valores, params_previos=()):
+        return self._ejecutar_en(nombre, valores, params_previos, _leer_todos)
+
+    def _uno(self, nombre, params=()):
+        return self._consulta(nombre, self._sql[nombre], params, _leer_uno)
+
+    def _todos(self, nombre, params=()):
+        return self._consulta(nombre, self._sql[nombre], params, _leer_todos)
+
+    @contextmanager
+    def transaccion(self):
+        """Confirmar los cambios al salir o deshacerlos si hubo un error"""
+        if self._en_transaccion:
+            # Las transacciones anidadas se integran en la exterior
+            yield self
+            return
+        try:
+            self.backend.iniciar_transaccion(self.connection)
+        except self.backend.Error as e:
+            raise ErrorBD(str(e)) from e
+        self._en_transaccion = True
+        try:
+            yield self
+            self.connection.commit()
+        except BaseException:
+            try:
+                self.connection.rollback()
+            except self.backend.Error:
+                pass
+            raise
+        finally:
+            self._en_transaccion = False
+
+    # === CREDENCIALES ===
+
+    def buscar_administrador(self, username):
+        """Devolver (id, nombre, password) del administrador o None"""
+        return self._uno("admin_por_username", (username,))
+
+    def buscar_usuario(self, email):
+        """Devolver (id, nombre, password) del usuario o None"""
+        return self._uno("usuario_por_email", (email,))
+
+    def buscar_credenciales(self, identificador):
+        """Devolver [(tipo, id, nombre, password)], primero el administrador si lo hay"""
+        return self._todos("credenciales", (identificador, identificador))
+
+    def actualizar_password(self, tipo, cuenta_id, hash_anterior, hash_nuevo):
+        """Sustituir el hash de una cuenta y devolver si se actualizó"""
+        with self.transaccion():
+            cursor = self._ejecutar(f"actualizar_password_{tipo}", (hash_nuevo, cuenta_id, hash_anterior))
+            return cursor.rowcount == 1
+
+    def buscar_token_api(self, token_hash):
+        """Devolver (tipo, id, nombre) de la cuenta del token o None si no existe o la cuenta se borró"""
+        return self._uno("token_api", (token_hash, token_hash))
+
+    def insertar_token_api(self, token_hash, tipo, cuenta_id, descripcion, creado):
+        with self.transaccion():
+            self._ejecutar("insertar_token_api", (token_hash, tipo, cuenta_id, descripcion, creado))
+
+    def borrar_token_api(self, token_hash):
+        """Borrar el token y devolver si existía"""
+        with self.transaccion():
+            return self._ejecutar("borrar_token_api", (token_hash,)).rowcount == 1
+
+    def existe_administrador(self, username):
+        return self._uno("existe_admin", (username,)) is not None
+
+    def existe_usuario(self, email):
+        return self._uno("existe_usuario", (email,)) is not None
+
+    def hay_administradores(self):
+        return self._uno("contar_administradores")[0] > 0
+
+    def existe_usuario_id(self, usuario_id):
+        return self._uno("existe_usuario_id", (usuario_id,)) is not None
+
+    # === ALTAS ===
+
+    def insertar_libro(self, titulo, autor, isbn, editorial, año, categoria, cantidad, sucursal=SUCURSAL_PRINCIPAL,
+                       con_ejemplares=True):
+        """Insertar el libro con sus ejemplares y devolver su id.
+
+        Con con_ejemplares=False solo se da de alta la ficha: los ejemplares
+        viven en el nodo de la sucursal (véase copiar_libro).
+        """
+        with self.transaccion():
+            cursor = self._ejecutar("insertar_libro", (titulo, autor, isbn, editorial, año, categoria, cantidad))
+            if con_ejemplares:
+                self._crear_ejemplares([(cursor.lastrowid, cantidad)], sucursal)
+            self._registrar_eventos([_evento_libro(cursor.lastrowid, (titulo, autor, isbn, editorial, año, categoria,
+                                                                      cantidad), sucursal)])
+            return cursor.lastrowid
+
+    def insertar_libros(self, libros, sucursal=SUCURSAL_PRINCIPAL):
+        """Insertar muchos libros con sus ejemplares en una sola transacción y devolver cuántos"""
+        with self.transaccion():
+            # 7 columnas por libro: cada bloque se queda por debajo del límite de parámetros
+            for bloque in _bloques(libros, TAMAÑO_BLOQUE_IN // 7):
+                ids = self._insertar_filas("insertar_libros", "(%s, %s, %s, %s, %s, %s, %s)", bloque)
+                self._crear_ejemplares([(libro_id, libro[6]) for libro_id, libro in zip(ids, bloque)], sucursal)
+                self._registrar_eventos([_evento_libro(libro_id, libro, sucursal) for libro_id, libro in zip(ids, bloque)])
+        return len(libros)
+
+    def _crear_ejemplares(self, libros, sucursal):
+        """Dar de alta los ejemplares de (libro_id, cantidad) numerados desde 1"""
+        filas = [(libro_id, codigo_barras(libro_id, numero), sucursal)
+                 for libro_id, cantidad in libros for numero in range(1, cantidad + 1)]
+        if filas:
+            self._ejecutar_lote("insertar_ejemplar", filas)
+
+    def copiar_libro(self, libro_id, datos, sucursal):
+        """Dar de alta con el mismo id la ficha del catálogo y sus ejemplares en el nodo de una sucursal"""
+        with self.transaccion():
+            self._ejecutar("copiar_libro", (libro_id, *datos))
+            self._crear_ejemplares([(libro_id, datos[6])], sucursal)
+
+    def isbns_existentes(self, isbns):
+        """Devolver el subconjunto de ISBN que ya están en el catálogo"""
+        if not isbns:
+            return set()
+        return {fila[0] for fila in self._todos_en("isbns_existentes", list(isbns))}
+
+    def insertar_usuario(self, nombre, email, password_hash, telefono, direccion):
+        with self.transaccion():
+            cursor = self._ejecutar("insertar_usuario", (nombre, email, password_hash, telefono, direccion))
+            # Sin datos personales: quien los necesite los consulta con los permisos adecuados
+            self._registrar_eventos([("usuario.creado", cursor.lastrowid, {})])
+            return cursor.lastrowid
+
+    def obtener_usuario(self, usuario_id):
+        """Devolver (id, nombre, email, telefono, direccion) del usuario o None"""
+        return self._uno("usuario_por_id", (usuario_id,))
+
+    def copiar_usuario(self, usuario):
+        """Copiar la fila de un usuario del catálogo si aún no está en este nodo.
+
+        La copia no lleva contraseña: los inicios de sesión van al catálogo.
+        """
+        with self.transaccion():
+            self._ejecutar("copiar_usuario", (*usuario, "!"))
+
+    def insertar_historial(self, prestamos):
+        """Cargar préstamos ya registrados en otro sistema en una sola transacción.
+
+        Cada fila es (libro_id, usuario_id, fecha_prestamo, fecha_vencimiento,
+        fecha_devolucion, estado). Los préstamos activos ocupan un ejemplar libre
+        del libro y lo descuentan de cantidad_disponible; si no queda ninguno se
+        deshace la carga entera.
+        """
+        with self.transaccion():
+            filas = []
+            for prestamo in prestamos:
+                ejemplar_id = None
+                if prestamo[5] == "activo":
+                    ejemplar = self._ocupar_ejemplar(prestamo[0])
+                    if ejemplar is None:
+                        raise ErrorBD(f"El libro {prestamo[0]} no tiene ejemplares libres para un préstamo activo")
+                    ejemplar_id = ejemplar[0]
+                    self._descontar_disponible(prestamo[0])
+                filas.append((*prestamo, ejemplar_id))
+            if filas:
+                self._ejecutar_lote("insertar_prestamo_historico", filas)
+        return len(prestamos)
+
+    def insertar_administrador(self, username, password_hash, nombre, email):
+        with self.transaccion():
+            cursor = self._ejecutar("insertar_admin", (username, password_hash, nombre, email))
+            return cursor.lastrowid
+
+    # === LISTADOS ===
+
+    def listar_libros(self):
+        return self._todos("listar_libros")
+
+    def listar_usuarios(self):
+        return self._todos("listar_usuarios")
+
+    def listar_prestamos(self):
+        return self._todos("listar_prestamos")
+
+    def listar_libros_disponibles(self):
+        return self._todos("listar_libros_disponibles")
+
+    def listar_vencidos(self):
+        return self._todos("listar_vencidos")
+
+    def pagina(self, listado, limite, despues_de=None):
+        """Devolver (filas, clave de la última fila o None si no hay más)"""
+        if despues_de is None:
+            filas = self._todos(f"pagina_{listado}", (limite + 1,))
+        else:
+            a, b = despues_de
+            filas = self._todos(f"pagina_{listado}_siguiente", (a, a, b, limite + 1))
+        # Se pide una fila de más solo para saber si existe otra página
+        if len(filas) <= limite:
+            return filas, None
+        filas = filas[:limite]
+        (_, _, pos_a), (_, _, pos_b) = LISTADOS[listado]["orden"]
+        return filas, (filas[-1][pos_a], filas[-1][pos_b])
+
+    def iterar(self, listado, tamaño_bloque=500):
+        """Recorrer un listado completo con un cursor sin buffer, bloque a bloque"""
+        nombre = f"listar_{listado}"
+        inicio = time.perf_counter()
+        filas = 0
+        cursor = self.backend.cursor_sin_buffer(self.connection)
+        try:
+            cursor.execute(self._sql[nombre])
+            while True:
+                bloque = cursor.fetchmany(tamaño_bloque)
+                if not bloque:
+                    break
+                filas += len(bloque)
+                yield from bloque
+        except self.backend.Error as e:
+            if self.metricas is not None:
+                self.metricas.registrar_error(nombre)
+            raise ErrorBD(str(e)) from e
+        finally:
+            self.backend.cerrar_cursor(self.connection, cursor)
+        if self.metricas is not None:
+            # Incluye el tiempo que el consumidor tarda en procesar cada bloque
+            self.metricas.registrar_consulta(nombre, time.perf_counter() - inicio, filas)
+
+    def buscar_libros(self, terminos, limite, desplazamiento=0):
+        """Devolver (filas, hay_mas) de los libros que contienen todos los términos, por relevancia"""
+        filas = self._todos("buscar_libros", {
+            "expresion": self.backend.expresion_busqueda(terminos),
+            "limite": limite + 1,
+            "desplazamiento": desplazamiento,
+        })
+        return filas[:limite], len(filas) > limite
+
+    def prestamos_activos(self, usuario_id):
+        return self._todos("prestamos_activos_usuario", (usuario_id,))
+
+    # === PRÉSTAMOS ===
+
+    def obtener_libro(self, libro_id):
+        """Devolver la fila completa del libro o None"""
+        return self._uno("libro_por_id", (libro_id,))
+
+    def cantidad_disponible(self, libro_id):
+        fila = self._uno("cantidad_libro", (libro_id,))
+        return fila[0] if fila else None
+
+    def registrar_prestamo(self, libro_id, usuario_id, fecha_prestamo, fecha_vencimiento):
+        """Registrar el préstamo y devolver (prestamo_id, titulo, codigo_barras), o None si no hay ejemplares.
+
+        Si el usuario tiene una reserva del libro con ejemplar asignado, se le
+        presta ese ejemplar. Si no, la primera sentencia ocupa un ejemplar libre
+        concreto: préstamos concurrentes del mismo título bloquean filas de
+        ejemplares distintas y nunca prestan más ejemplares de los que existen.
+        El resumen de cantidad_disponible se descuenta al final, de modo que la
+        fila del libro solo queda bloqueada hasta el commit inmediato.
+        """
+        with self.transaccion():
+            reserva = self._uno("reserva_asignada_usuario", (libro_id, usuario_id))
+            if reserva is not None:
+                # El ejemplar reservado ya no contaba como disponible
+                reserva_id, ejemplar_id, codigo = reserva
+                self._recoger_reservas([reserva_id], [ejemplar_id])
+                cursor = self._ejecutar("insertar_prestamo",
+                                        (libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento))
+                self._registrar_eventos([_evento_prestamo(cursor.lastrowid, libro_id, ejemplar_id, usuario_id,
+                                                          fecha_prestamo, fecha_vencimiento, reserva_id)])
+                return cursor.lastrowid, self._uno("titulo_libro", (libro_id,))[0], codigo
+            ejemplar = self._ocupar_ejemplar(libro_id)
+            if ejemplar is None:
+                return None
+            ejemplar_id, codigo = ejemplar
+            cursor = self._ejecutar("insertar_prestamo",
+                                    (libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento))
+            self._registrar_eventos([_evento_prestamo(cursor.lastrowid, libro_id, ejemplar_id, usuario_id,
+                                                      fecha_prestamo, fecha_vencimiento)])
+            return cursor.lastrowid, self._descontar_disponible(libro_id), codigo
+
+    def _ocupar_ejemplar(self, libro_id):
+        """Marcar como prestado un ejemplar libre del libro y devolver (id, codigo_barras) o None"""
+        if self.backend.soporta_returning:
+            filas = self._todos("ocupar_ejemplar_returning", (libro_id,))
+            return filas[0] if filas else None
+        ejemplar = self._uno("ejemplar_libre", (libro_id,))
+        if ejemplar is not None:
+            self._ejecutar("ocupar_ejemplar", (ejemplar[0],))
+        return ejemplar
+
+    def _descontar_disponible(self, libro_id):
+        """Descontar un ejemplar del resumen del libro y devolver su título"""
+        if self.backend.soporta_returning:
+            filas = self._todos("descontar_ejemplar_returning", (libro_id,))
+            if filas:
+                return filas[0][0]
+        elif self._ejecutar("descontar_ejemplar", (libro_id,)).rowcount == 1:
+            return self._uno("titulo_libro", (libro_id,))[0]
+        # Había un ejemplar libre pero el resumen dice que no: se deshace el préstamo
+        raise ErrorBD(f"cantidad_disponible del libro {libro_id} no coincide con sus ejemplares")
+
+    def devolver_prestamo(self, prestamo_id, usuario_id, fecha_devolucion, limite_recogida):
+        """Marcar el préstamo como devuelto y devolver (libro_id, titulo), o None si no corresponde.
+
+        El ejemplar pasa a la reserva más antigua del libro (que puede recogerlo
+        hasta limite_recogida) o, si nadie espera, vuelve a estar disponible.
+        """
+        with self.transaccion():
+            if self.backend.soporta_returning:
+                filas = self._todos("devolver_prestamo_returning", (fecha_devolucion, prestamo_id, usuario_id))
+                if not filas:
+                    return None
+                libro_id, ejemplar_id = filas[0]
+            else:
+                # Bloquea la fila del préstamo: dos devoluciones simultáneas no reponen dos veces
+                resultado = self._uno("prestamo_activo_usuario", (prestamo_id, usuario_id))
+                if resultado is None:
+                    return None
+                libro_id, ejemplar_id = resultado
+                self._ejecutar("marcar_devuelto", (fecha_devolucion, prestamo_id))
+            self._registrar_eventos([_evento_devolucion(prestamo_id, libro_id, ejemplar_id, usuario_id,
+                                                        fecha_devolucion)])
+            self._reponer([(libro_id, ejemplar_id)], fecha_devolucion, limite_recogida)
+            return libro_id, self._uno("titulo_libro", (libro_id,))[0]
+
+    def _reponer(self, devueltos, fecha, limite_recogida):
+        """Pasar los ejemplares devueltos a las reservas en espera y dejar disponibles los demás.
+
+        devueltos son (libro_id, ejemplar_id). Cada ejemplar va a la reserva más
+        antigua de su libro; los que nadie espera se liberan y se suman a
+        cantidad_disponible, que no cuenta los ejemplares reservados.
+        """
+        cola = {}
+        libros = sorted({libro_id for libro_id, ejemplar_id in devueltos if ejemplar_id is not None})
+        for bloque in _bloques(libros):
+            for reserva_id, libro_id, usuario_id in self._todos_en("reservas_en_espera", bloque):
+                cola.setdefault(libro_id, []).append((reserva_id, usuario_id))
+        asignaciones = []
+        eventos = []
+        libres = []
+        for libro_id, ejemplar_id in devueltos:
+            if ejemplar_id is not None and cola.get(libro_id):
+                reserva_id, usuario_id = cola[libro_id].pop(0)
+                asignaciones.append((ejemplar_id, fecha, limite_recogida, reserva_id))
+                eventos.append(("reserva.asignada", reserva_id, {
+                    "libro_id": libro_id, "usuario_id": usuario_id, "ejemplar_id": ejemplar_id,
+                    "fecha_limite": limite_recogida}))
+            else:
+                libres.append((libro_id, ejemplar_id))
+        if asignaciones:
+            for bloque in _bloques(sorted(asignacion[0] for asignacion in asignaciones)):
+                if self._ejecutar_en("reservar_ejemplares", bloque).rowcount != len(bloque):
+                    raise ErrorBD("Otro proceso modificó los ejemplares devueltos; vuelva a intentarlo")
+            if self._ejecutar_lote("asignar_reserva", asignaciones).rowcount != len(asignaciones):
+                raise ErrorBD("Otro proceso modificó las reservas; vuelva a intentarlo")
+            self._registrar_eventos(eventos)
+        self._liberar_ejemplares([ejemplar_id for _, ejemplar_id in libres])
+        reposiciones = Counter(libro_id for libro_id, _ in libres)
+        if reposiciones:
+            self._ejecutar_lote("reponer_ejemplares", [(n, libro_id) for libro_id, n in sorted(reposiciones.items())])
+
+    def _liberar_ejemplares(self, ejemplar_ids):
+        """Volver a dejar disponibles los ejemplares de préstamos devueltos"""
+        # Los préstamos anteriores al inventario por ejemplares no tienen ninguno
+        ejemplar_ids = sorted(ejemplar_id for ejemplar_id in ejemplar_ids if ejemplar_id is not None)
+        for bloque in _bloques(ejemplar_ids):
+            if self._ejecutar_en("liberar_ejemplares", bloque).rowcount != len(bloque):
+                raise ErrorBD("Otro proceso modificó los ejemplares devueltos; vuelva a intentarlo")
+
+    # === EJEMPLARES ===
+
+    def ejemplares(self, libro_id):
+        """Ejemplares del libro como (id, codigo, sucursal, estado, prestamo_id, usuario_id, vencimiento)"""
+        return self._todos("ejemplares_libro", (libro_id,))
+
+    def buscar_ejemplar(self, codigo):
+        """Resolver un código de barras leído en el ejemplar y su préstamo activo, o None.
+
+        Devuelve (ejemplar_id, codigo, sucursal, estado, libro_id, titulo,
+        prestamo_id, usuario_id, nombre, fecha_prestamo, fecha_vencimiento); las
+        columnas del préstamo son None si el ejemplar está en la estantería.
+        """
+        return self._uno("ejemplar_por_codigo", (codigo,))
+
+    # === CIRCULACIÓN EN LOTE ===
+
+    def devolver_lote(self, ids, por, fecha_devolucion, limite_recogida, usuario_id=None):
+        """Devolver muchos préstamos en una transacción.
+
+        ids son ids de préstamo; con por="libro", ids de libro (se devuelve el
+        préstamo activo más antiguo de cada uno; un libro repetido devuelve otro
+        ejemplar), y con por="codigo", códigos de barras de ejemplares. Con
+        usuario_id solo se aceptan préstamos de ese usuario. Los ejemplares pasan
+        a las reservas en espera como en devolver_prestamo. Devuelve una lista
+        alineada con ids de (prestamo_id, libro_id, titulo) o None.
+        """
+        consulta = f"prestamos_activos_por_{por}"
+        with self.transaccion():
+            candidatos = {}
+            # Orden fijo de bloqueo: dos lotes simultáneos no se bloquean mutuamente
+            for bloque in _bloques(sorted(set(ids))):
+                for clave, prestamo_id, libro_id, dueño, titulo, ejemplar_id in self._todos_en(consulta, bloque):
+                    if usuario_id is None or dueño == usuario_id:
+                        candidatos.setdefault(clave, []).append((prestamo_id, libro_id, titulo, ejemplar_id, dueño))
+            resultados = []
+            for id_ in ids:
+                pendientes = candidatos.get(id_)
+                resultados.append(pendientes.pop(0) if pendientes else None)
+            devueltos = sorted(resultado[0] for resultado in resultados if resultado)
+            for bloque in _bloques(devueltos):
+                if self._ejecutar_en("marcar_devueltos", bloque, (fecha_devolucion,)).rowcount != len(bloque):
+                    raise ErrorBD("Otro proceso modificó los préstamos del lote; vuelva a intentarlo")
+            self._registrar_eventos([_evento_devolucion(prestamo_id, libro_id, ejemplar_id, dueño, fecha_devolucion)
+                                     for prestamo_id, libro_id, _, ejemplar_id, dueño in filter(None, resultados)])
+            self._reponer([(resultado[1], resultado[3]) for resultado in resultados if resultado],
+                          fecha_devolucion, limite_recogida)
+            return [resultado[:3] if resultado else None for resultado in resultados]
+
+    def prestar_lote(self, usuario_id, libro_ids, fecha_prestamo, fecha_vencimiento):
+        """Prestar muchos libros a un usuario en una transacción.
+
+        Devuelve una lista alineada con libro_ids de (titulo, prestamo_id):
+        titulo es None si el libro no existe y prestamo_id es None si no quedaban
+        ejemplares (un libro repetido consume un ejemplar por aparición). Los
+        ejemplares que el usuario tiene reservados se prestan antes que los libres.
+        """
+        with self.transaccion():
+            titulos = {}
+            libres = {}
+            reservados = {}
+            for bloque in _bloques(sorted(set(libro_ids))):
+                for libro_id, titulo in self._todos_en("libros_para_prestar", bloque):
+                    titulos[libro_id] = titulo
+                for reserva_id, libro_id, ejemplar_id in self._todos_en("reservas_asignadas_lote", bloque, (usuario_id,)):
+                    reservados.setdefault(libro_id, []).append((reserva_id, ejemplar_id))
+                for ejemplar_id, libro_id in self._todos_en("ejemplares_para_prestar", bloque):
+                    libres.setdefault(libro_id, []).append(ejemplar_id)
+            resultados = []
+            prestados = []
+            recogidas = []
+            for libro_id in libro_ids:
+                titulo = titulos.get(libro_id)
+                if titulo is not None and reservados.get(libro_id):
+                    reserva_id, ejemplar_id = reservados[libro_id].pop(0)
+                    recogidas.append((reserva_id, ejemplar_id))
+                    prestados.append((libro_id, ejemplar_id))
+                    resultados.append([titulo, True])
+                elif titulo is not None and libres.get(libro_id):
+                    prestados.append((libro_id, libres[libro_id].pop(0)))
+                    resultados.append([titulo, True])
+                else:
+                    resultados.append([titulo, None])
+            if prestados:
+                if recogidas:
+                    self._recoger_reservas([reserva_id for reserva_id, _ in recogidas],
+                                           [ejemplar_id for _, ejemplar_id in recogidas])
+                de_reserva = {ejemplar_id for _, ejemplar_id in recogidas}
+                ocupados = sorted(ejemplar_id for _, ejemplar_id in prestados if ejemplar_id not in de_reserva)
+                # Solo se bloquean los ejemplares elegidos; si otro préstamo se adelantó se repite el lote
+                for bloque in _bloques(ocupados):
+                    if self._ejecutar_en("ocupar_ejemplares", bloque).rowcount != len(bloque):
+                        raise ErrorBD("Otro proceso prestó ejemplares del lote; vuelva a intentarlo")
+                ids = []
+                # 5 parámetros por préstamo
+                for bloque in _bloques(prestados, TAMAÑO_BLOQUE_IN // 5):
+                    ids.extend(self._insertar_prestamos(usuario_id, bloque, fecha_prestamo, fecha_vencimiento))
+                reservas = {ejemplar_id: reserva_id for reserva_id, ejemplar_id in recogidas}
+                self._registrar_eventos([
+                    _evento_prestamo(prestamo_id, libro_id, ejemplar_id, usuario_id, fecha_prestamo,
+                                     fecha_vencimiento, reservas.get(ejemplar_id))
+                    for prestamo_id, (libro_id, ejemplar_id) in zip(ids, prestados)])
+                pedidos = Counter(libro_id for libro_id, ejemplar_id in prestados if ejemplar_id not in de_reserva)
+                descuentos = [(n, libro_id, n) for libro_id, n in sorted(pedidos.items())]
+                if descuentos and self._ejecutar_lote("descontar_ejemplares", descuentos).rowcount != len(descuentos):
+                    raise ErrorBD("cantidad_disponible no coincide con los ejemplares del lote")
+                pendientes = iter(ids)
+                for resultado in resultados:
+                    if resultado[1]:
+                        resultado[1] = next(pendientes)
+            return [tuple(resultado) for resultado in resultados]
+
+    def _insertar_prestamos(self, usuario_id, prestados, fecha_prestamo, fecha_vencimiento):
+        """Insertar un préstamo por (libro_id, ejemplar_id) y devolver sus ids en orden"""
+        filas = [(libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento)
+                 for libro_id, ejemplar_id in prestados]
+        return self._insertar_filas("insertar_prestamos", "(%s, %s, %s, %s, %s, 'activo')", filas)
+
+    def _insertar_filas(self, nombre, plantilla, filas):
+        """Insertar filas con INSERT ... VALUES {filas} y devolver sus ids en orden.
+
+        Con RETURNING basta un único INSERT. Sin él se inserta fila a fila y se
+        toma el lastrowid de cada una: los ids de un INSERT de varias filas no
+        tienen por qué ser consecutivos (InnoDB con innodb_autoinc_lock_mode=2
+        los intercala con los de otras sesiones).
+        """
+        if self.backend.soporta_returning:
+            valores = ", ".join([self.backend.adaptar_sql(plantilla)] * len(filas))
+            params = [valor for fila in filas for valor in fila]
+            # Los ids se asignan en orden de inserción aunque RETURNING no garantice el orden
+            nombre = f"{nombre}_returning"
+            filas_ids = self._consulta(nombre, self._sql[nombre].format(filas=valores), params, _leer_todos)
+            return sorted(fila[0] for fila in filas_ids)
+        sentencia = self._sql[nombre].format(filas=self.backend.adaptar_sql(plantilla))
+        return [self._consulta(nombre, sentencia, fila).lastrowid for fila in filas]
+
+    # === DIARIO SIN CONEXIÓN ===
+
+    def aplicar_diario(self, operaciones, plazo, hoy, limite_recogida):
+        """Aplicar en una transacción las operaciones registradas sin conexión en un mostrador.
+
+        operaciones son (uuid, tipo, codigo_barras, usuario_id, fecha) en el orden
+        en que se hicieron; tipo es "prestamo" o "devolucion" y los préstamos
+        vencen a fecha + plazo. Se leen y bloquean todos los ejemplares y
+        préstamos afectados con una consulta por bloque, se resuelve el lote en
+        memoria y se escribe con unas pocas sentencias. Los conflictos no
+        detienen el lote:
+
+        - un uuid ya aplicado se omite (sincronización repetida);
+        - prestar un ejemplar que figura prestado a otro cierra ese préstamo en
+          la fecha del nuevo: el ejemplar estaba en el mostrador, así que su
+          devolución no llegó a registrarse;
+        - devolver un ejemplar sin préstamo activo, prestar uno apartado para una
+          reserva o a un usuario desconocido queda como conflicto para revisar.
+
+        Devuelve una lista alineada de (estado, detalle, prestamo_id, libro_id)
+        con estado "aplicada", "duplicada" o "conflicto".
+        """
+        with self.transaccion():
+            aplicadas = set()
+            ejemplares = {}
+            activos = {}
+            usuarios = set()
+            for bloque in _bloques(sorted({operacion[0] for operacion in operaciones})):
+                aplicadas.update(fila[0] for fila in self._todos_en("diario_aplicado", bloque))
+            # Orden fijo de bloqueo, como en los lotes del mostrador
+            for bloque in _bloques(sorted({operacion[2] for operacion in operaciones})):
+                for codigo, ejemplar_id, libro_id, estado in self._todos_en("ejemplares_por_codigos", bloque):
+                    ejemplares[codigo] = [ejemplar_id, libro_id, estado]
+                for codigo, prestamo_id, libro_id, usuario_id, _, ejemplar_id in self._todos_en(
+                        "prestamos_activos_por_codigo", bloque):
+                    activos[codigo] = {"id": prestamo_id, "libro_id": libro_id, "ejemplar_id": ejemplar_id,
+                                       "usuario_id": usuario_id, "fecha_devolucion": None}
+            for bloque in _bloques(sorted({operacion[3] for operacion in operaciones if operacion[3] is not None})):
+                usuarios.update(fila[0] for fila in self._todos_en("usuarios_existentes", bloque))
+            estado_inicial = {codigo: ejemplar[2] for codigo, ejemplar in ejemplares.items()}
+
+            resultados = []
+            nuevos = []
+            cerrados = []
+            # (tipo de evento, préstamo) en el orden de las operaciones
+            historia = []
+            procesadas = []
+
+            def cerrar(prestamo, fecha):
+                prestamo["fecha_devolucion"] = fecha
+                if prestamo["id"] is not None:
+                    cerrados.append(prestamo)
+                historia.append(("devuelto", prestamo))
+
+            for uuid, tipo, codigo, usuario_id, fecha in operaciones:
+                if uuid in aplicadas:
+                    resultados.append(["duplicada", "Ya procesada en una sincronización anterior", None, None])
+                    continue
+                aplicadas.add(uuid)
+                procesadas.append(uuid)
+                ejemplar = ejemplares.get(codigo)
+                if ejemplar is None:
+                    resultados.append(["conflicto", "Ejemplar desconocido", None, None])
+                    continue
+                ejemplar_id, libro_id, estado = ejemplar
+                actual = activos.get(codigo)
+                if tipo == "devolucion":
+                    if actual is None:
+                        resultados.append(["conflicto", "El ejemplar no estaba prestado", None, libro_id])
+                        continue
+                    cerrar(actual, fecha)
+                    del activos[codigo]
+                    ejemplar[2] = "disponible"
+                    resultados.append(["aplicada", None, actual, libro_id])
+                    continue
+                if usuario_id not in usuarios:
+                    resultados.append(["conflicto", "Usuario desconocido", None, libro_id])
+                    continue
+                if actual is not None and actual["usuario_id"] == usuario_id:
+                    resultados.append(["duplicada", "El ejemplar ya estaba prestado a este usuario", actual, libro_id])
+                    continue
+                detalle = None
+                if actual is not None:
+                    cerrar(actual, fecha)
+                    detalle = f"Se cerró el préstamo anterior del ejemplar (usuario {actual['usuario_id']})"
+                elif estado != "disponible":
+                    resultados.append(["conflicto", f"El ejemplar está {estado}", None, libro_id])
+                    continue
+                nuevo = {"id": None, "libro_id": libro_id, "ejemplar_id": ejemplar_id, "usuario_id": usuario_id,
+                         "fecha_prestamo": fecha, "fecha_vencimiento": fecha + plazo, "fecha_devolucion": None}
+                nuevos.append(nuevo)
+                historia.append(("creado", nuevo))
+                activos[codigo] = nuevo
+                ejemplar[2] = "prestado"
+                resultados.append(["aplicada", detalle, nuevo, libro_id])
+
+            if cerrados and self._ejecutar_lote("marcar_devuelto", [(prestamo["fecha_devolucion"], prestamo["id"])
+                                                                     for prestamo in cerrados]).rowcount != len(cerrados):
+                raise ErrorBD("Otro proceso modificó los préstamos del diario; vuelva a intentarlo")
+            # 7 parámetros por préstamo
+            for bloque in _bloques(nuevos, TAMAÑO_BLOQUE_IN // 7):
+                filas = [(prestamo["libro_id"], prestamo["ejemplar_id"], prestamo["usuario_id"],
+                          prestamo["fecha_prestamo"], prestamo["fecha_vencimiento"], prestamo["fecha_devolucion"],
+                          "activo" if prestamo["fecha_devolucion"] is None else "devuelto")
+                         for prestamo in bloque]
+                ids = self._insertar_filas("insertar_prestamos_diario", "(%s, %s, %s, %s, %s, %s, %s)", filas)
+                for prestamo, prestamo_id in zip(bloque, ids):
+                    prestamo["id"] = prestamo_id
+            self._registrar_eventos([
+                _evento_prestamo(prestamo["id"], prestamo["libro_id"], prestamo["ejemplar_id"], prestamo["usuario_id"],
+                                 prestamo["fecha_prestamo"], prestamo["fecha_vencimiento"]) if evento == "creado"
+                else _evento_devolucion(prestamo["id"], prestamo["libro_id"], prestamo["ejemplar_id"],
+                                        prestamo["usuario_id"], prestamo["fecha_devolucion"])
+                for evento, prestamo in historia])
+
+            # Solo cuenta el estado final de cada ejemplar frente al que tenía al empezar
+            ocupados = sorted((ejemplar[1], ejemplar[0]) for codigo, ejemplar in ejemplares.items()
+                              if estado_inicial[codigo] == "disponible" and ejemplar[2] == "prestado")
+            liberados = sorted((ejemplar[1], ejemplar[0]) for codigo, ejemplar in ejemplares.items()
+                               if estado_inicial[codigo] == "prestado" and ejemplar[2] == "disponible")
+            for bloque in _bloques(sorted(ejemplar_id for _, ejemplar_id in ocupados)):
+                if self._ejecutar_en("ocupar_ejemplares", bloque).rowcount != len(bloque):
+                    raise ErrorBD("Otro proceso prestó ejemplares del diario; vuelva a intentarlo")
+            descuentos = [(n, libro_id, n) for libro_id, n in sorted(Counter(libro_id for libro_id, _ in ocupados).items())]
+            if descuentos and self._ejecutar_lote("descontar_ejemplares", descuentos).rowcount != len(descuentos):
+                raise ErrorBD("cantidad_disponible no coincide con los ejemplares del diario")
+            # Los ejemplares devueltos pasan a las reservas en espera desde hoy, no desde la devolución
+            self._reponer(liberados, hoy, limite_recogida)
+            if procesadas:
+                aplicada = datetime.now().replace(microsecond=0)
+                self._ejecutar_lote("insertar_diario_aplicado", [(uuid, aplicada) for uuid in procesadas])
+            return [(estado, detalle, prestamo["id"] if prestamo else None, libro_id)
+                    for estado, detalle, prestamo, libro_id in resultados]
+
+    # === RESERVAS ===
+
+    def reservar(self, libro_id, usuario_id, ahora):
+        """Poner al usuario al final de la cola del libro y devolver (reserva_id, posicion).
+
+        Devuelve None si ya espera o tiene asignado un ejemplar del libro.
+        """
+        with self.transaccion():
+            self._uno("bloquear_usuario", (usuario_id,))
+            if self._uno("reserva_activa_usuario", (usuario_id, libro_id)) is not None:
+                return None
+            reserva_id = self._ejecutar("insertar_reserva", (libro_id, usuario_id, ahora)).lastrowid
+            return reserva_id, self._uno("posicion_reserva", (libro_id, reserva_id))[0]
+
+    def reservas_usuario(self, usuario_id):
+        """Reservas activas como (id, libro_id, titulo, estado, fecha, limite, codigo, posicion)"""
+        return self._todos("reservas_usuario", (usuario_id,))
+
+    def cancelar_reserva(self, reserva_id, usuario_id, fecha, limite_recogida):
+        """Cancelar una reserva activa del usuario y devolver su libro_id, o None.
+
+        Si ya tenía un ejemplar asignado, pasa a la siguiente reserva de la cola.
+        """
+        with self.transaccion():
+            fila = self._uno("reserva_usuario", (reserva_id, usuario_id))
+            if fila is None:
+                return None
+            libro_id, ejemplar_id = fila
+            self._ejecutar_en("terminar_reservas", [reserva_id], ("cancelada",))
+            if ejemplar_id is not None:
+                self._reponer([(libro_id, ejemplar_id)], fecha, limite_recogida)
+            return libro_id
+
+    def caducar_reservas(self, hoy, limite_recogida, tamaño_bloque):
+        """Caducar un bloque de reservas asignadas sin recoger y devolver sus libro_id.
+
+        Sus ejemplares pasan a la siguiente reserva (que puede recogerlos hasta
+        limite_recogida) o vuelven a estar disponibles.
+        """
+        with self.transaccion():
+            filas = self._todos("reservas_caducadas", (hoy, tamaño_bloque))
+            for bloque in _bloques([fila[0] for fila in filas]):
+                if self._ejecutar_en("terminar_reservas", bloque, ("caducada",)).rowcount != len(bloque):
+                    raise ErrorBD("Otro proceso modificó las reservas; vuelva a intentarlo")
+            self._reponer([(libro_id, ejemplar_id) for _, libro_id, ejemplar_id in filas], hoy, limite_recogida)
+            return [libro_id for _, libro_id, _ in filas]
+
+    def _recoger_reservas(self, reserva_ids, ejemplar_ids):
+        """Marcar como recogidas las reservas y como prestados sus ejemplares"""
+        for nombre, ids in (("recoger_reservas", reserva_ids), ("recoger_ejemplares", ejemplar_ids)):
+            for bloque in _bloques(sorted(ids)):
+                if self._ejecutar_en(nombre, bloque).rowcount != len(bloque):
+                    raise ErrorBD("Otro proceso modificó las reservas; vuelva a intentarlo")
+
+    # === EVENTOS ===
+
+    def _registrar_eventos(self, eventos):
+        """Añadir (tipo, entidad_id, datos) a la bandeja de salida en la transacción en curso.
+
+        Los eventos se confirman o se deshacen junto con el cambio que describen.
+        """
+        if not eventos:
+            return
+        creado = datetime.now().replace(microsecond=0)
+        self._ejecutar_lote("insertar_evento", [
+            (tipo, entidad_id, json.dumps(datos, ensure_ascii=False, default=str), creado)
+            for tipo, entidad_id, datos in eventos])
+
+    def eventos_desde(self, ultimo_id, limite):
+        """Siguientes eventos como (id, tipo, entidad_id, datos, creado), por orden de id"""
+        return self._todos("eventos_desde", (ultimo_id, limite))
+
+    def posicion_consumidor(self, consumidor):
+        """Último id de evento entregado por el consumidor (0 si es nuevo)"""
+        fila = self._uno("posicion_consumidor", (consumidor,))
+        return fila[0] if fila else 0
+
+    def guardar_posicion_consumidor(self, consumidor, ultimo_id, ahora):
+        with self.transaccion():
+            self._ejecutar("borrar_posicion_consumidor", (consumidor,))
+            self._ejecutar("insertar_posicion_consumidor", (consumidor, ultimo_id, ahora))
+
+    def purgar_eventos(self, antes_de):
+        """Borrar los eventos anteriores a antes_de ya entregados a todos los consumidores y devolver cuántos"""
+        with self.transaccion():
+            hasta = self._uno("posicion_minima_consumidores")[0]
+            if hasta is None:
+                # Sin consumidores registrados no se sabe qué falta por entregar
+                return 0
+            return self._ejecutar("purgar_eventos", (hasta, antes_de)).rowcount
+
+    # === RÉPLICAS Y SUCURSALES ===
+
+    def latido(self):
+        """Marca de tiempo del último latido aplicado en este nodo"""
+        return self._uno("latido")[0]
+
+    def marcar_latido(self, marca):
+        with self.transaccion():
+            self._ejecutar("marcar_latido", (marca,))
+
+    def disponibilidad(self, libro_ids):
+        """Devolver {libro_id: cantidad_disponible} de los libros presentes en este nodo"""
+        disponibles = {}
+        for bloque in _bloques(sorted(set(libro_ids))):
+            disponibles.update(self._todos_en("disponibilidad_libros", bloque))
+        return disponibles
+
+    def fijar_disponibilidad(self, cantidades):
+        """Sustituir cantidad_disponible de {libro_id: cantidad} (resumen del catálogo por sucursales)"""
+        with self.transaccion():
+            self._ejecutar_lote("fijar_disponible", [(cantidad, libro_id)
+                                                     for libro_id, cantidad in sorted(cantidades.items())])
+
+    # === MULTAS ===
+
+    def prestamos_para_multa(self, desde_id, corte, limite):
+        """Siguiente bloque de préstamos vencidos con la multa pendiente de (re)calcular"""
+        return self._todos("prestamos_para_multa", (desde_id, corte, corte, limite))
+
+    def aplicar_multas(self, grupos, trabajo, ultimo_id, procesados, ahora):
+        """Guardar un bloque de multas y avanzar el punto de control en la misma transacción.
+
+        grupos es {(dias_retraso, multa_centimos, calculada): [ids]}: los préstamos
+        con el mismo resultado se actualizan con una sola sentencia.
+        """
+        with self.transaccion():
+            for valores, ids in grupos.items():
+                for bloque in _bloques(ids):
+                    self._ejecutar_en("actualizar_multas", bloque, valores)
+            self._ejecutar("avanzar_punto_control", (ultimo_id, procesados, ahora, trabajo))
+
+    def punto_control(self, trabajo):
+        """Devolver (corte, ultimo_id, procesados, completado) del trabajo o None"""
+        return self._uno("punto_control", (trabajo,))
+
+    def iniciar_punto_control(self, trabajo, corte, ahora):
+        with self.transaccion():
+            self._ejecutar("borrar_punto_control", (trabajo,))
+            self._ejecutar("insertar_punto_control", (trabajo, corte, ahora))
+
+    def completar_punto_control(self, trabajo, ahora):
+        with self.transaccion():
+            self._ejecutar("completar_punto_control", (ahora, trabajo))
+
+    def fijar_punto_control(self, trabajo, corte, ultimo_id, procesados, ahora):
+        """Guardar de una vez el punto de control de un trabajo ya terminado"""
+        with self.transaccion():
+            self._ejecutar("borrar_punto_control", (trabajo,))
+            self._ejecutar("insertar_punto_control", (trabajo, corte, ahora))
+            self._ejecutar("avanzar_punto_control", (ultimo_id, procesados, ahora, trabajo))
+            self._ejecutar("completar_punto_control", (ahora, trabajo))
+
+    # === RECOMENDACIONES ===
+
+    def prestamos_lectores(self, desde_id, limite, archivo=False):
+        """Siguiente bloque de (id, usuario_id, libro_id) de préstamos (o del archivo) por orden de id"""
+        return self._todos("archivo_lectores" if archivo else "prestamos_lectores", (desde_id, limite))
+
+    def _pares(self, nombre, ids):
+        # Cada consulta lee prestamos y el archivo con la misma lista de ids: dos parámetros por id
+        pares = []
+        for bloque in _bloques(ids, TAMAÑO_BLOQUE_IN // 2):
+            pares.extend(self._todos_en(nombre, bloque, bloque))
+        return pares
+
+    def libros_de_lectores(self, usuario_ids):
+        """Pares (usuario_id, libro_id) distintos de los usuarios dados"""
+        return self._pares("libros_de_lectores", list(usuario_ids))
+
+    def lectores_de_libros(self, libro_ids):
+        """Pares (usuario_id, libro_id) distintos de los libros dados"""
+        return self._pares("lectores_de_libros", list(libro_ids))
+
+    def numero_lectores(self, libro_ids):
+        """{libro_id: usuarios distintos que lo han tomado prestado}"""
+        return dict(self._pares("numero_lectores", list(libro_ids)))
+
+    def guardar_recomendaciones(self, vecinos, tramo=None):
+        """Sustituir los vecinos de un bloque de libros: {libro_id: [(vecino_id, puntuacion)]}.
+
+        Con tramo (desde, hasta) se borran además los libros del tramo que ya
+        no tienen vecinos; si no, solo los del bloque.
+        """
+        filas = [(libro_id, posicion, vecino_id, puntuacion)
+                 for libro_id, lista in vecinos.items()
+                 for posicion, (vecino_id, puntuacion) in enumerate(lista, 1)]
+        with self.transaccion():
+            if tramo is not None:
+                self._ejecutar("borrar_recomendaciones_tramo", tramo)
+            else:
+                for bloque in _bloques(list(vecinos)):
+                    self._ejecutar_en("borrar_recomendaciones_libros", bloque)
+            if filas:
+                self._ejecutar_lote("insertar_recomendacion", filas)
+
+    def libros_prestados(self, usuario_id):
+        """Ids de los libros que el usuario tiene prestados ahora"""
+        return [fila[0] for fila in self._todos("libros_prestados_usuario", (usuario_id,))]
+
+    def recomendaciones_libros(self, libro_ids):
+        """Vecinos de los libros sumando sus puntuaciones, de mayor a menor"""
+        # La lista se usa dos veces (IN y NOT IN): dos parámetros por libro
+        libro_ids = list(libro_ids)[:TAMAÑO_BLOQUE_IN // 2]
+        if not libro_ids:
+            return []
+        return self._todos_en("recomendaciones_libros", libro_ids, libro_ids)
+
+    def recomendaciones_usuario(self, usuario_id, limite):
+        """Vecinos de los libros que el usuario tiene prestados, con una sola consulta"""
+        return self._todos("recomendaciones_usuario", (usuario_id, limite))
+
+    # === ARCHIVO ===
+
+    def prestamos_para_archivar(self, desde_id, corte, limite):
+        """Ids del siguiente bloque de préstamos devueltos antes del corte y ya sin multa pendiente"""
+        return [fila[0] for fila in self._todos("prestamos_para_archivar", (desde_id, corte, limite))]
+
+    def archivar_prestamos(self, ids, ahora):
+        """Mover los préstamos al archivo en una transacción y devolver cuántos se movieron"""
+        copiados = borrados = 0
+        with self.transaccion():
+            for bloque in _bloques(ids):
+                copiados += self._ejecutar_en("archivar_prestamos", bloque, (ahora,)).rowcount
+                borrados += self._ejecutar_en("borrar_prestamos_archivados", bloque).rowcount
+            if copiados != borrados:
+                raise ErrorBD(f"Archivo interrumpido: {copiados} préstamos copiados y {borrados} borrados")
+        return borrados
+
+    def historial(self, usuario_id, limite, despues_de=None):
+        """Página del historial del usuario (préstamos y archivo) tras la clave (fecha_prestamo, id)"""
+        if despues_de is None:
+            return self._todos("historial_usuario", (usuario_id, usuario_id, limite))
+        fecha, prestamo_id = despues_de
+        filtro = (usuario_id, fecha, fecha, prestamo_id)
+        return self._todos("historial_usuario_siguiente", (*filtro, *filtro, limite))
+
+    # === INFORMES ===
+
+    def informe(self, nombre, params=()):
+        return self._todos(f"informe_{nombre}", params)
+
+    def reconstruir_estadisticas(self):
+        """Recalcular los contadores desde prestamos (reparación; recorre todo el histórico)"""
+        with self.transaccion():
+            for tabla in ("libros", "usuarios"):
+                self._ejecutar(f"vaciar_estadisticas_{tabla}")
+                self._ejecutar(f"reconstruir_estadisticas_{tabla}")
+
+
+def _evento_libro(libro_id, libro, sucursal):
+    titulo, autor, isbn, editorial, año, categoria, cantidad = libro
+    return "libro.creado", libro_id, {
+        "titulo": titulo, "autor": autor, "isbn": isbn, "editorial": editorial, "año_publicacion": año,
+        "categoria": categoria, "ejemplares": cantidad, "sucursal": sucursal}
+
+
+def _evento_prestamo(prestamo_id, libro_id, ejemplar_id, usuario_id, fecha_prestamo, fecha_vencimiento,
+                     reserva_id=None):
+    return "prestamo.creado", prestamo_id, {
+        "libro_id": libro_id, "usuario_id": usuario_id, "ejemplar_id": ejemplar_id, "reserva_id": reserva_id,
+        "fecha_prestamo": fecha_prestamo, "fecha_vencimiento": fecha_vencimiento}
+
+
+def _evento_devolucion(prestamo_id, libro_id, ejemplar_id, usuario_id, fecha_devolucion):
+    return "prestamo.devuelto", prestamo_id, {
+        "libro_id": libro_id, "usuario_id": usuario_id, "ejemplar_id": ejemplar_id,
+        "fecha_devolucion": fecha_devolucion}
+
+
+def orden_listado(listado):
+    """(clave, descendente) para ordenar en Python las filas de un listado como lo hace su ORDER BY"""
+    (_, sentido, pos_a), (_, _, pos_b) = LISTADOS[listado]["orden"]
+    return (lambda fila: (fila[pos_a], fila[pos_b])), sentido == "DESC"
+
+
+def mezclar_listado(listado, partes):
+    """Unir en el orden del listado las filas leídas en varios nodos"""
+    clave, descendente = orden_listado(listado)
+    return sorted((fila for filas in partes for fila in filas), key=clave, reverse=descendente)
+
+
+def mezclar_paginas(listado, paginas, limite):
+    """Unir las páginas [(nodo, (filas, clave siguiente))] leídas en varios nodos en una sola página.
+
+    Cada nodo devuelve sus primeras filas tras el cursor, así que las primeras
+    del conjunto están entre ellas. Cada nodo numera sus propios ids, así que
+    entre nodos se ordena por (fecha, nodo, id) y esa es la clave siguiente.
+    """
+    clave, descendente = orden_listado(listado)
+    filas = sorted((((a, nodo, b), fila) for nodo, (filas_nodo, _) in paginas
+                    for fila in filas_nodo for a, b in [clave(fila)]),
+                   key=lambda par: par[0], reverse=descendente)
+    if len(filas) <= limite and all(ultima is None for _, (_, ultima) in paginas):
+        return [fila for _, fila in filas], None
+    filas = filas[:limite]
+    return [fila for _, fila in filas], filas[-1][0]
+
+
+def clave_en_nodo(clave, nodo, descendente):
+    """Traducir el cursor (a, nodo, b) de una mezcla entre nodos al cursor (a, b) de uno de ellos.
+
+    Las filas con la misma a de un nodo que va detrás del nodo del cursor aún
+    no se han visto; las de uno que va delante, ya sí.
+    """
+    a, nodo_cursor, b = clave
+    if nodo == nodo_cursor:
+        return a, b
+    detras = nodo < nodo_cursor if descendente else nodo > nodo_cursor
+    # Las consultas siguen con id < b si el orden es descendente y con id > b si es ascendente
+    todas, ninguna = (ID_SIN_LIMITE, 0) if descendente else (0, ID_SIN_LIMITE)
+    return a, todas if detras else ninguna
+
+
+def _bloques(valores, tamaño=TAMAÑO_BLOQUE_IN):
+    """Partir una lista para no superar el número de parámetros por sentencia"""
+    for inicio in range(0, len(valores), tamaño):
+        yield valores[inicio:inicio + tamaño]
+
+
+def _leer_uno(cursor):
+    return cursor.fetchone()
+
+
+def _leer_todos(cursor):
+    return cursor.fetchall()
@@ -0,0 +1,77 @@
+"""Caducidad de las reservas con ejemplar apartado que nadie recogió.
+
+Uso:
+    python reservas.py                          # hoy
+    python reservas.py --hoy 2024-06-30 --bloque 200
+
+Pensado para ejecutarse cada noche. Las reservas asignadas cuyo plazo de
+recogida terminó antes de hoy caducan y su ejemplar pasa a la siguiente
+reserva de la cola del libro o, si nadie espera, vuelve a estar disponible.
+Cada bloque se confirma por separado: si el trabajo se interrumpe no queda
+nada a medias y la siguiente ejecución continúa con las que falten.
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from almacenamiento import ErrorBD, crear_backend
+from repositorio import RepositorioBiblioteca
+from servicio import DIAS_RECOGIDA
+
+TAMAÑO_BLOQUE = 500
+
+
+def caducar_reservas(repo, hoy=None, tamaño_bloque=TAMAÑO_BLOQUE, progreso=None):
+    """Caducar por bloques las reservas no recogidas y devolver un resumen"""
+    hoy = hoy or datetime.now().date()
+    limite_recogida = hoy + timedelta(days=DIAS_RECOGIDA)
+    inicio = time.perf_counter()
+    libros = set()
+    resumen = {"hoy": hoy, "bloques": 0, "caducadas": 0}
+    while True:
+        # Los ejemplares reasignados vencen después de hoy: el bucle siempre termina
+        caducadas = repo.caducar_reservas(hoy, limite_recogida, tamaño_bloque)
+        if not caducadas:
+            break
+        libros.update(caducadas)
+        resumen["bloques"] += 1
+        resumen["caducadas"] += len(caducadas)
+        if progreso:
+            progreso(resumen)
+    resumen["libro_ids"] = sorted(libros)
+    resumen["segundos"] = round(time.perf_counter() - inicio, 3)
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hoy", type=date.fromisoformat, help="Fecha de referencia AAAA-MM-DD (por defecto, hoy)")
+    parser.add_argument("--bloque", type=int, default=TAMAÑO_BLOQUE, help="Reservas por bloque y por commit")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"])
+    args = parser.parse_args()
+    if args.bloque < 1:
+        parser.error("--bloque debe ser positivo")
+
+    backend = crear_backend(args.backend)
+    try:
+        connection = backend.conectar()
+    except ErrorBD as e:
+        print(f"✗ Error al conectar a la base de datos: {e}")
+        raise SystemExit(1)
+    try:
+        resumen = caducar_reservas(RepositorioBiblioteca(backend, connection), args.hoy, args.bloque,
+                                   lambda resumen: print(f"  bloque {resumen['bloques']}: "
+                                                         f"{resumen['caducadas']} reservas caducadas"))
+    except ErrorBD as e:
+        print(f"✗ Error al caducar reservas: {e}")
+        raise SystemExit(1)
+    finally:
+        backend.cerrar(connection)
+    print(f"✓ {resumen['caducadas']} reservas caducadas al {resumen['hoy']} en {resumen['segundos']} s")
+    print(json.dumps({clave: valor for clave, valor in resumen.items() if clave != "libro_ids"},
+                     ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Hash de contraseñas con sal y coste configurable.
+
+Formatos guardados en la columna password:
+    scrypt$<n>$<r>$<p>$<sal>$<hash>
+    pbkdf2_sha256$<iteraciones>$<sal>$<hash>
+    <64 dígitos hexadecimales>           (SHA-256 sin sal heredado; se rehashea al iniciar sesión)
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+
+ALGORITMOS = ("scrypt", "pbkdf2_sha256")
+LONGITUD_SAL = 16
+LONGITUD_HASH = 32
+
+
+def _b64(datos):
+    return base64.b64encode(datos).decode().rstrip("=")
+
+
+def _desde_b64(texto):
+    return base64.b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _es_sha256_heredado(password_hash):
+    return len(password_hash) == 64 and all(c in "0123456789abcdef" for c in password_hash.lower())
+
+
+class PoliticaHash:
+    """Algoritmo y costes con los que se hashean las contraseñas nuevas"""
+
+    def __init__(self, algoritmo="scrypt", n=2 ** 14, r=8, p=1, iteraciones=600_000):
+        if algoritmo not in ALGORITMOS:
+            raise ValueError(f"Algoritmo de hash desconocido: {algoritmo}")
+        self.algoritmo = algoritmo
+        self.n = n
+        self.r = r
+        self.p = p
+        self.iteraciones = iteraciones
+
+    def descripcion(self):
+        if self.algoritmo == "scrypt":
+            return f"scrypt n={self.n} r={self.r} p={self.p}"
+        return f"pbkdf2_sha256 iteraciones={self.iteraciones}"
+
+    def hash(self, password):
+        """Hashear la contraseña con una sal aleatoria"""
+        sal = secrets.token_bytes(LONGITUD_SAL)
+        if self.algoritmo == "scrypt":
+            derivada = _scrypt(password, sal, self.n, self.r, self.p)
+            return f"scrypt${self.n}${self.r}${self.p}${_b64(sal)}${_b64(derivada)}"
+        derivada = hashlib.pbkdf2_hmac("sha256", password.encode(), sal, self.iteraciones, LONGITUD_HASH)
+        return f"pbkdf2_sha256${self.iteraciones}${_b64(sal)}${_b64(derivada)}"
+
+    def necesita_rehash(self, password_hash):
+        """Indicar si el hash guardado usa otro algoritmo o un coste distinto al actual"""
+        partes = password_hash.split("$")
+        if self.algoritmo == "scrypt":
+            return partes[:4] != ["scrypt", str(self.n), str(self.r), str(self.p)]
+        return partes[:2] != ["pbkdf2_sha256", str(self.iteraciones)]
+
+
+def _scrypt(password, sal, n, r, p):
+    # scrypt usa 128·n·r bytes por hilo; se deja margen sobre el límite por defecto de 32 MiB
+    return hashlib.scrypt(password.encode(), salt=sal, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + 2 ** 20, dklen=LONGITUD_HASH)
+
+
+def verificar_password(password, password_hash):
+    """Verificar si la contraseña coincide con el hash, en cualquiera de los formatos"""
+    if not password_hash:
+        return False
+    if _es_sha256_heredado(password_hash):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), password_hash.lower())
+    partes = password_hash.split("$")
+    try:
+        if partes[0] == "scrypt" and len(partes) == 6:
+            n, r, p = int(partes[1]), int(partes[2]), int(partes[3])
+            derivada = _scrypt(password, _desde_b64(partes[4]), n, r, p)
+        elif partes[0] == "pbkdf2_sha256" and len(partes) == 4:
+            derivada = hashlib.pbkdf2_hmac("sha256", password.encode(), _desde_b64(partes[2]), int(partes[1]),
+                                           LONGITUD_HASH)
+        else:
+            return False
+        return hmac.compare_digest(derivada, _desde_b64(partes[-1]))
+    except ValueError:
+        return False
+
+
+def politica_desde_entorno():
+    """Política configurada con BIBLIOTECA_HASH_ALGORITMO y sus costes"""
+    return PoliticaHash(
+        algoritmo=os.environ.get("BIBLIOTECA_HASH_ALGORITMO", "scrypt"),
+        n=int(os.environ.get("BIBLIOTECA_SCRYPT_N", str(2 ** 14))),
+        r=int(os.environ.get("BIBLIOTECA_SCRYPT_R", "8")),
+        p=int(os.environ.get("BIBLIOTECA_SCRYPT_P", "1")),
+        iteraciones=int(os.environ.get("BIBLIOTECA_PBKDF2_ITERACIONES", "600000")),
+    )
+
+
+POLITICA = politica_desde_entorno()
+
+
+def hash_password(password, politica=None):
+    """Hashear la contraseña con sal usando la política configurada"""
+    return (politica or POLITICA).hash(password)
+
+
+def necesita_rehash(password_hash, politica=None):
+    return (politica or POLITICA).necesita_rehash(password_hash)
+
+
+def huella_token(token):
+    """SHA-256 de un token de acceso: son 256 bits aleatorios, no hace falta sal ni coste"""
+    return hashlib.sha256(token.encode()).hexdigest()
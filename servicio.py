@@ -0,0 +1,1063 @@
+import heapq
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+
+from almacenamiento import ErrorBD
+from cache import crear_cache
+from limites import crear_limitador
+from metricas import crear_metricas
+from paginacion import codificar_cursor, decodificar_cursor
+from repositorio import clave_en_nodo, mezclar_listado, mezclar_paginas, orden_listado
+from seguridad import POLITICA, huella_token, verificar_password
+from topologia import crear_topologia
+from validaciones import terminos_busqueda, validar_input, validar_libro, validar_password_nueva
+
+DIAS_PRESTAMO = 15
+# Días que un ejemplar devuelto queda apartado para la primera reserva de la cola
+DIAS_RECOGIDA = 3
+TABLAS_REQUERIDAS = ['administradores', 'usuarios', 'libros', 'prestamos']
+LIMITE_PAGINA_MAXIMO = 1000
+# Los resultados por relevancia se recorren con desplazamiento: se acota su profundidad
+BUSQUEDA_RESULTADOS_MAXIMOS = 1000
+COLUMNAS_BUSQUEDA = ("id", "titulo", "autor", "editorial", "categoria", "cantidad_disponible", "relevancia")
+COLUMNAS_LIBRO = ("id", "titulo", "autor", "isbn", "editorial", "año_publicacion", "categoria", "cantidad_disponible")
+COLUMNAS_EJEMPLAR = ("id", "codigo_barras", "sucursal", "estado", "prestamo_id", "usuario_id", "fecha_vencimiento")
+COLUMNAS_RESERVA = ("id", "libro_id", "titulo", "estado", "fecha_reserva", "fecha_limite", "codigo_barras",
+                    "posicion")
+COLUMNAS_RECOMENDACION = ("id", "titulo", "autor", "categoria", "cantidad_disponible", "puntuacion")
+RECOMENDACIONES_MAXIMAS = 50
+COLUMNAS_HISTORIAL = ("id", "libro_id", "titulo", "fecha_prestamo", "fecha_devolucion", "estado", "multa_centimos")
+COLUMNAS_CODIGO = ("ejemplar_id", "codigo_barras", "sucursal", "estado", "libro_id", "titulo", "prestamo_id",
+                   "usuario_id", "usuario", "fecha_prestamo", "fecha_vencimiento")
+
+# Operaciones de diario aplicadas por transacción al sincronizar un mostrador
+DIARIO_LOTE = 500
+TIPOS_DIARIO = ("prestamo", "devolucion")
+
+# Datos de los que depende cada resultado en caché; cada escritura invalida los suyos
+DEPENDENCIAS = {
+    "libros": ("catalogo", "disponibilidad"),
+    "libros_disponibles": ("catalogo", "disponibilidad"),
+    "busqueda": ("catalogo", "disponibilidad"),
+    "usuarios": ("usuarios",),
+    "prestamos": ("prestamos",),
+    "vencidos": ("prestamos", "multas"),
+}
+
+# Listado -> (rol requerido o None para cualquier sesión, nombres de columna)
+LISTADOS = {
+    "libros": ("administrador", ("id", "titulo", "autor", "editorial", "año_publicacion", "categoria",
+                                 "cantidad_disponible")),
+    "libros_disponibles": (None, ("id", "titulo", "autor", "editorial", "categoria", "cantidad_disponible")),
+    "usuarios": ("administrador", ("id", "nombre", "email", "telefono")),
+    "prestamos": ("administrador", ("id", "titulo", "usuario", "fecha_prestamo", "fecha_devolucion", "estado")),
+    "vencidos": ("administrador", ("id", "titulo", "usuario", "email", "fecha_prestamo", "fecha_vencimiento",
+                                   "dias_retraso", "multa_centimos")),
+}
+# Listados que leen préstamos: con sucursales se leen en cada una y se mezclan
+LISTADOS_CIRCULACION = ("prestamos", "vencidos")
+
+
+class ErrorBiblioteca(Exception):
+    """Error de negocio con un mensaje apto para mostrar al usuario"""
+
+
+class CredencialesInvalidas(ErrorBiblioteca):
+    """Usuario inexistente o contraseña incorrecta"""
+
+
+class SesionInvalida(ErrorBiblioteca):
+    """Token de sesión desconocido o caducado"""
+
+
+class PermisoDenegado(ErrorBiblioteca):
+    """La sesión no tiene el rol necesario para la operación"""
+
+
+class DatosInvalidos(ErrorBiblioteca):
+    """Los datos recibidos no superan las validaciones"""
+
+
+class NoDisponible(ErrorBiblioteca):
+    """El libro o préstamo solicitado no existe o no está en el estado esperado"""
+
+
+class DemasiadosIntentos(ErrorBiblioteca):
+    """Demasiados intentos de login desde el mismo origen o contra la misma cuenta"""
+
+    def __init__(self, espera):
+        super().__init__(f"Demasiados intentos; vuelva a intentarlo en {max(1, round(espera))} s")
+        self.espera = espera
+
+
+class Sesion:
+    """Usuario autenticado; no retiene ninguna conexión a la base de datos"""
+
+    __slots__ = ("token", "usuario_id", "tipo", "nombre", "expira")
+
+    def __init__(self, token, usuario_id, tipo, nombre, expira):
+        self.token = token
+        self.usuario_id = usuario_id
+        self.tipo = tipo
+        self.nombre = nombre
+        self.expira = expira
+
+    @property
+    def es_administrador(self):
+        return self.tipo == "administrador"
+
+
+def _filas(filas, columnas):
+    return [dict(zip(columnas, fila)) for fila in filas]
+
+
+def _operacion_diario(operacion, hoy):
+    """Validar una operación de diario y devolver (uuid, tipo, codigo_barras, usuario_id, fecha)"""
+    if not isinstance(operacion, dict):
+        raise DatosInvalidos("Operación mal formada")
+    uuid, tipo, codigo = operacion.get("uuid"), operacion.get("tipo"), operacion.get("codigo_barras")
+    if not isinstance(uuid, str) or not 1 <= len(uuid) <= 32:
+        raise DatosInvalidos("Identificador de operación inválido")
+    if tipo not in TIPOS_DIARIO:
+        raise DatosInvalidos(f"Tipo de operación desconocido: {tipo}")
+    if not isinstance(codigo, str) or not 1 <= len(codigo.strip()) <= 32:
+        raise DatosInvalidos("Código de barras inválido")
+    usuario_id = operacion.get("usuario_id")
+    if tipo == "prestamo" and (not isinstance(usuario_id, int) or usuario_id < 1):
+        raise DatosInvalidos("El préstamo necesita el id del usuario")
+    fecha = operacion.get("fecha")
+    try:
+        fecha = datetime.fromisoformat(fecha) if isinstance(fecha, str) else fecha
+    except ValueError:
+        fecha = None
+    if not isinstance(fecha, datetime):
+        raise DatosInvalidos("Fecha de operación inválida")
+    # Un reloj adelantado en el mostrador no debe crear préstamos en el futuro
+    if fecha.date() > hoy:
+        raise DatosInvalidos("La fecha de la operación es posterior a hoy")
+    return uuid, tipo, codigo.strip(), usuario_id if tipo == "prestamo" else None, fecha.date()
+
+
+class ServicioBiblioteca:
+    """Operaciones de la biblioteca por sesión sobre pools acotados de conexiones.
+
+    Sin topología (ni BIBLIOTECA_TOPOLOGIA) todo va a un único nodo con el
+    backend indicado; véase topologia.py para réplicas y sucursales.
+    """
+
+    def __init__(self, backend=None, tamaño_pool=10, duracion_sesion=8 * 3600, timeout_pool=30.0, cache=None,
+                 politica_hash=None, hilos_hash=None, metricas=None, topologia=None, limites=None):
+        # None desactiva la instrumentación: el repositorio y el pool no miden nada
+        self.metricas = metricas if metricas is not None else crear_metricas()
+        self.topologia = topologia or crear_topologia(backend, tamaño_pool, timeout_pool, self.metricas)
+        # El primario del catálogo identifica la instalación (caché, migraciones, métricas del pool)
+        self.backend = self.topologia.catalogo.primario.backend
+        self.pool = self.topologia.catalogo.primario.pool
+        self.cache = cache or crear_cache(self.backend.descripcion())
+        self.limites = limites or crear_limitador(self.backend.descripcion())
+        self.politica_hash = politica_hash or POLITICA
+        # El hash es CPU y memoria (scrypt): se limita a un hilo por núcleo para que
+        # una avalancha de logins no deje sin CPU al resto de peticiones
+        self._hasheo = ThreadPoolExecutor(max_workers=hilos_hash or os.cpu_count() or 2,
+                                          thread_name_prefix="hash")
+        # Hash de referencia para gastar el mismo tiempo cuando la cuenta no existe;
+        # se calcula en el primer login con contraseña (un script con token no lo paga)
+        self._hash_señuelo = None
+        self.duracion_sesion = duracion_sesion
+        self._sesiones = {}
+        # (sucursal, usuario_id) cuya fila ya está copiada en el nodo de la sucursal
+        self._usuarios_copiados = set()
+        self._lock = threading.Lock()
+
+    def _repo(self, lectura=False):
+        """Repositorio del catálogo; las lecturas que toleran retraso pueden ir a una réplica"""
+        return self.topologia.catalogo.repo(lectura)
+
+    def _grupo(self, sucursal=None):
+        try:
+            return self.topologia.circulacion(sucursal)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+
+    @contextmanager
+    def _repo_sucursal(self, sucursal=None, usuario_id=None, lectura=False):
+        """Repositorio con la circulación de la sucursal; antes copia allí la fila del usuario si falta"""
+        grupo = self._grupo(sucursal)
+        if usuario_id is not None and self.topologia.fragmentada:
+            self._copiar_usuario(grupo, usuario_id)
+        with grupo.repo(lectura) as repo:
+            yield repo
+
+    def _copiar_usuario(self, grupo, usuario_id):
+        if (grupo.nombre, usuario_id) in self._usuarios_copiados:
+            return
+        with self._repo() as repo:
+            usuario = repo.obtener_usuario(usuario_id)
+        if usuario is None:
+            return
+        with grupo.repo() as repo:
+            repo.copiar_usuario(usuario)
+        with self._lock:
+            self._usuarios_copiados.add((grupo.nombre, usuario_id))
+
+    def _en_sucursales(self, operacion, lectura=False):
+        """Ejecutar operacion(repo) en cada grupo con circulación y devolver [(sucursal, resultado)]"""
+        resultados = []
+        for sucursal, grupo in self.topologia.grupos_circulacion():
+            with grupo.repo(lectura) as repo:
+                resultados.append((sucursal, operacion(repo)))
+        return resultados
+
+    def _cursor_sucursales(self, cursor):
+        """Decodificar el cursor (a, sucursal, b) de una lectura que mezcla todas las sucursales"""
+        try:
+            despues_de = decodificar_cursor(cursor, longitud=3)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        if despues_de is not None and despues_de[1] not in dict(self.topologia.grupos_circulacion()):
+            raise DatosInvalidos("Cursor de paginación inválido")
+        return despues_de
+
+    def _paginas_sucursales(self, leer, despues_de, descendente):
+        """Ejecutar leer(repo, cursor) en cada sucursal con el cursor de la mezcla traducido al suyo"""
+        resultados = []
+        for sucursal, grupo in self.topologia.grupos_circulacion():
+            with grupo.repo(lectura=True) as repo:
+                resultados.append((sucursal, leer(repo, despues_de and clave_en_nodo(despues_de, sucursal,
+                                                                                      descendente))))
+        return resultados
+
+    def _conciliar_disponibilidad(self, libro_ids):
+        """Recalcular en el catálogo la disponibilidad de los libros como suma de las sucursales.
+
+        La sucursal decide si hay ejemplares; el catálogo solo guarda el resumen
+        que muestran los listados y la búsqueda.
+        """
+        if not self.topologia.fragmentada or not libro_ids:
+            return
+        cantidades = dict.fromkeys(libro_ids, 0)
+        for _, disponibles in self._en_sucursales(lambda repo: repo.disponibilidad(libro_ids)):
+            for libro_id, cantidad in disponibles.items():
+                cantidades[libro_id] += cantidad
+        with self._repo() as repo:
+            repo.fijar_disponibilidad(cantidades)
+
+    def cerrar(self):
+        """Cerrar las sesiones y las conexiones del pool"""
+        with self._lock:
+            self._sesiones.clear()
+        self._hasheo.shutdown(wait=True)
+        try:
+            if self.metricas is not None:
+                self.metricas.volcar(self._medidas_adicionales())
+        finally:
+            self.topologia.cerrar()
+
+    def migrar_esquema(self):
+        """Crear o actualizar las tablas e índices de cada primario y devolver las migraciones aplicadas"""
+        from migraciones import migrar
+        aplicadas = []
+        for nodo in self.topologia.primarios():
+            with nodo.pool.conexion() as connection:
+                aplicadas.extend(migrar(nodo.backend, connection))
+        return aplicadas
+
+    def tablas_faltantes(self):
+        """Devolver las tablas requeridas que no existen en la base de datos"""
+        with self.pool.conexion() as connection:
+            try:
+                existentes = self.backend.listar_tablas(connection)
+            except self.backend.Error as e:
+                raise ErrorBD(str(e)) from e
+        return [tabla for tabla in TABLAS_REQUERIDAS if tabla not in existentes]
+
+    # === SESIONES ===
+
+    def _abrir_sesion(self, usuario_id, tipo, nombre):
+        sesion = Sesion(secrets.token_urlsafe(32), usuario_id, tipo, nombre,
+                        time.monotonic() + self.duracion_sesion)
+        with self._lock:
+            self._sesiones[sesion.token] = sesion
+        return sesion
+
+    def sesion(self, token):
+        """Devolver la sesión activa del token y renovar su caducidad"""
+        if isinstance(token, Sesion):
+            token = token.token
+        ahora = time.monotonic()
+        with self._lock:
+            sesion = self._sesiones.get(token)
+            if sesion is None or sesion.expira < ahora:
+                self._sesiones.pop(token, None)
+                raise SesionInvalida("Sesión inválida o caducada")
+            sesion.expira = ahora + self.duracion_sesion
+            return sesion
+
+    def cerrar_sesion(self, sesion):
+        token = sesion.token if isinstance(sesion, Sesion) else sesion
+        with self._lock:
+            self._sesiones.pop(token, None)
+
+    def purgar_sesiones(self):
+        """Eliminar las sesiones caducadas y devolver cuántas quedan"""
+        ahora = time.monotonic()
+        with self._lock:
+            for token in [t for t, s in self._sesiones.items() if s.expira < ahora]:
+                del self._sesiones[token]
+            return len(self._sesiones)
+
+    def _requiere(self, sesion, tipo=None):
+        sesion = self.sesion(sesion)
+        if tipo is not None and sesion.tipo != tipo:
+            raise PermisoDenegado(f"Operación no permitida para una cuenta de tipo {sesion.tipo}")
+        return sesion
+
+    # === CONTRASEÑAS ===
+
+    def _hash(self, password):
+        """Hashear en el grupo de hilos de hash sin retener ninguna conexión"""
+        return self._hasheo.submit(self.politica_hash.hash, password).result()
+
+    def _verificar(self, password, password_hash):
+        return self._hasheo.submit(verificar_password, password, password_hash).result()
+
+    def _comprobar_cuenta(self, tipo, cuenta_id, nombre, password, password_hash):
+        """Abrir sesión si la contraseña es correcta y actualizar hashes antiguos"""
+        if not self._verificar(password, password_hash):
+            return None
+        if self.politica_hash.necesita_rehash(password_hash):
+            # SHA-256 heredado o coste anterior: se rehashea ahora que se conoce la contraseña
+            nuevo = self._hash(password)
+            with self._repo() as repo:
+                repo.actualizar_password(tipo, cuenta_id, password_hash, nuevo)
+        return self._abrir_sesion(cuenta_id, tipo, nombre)
+
+    # === LOGIN ===
+
+    def _señuelo(self):
+        if self._hash_señuelo is None:
+            señuelo = self._hash(secrets.token_hex(8))
+            with self._lock:
+                if self._hash_señuelo is None:
+                    self._hash_señuelo = señuelo
+        return self._hash_señuelo
+
+    def _admitir(self, cuenta, origen, coste_origen=1):
+        """Rechazar el intento sin tocar la base si el origen o la cuenta agotaron sus fichas"""
+        espera = self.limites.admitir(cuenta, origen, coste_origen)
+        if espera:
+            raise DemasiadosIntentos(espera)
+
+    def login(self, username, password, origen=None):
+        """Login unificado con una sola consulta: primero administradores, luego usuarios.
+
+        origen identifica al cliente (su dirección) para limitar los intentos.
+        """
+        username = validar_input(username or "")
+        if not username or not password:
+            raise CredencialesInvalidas("Username/Email y password son requeridos")
+        self._admitir(username, origen)
+        # Antes de la consulta, exista o no la cuenta: el primer intento no delata nada
+        señuelo = self._señuelo()
+        if self.limites.es_desconocida(username):
+            cuentas = []
+        else:
+            with self._repo() as repo:
+                cuentas = repo.buscar_credenciales(username)
+        if not cuentas:
+            # Mismo coste que una contraseña incorrecta: no revela qué cuentas existen
+            self.limites.anotar_desconocida(username)
+            self._verificar(password, señuelo)
+        for tipo, cuenta_id, nombre, password_hash in cuentas:
+            sesion = self._comprobar_cuenta(tipo, cuenta_id, nombre, password, password_hash)
+            if sesion is not None:
+                return sesion
+        self.limites.fallo(username)
+        raise CredencialesInvalidas("Credenciales incorrectas o usuario no encontrado")
+
+    def login_token(self, token, origen=None):
+        """Abrir sesión con un token de acceso: sin contraseña ni hash lento, para scripts"""
+        if not token:
+            raise CredencialesInvalidas("Token de acceso requerido")
+        # Un token válido no cuesta nada: el origen solo gasta fichas con los inválidos
+        self._admitir(None, origen, coste_origen=0)
+        with self._repo() as repo:
+            cuenta = repo.buscar_token_api(huella_token(token))
+        if cuenta is None:
+            self.limites.fallo(None, origen, coste_origen=1)
+            raise CredencialesInvalidas("Token de acceso inválido o revocado")
+        tipo, cuenta_id, nombre = cuenta
+        return self._abrir_sesion(cuenta_id, tipo, nombre)
+
+    # === TOKENS DE ACCESO ===
+
+    def crear_token_api(self, sesion, descripcion=""):
+        """Crear un token permanente para la cuenta de la sesión; solo se muestra esta vez"""
+        sesion = self._requiere(sesion)
+        descripcion = validar_input(descripcion or "")[:100]
+        token = secrets.token_urlsafe(32)
+        with self._repo() as repo:
+            repo.insertar_token_api(huella_token(token), sesion.tipo, sesion.usuario_id, descripcion,
+                                    datetime.now().replace(microsecond=0))
+        return {"token": token, "tipo": sesion.tipo, "descripcion": descripcion}
+
+    def revocar_token_api(self, sesion, token):
+        """Revocar un token propio; un administrador puede revocar cualquiera"""
+        sesion = self._requiere(sesion)
+        huella = huella_token(token or "")
+        with self._repo() as repo:
+            cuenta = repo.buscar_token_api(huella)
+            if cuenta is not None and not sesion.es_administrador and cuenta[:2] != (sesion.tipo, sesion.usuario_id):
+                cuenta = None
+            if cuenta is None or not repo.borrar_token_api(huella):
+                raise NoDisponible("Token no encontrado o no te pertenece")
+        return {"revocado": True}
+
+    # === ADMINISTRACIÓN ===
+
+    def hay_administradores(self):
+        with self._repo() as repo:
+            return repo.hay_administradores()
+
+    def registrar_libro(self, sesion, titulo, autor, isbn, editorial, año, categoria, cantidad, sucursal=None):
+        """Registrar un libro con un ejemplar por unidad en la sucursal y devolver su id.
+
+        Con sucursales, la ficha se da de alta en el catálogo y los ejemplares
+        (con una copia de la ficha) en el nodo de la sucursal.
+        """
+        self._requiere(sesion, "administrador")
+        try:
+            datos = validar_libro(titulo, autor, isbn, editorial, año, categoria, cantidad)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        sucursal = self.topologia.sucursal_por_defecto if sucursal is None else validar_input(str(sucursal))
+        if not sucursal or len(sucursal) > 50:
+            raise DatosInvalidos("La sucursal es obligatoria y admite como máximo 50 caracteres")
+        if not self.topologia.fragmentada:
+            with self._repo() as repo:
+                libro_id = repo.insertar_libro(*datos, sucursal=sucursal)
+            self.cache.invalidar("catalogo")
+            return libro_id
+        grupo = self._grupo(sucursal)
+        with self._repo() as repo:
+            libro_id = repo.insertar_libro(*datos, sucursal=sucursal, con_ejemplares=False)
+        try:
+            with grupo.repo() as repo:
+                repo.copiar_libro(libro_id, datos, sucursal)
+        except ErrorBD:
+            # La ficha queda en el catálogo sin ejemplares disponibles
+            self._conciliar_disponibilidad([libro_id])
+            raise
+        finally:
+            self.cache.invalidar("catalogo")
+        return libro_id
+
+    def registrar_usuario(self, sesion, nombre, email, password, telefono="", direccion="", confirmacion=None):
+        """Registrar un usuario con la contraseña hasheada y devolver su id"""
+        self._requiere(sesion, "administrador")
+        nombre = validar_input(nombre or "")
+        email = validar_input(email or "")
+        if not nombre or not email or not password:
+            raise DatosInvalidos("Nombre, email y password son campos requeridos")
+        try:
+            validar_password_nueva(password, confirmacion)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        # El hash se calcula antes de pedir la conexión para no retenerla mientras tanto
+        password_hash = self._hash(password)
+        with self._repo() as repo:
+            if repo.existe_usuario(email):
+                raise DatosInvalidos("El email ya está registrado")
+            usuario_id = repo.insertar_usuario(nombre, email, password_hash,
+                                               validar_input(telefono or ""), validar_input(direccion or ""))
+        self.limites.olvidar_desconocida(email)
+        self.cache.invalidar("usuarios")
+        return usuario_id
+
+    def registrar_administrador(self, sesion, username, password, nombre, email, confirmacion=None):
+        """Registrar un administrador; sin sesión solo se permite el primero"""
+        if sesion is not None or self.hay_administradores():
+            self._requiere(sesion, "administrador")
+        username = validar_input(username or "")
+        nombre = validar_input(nombre or "")
+        email = validar_input(email or "")
+        if not username or not password or not nombre or not email:
+            raise DatosInvalidos("Todos los campos son requeridos")
+        try:
+            validar_password_nueva(password, confirmacion)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        password_hash = self._hash(password)
+        with self._repo() as repo:
+            if repo.existe_administrador(username):
+                raise DatosInvalidos("El username ya está registrado")
+            administrador_id = repo.insertar_administrador(username, password_hash, nombre, email)
+        self.limites.olvidar_desconocida(username)
+        return administrador_id
+
+    def importar_catalogo(self, sesion, ruta, formato=None, tamaño_lote=1000, ruta_rechazos=None, progreso=None):
+        """Importar libros desde un archivo CSV, JSON Lines o MARC por lotes"""
+        from importacion import importar_archivo
+        self._requiere(sesion, "administrador")
+        if self.topologia.fragmentada:
+            raise DatosInvalidos("Con sucursales el catálogo se importa en cada nodo con importacion.py")
+        try:
+            with self._repo() as repo:
+                try:
+                    return importar_archivo(repo, ruta, formato, tamaño_lote, ruta_rechazos, progreso=progreso)
+                except (ValueError, OSError) as e:
+                    raise DatosInvalidos(str(e)) from e
+        finally:
+            # Cada lote se confirma por separado: aunque falle a mitad, parte del catálogo cambió
+            self.cache.invalidar("catalogo")
+
+    def listar_libros(self, sesion):
+        return self._listar(sesion, "libros")
+
+    def listar_usuarios(self, sesion):
+        return self._listar(sesion, "usuarios")
+
+    def listar_prestamos(self, sesion):
+        return self._listar(sesion, "prestamos")
+
+    # === LISTADOS PAGINADOS ===
+
+    def _listado(self, sesion, listado):
+        if listado not in LISTADOS:
+            raise DatosInvalidos(f"Listado desconocido: {listado}")
+        rol, columnas = LISTADOS[listado]
+        self._requiere(sesion, rol)
+        return columnas
+
+    def _consultar(self, clave, dependencias, cargar, circulacion=False, sucursal=None, combinar=None):
+        """Leer a través de la caché; cargar(repo) solo se ejecuta si falta el resultado.
+
+        Se lee del catálogo o, con circulacion, del grupo de la sucursal; si hay
+        sucursales y no se indica ninguna, de todas, uniendo sus resultados con
+        combinar. Admite el retraso de las réplicas.
+        """
+        def desde_base():
+            if circulacion and sucursal is None and self.topologia.fragmentada:
+                return combinar([resultado for _, resultado in self._en_sucursales(cargar, lectura=True)])
+            with (self._repo_sucursal(sucursal, lectura=True) if circulacion else self._repo(lectura=True)) as repo:
+                return cargar(repo)
+        return self.cache.obtener(clave, dependencias, desde_base)
+
+    def _listar(self, sesion, listado):
+        columnas = self._listado(sesion, listado)
+        filas = self._consultar(("listar", listado), DEPENDENCIAS[listado],
+                                lambda repo: getattr(repo, f"listar_{listado}")(),
+                                circulacion=listado in LISTADOS_CIRCULACION,
+                                combinar=lambda partes: mezclar_listado(listado, partes))
+        return _filas(filas, columnas)
+
+    def pagina(self, sesion, listado, limite=50, cursor=None):
+        """Devolver una página del listado y el token para pedir la siguiente.
+
+        La paginación es por clave (continúa después de la última fila vista),
+        así que el coste de cada página no crece con su posición en la tabla.
+        """
+        columnas = self._listado(sesion, listado)
+        if not isinstance(limite, int) or not 1 <= limite <= LIMITE_PAGINA_MAXIMO:
+            raise DatosInvalidos(f"El tamaño de página debe estar entre 1 y {LIMITE_PAGINA_MAXIMO}")
+        if listado in LISTADOS_CIRCULACION and self.topologia.fragmentada:
+            # Los ids se repiten entre sucursales: el cursor lleva también la sucursal
+            despues_de = self._cursor_sucursales(cursor)
+            descendente = orden_listado(listado)[1]
+            filas, ultima = self.cache.obtener(
+                ("pagina", listado, limite, despues_de), DEPENDENCIAS[listado],
+                lambda: mezclar_paginas(listado, self._paginas_sucursales(
+                    lambda repo, despues: repo.pagina(listado, limite, despues), despues_de, descendente), limite))
+            return {"filas": _filas(filas, columnas), "siguiente": codificar_cursor(ultima)}
+        try:
+            despues_de = decodificar_cursor(cursor)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        filas, ultima = self._consultar(("pagina", listado, limite, despues_de), DEPENDENCIAS[listado],
+                                        lambda repo: repo.pagina(listado, limite, despues_de),
+                                        circulacion=listado in LISTADOS_CIRCULACION)
+        return {"filas": _filas(filas, columnas), "siguiente": codificar_cursor(ultima)}
+
+    def iterar(self, sesion, listado, tamaño_bloque=500):
+        """Generar todas las filas del listado con memoria constante.
+
+        Retiene una conexión del pool hasta agotar o cerrar el generador.
+        """
+        columnas = self._listado(sesion, listado)
+        return self._iterar(listado, columnas, tamaño_bloque)
+
+    def _iterar(self, listado, columnas, tamaño_bloque):
+        if listado in LISTADOS_CIRCULACION and self.topologia.fragmentada:
+            # Una conexión por sucursal; las filas se mezclan en el orden del listado
+            clave, descendente = orden_listado(listado)
+            fuentes = [self._iterar_grupo(grupo, listado, tamaño_bloque)
+                       for _, grupo in self.topologia.grupos_circulacion()]
+            for fila in heapq.merge(*fuentes, key=clave, reverse=descendente):
+                yield dict(zip(columnas, fila))
+            return
+        for fila in self._iterar_grupo(self.topologia.catalogo, listado, tamaño_bloque):
+            yield dict(zip(columnas, fila))
+
+    def _iterar_grupo(self, grupo, listado, tamaño_bloque):
+        with grupo.repo(lectura=True) as repo:
+            yield from repo.iterar(listado, tamaño_bloque)
+
+    def buscar_libros(self, sesion, texto, limite=20, cursor=None):
+        """Buscar en título, autor, editorial, categoría e ISBN ordenando por relevancia.
+
+        Cada palabra se busca por prefijo y sin distinguir tildes ni mayúsculas;
+        solo aparecen los libros que contienen todas las palabras.
+        """
+        self._requiere(sesion)
+        if not isinstance(limite, int) or not 1 <= limite <= LIMITE_PAGINA_MAXIMO:
+            raise DatosInvalidos(f"El tamaño de página debe estar entre 1 y {LIMITE_PAGINA_MAXIMO}")
+        try:
+            terminos = terminos_busqueda(texto)
+            desplazamiento = decodificar_cursor(cursor, longitud=1)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        desplazamiento = desplazamiento[0] if desplazamiento else 0
+        if not isinstance(desplazamiento, int) or not 0 <= desplazamiento < BUSQUEDA_RESULTADOS_MAXIMOS:
+            raise DatosInvalidos("Cursor de paginación inválido")
+        limite = min(limite, BUSQUEDA_RESULTADOS_MAXIMOS - desplazamiento)
+        filas, hay_mas = self._consultar(("busqueda", tuple(terminos), limite, desplazamiento),
+                                         DEPENDENCIAS["busqueda"],
+                                         lambda repo: repo.buscar_libros(terminos, limite, desplazamiento))
+        siguiente = desplazamiento + len(filas)
+        return {
+            "filas": _filas(filas, COLUMNAS_BUSQUEDA),
+            "siguiente": codificar_cursor((siguiente,)) if hay_mas and siguiente < BUSQUEDA_RESULTADOS_MAXIMOS else None,
+        }
+
+    def obtener_libro(self, sesion, libro_id):
+        """Devolver la ficha de un libro con sus ejemplares disponibles"""
+        self._requiere(sesion)
+        fila = self._consultar(("libro", libro_id), ("catalogo", f"libro:{libro_id}"),
+                               lambda repo: repo.obtener_libro(libro_id))
+        if fila is None:
+            raise NoDisponible("Libro no encontrado")
+        return dict(zip(COLUMNAS_LIBRO, fila))
+
+    def ejemplares(self, sesion, libro_id):
+        """Ejemplares de un libro con su estado y, si están prestados, el préstamo activo"""
+        self._requiere(sesion, "administrador")
+        filas = [fila for _, parte in self._en_sucursales(lambda repo: repo.ejemplares(libro_id)) for fila in parte]
+        if not filas:
+            raise NoDisponible("Libro no encontrado o sin ejemplares")
+        return _filas(filas, COLUMNAS_EJEMPLAR)
+
+    def buscar_ejemplar(self, sesion, codigo):
+        """Resolver un código de barras leído en el mostrador: ejemplar, libro y préstamo activo"""
+        self._requiere(sesion, "administrador")
+        codigo = validar_input(codigo or "")
+        if not codigo:
+            raise DatosInvalidos("Indique el código de barras")
+        for _, grupo in self.topologia.grupos_circulacion():
+            with grupo.repo() as repo:
+                fila = repo.buscar_ejemplar(codigo)
+            if fila is not None:
+                return dict(zip(COLUMNAS_CODIGO, fila))
+        raise NoDisponible("Código de barras desconocido")
+
+    def conciliar_disponibilidad(self, sesion, tamaño_bloque=500):
+        """Recalcular la disponibilidad de todo el catálogo a partir de las sucursales (reparación)"""
+        self._requiere(sesion, "administrador")
+        libros = 0
+        if self.topologia.fragmentada:
+            with self._repo() as repo:
+                ids = [fila[0] for fila in repo.iterar("libros", tamaño_bloque)]
+            for inicio in range(0, len(ids), tamaño_bloque):
+                self._conciliar_disponibilidad(ids[inicio:inicio + tamaño_bloque])
+            libros = len(ids)
+            self.cache.invalidar("disponibilidad")
+        return {"libros": libros}
+
+    def _filas_sucursales(self, resultados, columnas):
+        """Unir las filas leídas en cada sucursal; con sucursales cada fila indica la suya"""
+        filas = []
+        for sucursal, parte in resultados:
+            for fila in _filas(parte, columnas):
+                if self.topologia.fragmentada:
+                    fila["sucursal"] = sucursal
+                filas.append(fila)
+        return filas
+
+    # === PRÉSTAMOS ===
+
+    def listar_libros_disponibles(self, sesion):
+        return self._listar(sesion, "libros_disponibles")
+
+    def registrar_prestamo(self, sesion, libro_id, sucursal=None):
+        """Prestar al usuario de la sesión un ejemplar del libro en la sucursal"""
+        sesion = self._requiere(sesion, "usuario")
+        fecha_prestamo = datetime.now().date()
+        fecha_vencimiento = fecha_prestamo + timedelta(days=DIAS_PRESTAMO)
+        with self._repo_sucursal(sucursal, sesion.usuario_id) as repo:
+            resultado = repo.registrar_prestamo(libro_id, sesion.usuario_id, fecha_prestamo, fecha_vencimiento)
+        if resultado is None:
+            raise NoDisponible("Libro no disponible o no encontrado; puede reservarlo")
+        self._conciliar_disponibilidad([libro_id])
+        self.cache.invalidar("disponibilidad", "prestamos", f"libro:{libro_id}")
+        return {
+            "prestamo_id": resultado[0],
+            "titulo": resultado[1],
+            "codigo_barras": resultado[2],
+            "fecha_prestamo": fecha_prestamo,
+            "fecha_devolucion_estimada": fecha_vencimiento,
+        }
+
+    def devolver_libro(self, sesion, prestamo_id, sucursal=None):
+        """Devolver un préstamo activo del usuario de la sesión.
+
+        Con sucursales, los ids de préstamo son propios de cada una: se busca
+        en la indicada (la que acompaña al préstamo en mis_prestamos_activos).
+        """
+        sesion = self._requiere(sesion, "usuario")
+        fecha_devolucion = datetime.now().date()
+        with self._repo_sucursal(sucursal) as repo:
+            resultado = repo.devolver_prestamo(prestamo_id, sesion.usuario_id, fecha_devolucion,
+                                               fecha_devolucion + timedelta(days=DIAS_RECOGIDA))
+        if resultado is None:
+            raise NoDisponible("Préstamo no encontrado, ya devuelto o no te pertenece")
+        libro_id, titulo = resultado
+        self._conciliar_disponibilidad([libro_id])
+        self.cache.invalidar("disponibilidad", "prestamos", f"libro:{libro_id}")
+        return {"prestamo_id": prestamo_id, "titulo": titulo, "fecha_devolucion": fecha_devolucion}
+
+    # === RESERVAS ===
+
+    def reservar(self, sesion, libro_id, sucursal=None):
+        """Poner al usuario de la sesión en la cola de un libro sin ejemplares disponibles.
+
+        Al devolverse un ejemplar se aparta para la reserva más antigua durante
+        DIAS_RECOGIDA días; registrar_prestamo lo entrega a su titular. Así no
+        hace falta reintentar el préstamo hasta que haya stock.
+        """
+        sesion = self._requiere(sesion, "usuario")
+        with self._repo_sucursal(sucursal, sesion.usuario_id) as repo:
+            disponibles = repo.cantidad_disponible(libro_id)
+            if disponibles is None:
+                raise NoDisponible("Libro no encontrado")
+            if disponibles > 0:
+                raise DatosInvalidos("Hay ejemplares disponibles: solicite el préstamo")
+            reserva = repo.reservar(libro_id, sesion.usuario_id, datetime.now().replace(microsecond=0))
+        if reserva is None:
+            raise DatosInvalidos("Ya tiene una reserva de este libro")
+        reserva_id, posicion = reserva
+        return {"reserva_id": reserva_id, "libro_id": libro_id, "posicion": posicion}
+
+    def mis_reservas(self, sesion):
+        """Reservas activas del usuario: posición en la cola o ejemplar apartado y plazo"""
+        sesion = self._requiere(sesion, "usuario")
+        return self._filas_sucursales(self._en_sucursales(lambda repo: repo.reservas_usuario(sesion.usuario_id)),
+                                      COLUMNAS_RESERVA)
+
+    def cancelar_reserva(self, sesion, reserva_id, sucursal=None):
+        """Cancelar una reserva; un ejemplar ya apartado pasa a la siguiente de la cola"""
+        sesion = self._requiere(sesion, "usuario")
+        hoy = datetime.now().date()
+        with self._repo_sucursal(sucursal) as repo:
+            libro_id = repo.cancelar_reserva(reserva_id, sesion.usuario_id, hoy, hoy + timedelta(days=DIAS_RECOGIDA))
+        if libro_id is None:
+            raise NoDisponible("Reserva no encontrada, ya terminada o no te pertenece")
+        self._conciliar_disponibilidad([libro_id])
+        self.cache.invalidar("disponibilidad", f"libro:{libro_id}")
+        return {"reserva_id": reserva_id, "libro_id": libro_id}
+
+    def caducar_reservas(self, sesion, hoy=None, tamaño_bloque=None, progreso=None):
+        """Caducar las reservas no recogidas a tiempo; es el trabajo de python reservas.py"""
+        from reservas import TAMAÑO_BLOQUE, caducar_reservas
+        self._requiere(sesion, "administrador")
+        resultados = self._en_sucursales(lambda repo: caducar_reservas(repo, hoy, tamaño_bloque or TAMAÑO_BLOQUE,
+                                                                       progreso))
+        resumen = self._combinar_resumenes(resultados, ("bloques", "caducadas", "segundos"))
+        resumen["libro_ids"] = sorted({libro_id for _, parte in resultados for libro_id in parte["libro_ids"]})
+        if resumen["libro_ids"]:
+            self._conciliar_disponibilidad(resumen["libro_ids"])
+            self.cache.invalidar("disponibilidad", *(f"libro:{libro_id}" for libro_id in resumen["libro_ids"]))
+        return resumen
+
+    def _combinar_resumenes(self, resultados, sumar):
+        """Resumen de un trabajo ejecutado en cada sucursal: suma los contadores y conserva el detalle"""
+        if not self.topologia.fragmentada:
+            return resultados[0][1]
+        resumen = dict(resultados[0][1])
+        for clave in sumar:
+            resumen[clave] = sum(parte[clave] for _, parte in resultados)
+        resumen["sucursales"] = dict(resultados)
+        return resumen
+
+    # === CIRCULACIÓN EN LOTE ===
+
+    def _invalidar_circulacion(self, resumen):
+        libros = {item["libro_id"] for item in resumen["items"] if item["ok"]}
+        if libros:
+            self._conciliar_disponibilidad(sorted(libros))
+            self.cache.invalidar("disponibilidad", "prestamos", *(f"libro:{libro_id}" for libro_id in sorted(libros)))
+
+    def devolver_lote(self, sesion, ids, por="prestamo", sucursal=None):
+        """Devolver muchos préstamos en una transacción e informar del resultado de cada uno.
+
+        En el mostrador (sesión de administrador) se acepta cualquier préstamo
+        activo; un usuario solo puede devolver los suyos. Con por="libro" cada id
+        es un libro escaneado y se devuelve su préstamo activo más antiguo; con
+        por="codigo", el código de barras del ejemplar concreto. Con sucursales,
+        el lote se aplica en la sucursal del mostrador.
+        """
+        from circulacion import devolver_lote
+        sesion = self._requiere(sesion)
+        usuario_id = None if sesion.es_administrador else sesion.usuario_id
+        try:
+            with self._repo_sucursal(sucursal) as repo:
+                resumen = devolver_lote(repo, list(ids or ()), por, usuario_id)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        self._invalidar_circulacion(resumen)
+        return resumen
+
+    def prestar_lote(self, sesion, libro_ids, usuario_id=None, sucursal=None):
+        """Prestar muchos libros en una transacción; el mostrador indica el usuario"""
+        from circulacion import prestar_lote
+        sesion = self._requiere(sesion)
+        if sesion.es_administrador:
+            if usuario_id is None:
+                raise DatosInvalidos("Indique el usuario al que se prestan los libros")
+        elif usuario_id not in (None, sesion.usuario_id):
+            raise PermisoDenegado("Solo puede registrar préstamos a su nombre")
+        else:
+            usuario_id = sesion.usuario_id
+        try:
+            with self._repo_sucursal(sucursal, usuario_id) as repo:
+                resumen = prestar_lote(repo, usuario_id, list(libro_ids or ()))
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        self._invalidar_circulacion(resumen)
+        return resumen
+
+    def sincronizar_diario(self, sesion, operaciones, tamaño_lote=DIARIO_LOTE):
+        """Aplicar las operaciones de un diario de mostrador registradas sin conexión.
+
+        Cada operación es un dict con uuid, tipo ("prestamo" o "devolucion"),
+        codigo_barras, usuario_id (en los préstamos), fecha y, con sucursales,
+        sucursal. Se aplican por orden en transacciones de tamaño_lote; véase
+        RepositorioBiblioteca.aplicar_diario para la resolución de conflictos.
+        """
+        inicio = time.perf_counter()
+        self._requiere(sesion, "administrador")
+        hoy = datetime.now().date()
+        items = []
+        grupos = {}
+        for operacion in operaciones:
+            try:
+                valida = _operacion_diario(operacion, hoy)
+            except DatosInvalidos as e:
+                items.append({"uuid": operacion.get("uuid") if isinstance(operacion, dict) else None,
+                              "estado": "conflicto", "detalle": str(e)})
+                continue
+            items.append({"uuid": valida[0]})
+            sucursal = operacion.get("sucursal") if self.topologia.fragmentada else None
+            grupos.setdefault(sucursal, []).append((len(items) - 1, valida))
+        for sucursal, pendientes in grupos.items():
+            grupo = self._grupo(sucursal)
+            if self.topologia.fragmentada:
+                for usuario_id in sorted({valida[3] for _, valida in pendientes if valida[3] is not None}):
+                    self._copiar_usuario(grupo, usuario_id)
+            for inicio_lote in range(0, len(pendientes), tamaño_lote):
+                lote = pendientes[inicio_lote:inicio_lote + tamaño_lote]
+                with grupo.repo() as repo:
+                    resultados = repo.aplicar_diario([valida for _, valida in lote], timedelta(days=DIAS_PRESTAMO),
+                                                     hoy, hoy + timedelta(days=DIAS_RECOGIDA))
+                for (posicion, _), (estado, detalle, prestamo_id, libro_id) in zip(lote, resultados):
+                    items[posicion].update(estado=estado, detalle=detalle, prestamo_id=prestamo_id, libro_id=libro_id)
+        for item in items:
+            item["ok"] = item["estado"] != "conflicto"
+        resumen = {estado: sum(1 for item in items if item["estado"] == estado)
+                   for estado in ("aplicada", "duplicada", "conflicto")}
+        resumen.update(segundos=round(time.perf_counter() - inicio, 4), items=items)
+        self._invalidar_circulacion({"items": [item for item in items if item.get("libro_id") is not None]})
+        return resumen
+
+    def mis_prestamos_activos(self, sesion):
+        sesion = self._requiere(sesion, "usuario")
+        return self._filas_sucursales(
+            self._en_sucursales(lambda repo: repo.prestamos_activos(sesion.usuario_id)),
+            ("id", "titulo", "fecha_prestamo", "autor", "fecha_devolucion_estimada", "dias_retraso", "multa_centimos"))
+
+    # === INFORMES ===
+
+    def informe(self, sesion, nombre, limite=20, sucursal=None):
+        """Devolver un informe de circulación leído de los contadores materializados.
+
+        Con sucursales, los contadores son los de una sucursal (la indicada o la principal).
+        """
+        from informes import INFORMES, generar_informe
+        self._requiere(sesion, "administrador")
+        if self.topologia.fragmentada:
+            sucursal = sucursal or self.topologia.sucursal_por_defecto
+        try:
+            columnas, filas = self._consultar(("informe", nombre, limite, sucursal),
+                                              ("catalogo", "disponibilidad", "prestamos"),
+                                              lambda repo: generar_informe(repo, nombre, limite),
+                                              circulacion=True, sucursal=sucursal)
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        return {"informe": nombre, "descripcion": INFORMES[nombre][0], "columnas": list(columnas),
+                "filas": _filas(filas, columnas)}
+
+    def reconstruir_estadisticas(self, sesion):
+        """Recalcular los contadores de los informes recorriendo todo el histórico"""
+        self._requiere(sesion, "administrador")
+        self._en_sucursales(lambda repo: repo.reconstruir_estadisticas())
+        self.cache.invalidar("prestamos")
+
+    # === MULTAS ===
+
+    def listar_vencidos(self, sesion):
+        return self._listar(sesion, "vencidos")
+
+    def procesar_vencidos(self, sesion, corte=None, tamaño_bloque=None, reiniciar=False, progreso=None):
+        """Calcular las multas de los préstamos vencidos hasta la fecha de corte.
+
+        Es el mismo trabajo por bloques que python multas.py, en cada sucursal;
+        retiene una conexión del pool mientras dura.
+        """
+        from multas import TAMAÑO_BLOQUE, procesar_vencidos
+        self._requiere(sesion, "administrador")
+        try:
+            resultados = self._en_sucursales(
+                lambda repo: procesar_vencidos(repo, corte, tamaño_bloque=tamaño_bloque or TAMAÑO_BLOQUE,
+                                               reiniciar=reiniciar, progreso=progreso))
+        except (ValueError, OSError) as e:
+            raise DatosInvalidos(str(e)) from e
+        finally:
+            self.cache.invalidar("multas")
+        resumen = self._combinar_resumenes(resultados, ("bloques", "procesados", "con_multa",
+                                                        "multa_total_centimos", "segundos"))
+        if self.topologia.fragmentada:
+            resumen["prestamos_por_segundo"] = (round(resumen["procesados"] / resumen["segundos"], 1)
+                                                if resumen["segundos"] else None)
+        return resumen
+
+    # === RECOMENDACIONES ===
+
+    def recomendaciones(self, sesion, libro_id=None, limite=10):
+        """Libros que también se llevaron los lectores de un libro o, sin libro, de los préstamos activos del usuario"""
+        sesion = self._requiere(sesion, None if libro_id is not None else "usuario")
+        if not isinstance(limite, int) or not 1 <= limite <= RECOMENDACIONES_MAXIMAS:
+            raise DatosInvalidos(f"El límite debe estar entre 1 y {RECOMENDACIONES_MAXIMAS}")
+        if libro_id is not None:
+            filas = self._consultar(("recomendaciones", libro_id), ("recomendaciones", "catalogo", "disponibilidad"),
+                                    lambda repo: repo.recomendaciones_libros([libro_id]))[:limite]
+        elif self.topologia.fragmentada:
+            # Los préstamos están en las sucursales y los vecinos en el catálogo
+            libro_ids = {libro_id for _, libros in self._en_sucursales(
+                lambda repo: repo.libros_prestados(sesion.usuario_id), lectura=True) for libro_id in libros}
+            with self._repo(lectura=True) as repo:
+                filas = repo.recomendaciones_libros(sorted(libro_ids))[:limite]
+        else:
+            with self._repo(lectura=True) as repo:
+                filas = repo.recomendaciones_usuario(sesion.usuario_id, limite)
+        return _filas(filas, COLUMNAS_RECOMENDACION)
+
+    def recalcular_recomendaciones(self, sesion, completo=False, vecinos=None, motor="auto", progreso=None):
+        """Actualizar el índice de recomendaciones como python recomendaciones.py.
+
+        Lee los préstamos de cada sucursal y escribe los vecinos en el catálogo;
+        retiene una conexión de cada grupo mientras dura.
+        """
+        from recomendaciones import VECINOS, actualizar_recomendaciones
+        self._requiere(sesion, "administrador")
+        with ExitStack() as pila:
+            destino = pila.enter_context(self._repo())
+            fuentes = [destino] if not self.topologia.fragmentada else [
+                pila.enter_context(grupo.repo()) for _, grupo in self.topologia.grupos_circulacion()]
+            try:
+                resumen = actualizar_recomendaciones(destino, fuentes, completo, vecinos or VECINOS, motor=motor,
+                                                     progreso=progreso)
+            except ValueError as e:
+                raise DatosInvalidos(str(e)) from e
+            finally:
+                self.cache.invalidar("recomendaciones")
+        return resumen
+
+    # === ARCHIVO ===
+
+    def historial_prestamos(self, sesion, usuario_id=None, limite=50, cursor=None):
+        """Página del historial de préstamos, del más reciente al más antiguo, incluidos los archivados.
+
+        Un usuario ve el suyo; un administrador indica de quién.
+        """
+        sesion = self._requiere(sesion)
+        if not sesion.es_administrador:
+            if usuario_id not in (None, sesion.usuario_id):
+                raise PermisoDenegado("Solo puedes consultar tu propio historial")
+            usuario_id = sesion.usuario_id
+        elif usuario_id is None:
+            raise DatosInvalidos("Indica el usuario del historial")
+        if not isinstance(limite, int) or not 1 <= limite <= LIMITE_PAGINA_MAXIMO:
+            raise DatosInvalidos(f"El tamaño de página debe estar entre 1 y {LIMITE_PAGINA_MAXIMO}")
+        # Orden (fecha_prestamo, sucursal, id): los ids se repiten entre sucursales
+        despues_de = self._cursor_sucursales(cursor)
+        partes = self._paginas_sucursales(lambda repo, despues: repo.historial(usuario_id, limite, despues),
+                                          despues_de, descendente=True)
+        filas = list(heapq.merge(*([((fila[3], sucursal, fila[0]), fila) for fila in filas]
+                                   for sucursal, filas in partes),
+                                 key=lambda par: par[0], reverse=True))[:limite]
+        return {
+            "filas": self._filas_sucursales([(clave[1], [fila]) for clave, fila in filas], COLUMNAS_HISTORIAL),
+            "siguiente": codificar_cursor(filas[-1][0]) if len(filas) == limite else None,
+        }
+
+    def archivar_prestamos(self, sesion, dias=None, tamaño_lote=None, pausa=None, progreso=None):
+        """Mover al archivo los préstamos devueltos hace más de dias días, como python archivo.py, en cada sucursal"""
+        from archivo import DIAS_ARCHIVO, PAUSA, TAMAÑO_LOTE, archivar_prestamos
+        self._requiere(sesion, "administrador")
+        try:
+            resultados = self._en_sucursales(
+                lambda repo: archivar_prestamos(repo, DIAS_ARCHIVO if dias is None else dias,
+                                                tamaño_lote or TAMAÑO_LOTE, PAUSA if pausa is None else pausa,
+                                                progreso=progreso))
+        except ValueError as e:
+            raise DatosInvalidos(str(e)) from e
+        finally:
+            self.cache.invalidar("prestamos")
+        resumen = self._combinar_resumenes(resultados, ("lotes", "archivados", "segundos"))
+        if self.topologia.fragmentada:
+            resumen["prestamos_por_segundo"] = (round(resumen["archivados"] / resumen["segundos"], 1)
+                                                if resumen["segundos"] else None)
+        return resumen
+
+    # === MÉTRICAS ===
+
+    def _medidas_adicionales(self):
+        pool = self.pool.estadisticas()
+        cache = self.cache.estadisticas()
+        return (
+            ("biblioteca_pool_conexiones", "gauge", "Conexiones abiertas por el pool", pool["creadas"]),
+            ("biblioteca_pool_libres", "gauge", "Conexiones abiertas sin prestar", pool["libres"]),
+            ("biblioteca_cache_aciertos_total", "counter", "Lecturas servidas desde la caché", cache["aciertos"]),
+            ("biblioteca_cache_fallos_total", "counter", "Lecturas que fueron a la base de datos", cache["fallos"]),
+            ("biblioteca_sesiones", "gauge", "Sesiones abiertas", len(self._sesiones)),
+            ("biblioteca_logins_rechazados_total", "counter", "Logins rechazados por exceso de intentos",
+             self.limites.rechazos),
+        )
+
+    def _requiere_metricas(self):
+        if self.metricas is None:
+            raise NoDisponible("Las métricas están desactivadas (active BIBLIOTECA_METRICAS=1)")
+        return self.metricas
+
+    def metricas_prometheus(self):
+        """Métricas en el formato de exposición de Prometheus (sin datos personales)"""
+        return self._requiere_metricas().exposicion(self._medidas_adicionales())
+
+    def resumen_metricas(self, sesion):
+        """Latencias por consulta, espera del pool, caché y últimas consultas lentas"""
+        self._requiere(sesion, "administrador")
+        metricas = self._requiere_metricas()
+        return dict(metricas.resumen(), cache=self.cache.estadisticas(), lentas=metricas.consultas_lentas())
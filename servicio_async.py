@@ -0,0 +1,128 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from servicio import ServicioBiblioteca
+
+
+class ServicioBibliotecaAsync:
+    """Variante asyncio del servicio: las llamadas bloqueantes se ejecutan en hilos.
+
+    Los hilos del ejecutor se limitan al tamaño del pool de conexiones, de modo
+    que miles de corrutinas pueden esperar en el bucle de eventos mientras solo
+    tantas operaciones como conexiones hay ocupan un hilo a la vez.
+    """
+
+    def __init__(self, servicio=None, backend=None, tamaño_pool=10, **opciones):
+        self.servicio = servicio or ServicioBiblioteca(backend, tamaño_pool=tamaño_pool, **opciones)
+        self._executor = ThreadPoolExecutor(max_workers=self.servicio.pool.tamaño,
+                                            thread_name_prefix="biblioteca")
+
+    async def _llamar(self, metodo, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(metodo, *args))
+
+    async def cerrar(self):
+        self._executor.shutdown(wait=True)
+        self.servicio.cerrar()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.cerrar()
+
+    # === LOGIN ===
+
+    async def login(self, username, password, origen=None):
+        return await self._llamar(self.servicio.login, username, password, origen)
+
+    async def login_token(self, token, origen=None):
+        return await self._llamar(self.servicio.login_token, token, origen)
+
+    def cerrar_sesion(self, sesion):
+        # Solo toca memoria; no necesita pasar por el ejecutor
+        self.servicio.cerrar_sesion(sesion)
+
+    # === ADMINISTRACIÓN ===
+
+    async def registrar_libro(self, sesion, titulo, autor, isbn, editorial, año, categoria, cantidad):
+        return await self._llamar(self.servicio.registrar_libro, sesion, titulo, autor, isbn,
+                                  editorial, año, categoria, cantidad)
+
+    async def registrar_usuario(self, sesion, nombre, email, password, telefono="", direccion=""):
+        return await self._llamar(self.servicio.registrar_usuario, sesion, nombre, email, password,
+                                  telefono, direccion)
+
+    async def listar_libros(self, sesion):
+        return await self._llamar(self.servicio.listar_libros, sesion)
+
+    async def listar_usuarios(self, sesion):
+        return await self._llamar(self.servicio.listar_usuarios, sesion)
+
+    async def listar_prestamos(self, sesion):
+        return await self._llamar(self.servicio.listar_prestamos, sesion)
+
+    async def pagina(self, sesion, listado, limite=50, cursor=None):
+        return await self._llamar(self.servicio.pagina, sesion, listado, limite, cursor)
+
+    async def buscar_libros(self, sesion, texto, limite=20, cursor=None):
+        return await self._llamar(self.servicio.buscar_libros, sesion, texto, limite, cursor)
+
+    async def obtener_libro(self, sesion, libro_id):
+        return await self._llamar(self.servicio.obtener_libro, sesion, libro_id)
+
+    async def ejemplares(self, sesion, libro_id):
+        return await self._llamar(self.servicio.ejemplares, sesion, libro_id)
+
+    async def buscar_ejemplar(self, sesion, codigo):
+        return await self._llamar(self.servicio.buscar_ejemplar, sesion, codigo)
+
+    async def conciliar_disponibilidad(self, sesion):
+        return await self._llamar(self.servicio.conciliar_disponibilidad, sesion)
+
+    # === PRÉSTAMOS ===
+
+    async def listar_libros_disponibles(self, sesion):
+        return await self._llamar(self.servicio.listar_libros_disponibles, sesion)
+
+    async def registrar_prestamo(self, sesion, libro_id, sucursal=None):
+        return await self._llamar(self.servicio.registrar_prestamo, sesion, libro_id, sucursal)
+
+    async def devolver_libro(self, sesion, prestamo_id, sucursal=None):
+        return await self._llamar(self.servicio.devolver_libro, sesion, prestamo_id, sucursal)
+
+    async def reservar(self, sesion, libro_id, sucursal=None):
+        return await self._llamar(self.servicio.reservar, sesion, libro_id, sucursal)
+
+    async def mis_reservas(self, sesion):
+        return await self._llamar(self.servicio.mis_reservas, sesion)
+
+    async def cancelar_reserva(self, sesion, reserva_id, sucursal=None):
+        return await self._llamar(self.servicio.cancelar_reserva, sesion, reserva_id, sucursal)
+
+    async def devolver_lote(self, sesion, ids, por="prestamo", sucursal=None):
+        return await self._llamar(self.servicio.devolver_lote, sesion, ids, por, sucursal)
+
+    async def prestar_lote(self, sesion, libro_ids, usuario_id=None, sucursal=None):
+        return await self._llamar(self.servicio.prestar_lote, sesion, libro_ids, usuario_id, sucursal)
+
+    async def mis_prestamos_activos(self, sesion):
+        return await self._llamar(self.servicio.mis_prestamos_activos, sesion)
+
+    async def listar_vencidos(self, sesion):
+        return await self._llamar(self.servicio.listar_vencidos, sesion)
+
+    async def historial_prestamos(self, sesion, usuario_id=None, limite=50, cursor=None):
+        return await self._llamar(self.servicio.historial_prestamos, sesion, usuario_id, limite, cursor)
+
+    # === INFORMES ===
+
+    async def informe(self, sesion, nombre, limite=20, sucursal=None):
+        return await self._llamar(self.servicio.informe, sesion, nombre, limite, sucursal)
+
+    async def recomendaciones(self, sesion, libro_id=None, limite=10):
+        return await self._llamar(self.servicio.recomendaciones, sesion, libro_id, limite)
+
+    async def resumen_metricas(self, sesion):
+        return await self._llamar(self.servicio.resumen_metricas, sesion)
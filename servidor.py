@@ -0,0 +1,365 @@
+"""Modo servicio sin interfaz: API HTTP/JSON multi-sesión sobre ServicioBiblioteca.
+
+Uso:
+    python servidor.py --puerto 8080 --pool 20
+
+Cada terminal obtiene un token con POST /sesiones (username y password, o
+token_api con un token de POST /tokens) y lo envía en la cabecera
+"Authorization: Bearer <token>". Todas las terminales comparten el mismo pool
+acotado de conexiones.
+
+Los listados (GET /libros, /libros/disponibles, /usuarios, /prestamos) se
+devuelven por páginas: ?limite=100&cursor=<siguiente>. Con ?formato=ndjson se
+transmiten completos, una fila JSON por línea, con memoria constante.
+GET /libros/busqueda?q=<texto> busca en el catálogo ordenando por relevancia.
+GET /recomendaciones sugiere libros a partir de los préstamos activos del
+usuario (o, con ?libro_id=, de los lectores de ese libro).
+GET /prestamos/historial pagina todo el historial del usuario, incluidos los
+préstamos archivados (un administrador indica ?usuario_id=).
+Con BIBLIOTECA_METRICAS=1, GET /metricas expone las métricas para Prometheus.
+"""
+import argparse
+import json
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from almacenamiento import ErrorBD, crear_backend
+from servicio import (CredencialesInvalidas, DatosInvalidos, DemasiadosIntentos, ErrorBiblioteca, NoDisponible,
+                      PermisoDenegado, ServicioBiblioteca, SesionInvalida)
+from validaciones import validar_numero
+
+LIMITE_PAGINA_HTTP = 100
+
+ESTADOS_HTTP = {
+    CredencialesInvalidas: 401,
+    SesionInvalida: 401,
+    PermisoDenegado: 403,
+    DatosInvalidos: 400,
+    NoDisponible: 409,
+    DemasiadosIntentos: 429,
+}
+
+
+def _sesion_publica(sesion):
+    return {"token": sesion.token, "tipo": sesion.tipo, "nombre": sesion.nombre, "usuario_id": sesion.usuario_id}
+
+
+class ManejadorBiblioteca(BaseHTTPRequestHandler):
+    """Traduce peticiones HTTP a llamadas del servicio"""
+
+    servicio = None
+    protocol_version = "HTTP/1.1"
+
+    # (método, ruta) -> nombre del método del manejador
+    RUTAS = {
+        ("POST", "/sesiones"): "crear_sesion",
+        ("DELETE", "/sesiones"): "cerrar_sesion",
+        ("POST", "/tokens"): "crear_token_api",
+        ("DELETE", "/tokens"): "revocar_token_api",
+        ("GET", "/libros"): "listar_libros",
+        ("POST", "/libros"): "registrar_libro",
+        ("GET", "/libros/disponibles"): "listar_libros_disponibles",
+        ("GET", "/libros/busqueda"): "buscar_libros",
+        ("GET", "/libros/detalle"): "obtener_libro",
+        ("GET", "/libros/ejemplares"): "ejemplares",
+        ("GET", "/ejemplares"): "buscar_ejemplar",
+        ("POST", "/libros/disponibilidad"): "conciliar_disponibilidad",
+        ("GET", "/usuarios"): "listar_usuarios",
+        ("POST", "/usuarios"): "registrar_usuario",
+        ("POST", "/administradores"): "registrar_administrador",
+        ("GET", "/prestamos"): "listar_prestamos",
+        ("POST", "/prestamos"): "registrar_prestamo",
+        ("GET", "/prestamos/activos"): "mis_prestamos_activos",
+        ("GET", "/prestamos/vencidos"): "listar_vencidos",
+        ("GET", "/prestamos/historial"): "historial_prestamos",
+        ("GET", "/informes"): "informe",
+        ("GET", "/recomendaciones"): "recomendaciones",
+        ("POST", "/reservas"): "reservar",
+        ("GET", "/reservas"): "mis_reservas",
+        ("DELETE", "/reservas"): "cancelar_reserva",
+        ("POST", "/devoluciones"): "devolver_libro",
+        ("POST", "/devoluciones/lote"): "devolver_lote",
+        ("POST", "/prestamos/lote"): "prestar_lote",
+        ("GET", "/metricas"): "metricas_prometheus",
+        ("GET", "/metricas/resumen"): "resumen_metricas",
+    }
+
+    def _token(self):
+        cabecera = self.headers.get("Authorization", "")
+        return cabecera[7:] if cabecera.startswith("Bearer ") else None
+
+    def _cuerpo(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        if not longitud:
+            return {}
+        try:
+            cuerpo = json.loads(self.rfile.read(longitud))
+        except ValueError:
+            raise DatosInvalidos("El cuerpo debe ser JSON válido") from None
+        if not isinstance(cuerpo, dict):
+            raise DatosInvalidos("El cuerpo debe ser un objeto JSON")
+        return cuerpo
+
+    def _transmitir(self, filas):
+        """Enviar un generador de filas como NDJSON con codificación chunked"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for fila in filas:
+                linea = json.dumps(fila, default=str, ensure_ascii=False).encode() + b"\n"
+                self.wfile.write(f"{len(linea):X}\r\n".encode() + linea + b"\r\n")
+        except ErrorBD:
+            # Las cabeceras ya salieron: se corta el flujo para que el cliente lo detecte
+            self.close_connection = True
+            return
+        finally:
+            filas.close()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _responder(self, estado, datos, cabeceras=()):
+        cuerpo = json.dumps(datos, default=str, ensure_ascii=False).encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        for nombre, valor in cabeceras:
+            self.send_header(nombre, valor)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _responder_texto(self, texto):
+        cuerpo = texto.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _despachar(self, metodo):
+        ruta, _, consulta = self.path.partition("?")
+        nombre = self.RUTAS.get((metodo, ruta.rstrip("/") or "/"))
+        if nombre is None:
+            self._responder(404, {"error": "Ruta no encontrada"})
+            return
+        try:
+            datos = dict(parse_qsl(consulta))
+            datos.update(self._cuerpo())
+            resultado = getattr(self, nombre)(datos)
+            if isinstance(resultado, types.GeneratorType):
+                self._transmitir(resultado)
+            elif isinstance(resultado, str):
+                self._responder_texto(resultado)
+            else:
+                self._responder(200, resultado)
+        except DemasiadosIntentos as e:
+            self._responder(429, {"error": str(e)}, [("Retry-After", str(max(1, round(e.espera))))])
+        except ErrorBiblioteca as e:
+            self._responder(ESTADOS_HTTP.get(type(e), 400), {"error": str(e)})
+        except ErrorBD as e:
+            self._responder(503, {"error": f"Error de base de datos: {e}"})
+
+    def do_GET(self):
+        self._despachar("GET")
+
+    def do_POST(self):
+        self._despachar("POST")
+
+    def do_DELETE(self):
+        self._despachar("DELETE")
+
+    def log_message(self, formato, *args):
+        pass
+
+    # === OPERACIONES ===
+
+    def crear_sesion(self, datos):
+        if "token_api" in datos:
+            return _sesion_publica(self.servicio.login_token(datos.get("token_api"), self.client_address[0]))
+        return _sesion_publica(self.servicio.login(datos.get("username"), datos.get("password"),
+                                                   self.client_address[0]))
+
+    def cerrar_sesion(self, datos):
+        self.servicio.cerrar_sesion(self._token())
+        return {"ok": True}
+
+    def _listado(self, listado, datos):
+        if datos.get("formato") == "ndjson":
+            return self.servicio.iterar(self._token(), listado)
+        limite = validar_numero(datos.get("limite", LIMITE_PAGINA_HTTP))
+        if limite is None:
+            raise DatosInvalidos("El límite debe ser un número")
+        return self.servicio.pagina(self._token(), listado, limite, datos.get("cursor"))
+
+    def crear_token_api(self, datos):
+        return self.servicio.crear_token_api(self._token(), datos.get("descripcion"))
+
+    def revocar_token_api(self, datos):
+        return self.servicio.revocar_token_api(self._token(), datos.get("token_api"))
+
+    def listar_libros(self, datos):
+        return self._listado("libros", datos)
+
+    def registrar_libro(self, datos):
+        libro_id = self.servicio.registrar_libro(
+            self._token(), datos.get("titulo"), datos.get("autor"), datos.get("isbn"), datos.get("editorial"),
+            datos.get("año_publicacion"), datos.get("categoria"), datos.get("cantidad_disponible"),
+            datos.get("sucursal"))
+        return {"id": libro_id}
+
+    def listar_libros_disponibles(self, datos):
+        return self._listado("libros_disponibles", datos)
+
+    def buscar_libros(self, datos):
+        limite = validar_numero(datos.get("limite", 20))
+        if limite is None:
+            raise DatosInvalidos("El límite debe ser un número")
+        return self.servicio.buscar_libros(self._token(), datos.get("q"), limite, datos.get("cursor"))
+
+    def obtener_libro(self, datos):
+        libro_id = validar_numero(datos.get("id", ""))
+        if libro_id is None:
+            raise DatosInvalidos("ID debe ser un número válido")
+        return self.servicio.obtener_libro(self._token(), libro_id)
+
+    def ejemplares(self, datos):
+        libro_id = validar_numero(datos.get("libro_id", ""))
+        if libro_id is None:
+            raise DatosInvalidos("ID debe ser un número válido")
+        return self.servicio.ejemplares(self._token(), libro_id)
+
+    def buscar_ejemplar(self, datos):
+        return self.servicio.buscar_ejemplar(self._token(), datos.get("codigo"))
+
+    def conciliar_disponibilidad(self, datos):
+        return self.servicio.conciliar_disponibilidad(self._token())
+
+    def listar_usuarios(self, datos):
+        return self._listado("usuarios", datos)
+
+    def registrar_usuario(self, datos):
+        usuario_id = self.servicio.registrar_usuario(
+            self._token(), datos.get("nombre"), datos.get("email"), datos.get("password"),
+            datos.get("telefono"), datos.get("direccion"))
+        return {"id": usuario_id}
+
+    def registrar_administrador(self, datos):
+        admin_id = self.servicio.registrar_administrador(
+            self._token(), datos.get("username"), datos.get("password"), datos.get("nombre"), datos.get("email"))
+        return {"id": admin_id}
+
+    def listar_prestamos(self, datos):
+        return self._listado("prestamos", datos)
+
+    def listar_vencidos(self, datos):
+        return self._listado("vencidos", datos)
+
+    def historial_prestamos(self, datos):
+        limite = validar_numero(datos.get("limite", LIMITE_PAGINA_HTTP))
+        if limite is None:
+            raise DatosInvalidos("El límite debe ser un número")
+        usuario_id = None
+        if "usuario_id" in datos:
+            usuario_id = validar_numero(datos["usuario_id"])
+            if usuario_id is None:
+                raise DatosInvalidos("ID debe ser un número válido")
+        return self.servicio.historial_prestamos(self._token(), usuario_id, limite, datos.get("cursor"))
+
+    def informe(self, datos):
+        limite = validar_numero(datos.get("limite", 20))
+        if limite is None:
+            raise DatosInvalidos("El límite debe ser un número")
+        return self.servicio.informe(self._token(), datos.get("nombre"), limite, datos.get("sucursal"))
+
+    def recomendaciones(self, datos):
+        limite = validar_numero(datos.get("limite", 10))
+        if limite is None:
+            raise DatosInvalidos("El límite debe ser un número")
+        libro_id = None
+        if "libro_id" in datos:
+            libro_id = validar_numero(datos["libro_id"])
+            if libro_id is None:
+                raise DatosInvalidos("ID debe ser un número válido")
+        return self.servicio.recomendaciones(self._token(), libro_id, limite)
+
+    def registrar_prestamo(self, datos):
+        return self.servicio.registrar_prestamo(self._token(), datos.get("libro_id"), datos.get("sucursal"))
+
+    def reservar(self, datos):
+        return self.servicio.reservar(self._token(), datos.get("libro_id"), datos.get("sucursal"))
+
+    def mis_reservas(self, datos):
+        return self.servicio.mis_reservas(self._token())
+
+    def cancelar_reserva(self, datos):
+        reserva_id = validar_numero(datos.get("reserva_id", ""))
+        if reserva_id is None:
+            raise DatosInvalidos("ID debe ser un número válido")
+        return self.servicio.cancelar_reserva(self._token(), reserva_id, datos.get("sucursal"))
+
+    def mis_prestamos_activos(self, datos):
+        return self.servicio.mis_prestamos_activos(self._token())
+
+    def devolver_libro(self, datos):
+        return self.servicio.devolver_libro(self._token(), datos.get("prestamo_id"), datos.get("sucursal"))
+
+    def devolver_lote(self, datos):
+        return self.servicio.devolver_lote(self._token(), _lista_ids(datos.get("ids")), datos.get("por", "prestamo"),
+                                           datos.get("sucursal"))
+
+    def prestar_lote(self, datos):
+        usuario_id = datos.get("usuario_id")
+        if usuario_id is not None and validar_numero(usuario_id) is None:
+            raise DatosInvalidos("El usuario debe ser un número")
+        return self.servicio.prestar_lote(self._token(), _lista_ids(datos.get("libro_ids")),
+                                          None if usuario_id is None else validar_numero(usuario_id),
+                                          datos.get("sucursal"))
+
+    def metricas_prometheus(self, datos):
+        return self.servicio.metricas_prometheus()
+
+    def resumen_metricas(self, datos):
+        return self.servicio.resumen_metricas(self._token())
+
+
+def _lista_ids(valor):
+    """Aceptar los ids como lista JSON o como texto separado por comas (query string)"""
+    if isinstance(valor, str):
+        return [codigo for codigo in valor.replace(";", ",").split(",") if codigo.strip()]
+    if not isinstance(valor, list):
+        raise DatosInvalidos("Indique los ids como una lista")
+    return valor
+
+
+def crear_servidor(servicio, host="127.0.0.1", puerto=8080):
+    """Crear un servidor HTTP con un hilo por petición sobre el servicio dado"""
+    manejador = type("Manejador", (ManejadorBiblioteca,), {"servicio": servicio})
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    servidor.daemon_threads = True
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--pool", type=int, default=10, help="Conexiones máximas a la base de datos")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"], default=None)
+    args = parser.parse_args()
+
+    # Sin --backend se usa BIBLIOTECA_TOPOLOGIA si está definida, o BIBLIOTECA_BACKEND
+    servicio = ServicioBiblioteca(crear_backend(args.backend) if args.backend else None, tamaño_pool=args.pool)
+    servidor = crear_servidor(servicio, args.host, args.puerto)
+    print(f"✓ Servicio de biblioteca escuchando en http://{args.host}:{args.puerto} (pool de {args.pool} conexiones)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServicio detenido")
+    finally:
+        servidor.server_close()
+        servicio.cerrar()
+
+
+if __name__ == "__main__":
+    main()
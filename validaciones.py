@@ -0,0 +1,53 @@
+import re
+
+LONGITUD_MINIMA_PASSWORD = 4
+MAXIMO_TERMINOS_BUSQUEDA = 8
+
+
+def validar_input(texto):
+    """Validar y limpiar input básico"""
+    return texto.strip()
+
+
+def validar_numero(texto):
+    """Validar que el input sea un número"""
+    try:
+        return int(str(texto).strip())
+    except ValueError:
+        return None
+
+
+def _texto(valor):
+    return validar_input("" if valor is None else str(valor))
+
+
+def validar_libro(titulo, autor, isbn, editorial, año, categoria, cantidad):
+    """Limpiar los datos de un libro y lanzar ValueError si no son válidos"""
+    titulo = _texto(titulo)
+    autor = _texto(autor)
+    año = validar_numero(año) if año is not None else None
+    if año is None:
+        raise ValueError("Año debe ser un número válido")
+    cantidad = validar_numero(cantidad) if cantidad is not None else None
+    if cantidad is None or cantidad < 0:
+        raise ValueError("Cantidad debe ser un número positivo")
+    if not titulo or not autor:
+        raise ValueError("Título y autor son campos requeridos")
+    return titulo, autor, _texto(isbn), _texto(editorial), año, _texto(categoria), cantidad
+
+
+def validar_password_nueva(password, confirmacion=None):
+    """Comprobar confirmación y longitud mínima de una contraseña nueva"""
+    if confirmacion is not None and password != confirmacion:
+        raise ValueError("Las contraseñas no coinciden")
+    if len(password) < LONGITUD_MINIMA_PASSWORD:
+        raise ValueError(f"La contraseña debe tener al menos {LONGITUD_MINIMA_PASSWORD} caracteres")
+
+
+def terminos_busqueda(texto):
+    """Separar el texto de búsqueda en palabras y lanzar ValueError si no hay ninguna"""
+    # Solo letras y dígitos: los operadores de cada índice nunca llegan desde el usuario
+    terminos = re.findall(r"\w+", _texto(texto).lower())
+    if not terminos:
+        raise ValueError("Escriba al menos una palabra para buscar")
+    return terminos[:MAXIMO_TERMINOS_BUSQUEDA]